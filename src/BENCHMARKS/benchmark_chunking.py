@@ -0,0 +1,189 @@
+"""
+    This code benchmarks the chunking of the documents: the TextChunker of STEP 1 against the CharacterTextSplitter used before.
+
+    The documents are either read from a directory (--documents-directory) or generated, as synthetic PDF documents
+    like the ones of the retrieval benchmark. They are parsed once, and each splitter then splits the same pages:
+        "character_text_splitter" is the CharacterTextSplitter of langchain, with the 200 characters and 75 of overlap used before,
+        "text_chunker_same_size" is the TextChunker with the same sizes, cutting on words and keeping the duplicates,
+        to compare the throughput of the two approaches on the same chunks, and
+        "text_chunker" is the TextChunker as configured in the .env file (CHUNK_SIZE, CHUNK_OVERLAP, ...).
+
+    For each splitter, the benchmark measures the number of chunks, the number of characters sent to the embeddings model
+    (the overlap is embedded twice), the best time of --repeats runs, and the throughput in chunks and megabytes per second.
+
+    The results are written as JSON (to data/benchmarks/chunking_benchmark.json by default).
+
+    Example:
+        python src/BENCHMARKS/benchmark_chunking.py --documents 50 --words-per-document 5000
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def load_pages(file_paths: List[str]) -> List[str]:
+    """
+    Parse the documents into the texts of their pages, like STEP 1 does.
+
+    Args:
+        - file_paths (List[str]): The paths to the documents.
+
+    Returns:
+        - List[str]: The texts of the pages of all the documents, in order.
+    """
+
+    from langchain.document_loaders import PyPDFLoader, UnstructuredFileLoader
+
+    pages = []
+    for file_path in file_paths:
+        if file_path.endswith(".pdf"):
+            loader = PyPDFLoader(file_path=file_path)
+        else:
+            loader = UnstructuredFileLoader(file_path=file_path)
+        pages.extend(page.page_content for page in loader.load())
+
+    return pages
+
+
+def benchmark_splitter(
+    split: Callable[[List[str]], List[str]],
+    pages: List[str],
+    repeats: int,
+) -> Dict[str, Any]:
+    """
+    Split the pages several times and measure the best run.
+
+    Args:
+        - split (Callable[[List[str]], List[str]]): The function splitting the texts of the pages into the texts of the chunks.
+        - pages (List[str]): The texts of the pages.
+        - repeats (int): The number of runs.
+
+    Returns:
+        - Dict[str, Any]: The number of chunks, their characters, the best time and the throughput.
+    """
+
+    best_seconds = float("inf")
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        chunks = split(pages)
+        best_seconds = min(best_seconds, time.perf_counter() - start_time)
+
+    input_megabytes = sum(len(page) for page in pages) / 1e6
+
+    return {
+        "chunks": len(chunks),
+        "chunk_characters": sum(len(chunk) for chunk in chunks),
+        "seconds": best_seconds,
+        "chunks_per_second": len(chunks) / best_seconds if best_seconds else 0.0,
+        "megabytes_per_second": input_megabytes / best_seconds if best_seconds else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--documents-directory",
+        default=None,
+        help="Benchmark the documents of this directory instead of a generated corpus",
+    )
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--words-per-document", type=int, default=5000)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default="./data/benchmarks/chunking_benchmark.json")
+    args = parser.parse_args()
+
+    from HELPERS.config import load_config
+
+    load_config()  # The TextChunker is configured in the .env file
+
+    from langchain.text_splitter import CharacterTextSplitter
+
+    from BENCHMARKS.benchmark_retrieval import generate_corpus
+    from HELPERS.step_1_chunker import TextChunker
+
+    scratch_directory = tempfile.mkdtemp(prefix="chunking_benchmark_")
+    try:
+        if args.documents_directory:
+            file_paths = [
+                os.path.join(args.documents_directory, file_name)
+                for file_name in sorted(os.listdir(args.documents_directory))
+            ]
+        else:
+            file_paths = generate_corpus(
+                directory=scratch_directory,
+                documents=args.documents,
+                words_per_document=args.words_per_document,
+            )
+        pages = load_pages(file_paths)
+    finally:
+        shutil.rmtree(scratch_directory, ignore_errors=True)
+
+    character_text_splitter = CharacterTextSplitter(
+        separator=" ", chunk_size=200, chunk_overlap=75, length_function=len
+    )
+    text_chunker_same_size = TextChunker(
+        chunk_size=200, chunk_overlap=75, size_unit="characters", boundary="word", dedup=False
+    )
+    text_chunker = TextChunker()
+
+    splitters = {
+        "character_text_splitter": lambda pages: [
+            chunk for page in pages for chunk in character_text_splitter.split_text(page)
+        ],
+        "text_chunker_same_size": text_chunker_same_size.split_texts,
+        "text_chunker": text_chunker.split_texts,
+    }
+
+    results = {}
+    for name, split in splitters.items():
+        print(f"Benchmarking {name}")
+        results[name] = benchmark_splitter(split=split, pages=pages, repeats=args.repeats)
+
+    baseline = results["character_text_splitter"]
+    for result in results.values():
+        result["chunks_vs_character_text_splitter"] = result["chunks"] / baseline["chunks"]
+        result["speedup_vs_character_text_splitter"] = baseline["seconds"] / result["seconds"]
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "corpus": {
+            "documents": len(file_paths),
+            "pages": len(pages),
+            "characters": sum(len(page) for page in pages),
+        },
+        "text_chunker": {
+            "chunk_size": text_chunker.chunk_size,
+            "chunk_overlap": text_chunker.chunk_overlap,
+            "size_unit": text_chunker.size_unit,
+            "boundary": text_chunker.boundary,
+            "dedup": text_chunker.dedup,
+        },
+        "results": results,
+    }
+
+    output_directory = os.path.dirname(args.output)
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
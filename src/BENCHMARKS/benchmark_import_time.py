@@ -0,0 +1,208 @@
+"""
+    This code benchmarks the startup of the command line interface: how long each command takes before it starts working.
+
+    Each measure runs a fresh interpreter, so nothing is already imported:
+        "python" starts the interpreter alone, the floor of every command,
+        "help" runs python -m src --help, which only imports the standard library, and
+        each command (ingest, embed, build, stream-ingest, query and serve) runs python -m src --import-only <command>,
+        which loads the .env file and imports the STEP module of the command with its dependencies, without running it.
+
+    For each of them, the benchmark keeps the median and the best wall time of --repeats runs,
+    and, from one more run with python -X importtime, the packages that take the longest to import.
+
+    The results are written as JSON (to data/benchmarks/import_time_benchmark.json by default), and appended
+    to a history (data/benchmarks/import_time_history.jsonl by default, one line per run with the git commit),
+    so the startup cost can be tracked over time: each run prints the change since the previous one.
+
+    Example:
+        python src/BENCHMARKS/benchmark_import_time.py --repeats 5
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+# The root of the repository, where python -m src is run from
+REPOSITORY_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# The packages of the repository, left out of the heaviest imports since they include all the others
+OWN_PACKAGES = {"src", "STEPS", "HELPERS", "BENCHMARKS", "__main__"}
+
+
+def time_command(arguments: List[str], repeats: int) -> Dict[str, float]:
+    """
+    Run a command in a fresh interpreter several times and measure its wall time.
+
+    Args:
+        - arguments (List[str]): The arguments given to the interpreter.
+        - repeats (int): The number of runs.
+
+    Returns:
+        - Dict[str, float]: The "median_seconds" and the "best_seconds" of the runs.
+    """
+
+    runs = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *arguments],
+            cwd=REPOSITORY_DIRECTORY,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        runs.append(time.perf_counter() - start_time)
+
+    return {"median_seconds": statistics.median(runs), "best_seconds": min(runs)}
+
+
+def heaviest_imports(arguments: List[str], top: int) -> Dict[str, float]:
+    """
+    Find the packages that take the longest to import, with python -X importtime.
+
+    Args:
+        - arguments (List[str]): The arguments given to the interpreter.
+        - top (int): The number of packages returned.
+
+    Returns:
+        - Dict[str, float]: The import time in seconds of the heaviest packages, the heaviest first.
+    """
+
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", *arguments],
+        cwd=REPOSITORY_DIRECTORY,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    # Each line is "import time: <self us> | <cumulative us> | <module>", the first import of a package
+    # (its largest cumulative time) includes the imports of its modules
+    packages: Dict[str, int] = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, module = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        package = module.strip().split(".")[0]
+        if package not in OWN_PACKAGES:
+            packages[package] = max(packages.get(package, 0), int(cumulative))
+
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+    return {package: microseconds / 1e6 for package, microseconds in heaviest}
+
+
+def git_commit() -> str | None:
+    """Return the current git commit of the repository, None if it isn't a git repository."""
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPOSITORY_DIRECTORY,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return completed.stdout.strip()
+
+
+def load_previous_run(history_path: str) -> Dict[str, Any] | None:
+    """Return the last run of the history, None if there is none."""
+    if not os.path.exists(history_path):
+        return None
+
+    previous_run = None
+    with open(history_path) as f:
+        for line in f:
+            if line.strip():
+                previous_run = json.loads(line)
+
+    return previous_run
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--commands",
+        default="ingest,embed,build,stream-ingest,query,serve",
+        help="Comma separated commands to benchmark",
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="The number of heaviest imports kept for each command")
+    parser.add_argument("--env-file", default=None, help="The .env file loaded by the commands")
+    parser.add_argument("--output", default="./data/benchmarks/import_time_benchmark.json")
+    parser.add_argument("--history", default="./data/benchmarks/import_time_history.jsonl")
+    args = parser.parse_args()
+
+    cli_arguments = ["-m", "src"]
+    if args.env_file:
+        cli_arguments += ["--env-file", os.path.abspath(args.env_file)]
+
+    targets = {
+        "python": ["-c", "pass"],
+        "help": cli_arguments + ["--help"],
+    }
+    for command in args.commands.split(","):
+        targets[command] = cli_arguments + ["--import-only", command]
+
+    results = {}
+    for name, arguments in targets.items():
+        print(f"Benchmarking {name}")
+        results[name] = time_command(arguments=arguments, repeats=args.repeats)
+        results[name]["heaviest_imports"] = heaviest_imports(arguments=arguments, top=args.top)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "repeats": args.repeats,
+        "results": results,
+    }
+
+    for path in (args.output, args.history):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    # Compare with the previous run before adding this one to the history
+    previous_run = load_previous_run(args.history)
+    history_entry = {
+        "created_at": report["created_at"],
+        "commit": report["commit"],
+        "python": report["environment"]["python"],
+        "median_seconds": {name: result["median_seconds"] for name, result in results.items()},
+    }
+    with open(args.history, "a") as f:
+        f.write(json.dumps(history_entry) + "\n")
+
+    print(json.dumps(results, indent=2))
+    for name, result in results.items():
+        line = f"{name}: {result['median_seconds']:.3f}s"
+        previous_seconds = (previous_run or {}).get("median_seconds", {}).get(name)
+        if previous_seconds:
+            line += (
+                f" ({result['median_seconds'] - previous_seconds:+.3f}s since {previous_run['commit']}"
+                f" of {previous_run['created_at']})"
+            )
+        print(line)
+    print(f"Results written to {args.output} and added to {args.history}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+    This code replays the queries of the query log (see step_4_query_log) against the retrieval and question answering path,
+    at a target rate, to measure its latency under a realistic load without a network connection or an API token.
+
+    The queries are read from the query log (QUERY_LOG_FILE_PATH, or --query-log), or from a text file with one query per line,
+    and replayed in order (again from the start when there are fewer queries than requests), each one with its metadata filter:
+        in "search" mode through create_similarity_search_docs, and
+        in "answer" mode through create_similarity_search_docs, pack_context and Q_and_A_implementation.
+    The vectorstore and the question answering chain are loaded once, like in the query server.
+
+    The Hugging Face Hub is replaced by the local stub of local_stub_hub_server, started in this process with the dimension
+    of the saved vectorstore (and the latencies given by --hub-latency-ms and --token-latency-ms), unless --hub-url is given.
+    The queries are embedded through a new, empty embeddings cache, so they reach the stub like new queries would.
+
+    The load is open: the requests are sent at --qps requests per second whatever the latency of the previous ones,
+    by a pool of --concurrency threads, and the latency of each request is counted from the time it was due,
+    so the time a request waits for a free thread is measured too (a closed loop would hide it).
+    With --qps 0 the threads send the requests back to back, to find the highest throughput.
+
+    The report has the achieved rate, the errors, a histogram and the percentiles of the latencies of the requests,
+    and the percentiles of the time of each stage of the requests (embedding, vector search, language model...).
+    It is printed and written as JSON (to data/benchmarks/replay_benchmark.json by default).
+
+    Example:
+        python src/BENCHMARKS/benchmark_replay.py --mode search --qps 50 --concurrency 8 --requests 1000
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# The upper bounds of the buckets of the latency histograms, in milliseconds
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float("inf")]
+
+
+def load_replay_queries(
+    query_log_file_path: str | None, queries_file_path: str | None
+) -> List[Tuple[str, Dict[str, Any] | None]]:
+    """
+    Read the queries to replay, with their metadata filters.
+
+    Args:
+        - query_log_file_path (str | None): The path to the query log, its rotated files are read too.
+        - queries_file_path (str | None): The path to a text file with one query per line, read instead of the log if given.
+
+    Returns:
+        - List[Tuple[str, Dict[str, Any] | None]]: The queries and their metadata filters, in the order they were logged.
+    """
+
+    if queries_file_path:
+        with open(queries_file_path, encoding="utf-8") as f:
+            return [(line.strip(), None) for line in f if line.strip()]
+
+    from HELPERS.step_4_query_log import iter_query_log
+
+    return [
+        (query, record.get("filter"))
+        for record in iter_query_log(file_path=query_log_file_path)
+        if "error" not in record
+        for query in record["queries"]
+    ]
+
+
+def _vectorstore_dimension(path_to_vectorstore: str) -> int:
+    """Read the dimension of the saved vectorstore, or of its first shard, from its index file."""
+    import faiss
+
+    from HELPERS.step_3_sharded_vectorstore import shards_path
+
+    index_file_paths = [os.path.join(path_to_vectorstore, "index.faiss")] + sorted(
+        glob.glob(os.path.join(shards_path(path_to_vectorstore), "*.faiss", "index.faiss"))
+    )
+    for index_file_path in index_file_paths:
+        if os.path.exists(index_file_path):
+            return faiss.read_index(index_file_path, faiss.IO_FLAG_MMAP).d
+
+    raise ValueError(f"No vectorstore saved at {path_to_vectorstore}, run STEP 3 first")
+
+
+def latency_summary(latencies_seconds: List[float]) -> Dict[str, Any]:
+    """
+    Summarize latencies with their percentiles and their histogram.
+
+    Args:
+        - latencies_seconds (List[float]): The latencies, in seconds.
+
+    Returns:
+        - Dict[str, Any]: The count, mean, p50, p90, p99, p99.9 and max latencies in milliseconds,
+            and the number of latencies in each bucket of HISTOGRAM_BUCKETS_MS.
+    """
+
+    if not latencies_seconds:
+        return {"count": 0}
+
+    latencies_ms = np.asarray(latencies_seconds) * 1000.0
+    bucket_counts = np.bincount(
+        np.searchsorted(HISTOGRAM_BUCKETS_MS, latencies_ms, side="left"),
+        minlength=len(HISTOGRAM_BUCKETS_MS),
+    )
+
+    return {
+        "count": len(latencies_ms),
+        "mean_ms": float(latencies_ms.mean()),
+        **{
+            f"p{percentile:g}_ms": float(np.percentile(latencies_ms, percentile))
+            for percentile in (50, 90, 99, 99.9)
+        },
+        "max_ms": float(latencies_ms.max()),
+        # The last bucket, without upper bound, has a null bound in the JSON report
+        "histogram": [
+            {"le_ms": None if bound == float("inf") else bound, "count": int(count)}
+            for bound, count in zip(HISTOGRAM_BUCKETS_MS, bucket_counts.tolist())
+        ],
+    }
+
+
+def _print_histogram(summary: Dict[str, Any], width: int = 40) -> None:
+    """Print a latency histogram as a bar chart, one bucket per line."""
+    largest = max(bucket["count"] for bucket in summary["histogram"]) or 1
+    for bucket in summary["histogram"]:
+        label = "inf" if bucket["le_ms"] is None else f"{bucket['le_ms']:g}"
+        bar = "#" * round(width * bucket["count"] / largest)
+        print(f"  <= {label:>6} ms {bucket['count']:>8} {bar}")
+
+
+def replay(
+    request: Callable[[str, Dict[str, Any] | None], None],
+    queries: List[Tuple[str, Dict[str, Any] | None]],
+    requests: int,
+    qps: float,
+    concurrency: int,
+) -> Dict[str, Any]:
+    """
+    Send the requests at the target rate and measure them.
+
+    Args:
+        - request (Callable[[str, Dict[str, Any] | None], None]): The function answering a query with its metadata filter.
+        - queries (List[Tuple[str, Dict[str, Any] | None]]): The queries to replay, in order, again from the start if needed.
+        - requests (int): The number of requests sent.
+        - qps (float): The target number of requests per second, 0 sends them back to back.
+        - concurrency (int): The number of requests running at the same time, at most.
+
+    Returns:
+        - Dict[str, Any]: The achieved rate, the errors, and the summaries of the latencies and of the time of each stage.
+    """
+
+    from HELPERS.instrumentation import METRICS
+
+    latencies: List[float] = []
+    service_times: List[float] = []
+    stage_times: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def run(number: int, due_at: float) -> None:
+        query, metadata_filter = queries[number % len(queries)]
+        started_at = time.perf_counter()
+        error = None
+        with METRICS.trace() as stages:
+            try:
+                request(query, metadata_filter)
+            except Exception as exception:
+                error = type(exception).__name__
+        finished_at = time.perf_counter()
+
+        with lock:
+            if error is not None:
+                errors[error] = errors.get(error, 0) + 1
+                return
+            latencies.append(finished_at - due_at)
+            service_times.append(finished_at - started_at)
+            for stage, seconds in stages.items():
+                stage_times.setdefault(stage, []).append(seconds)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if qps > 0:
+            # Open load: each request is due at its own time, whether the previous ones are done or not
+            for number in range(requests):
+                due_at = start_time + number / qps
+                delay = due_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(run, number, due_at)
+        else:
+            # Closed load: each thread sends its next request as soon as the previous one is done
+            next_number = iter(range(requests))
+            next_lock = threading.Lock()
+
+            def worker() -> None:
+                while True:
+                    with next_lock:
+                        number = next(next_number, None)
+                    if number is None:
+                        return
+                    run(number, time.perf_counter())
+
+            for _ in range(concurrency):
+                executor.submit(worker)
+    duration = time.perf_counter() - start_time
+
+    return {
+        "requests": requests,
+        "duration_seconds": duration,
+        "target_qps": qps,
+        "achieved_qps": requests / duration if duration else 0.0,
+        "errors": errors,
+        "latency": latency_summary(latencies),
+        "service_time": latency_summary(service_times),
+        "stages": {
+            stage: {
+                key: value
+                for key, value in latency_summary(seconds).items()
+                if key != "histogram"
+            }
+            for stage, seconds in sorted(stage_times.items())
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--mode", choices=("search", "answer"), default="search")
+    parser.add_argument("--query-log", default=None, help="The query log, QUERY_LOG_FILE_PATH by default")
+    parser.add_argument("--queries-file", default=None, help="A text file with one query per line, instead of the query log")
+    parser.add_argument("--requests", type=int, default=None, help="The number of requests, one per query by default")
+    parser.add_argument("--qps", type=float, default=10.0, help="The target requests per second, 0 sends them back to back")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--hub-url", default=None, help="The inference API to use instead of the local stub")
+    parser.add_argument("--hub-latency-ms", type=float, default=0.0)
+    parser.add_argument("--token-latency-ms", type=float, default=0.0)
+    parser.add_argument("--output", default="./data/benchmarks/replay_benchmark.json")
+    args = parser.parse_args()
+
+    from HELPERS.config import load_config
+
+    load_config()
+
+    # The helpers read the inference API url, the cache path and the query log path from the environment when they are called:
+    # point them to the stub and to a new embeddings cache, and don't log the replayed queries
+    query_log_file_path = args.query_log or os.getenv("QUERY_LOG_FILE_PATH", "")
+    os.environ["QUERY_LOG_FILE_PATH"] = ""
+
+    queries = load_replay_queries(
+        query_log_file_path=query_log_file_path, queries_file_path=args.queries_file
+    )
+    if not queries:
+        parser.error("No queries to replay, give a query log or a queries file")
+
+    scratch_directory = tempfile.mkdtemp(prefix="replay_benchmark_")
+    path_to_vectorstore = os.path.join(
+        os.getenv("SAVING_VECTORSTORE_DIRECTORY"),
+        os.getenv("SAVING_VECTORSTORE_FILE_NAME") + ".faiss",
+    )
+    stub = None
+    if args.hub_url is None:
+        from HELPERS.local_stub_hub_server import start_stub_hub_server
+
+        stub = start_stub_hub_server(
+            dimension=_vectorstore_dimension(path_to_vectorstore),
+            latency_seconds=args.hub_latency_ms / 1000.0,
+            token_latency_seconds=args.token_latency_ms / 1000.0,
+        )
+    os.environ["HUGGINGFACEHUB_INFERENCE_ENDPOINT"] = args.hub_url or stub.url
+    os.environ["HUGGINGFACEHUB_API_TOKEN"] = os.getenv("HUGGINGFACEHUB_API_TOKEN") or "replay"
+    os.environ["EMBEDDINGS_CACHE_FILE_PATH"] = os.path.join(scratch_directory, "cache.sqlite3")
+
+    from HELPERS.step_4A_create_similarity_search_docs import (
+        create_similarity_search_docs,
+        load_vectorstore,
+    )
+    from HELPERS.step_4B_context_packing import pack_context
+    from HELPERS.step_4B_using_similarity_search_docs_for_QA import (
+        Q_and_A_implementation,
+        load_hub_qa_chain,
+    )
+
+    vectorstore = load_vectorstore(
+        path_to_vectorstore=path_to_vectorstore, build_metadata_index=True
+    )
+    chain = load_hub_qa_chain(verbose=False) if args.mode == "answer" else None
+
+    def request(query: str, metadata_filter: Dict[str, Any] | None) -> None:
+        docs = create_similarity_search_docs(
+            query=query, vectorstore=vectorstore, metadata_filter=metadata_filter
+        )
+        if chain is not None:
+            passages, _ = pack_context(docs=docs)
+            Q_and_A_implementation(
+                similarity_search_docs=passages,
+                query=query,
+                chain=chain,
+                pack_context_docs=False,
+            )
+
+    requests = args.requests or len(queries)
+    print(
+        f"Replaying {requests} {args.mode} requests ({len(queries)} distinct queries) "
+        f"at {args.qps or 'max'} qps with {args.concurrency} threads"
+    )
+    try:
+        result = replay(
+            request=request,
+            queries=queries,
+            requests=requests,
+            qps=args.qps,
+            concurrency=args.concurrency,
+        )
+    finally:
+        if stub is not None:
+            stub.shutdown()
+        shutil.rmtree(scratch_directory, ignore_errors=True)
+
+    latency = result["latency"]
+    print(
+        f"{result['achieved_qps']:.1f} qps achieved, {sum(result['errors'].values())} errors, "
+        f"latency p50 {latency.get('p50_ms', 0):.1f} ms, p99 {latency.get('p99_ms', 0):.1f} ms, "
+        f"max {latency.get('max_ms', 0):.1f} ms"
+    )
+    if latency["count"]:
+        _print_histogram(latency)
+    for stage, summary in result["stages"].items():
+        print(f"  {stage:<24} p50 {summary['p50_ms']:8.2f} ms  p99 {summary['p99_ms']:8.2f} ms")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+        },
+        "parameters": {
+            "mode": args.mode,
+            "queries": len(queries),
+            "requests": requests,
+            "qps": args.qps,
+            "concurrency": args.concurrency,
+            "hub": args.hub_url or "stub",
+            "hub_latency_ms": args.hub_latency_ms,
+            "token_latency_ms": args.token_latency_ms,
+            "search_mode": os.getenv("SEARCH_MODE", "hybrid"),
+        },
+        "result": result,
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Benchmark results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
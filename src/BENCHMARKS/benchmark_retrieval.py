@@ -0,0 +1,448 @@
+"""
+    This code benchmarks the cost and the quality of the retrieval path, without a network connection or an API token.
+
+    For each corpus size, the benchmark:
+        generates a synthetic corpus of PDF documents (random sentences drawn from a fixed vocabulary, with a skewed word frequency),
+        ingests it with the streaming pipeline (STEP 1 to STEP 3), embedding the chunks with the local HashingEmbeddings,
+        and, for each index type the project supports (flat, ivf_flat, hnsw, ivf_pq):
+            builds the index from the saved embeddings (training it if its type needs it),
+            saves the vectorstore and measures the size of the index file,
+            runs the queries one at a time through the similarity search, measuring the p50 and p99 latency, and
+            measures the recall@k of the index against the exact search.
+
+    The results are written as JSON (to data/benchmarks/retrieval_benchmark.json by default),
+    so the results of two releases can be compared.
+
+    Example:
+        python src/BENCHMARKS/benchmark_retrieval.py --sizes 50,200 --queries 200 --k 4
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List
+
+import numpy as np
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def _write_text_pdf(file_path: str, lines: List[str], lines_per_page: int = 60) -> None:
+    """Write a minimal PDF document with one line of text per line, in Helvetica."""
+    pages = [
+        lines[start : start + lines_per_page]
+        for start in range(0, len(lines), lines_per_page)
+    ] or [[]]
+
+    # Objects 1 and 2 are the catalog and the page tree, 3 is the font, then a page and its content for each page
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids ["
+        + b" ".join(f"{4 + 2 * i} 0 R".encode() for i in range(len(pages)))
+        + f"] /Count {len(pages)} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, page_lines in enumerate(pages):
+        content = "BT /F1 10 Tf 40 760 Td 12 TL " + " ".join(
+            f"({line}) Tj T*" for line in page_lines
+        ) + " ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        objects.append(
+            f"<< /Length {len(content)} >>\nstream\n{content}\nendstream".encode()
+        )
+
+    with open(file_path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+        xref_offset = f.tell()
+        f.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+        for offset in offsets:
+            f.write(f"{offset:010d} 00000 n \n".encode())
+        f.write(
+            f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+        )
+
+
+def _sentence(generator: np.random.Generator, vocabulary: List[str], weights: np.ndarray) -> str:
+    """Draw a random sentence of 8 to 16 words from the vocabulary."""
+    words = generator.choice(vocabulary, size=generator.integers(8, 17), p=weights)
+    return " ".join(words)
+
+
+def generate_corpus(
+    directory: str,
+    documents: int,
+    words_per_document: int,
+    seed: int = 0,
+) -> List[str]:
+    """
+    Generate a synthetic corpus of PDF documents.
+
+    Args:
+        - directory (str): The directory the documents are written to.
+        - documents (int): The number of documents.
+        - words_per_document (int): The approximate number of words of each document.
+        - seed (int): The seed of the random text.
+
+    Returns:
+        - List[str]: The paths to the documents, in order.
+    """
+
+    generator = np.random.default_rng(seed)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    # Zipf-like word frequencies, like in natural text
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+
+    os.makedirs(directory, exist_ok=True)
+    file_paths = []
+    for i in range(documents):
+        lines, words = [], 0
+        while words < words_per_document:
+            line = _sentence(generator, vocabulary, weights)
+            lines.append(line)
+            words += line.count(" ") + 1
+        file_path = os.path.join(directory, f"document_{i:06d}.pdf")
+        _write_text_pdf(file_path, lines)
+        file_paths.append(file_path)
+
+    return file_paths
+
+
+def _generate_queries(queries: int, seed: int = 1) -> List[str]:
+    generator = np.random.default_rng(seed)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+    return [_sentence(generator, vocabulary, weights) for _ in range(queries)]
+
+
+def _directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, file_name))
+        for root, _, file_names in os.walk(path)
+        for file_name in file_names
+    )
+
+
+def benchmark_index(
+    index_config: Dict[str, Any],
+    loaded_embeddings,
+    chunks: List[Dict[str, Any]],
+    embeddings,
+    queries: List[str],
+    exact_ids: np.ndarray,
+    k: int,
+    directory: str,
+) -> Dict[str, Any]:
+    """
+    Build, save and query one index type, and measure it.
+
+    Args:
+        - index_config (Dict[str, Any]): The type of the index and its parameters.
+        - loaded_embeddings (EmbeddingMatrix): The embeddings saved by the ingestion.
+        - chunks (List[Dict[str, Any]]): The chunks of the chunk store, in the order of the embeddings.
+        - embeddings (Embeddings): The embeddings used to embed the queries.
+        - queries (List[str]): The queries.
+        - exact_ids (np.ndarray): The positions of the k nearest chunks of each query, found by the exact search.
+        - k (int): The number of chunks returned for each query.
+        - directory (str): The directory the vectorstore is saved to.
+
+    Returns:
+        - Dict[str, Any]: The measures of the index.
+    """
+
+    from langchain import FAISS
+    from langchain.docstore.in_memory import InMemoryDocstore
+    from langchain.schema import Document
+
+    from HELPERS.step_3_index_types import (
+        build_index,
+        describe_index,
+        needs_training,
+        sample_training_vectors,
+    )
+    from HELPERS.step_3_save_vectorstore import save_vectorstore
+    from HELPERS.step_4A_create_similarity_search_docs import load_vectorstore
+
+    # Build the index
+    start_time = time.perf_counter()
+    training_vectors = None
+    if needs_training(index_config):
+        training_vectors = sample_training_vectors(
+            matrix=loaded_embeddings.matrix,
+            sample_size=index_config["training_sample_size"],
+        )
+    index = build_index(
+        dimension=loaded_embeddings.dimension,
+        index_config=index_config,
+        training_vectors=training_vectors,
+    )
+    index.add(np.ascontiguousarray(loaded_embeddings.matrix))
+    build_seconds = time.perf_counter() - start_time
+
+    docstore_ids = [str(uuid.uuid4()) for _ in chunks]
+    vectorstore = FAISS(
+        embedding_function=embeddings.embed_query,
+        index=index,
+        docstore=InMemoryDocstore(
+            {
+                docstore_id: Document(
+                    page_content=chunk["text"], metadata={"chunk_id": chunk["id"]}
+                )
+                for docstore_id, chunk in zip(docstore_ids, chunks)
+            }
+        ),
+        index_to_docstore_id=dict(enumerate(docstore_ids)),
+    )
+
+    # Save the vectorstore and load it back, like STEP 4 does
+    save_vectorstore(
+        vectorstore=vectorstore, directory_path=directory, file_name=index_config["type"]
+    )
+    path_to_vectorstore = os.path.join(directory, index_config["type"] + ".faiss")
+    vectorstore = load_vectorstore(
+        path_to_vectorstore=path_to_vectorstore, embeddings=embeddings, shard_urls=[]
+    )
+
+    # Run the queries one at a time through the similarity search
+    latencies = []
+    for query in queries:
+        start_time = time.perf_counter()
+        vectorstore.similarity_search_with_score(query, k=k)
+        latencies.append(time.perf_counter() - start_time)
+    latencies_ms = np.array(latencies) * 1000.0
+
+    # Compare the results of the index to the exact search
+    query_vectors = np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+    _, ids = vectorstore.index.search(query_vectors, k)
+    recall = np.mean(
+        [
+            len(set(found[found >= 0]) & set(exact)) / k
+            for found, exact in zip(ids, exact_ids)
+        ]
+    )
+
+    return {
+        "index": describe_index(vectorstore.index),
+        "build_seconds": build_seconds,
+        "index_file_bytes": os.path.getsize(
+            os.path.join(path_to_vectorstore, "index.faiss")
+        ),
+        "vectorstore_bytes": _directory_size(path_to_vectorstore),
+        "latency_ms": {
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+            "mean": float(latencies_ms.mean()),
+        },
+        f"recall_at_{k}": float(recall),
+    }
+
+
+def benchmark_corpus(
+    documents: int,
+    words_per_document: int,
+    index_configs: List[Dict[str, Any]],
+    queries: List[str],
+    k: int,
+    dimension: int,
+    max_workers: int,
+    directory: str,
+) -> Dict[str, Any]:
+    """
+    Generate and ingest a corpus, then benchmark every index type on it.
+
+    Args:
+        - documents (int): The number of documents of the corpus.
+        - words_per_document (int): The approximate number of words of each document.
+        - index_configs (List[Dict[str, Any]]): The index types and their parameters.
+        - queries (List[str]): The queries.
+        - k (int): The number of chunks returned for each query.
+        - dimension (int): The dimension of the embeddings.
+        - max_workers (int): The number of worker processes used to load and chunk the documents.
+        - directory (str): The scratch directory of the corpus.
+
+    Returns:
+        - Dict[str, Any]: The measures of the corpus and of each index type.
+    """
+
+    from HELPERS.fake_embeddings import HashingEmbeddings
+    from HELPERS.step_1_to_3_streaming_pipeline import run_streaming_pipeline
+    from HELPERS.step_2_loading_chunks import iter_chunks
+    from HELPERS.step_3_loading_embeddings import load_embeddings
+
+    file_paths = generate_corpus(
+        directory=os.path.join(directory, "documents"),
+        documents=documents,
+        words_per_document=words_per_document,
+    )
+    embeddings = HashingEmbeddings(dimension=dimension)
+
+    # Ingest the corpus, STEP 1 to STEP 3
+    start_time = time.perf_counter()
+    run_streaming_pipeline(
+        file_paths=file_paths,
+        embeddings=embeddings,
+        model_id=embeddings.repo_id,
+        save_json_chunks_directory=os.path.join(directory, "chunks"),
+        saving_embeddings_file_name="embeddings",
+        saving_embeddings_directory=os.path.join(directory, "embeddings"),
+        max_workers=max_workers,
+        index_config={"type": "flat"},
+    )
+    ingest_seconds = time.perf_counter() - start_time
+
+    loaded_embeddings = load_embeddings(
+        os.path.join(directory, "embeddings", "embeddings")
+    )
+    chunks = list(iter_chunks(load_json_chunks_directory=os.path.join(directory, "chunks")))
+
+    # The exact k nearest chunks of each query
+    query_vectors = np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+    distances = (
+        (query_vectors**2).sum(axis=1)[:, None]
+        - 2 * query_vectors @ np.asarray(loaded_embeddings.matrix).T
+        + (np.asarray(loaded_embeddings.matrix) ** 2).sum(axis=1)[None, :]
+    )
+    exact_ids = np.argsort(distances, axis=1)[:, :k]
+
+    result = {
+        "documents": documents,
+        "chunks": loaded_embeddings.count,
+        "dimension": dimension,
+        "ingest_seconds": ingest_seconds,
+        "chunks_per_second": loaded_embeddings.count / ingest_seconds,
+        "indexes": [],
+    }
+
+    for index_config in index_configs:
+        print(f"  {documents} documents, {index_config['type']} index")
+        try:
+            result["indexes"].append(
+                benchmark_index(
+                    index_config=index_config,
+                    loaded_embeddings=loaded_embeddings,
+                    chunks=chunks,
+                    embeddings=embeddings,
+                    queries=queries,
+                    exact_ids=exact_ids,
+                    k=k,
+                    directory=os.path.join(directory, "vectorstores"),
+                )
+            )
+        except ValueError as exception:
+            # Some index types can't be built on small corpora (ivf_pq needs enough training vectors)
+            result["indexes"].append(
+                {"index": {"type": index_config["type"]}, "error": str(exception)}
+            )
+
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sizes", default="20,100", help="Comma separated numbers of documents")
+    parser.add_argument("--words-per-document", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument(
+        "--index-types",
+        default="flat,ivf_flat,hnsw,ivf_pq",
+        help="Comma separated index types to benchmark",
+    )
+    parser.add_argument("--max-workers", type=int, default=1)
+    parser.add_argument(
+        "--output", default="./data/benchmarks/retrieval_benchmark.json"
+    )
+    args = parser.parse_args()
+
+    scratch_directory = tempfile.mkdtemp(prefix="retrieval_benchmark_")
+
+    # The helpers read their default paths from the environment when they are called,
+    # point the ones that aren't set to the scratch directory
+    for name, value in {
+        "DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS": os.path.join(scratch_directory, "chunks"),
+        "SAVING_EMBEDDINGS_FILE_NAME": "embeddings",
+        "SAVING_EMBEDDINGS_DIRECTORY": os.path.join(scratch_directory, "embeddings"),
+        "SAVING_VECTORSTORE_FILE_NAME": "vectorstore",
+        "SAVING_VECTORSTORE_DIRECTORY": os.path.join(scratch_directory, "vectorstores"),
+        "EMBEDDINGS_CACHE_FILE_PATH": os.path.join(scratch_directory, "cache.sqlite3"),
+    }.items():
+        os.environ.setdefault(name, value)
+
+    # Then the rest of the configuration, from the .env file
+    from HELPERS.config import load_config
+
+    load_config()
+
+    from HELPERS.step_3_index_types import index_config_from_env
+
+    index_configs = [
+        dict(index_config_from_env(), type=index_type)
+        for index_type in args.index_types.split(",")
+    ]
+    queries = _generate_queries(args.queries)
+
+    results = []
+    try:
+        for size in args.sizes.split(","):
+            print(f"Benchmarking a corpus of {size} documents")
+            results.append(
+                benchmark_corpus(
+                    documents=int(size),
+                    words_per_document=args.words_per_document,
+                    index_configs=index_configs,
+                    queries=queries,
+                    k=args.k,
+                    dimension=args.dimension,
+                    max_workers=args.max_workers,
+                    directory=os.path.join(scratch_directory, size),
+                )
+            )
+    finally:
+        shutil.rmtree(scratch_directory, ignore_errors=True)
+
+    import faiss
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "faiss": faiss.__version__,
+        },
+        "parameters": {
+            "sizes": [int(size) for size in args.sizes.split(",")],
+            "words_per_document": args.words_per_document,
+            "queries": args.queries,
+            "k": args.k,
+            "dimension": args.dimension,
+            "index_configs": index_configs,
+        },
+        "results": results,
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Benchmark results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+    This code defines how the configuration of the pipeline is loaded: load_config loads the variables of the .env file
+    into the environment, once per process.
+
+    Neither the helpers nor the STEP scripts load the .env file when they are imported, so importing them has no side effect.
+    They read their configuration from the environment when their functions are called (the arguments left to None
+    are read from it then), so the order of the imports doesn't matter: the entry points (the command line interface
+    in src/__main__.py, the main functions of the STEP scripts and the benchmarks) call load_config before they run anything.
+
+    Only the first call loads a .env file, so the file chosen by the command line interface (--env-file)
+    isn't completed by the default .env file when the main function of a STEP script calls load_config again.
+    The variables already set in the environment take precedence over the ones of the .env file.
+"""
+
+import threading
+
+# Whether the configuration of the process was loaded
+_config_loaded = False
+_config_lock = threading.Lock()
+
+
+def load_config(dotenv_path: str | None = None) -> bool:
+    """
+    Load the variables of the .env file into the environment, the first time it is called in the process.
+
+    Args:
+        - dotenv_path (str | None): The path to the .env file, the first .env file found from the src directory upwards if None.
+
+    Returns:
+        - bool: Whether some variables were loaded by this call.
+    """
+
+    global _config_loaded
+    with _config_lock:
+        if _config_loaded:
+            return False
+        _config_loaded = True
+
+    # dotenv is only imported when the configuration is loaded
+    from dotenv import load_dotenv
+
+    return load_dotenv(dotenv_path=dotenv_path)
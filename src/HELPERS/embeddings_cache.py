@@ -0,0 +1,303 @@
+"""
+    This code defines a persistent, content addressed cache in front of an embeddings model.
+
+    The CachedEmbeddings class wraps any object implementing the langchain Embeddings interface.
+    Each embedding is stored in a SQLite file, keyed by the model id and the sha256 hash of the text,
+    so duplicate chunks and repeated queries only pay for one call to the model.
+
+    The cache:
+        only sends the texts that are not cached yet to the model, each distinct text once,
+        keeps at most max_entries embeddings and evicts the least recently used ones first, and
+        counts the hits and misses.
+
+    The function load_cached_embeddings creates the embeddings backend chosen in the .env file (EMBEDDINGS_BACKEND) wrapped in the cache,
+    it is used by STEP 2, STEP 3 and the similarity search in place of HuggingFaceHubEmbeddings:
+        "hub" embeds the texts with the Hugging Face Hub inference API, through the EmbeddingScheduler (the default), and
+        "local" embeds them with a sentence-transformers model run on the CPU of this machine, through LocalEmbeddings.
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, List
+
+from langchain.embeddings.base import Embeddings
+from langchain.embeddings.huggingface_hub import DEFAULT_REPO_ID
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+from HELPERS.step_2_embedding_scheduler import EmbeddingScheduler
+from HELPERS.step_2_local_embeddings import LocalEmbeddings, local_model_id
+
+EMBEDDINGS_BACKENDS = ("hub", "local")
+
+# SQLite limits the number of parameters in a single query
+SQLITE_MAX_VARIABLES = 900
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that caches the embeddings of another Embeddings object on disk.
+
+    Args:
+        - embeddings (Embeddings): The embeddings model to cache.
+        - model_id (str): The id of the model, part of the cache key so models never share embeddings.
+        - cache_file_path (str | None): The path to the SQLite file of the cache, EMBEDDINGS_CACHE_FILE_PATH in the .env file if None.
+        - max_entries (int | None): The maximum number of embeddings kept in the cache, EMBEDDINGS_CACHE_MAX_ENTRIES in the .env file if None.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_id: str,
+        cache_file_path: str | None = None,
+        max_entries: int | None = None,
+    ) -> None:
+        if cache_file_path is None:
+            cache_file_path = os.getenv("EMBEDDINGS_CACHE_FILE_PATH")
+        if max_entries is None:
+            max_entries = int(os.getenv("EMBEDDINGS_CACHE_MAX_ENTRIES", "1000000"))
+
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(cache_file_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(cache_file_path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._connection.commit()
+        self._size = self._connection.execute(
+            "SELECT COUNT(*) FROM embeddings"
+        ).fetchone()[0]
+
+    def _key(self, text: str, kind: str) -> str:
+        """Cache key of a text, documents and queries are kept apart since some models embed them differently."""
+        return hashlib.sha256(
+            f"{self.model_id}\0{kind}\0{text}".encode("utf-8")
+        ).hexdigest()
+
+    def _existing(self, keys: List[str]) -> int:
+        """Count the given keys already in the cache."""
+        count = 0
+        for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            batch = keys[start : start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(batch))
+            count += self._connection.execute(
+                f"SELECT COUNT(*) FROM embeddings WHERE key IN ({placeholders})",
+                batch,
+            ).fetchone()[0]
+
+        return count
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Return the cached embeddings of the given keys and mark them as recently used."""
+        found: Dict[str, List[float]] = {}
+        for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            batch = keys[start : start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                batch,
+            ).fetchall()
+            for key, vector in rows:
+                found[key] = array("f", vector).tolist()
+
+        if found:
+            now = time.time()
+            self._connection.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+
+        return found
+
+    def _store(self, embeddings: Dict[str, List[float]]) -> None:
+        """Add embeddings to the cache and evict the least recently used ones above max_entries."""
+        # Only the new keys add to the size, the ones stored meanwhile by another thread are replaced
+        new_entries = len(embeddings) - self._existing(list(embeddings))
+
+        now = time.time()
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [
+                (key, array("f", vector).tobytes(), now)
+                for key, vector in embeddings.items()
+            ],
+        )
+        self._size += new_entries
+
+        if self._size > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (self._size - self.max_entries,),
+            )
+            self._size = self.max_entries
+
+    def _embed(
+        self, texts: List[str], kind: str, batch_queries: bool = False
+    ) -> List[List[float]]:
+        """
+        Return the embeddings of the texts, only sending the ones missing from the cache to the model.
+
+        The lock is only held while the SQLite file is read and written, not while the model embeds the missing texts,
+        so the threads sharing the cache (the query server, the hybrid search, the sharded build) embed concurrently.
+        """
+        keys = [self._key(text, kind) for text in texts]
+
+        with self._lock:
+            cached = self._lookup(keys)
+            self._connection.commit()
+
+            # Embed each distinct missing text once
+            missing: Dict[str, str] = {}
+            for key, text in zip(keys, texts):
+                if key not in cached and key not in missing:
+                    missing[key] = text
+
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        METRICS.increment("embeddings_cache_hits", len(texts) - len(missing))
+        METRICS.increment("embeddings_cache_misses", len(missing))
+
+        if missing:
+            if kind == "query" and not batch_queries:
+                vectors = [self.embeddings.embed_query(text) for text in missing.values()]
+            else:
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_embeddings = dict(zip(missing.keys(), vectors))
+            cached.update(new_embeddings)
+
+            with self._lock:
+                self._store(new_embeddings)
+                self._connection.commit()
+
+        return [cached[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed search docs, using the cache where possible."""
+        return self._embed(texts, "document")
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed query text, using the cache where possible."""
+        return self._embed([text], "query")[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed several query texts, using the cache where possible.
+
+        The missing queries are sent to the model in a single embed_documents call,
+        the models of the feature-extraction pipeline embed queries and documents the same way.
+        """
+        return self._embed(texts, "query", batch_queries=True)
+
+    def stats(self) -> Dict[str, float]:
+        """Return the hit and miss counters of the cache."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self._size,
+        }
+
+
+def embeddings_model_id(
+    backend: str | None = None,
+) -> str:
+    """
+    Return the id of the model of an embeddings backend, without loading the model.
+
+    Args:
+        - backend (str | None): The embeddings backend, "hub" or "local", EMBEDDINGS_BACKEND in the .env file if None.
+
+    Returns:
+        - str: The id of the model, saved with the embeddings.
+    """
+
+    if backend is None:
+        backend = os.getenv("EMBEDDINGS_BACKEND", "hub")
+
+    if backend == "hub":
+        return DEFAULT_REPO_ID
+    if backend == "local":
+        return local_model_id(
+            model_directory=os.getenv("LOCAL_EMBEDDINGS_MODEL_DIRECTORY", ""),
+            quantize=os.getenv("LOCAL_EMBEDDINGS_QUANTIZE", "false").lower() == "true",
+        )
+
+    raise ValueError(
+        f"Unknown embeddings backend {backend}, expected one of {EMBEDDINGS_BACKENDS}"
+    )
+
+
+def load_embeddings_backend(
+    huggingfacehub_api_token: str | None = None,
+    backend: str | None = None,
+) -> Embeddings:
+    """
+    Create the embeddings backend, without the cache.
+
+    Args:
+        - huggingfacehub_api_token (str | None): The Hugging Face Hub API token, only used by the "hub" backend.
+        - backend (str | None): The embeddings backend, "hub" or "local", EMBEDDINGS_BACKEND in the .env file if None.
+
+    Returns:
+        - Embeddings: The EmbeddingScheduler for the "hub" backend, LocalEmbeddings for the "local" backend.
+    """
+
+    if backend is None:
+        backend = os.getenv("EMBEDDINGS_BACKEND", "hub")
+
+    if backend == "hub":
+        return EmbeddingScheduler(
+            huggingfacehub_api_token=huggingfacehub_api_token,
+            repo_id=DEFAULT_REPO_ID,
+        )
+    if backend == "local":
+        return LocalEmbeddings()
+
+    raise ValueError(
+        f"Unknown embeddings backend {backend}, expected one of {EMBEDDINGS_BACKENDS}"
+    )
+
+
+def load_cached_embeddings(
+    huggingfacehub_api_token: str | None = None,
+    embeddings: Embeddings | None = None,
+) -> CachedEmbeddings:
+    """
+    Create the embeddings backend chosen in the .env file, wrapped in the persistent embeddings cache.
+
+    Args:
+        - huggingfacehub_api_token (str | None): The Hugging Face Hub API token.
+        - embeddings (Embeddings | None): The embeddings object to wrap instead of a new embeddings backend,
+            it must have a repo_id attribute.
+
+    Returns:
+        - CachedEmbeddings: The cached embeddings.
+    """
+
+    if embeddings is None:
+        embeddings = load_embeddings_backend(
+            huggingfacehub_api_token=huggingfacehub_api_token
+        )
+
+    return CachedEmbeddings(embeddings=embeddings, model_id=embeddings.repo_id)
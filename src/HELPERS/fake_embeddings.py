@@ -0,0 +1,67 @@
+"""
+    This code defines the HashingEmbeddings class, a deterministic, local stand-in for the embeddings model,
+    used to benchmark the pipeline without a network connection or an API token.
+
+    Each word gets a random unit vector seeded by the hash of the word, and a text is embedded as the normalized sum
+    of the vectors of its words, so texts sharing words get similar embeddings, like they would with a real model,
+    and the similarity search returns meaningful neighbours.
+
+    The HashingEmbeddings class implements the langchain Embeddings interface, so it can be used in place of
+    HuggingFaceHubEmbeddings (and wrapped in the embeddings cache).
+"""
+
+import hashlib
+import re
+import threading
+from typing import Dict, List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Embeddings object embedding a text as the normalized sum of deterministic random vectors of its words.
+
+    Args:
+        - dimension (int): The dimension of the embeddings.
+    """
+
+    def __init__(self, dimension: int = 256) -> None:
+        self.dimension = dimension
+        self.repo_id = f"hashing-embeddings-{dimension}"
+        self._word_vectors: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        """Return the random unit vector of a word, seeded by its hash."""
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "big")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension)
+            vector = (vector / np.linalg.norm(vector)).astype(np.float32)
+            with self._lock:
+                self._word_vectors[word] = vector
+
+        return vector
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in WORD_PATTERN.findall(text.lower()):
+            vector += self._word_vector(word)
+
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed search docs."""
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed query text."""
+        return self._embed(text)
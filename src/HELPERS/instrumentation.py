@@ -0,0 +1,322 @@
+"""
+    This code defines a lightweight instrumentation layer: timers and counters shared by every step of the pipeline.
+
+    The timers measure how long each stage takes (loading and splitting the documents, the embedding requests,
+    building the index, the similarity search, the language model...), and the counters count what went through them
+    (documents, chunks, bytes, API calls, retries, tokens...).
+
+    Everything is recorded in the process wide METRICS registry, which can be:
+        written as a JSON run report with save_run_report (in RUN_REPORT_DIRECTORY, set in the .env file), and
+        exposed in the Prometheus text format with prometheus_text (the query server serves it on GET /metrics,
+        start_metrics_server serves it from the other STEP scripts while they run, when METRICS_SERVER_PORT is set).
+
+    The stages can also be profiled, on demand: the stages listed in PROFILE_STAGES (or "all") are run under cProfile
+    and their profiles are written to PROFILE_OUTPUT_DIRECTORY, to be opened with pstats or snakeviz.
+    Each stage is a plain function call, so the stages also show up by name in the flame graphs of a sampling profiler like py-spy.
+
+    The documents loaded in worker processes are measured with collect_metrics, which hands the measures of each document
+    back to the parent process with the document.
+
+    The stages of a single request are collected with METRICS.trace: the stages timed by the thread running the block
+    are added up in a dictionary of their own (the query log records them with each query, see step_4_query_log).
+"""
+
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+# Prefix of the Prometheus metric names
+PROMETHEUS_PREFIX = "hf_langchain"
+
+# The stages of the trace running on each thread, see Metrics.trace
+_traces = threading.local()
+
+
+class Metrics:
+    """
+    Thread safe registry of stage timers and counters.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Drop every measure."""
+        with self._lock:
+            self.started_at = time.time()
+            self.stages: Dict[str, Dict[str, float]] = {}
+            self.counters: Dict[str, float] = {}
+
+    def record(self, stage: str, seconds: float, calls: int = 1) -> None:
+        """Add the duration of calls of a stage."""
+        with self._lock:
+            measures = self.stages.setdefault(
+                stage, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+            )
+            measures["calls"] += calls
+            measures["seconds"] += seconds
+            measures["max_seconds"] = max(measures["max_seconds"], seconds)
+
+    def increment(self, counter: str, value: float = 1) -> None:
+        """Add value to a counter."""
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Measure how long the block takes, and profile it if the stage is listed in PROFILE_STAGES."""
+        profiler = _profiler_for(stage)
+        if profiler is not None:
+            profiler.enable()
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            self.record(stage, seconds)
+            stages = getattr(_traces, "stages", None)
+            if stages is not None:
+                stages[stage] = stages.get(stage, 0.0) + seconds
+            if profiler is not None:
+                profiler.disable()
+                _dump_profile(stage, profiler)
+
+    @contextmanager
+    def trace(self) -> Iterator[Dict[str, float]]:
+        """Collect the seconds spent in each stage timed by this thread during the block, in the dictionary yielded."""
+        outer_stages = getattr(_traces, "stages", None)
+        stages: Dict[str, float] = {}
+        _traces.stages = stages
+        try:
+            yield stages
+        finally:
+            _traces.stages = outer_stages
+            # The stages of a nested trace also belong to the trace around it
+            if outer_stages is not None:
+                for stage, seconds in stages.items():
+                    outer_stages[stage] = outer_stages.get(stage, 0.0) + seconds
+
+    def timed(self, stage: str) -> Callable:
+        """Decorator measuring every call of a function as a stage."""
+
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a copy of the measures."""
+        with self._lock:
+            return {
+                "stages": {stage: dict(measures) for stage, measures in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        """Add the measures of a snapshot, taken in another process."""
+        with self._lock:
+            for stage, measures in snapshot["stages"].items():
+                current = self.stages.setdefault(
+                    stage, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+                )
+                current["calls"] += measures["calls"]
+                current["seconds"] += measures["seconds"]
+                current["max_seconds"] = max(current["max_seconds"], measures["max_seconds"])
+            for counter, value in snapshot["counters"].items():
+                self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def report(self) -> Dict[str, Any]:
+        """Return the run report: when the run started, how long it took, and the measures of every stage and counter."""
+        report = self.snapshot()
+        report = {
+            "started_at": self.started_at,
+            "duration_seconds": time.time() - self.started_at,
+            **report,
+        }
+        for measures in report["stages"].values():
+            measures["mean_seconds"] = (
+                measures["seconds"] / measures["calls"] if measures["calls"] else 0.0
+            )
+
+        return report
+
+
+METRICS = Metrics()
+
+
+# Only one stage is profiled at a time
+_profiler_lock = threading.Lock()
+
+
+# The stages listed in PROFILE_STAGES, read when the first stage is timed, once the .env file is loaded
+_profiled_stages: frozenset | None = None
+
+
+def _profiler_for(stage: str) -> cProfile.Profile | None:
+    """Return a profiler if the stage should be profiled, only one profiler can run at a time."""
+    global _profiled_stages
+    if _profiled_stages is None:
+        _profiled_stages = frozenset(
+            stage.strip() for stage in os.getenv("PROFILE_STAGES", "").split(",") if stage.strip()
+        )
+
+    stages = _profiled_stages
+    if not stages or ("all" not in stages and stage not in stages):
+        return None
+
+    if not _profiler_lock.acquire(blocking=False):
+        # Another stage is already being profiled, it includes this one if it is on the same thread
+        return None
+
+    return cProfile.Profile()
+
+
+def _dump_profile(stage: str, profiler: cProfile.Profile) -> None:
+    try:
+        directory = os.getenv("PROFILE_OUTPUT_DIRECTORY", "./data/profiles")
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(
+            os.path.join(directory, f"{stage}-{os.getpid()}-{time.time_ns()}.prof")
+        )
+    finally:
+        _profiler_lock.release()
+
+
+def collect_metrics(function: Callable, *args) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Call a function in a worker process and return its result with the measures it recorded,
+    to be merged into the registry of the parent process with METRICS.merge.
+
+    Args:
+        - function (Callable): The function to call.
+        - args: The arguments of the function.
+
+    Returns:
+        - Tuple[Any, Dict[str, Any]]: The result of the function and the snapshot of its measures.
+    """
+
+    METRICS.reset()
+    result = function(*args)
+
+    return result, METRICS.snapshot()
+
+
+def save_run_report(
+    name: str,
+    report_directory: str | None = None,
+) -> str | None:
+    """
+    Write the run report as JSON, nothing is written if no report directory is set.
+
+    Args:
+        - name (str): The name of the run, the report is saved as "<name>-<timestamp>.json".
+        - report_directory (str | None): The directory the report is written to, RUN_REPORT_DIRECTORY in the .env file if None.
+
+    Returns:
+        - str | None: The path to the report.
+    """
+
+    if report_directory is None:
+        report_directory = os.getenv("RUN_REPORT_DIRECTORY")
+
+    if not report_directory:
+        return None
+
+    os.makedirs(report_directory, exist_ok=True)
+    report_path = os.path.join(
+        report_directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    with open(report_path, "w") as f:
+        json.dump({"name": name, **METRICS.report()}, f, indent=2)
+
+    return report_path
+
+
+def prometheus_text() -> str:
+    """
+    Return the measures in the Prometheus text exposition format.
+
+    Returns:
+        - str: The stage timers as <prefix>_stage_seconds_total, <prefix>_stage_calls_total and <prefix>_stage_max_seconds
+            labelled by stage, and each counter as <prefix>_<counter>_total.
+    """
+
+    snapshot = METRICS.snapshot()
+    lines = []
+
+    for metric, key, kind in (
+        ("stage_seconds_total", "seconds", "counter"),
+        ("stage_calls_total", "calls", "counter"),
+        ("stage_max_seconds", "max_seconds", "gauge"),
+    ):
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{metric} {kind}")
+        for stage, measures in sorted(snapshot["stages"].items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_{metric}{{stage="{stage}"}} {measures[key]}')
+
+    for counter, value in sorted(snapshot["counters"].items()):
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{counter}_total counter")
+        lines.append(f"{PROMETHEUS_PREFIX}_{counter}_total {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves the measures in the Prometheus text format on GET /metrics."""
+
+    def log_message(self, format: str, *args) -> None:
+        """Keep the console quiet."""
+
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        payload = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_metrics_server(
+    host: str = "127.0.0.1",
+    port: int | None = None,
+) -> ThreadingHTTPServer | None:
+    """
+    Serve the measures in the Prometheus text format on GET /metrics, from a background thread.
+
+    The STEP scripts call it when they start, nothing is served unless METRICS_SERVER_PORT is set.
+
+    Args:
+        - host (str): The host to listen on.
+        - port (int | None): The port to listen on, 0 picks a free port, METRICS_SERVER_PORT in the .env file if None,
+            nothing is served if it is empty.
+
+    Returns:
+        - ThreadingHTTPServer | None: The running server, shutdown() stops it, None if nothing is served.
+    """
+
+    if port is None:
+        if not os.getenv("METRICS_SERVER_PORT"):
+            return None
+        port = int(os.getenv("METRICS_SERVER_PORT"))
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
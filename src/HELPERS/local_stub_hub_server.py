@@ -0,0 +1,217 @@
+"""
+    This code defines a local stub of the Hugging Face Hub inference API, used to try and benchmark the pipeline
+    without a network connection or an API token.
+
+    The stub answers the feature-extraction pipeline route used to embed texts:
+        POST /pipeline/feature-extraction/<repo id> with {"inputs": [texts]} returns one embedding per text,
+    and the model route used to generate text:
+        POST /models/<repo id> with {"inputs": prompt} returns [{"generated_text": ...}], a short deterministic answer, and
+        POST /models/<repo id> with {"inputs": prompt, "stream": true} streams the same answer token by token,
+        as server-sent events in the text-generation-inference format, waiting token_latency_seconds before each token.
+
+    The embeddings are deterministic: each text always gets the same unit length vector, computed from its hash.
+
+    The stub can simulate a rate limited API: every fail_every-th request is answered with a 429 status code
+    and a Retry-After header, and each request can be slowed down by latency_seconds.
+
+    The function start_stub_hub_server starts the stub in a background thread and returns it with its url.
+    Running this file starts the stub in the foreground, point HUGGINGFACEHUB_INFERENCE_ENDPOINT to it to use it.
+"""
+
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+
+
+def stub_embedding(text: str, dimension: int) -> List[float]:
+    """
+    Compute the deterministic unit length embedding of a text.
+
+    Args:
+        - text (str): The text to embed.
+        - dimension (int): The dimension of the embedding.
+
+    Returns:
+        - List[float]: The embedding of the text.
+    """
+
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    generator = random.Random(seed)
+    vector = [generator.gauss(0.0, 1.0) for _ in range(dimension)]
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+
+    return [value / norm for value in vector]
+
+
+class StubHubServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server standing in for the Hugging Face Hub inference API.
+
+    Args:
+        - server_address (Tuple[str, int]): The host and port to listen on, port 0 picks a free port.
+        - dimension (int): The dimension of the embeddings returned.
+        - fail_every (int): Answer every fail_every-th request with a 429 status code, 0 never fails.
+        - latency_seconds (float): The time each request takes.
+        - token_latency_seconds (float): The time each streamed token takes to generate.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        server_address: Tuple[str, int] = ("127.0.0.1", 0),
+        dimension: int = 768,
+        fail_every: int = 0,
+        latency_seconds: float = 0.0,
+        token_latency_seconds: float = 0.0,
+    ) -> None:
+        super().__init__(server_address, StubHubRequestHandler)
+        self.dimension = dimension
+        self.fail_every = fail_every
+        self.latency_seconds = latency_seconds
+        self.token_latency_seconds = token_latency_seconds
+        self.requests_received = 0
+        self.texts_embedded = 0
+        self._counters_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """The url to use as HUGGINGFACEHUB_INFERENCE_ENDPOINT."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class StubHubRequestHandler(BaseHTTPRequestHandler):
+    """Request handler of the StubHubServer."""
+
+    server: StubHubServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        """Keep the console quiet."""
+
+    def _send_json(self, status_code: int, body, headers: dict | None = None) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream_tokens(self, generated_text: str) -> None:
+        """Send the generated text token by token, one server-sent event per token, in a chunked response."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        # The tokens are the words, with the space before them
+        words = generated_text.split(" ")
+        tokens = [words[0]] + [" " + word for word in words[1:]]
+        try:
+            for i, token in enumerate(tokens):
+                if self.server.token_latency_seconds:
+                    time.sleep(self.server.token_latency_seconds)
+                event = {
+                    "token": {"id": i, "text": token, "logprob": 0.0, "special": False},
+                    "generated_text": generated_text if i == len(tokens) - 1 else None,
+                    "details": None,
+                }
+                payload = f"data:{json.dumps(event)}\n\n".encode("utf-8")
+                self.wfile.write(
+                    f"{len(payload):X}\r\n".encode("ascii") + payload + b"\r\n"
+                )
+                self.wfile.flush()
+
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading the answer
+            self.close_connection = True
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        with self.server._counters_lock:
+            self.server.requests_received += 1
+            request_number = self.server.requests_received
+
+        if self.server.latency_seconds:
+            time.sleep(self.server.latency_seconds)
+
+        # Simulate the rate limiting of the inference API
+        if self.server.fail_every and request_number % self.server.fail_every == 0:
+            self._send_json(
+                429, {"error": "Rate limit reached"}, headers={"Retry-After": "0"}
+            )
+            return
+
+        if self.path.startswith("/pipeline/feature-extraction/"):
+            inputs = request.get("inputs", [])
+            texts = [inputs] if isinstance(inputs, str) else inputs
+            embeddings = [stub_embedding(text, self.server.dimension) for text in texts]
+
+            with self.server._counters_lock:
+                self.server.texts_embedded += len(texts)
+
+            self._send_json(200, embeddings[0] if isinstance(inputs, str) else embeddings)
+            return
+
+        if self.path.startswith("/models/"):
+            prompt = request.get("inputs", "")
+            generated_text = f"Stub answer to a prompt of {len(prompt)} characters."
+            if request.get("stream"):
+                self._stream_tokens(generated_text)
+                return
+            self._send_json(200, [{"generated_text": generated_text}])
+            return
+
+        self._send_json(404, {"error": f"Unknown route {self.path}"})
+
+
+def start_stub_hub_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    dimension: int = 768,
+    fail_every: int = 0,
+    latency_seconds: float = 0.0,
+    token_latency_seconds: float = 0.0,
+) -> StubHubServer:
+    """
+    Start the stub inference API in a background thread.
+
+    Args:
+        - host (str): The host to listen on.
+        - port (int): The port to listen on, 0 picks a free port.
+        - dimension (int): The dimension of the embeddings returned.
+        - fail_every (int): Answer every fail_every-th request with a 429 status code, 0 never fails.
+        - latency_seconds (float): The time each request takes.
+        - token_latency_seconds (float): The time each streamed token takes to generate.
+
+    Returns:
+        - StubHubServer: The running server, its url attribute is the endpoint to use and shutdown() stops it.
+    """
+
+    server = StubHubServer(
+        server_address=(host, port),
+        dimension=dimension,
+        fail_every=fail_every,
+        latency_seconds=latency_seconds,
+        token_latency_seconds=token_latency_seconds,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+if __name__ == "__main__":
+    server = StubHubServer(server_address=("127.0.0.1", 8080))
+    print(f"Stub Hugging Face Hub inference API listening on {server.url}")
+    server.serve_forever()
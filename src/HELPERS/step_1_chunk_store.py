@@ -0,0 +1,327 @@
+"""
+    This code defines the binary chunk store ("chunks.bin"), which holds the chunks of all the documents in a single file.
+
+    The file is made of:
+        a header: a magic string, the number of chunks and the offsets of the tables below,
+        the texts of the chunks, in the order they were saved, each one as its length (4 bytes) followed by its UTF-8 bytes,
+        the documents: the name of each one, stored the same way, when it was ingested and its tags,
+        the index: one fixed size entry per chunk, with its id, the number of its document, its chunk index, its page
+        (-1 for None) and the offset and length of its text, and
+        the ids of the chunks sorted, with the position of each one, to find a chunk by id with a binary search.
+
+    The ChunkStoreWriter writes the texts as they come and the tables when it is closed,
+    so a chunk store of any size is written with only its index in memory.
+
+    The ChunkStore memory-maps the file: opening it only reads the header and the table of the documents,
+    the index is used in place, without being parsed, and the text of a chunk is only decoded when that chunk is read.
+    It reads the chunks in order (iter_records), the chunks of some documents (without reading the others),
+    or a single chunk by id (get).
+
+    The chunk stores written before the documents had an ingest time and tags (version 1) are still read,
+    their chunks have no ingest time and no tags.
+"""
+
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+
+CHUNK_STORE_FILE_NAME = "chunks.bin"
+
+MAGIC = b"CHUNKS02"
+MAGIC_VERSION_1 = b"CHUNKS01"
+# Magic string, number of chunks, offset of the table of the documents, offset of the index
+HEADER = struct.Struct("<8sQQQ")
+LENGTH = struct.Struct("<I")
+TIMESTAMP = struct.Struct("<d")
+
+ID_LENGTH = 16
+INDEX_DTYPE = np.dtype(
+    [
+        ("id", f"S{ID_LENGTH}"),
+        ("document", "<u4"),
+        ("chunk_index", "<u4"),
+        ("page", "<i4"),
+        ("offset", "<u8"),
+        ("length", "<u4"),
+    ]
+)
+NO_PAGE = -1
+# Number of entries of the index converted together when reading the chunks in order
+READ_BLOCK_SIZE = 4096
+
+
+def _read_string(buffer, offset: int) -> Tuple[str, int]:
+    """Read the length-prefixed UTF-8 string at an offset, return it with the offset following it."""
+    (length,) = LENGTH.unpack_from(buffer, offset)
+    start = offset + LENGTH.size
+
+    return buffer[start : start + length].decode("utf-8"), start + length
+
+
+class ChunkStoreWriter:
+    """
+    Writes a chunk store, one chunk at a time.
+
+    The chunk store is only complete once the writer is closed, by close or at the end of a with block.
+
+    Args:
+        - file_path (str): The path to the chunk store file.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self._file = open(file_path, "wb")
+        self._file.write(HEADER.pack(MAGIC, 0, 0, 0))
+        self._offset = HEADER.size
+        # The number, ingest time and tags of each document, by name
+        self._documents: Dict[str, Tuple[int, float | None, List[str]]] = {}
+        self._entries: List[tuple] = []
+
+    def add(self, record: Dict[str, Union[str, int, None]]) -> None:
+        """
+        Append a chunk to the chunk store.
+
+        Args:
+            - record (Dict[str, Union[str, int, None]]): The chunk, with its "id", "document", "chunk_index", "page" and "text",
+                and optionally the "ingested_at" and "tags" of its document, taken from the first chunk of each document.
+        """
+
+        text = record["text"].encode("utf-8")
+        self._file.write(LENGTH.pack(len(text)))
+        self._file.write(text)
+
+        if record["document"] not in self._documents:
+            self._documents[record["document"]] = (
+                len(self._documents),
+                record.get("ingested_at"),
+                list(record.get("tags") or []),
+            )
+        document = self._documents[record["document"]][0]
+        page = record.get("page")
+        self._entries.append(
+            (
+                record["id"].encode("ascii"),
+                document,
+                record["chunk_index"],
+                NO_PAGE if page is None else page,
+                self._offset + LENGTH.size,
+                len(text),
+            )
+        )
+        self._offset += LENGTH.size + len(text)
+
+    def close(self) -> None:
+        """Write the table of the documents, the index and the header."""
+        if self._file.closed:
+            return
+
+        documents_offset = self._offset
+        self._file.write(LENGTH.pack(len(self._documents)))
+        for document_name, (_, ingested_at, tags) in self._documents.items():
+            self._write_string(document_name)
+            self._file.write(
+                TIMESTAMP.pack(float("nan") if ingested_at is None else ingested_at)
+            )
+            self._file.write(LENGTH.pack(len(tags)))
+            for tag in tags:
+                self._write_string(tag)
+
+        index = np.array(self._entries, dtype=INDEX_DTYPE)
+        index_offset = self._file.tell()
+        self._file.write(index.tobytes())
+        # The ids sorted, and the position of each of them in the index
+        id_order = np.argsort(index["id"], kind="stable").astype("<u4")
+        self._file.write(index["id"][id_order].tobytes())
+        self._file.write(id_order.tobytes())
+
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, len(index), documents_offset, index_offset))
+        self._file.close()
+
+    def _write_string(self, string: str) -> None:
+        encoded = string.encode("utf-8")
+        self._file.write(LENGTH.pack(len(encoded)))
+        self._file.write(encoded)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __enter__(self) -> "ChunkStoreWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class ChunkStore:
+    """
+    Reads a chunk store, memory-mapped.
+
+    Args:
+        - file_path (str): The path to the chunk store file.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        with open(file_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, documents_offset, index_offset = HEADER.unpack_from(self._mmap, 0)
+        if magic not in (MAGIC, MAGIC_VERSION_1):
+            self._mmap.close()
+            raise ValueError(f"{file_path} is not a chunk store")
+
+        # The name, ingest time and tags of each document
+        self.documents: List[str] = []
+        self.ingested_at: List[float | None] = []
+        self.tags: List[List[str]] = []
+        (document_count,) = LENGTH.unpack_from(self._mmap, documents_offset)
+        offset = documents_offset + LENGTH.size
+        for _ in range(document_count):
+            document_name, offset = _read_string(self._mmap, offset)
+            self.documents.append(document_name)
+            if magic == MAGIC_VERSION_1:
+                self.ingested_at.append(None)
+                self.tags.append([])
+                continue
+
+            (ingested_at,) = TIMESTAMP.unpack_from(self._mmap, offset)
+            (tag_count,) = LENGTH.unpack_from(self._mmap, offset + TIMESTAMP.size)
+            offset += TIMESTAMP.size + LENGTH.size
+            tags = []
+            for _ in range(tag_count):
+                tag, offset = _read_string(self._mmap, offset)
+                tags.append(tag)
+            # NaN stands for a document without ingest time
+            self.ingested_at.append(None if np.isnan(ingested_at) else ingested_at)
+            self.tags.append(tags)
+
+        self.index = np.frombuffer(
+            self._mmap, dtype=INDEX_DTYPE, count=count, offset=index_offset
+        )
+        sorted_ids_offset = index_offset + count * INDEX_DTYPE.itemsize
+        self._sorted_ids = np.frombuffer(
+            self._mmap, dtype=f"S{ID_LENGTH}", count=count, offset=sorted_ids_offset
+        )
+        self._id_order = np.frombuffer(
+            self._mmap,
+            dtype="<u4",
+            count=count,
+            offset=sorted_ids_offset + count * ID_LENGTH,
+        )
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def record(self, position: int) -> Dict[str, Union[str, int, None]]:
+        """
+        Read the chunk at a position.
+
+        Args:
+            - position (int): The position of the chunk in the chunk store.
+
+        Returns:
+            - Dict[str, Union[str, int, None]]: The chunk, with its "id", "document", "chunk_index", "page", "text",
+                and the "ingested_at" and "tags" of its document.
+        """
+
+        return self._record(self.index[position].tolist())
+
+    def _record(self, entry: tuple) -> Dict[str, Union[str, int, None]]:
+        """Build the chunk of an entry of the index, decoding its text."""
+        chunk_id, document, chunk_index, page, offset, length = entry
+
+        return {
+            "id": chunk_id.decode("ascii"),
+            "document": self.documents[document],
+            "chunk_index": chunk_index,
+            "page": None if page == NO_PAGE else page,
+            "text": self._mmap[offset : offset + length].decode("utf-8"),
+            "ingested_at": self.ingested_at[document],
+            "tags": list(self.tags[document]),
+        }
+
+    def position(self, chunk_id: str) -> int | None:
+        """Return the position of the chunk with this id, None if there is no such chunk."""
+        key = chunk_id.encode("ascii")
+        sorted_position = int(np.searchsorted(self._sorted_ids, key))
+        if sorted_position == len(self) or self._sorted_ids[sorted_position] != key:
+            return None
+
+        return int(self._id_order[sorted_position])
+
+    def get(self, chunk_id: str) -> Dict[str, Union[str, int, None]] | None:
+        """Read the chunk with this id, None if there is no such chunk."""
+        position = self.position(chunk_id)
+
+        return None if position is None else self.record(position)
+
+    def iter_records(
+        self, document_names: Iterable[str] | None = None
+    ) -> Iterator[Dict[str, Union[str, int, None]]]:
+        """
+        Read the chunks in the order they were saved.
+
+        Args:
+            - document_names (Iterable[str] | None): The names of the documents to read the chunks of, all the chunks if None.
+
+        Returns:
+            - Iterator[Dict[str, Union[str, int, None]]]: The chunks.
+        """
+
+        if document_names is None:
+            positions = np.arange(len(self))
+        else:
+            document_names = set(document_names)
+            documents = [
+                number
+                for number, document_name in enumerate(self.documents)
+                if document_name in document_names
+            ]
+            positions = np.flatnonzero(np.isin(self.index["document"], documents))
+
+        # Convert the entries of the index to tuples a block at a time, much faster than field by field
+        for block_start in range(0, len(positions), READ_BLOCK_SIZE):
+            block = self.index[positions[block_start : block_start + READ_BLOCK_SIZE]]
+            for entry in block.tolist():
+                yield self._record(entry)
+
+    def close(self) -> None:
+        """Release the memory map, the arrays of the index can't be used afterwards."""
+        self.index = self._sorted_ids = self._id_order = None
+        self._mmap.close()
+
+    def __enter__(self) -> "ChunkStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def chunk_store_file_path(directory: str, file_name: str = CHUNK_STORE_FILE_NAME) -> str:
+    """
+    Return the path to the chunk store of a directory, refusing the directories still holding chunks in the legacy formats.
+
+    Args:
+        - directory (str): The directory of the chunk store.
+        - file_name (str): The name of the chunk store file.
+
+    Returns:
+        - str: The path to the chunk store file.
+    """
+
+    file_path = os.path.join(directory, file_name)
+    if not os.path.exists(file_path) and os.path.isdir(directory):
+        if any(
+            name == "chunks.jsonl" or name.endswith(" Chunks.json")
+            for name in os.listdir(directory)
+        ):
+            raise ValueError(
+                f"{directory} holds chunks in a legacy format, convert them first with: "
+                f"python src/HELPERS/step_1_convert_chunk_store.py {directory}"
+            )
+
+    return file_path
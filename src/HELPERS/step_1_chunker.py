@@ -0,0 +1,240 @@
+"""
+    This code defines the TextChunker class, which splits the text of a document into overlapping chunks.
+
+    It replaces the CharacterTextSplitter of langchain in STEP 1, which splits the text on every space
+    and joins the words back together, allocating a new string for every word and every chunk being built.
+    The TextChunker works on offsets into the original text instead:
+        the characters of the text are classified (space, word or punctuation) in a single vectorized pass with numpy,
+        the start and end offsets of the words, and where the sentences end, are derived from these classes,
+        the end of every chunk and the start of the next one are found by binary search over the cumulated sizes of the words, and
+        the text of each chunk is sliced from the original text once, at the end.
+
+    The size of the chunks and of their overlap (CHUNK_SIZE and CHUNK_OVERLAP in the .env file) are counted in
+    characters or in tokens (CHUNK_SIZE_UNIT), the tokens being the words and the punctuation marks of the text,
+    which is close to the number of tokens of the embeddings model.
+
+    The chunks end on word boundaries or, when CHUNK_BOUNDARY is "sentence", on the last sentence boundary that fits
+    (a sentence longer than a chunk is still split on word boundaries),
+    and the identical chunks of a document are only kept once when CHUNK_DEDUP is "true".
+"""
+
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+CHUNK_SIZE_UNITS = ("characters", "tokens")
+CHUNK_BOUNDARIES = ("word", "sentence")
+
+# Classes of the characters, the characters past the table are classified as word characters
+SPACE, WORD, PUNCTUATION = 0, 1, 2
+_CLASS_TABLE_SIZE = 0x3001
+CHARACTER_CLASSES = np.array(
+    [
+        SPACE
+        if chr(code).isspace()
+        else WORD
+        if chr(code).isalnum() or chr(code) == "_"
+        else PUNCTUATION
+        for code in range(_CLASS_TABLE_SIZE)
+    ]
+    + [WORD],
+    dtype=np.uint8,
+)
+
+# Whether each ASCII character ends a sentence, or closes a quote or a bracket, the last entry stands for the other characters
+SENTENCE_END_CHARACTERS = np.array([chr(code) in ".!?" for code in range(128)] + [False])
+CLOSING_CHARACTERS = np.array([chr(code) in "\"')]" for code in range(128)] + [False])
+
+
+def _character_classes(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the code points of the characters of the text and their classes, indexed like the text."""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    classes = CHARACTER_CLASSES[np.minimum(codes, _CLASS_TABLE_SIZE)]
+
+    return codes, classes
+
+
+def _token_starts(classes: np.ndarray) -> np.ndarray:
+    """Return whether a token starts at each character: at each punctuation mark and at the first character of each run of word characters."""
+    previous_classes = np.concatenate(([SPACE], classes[:-1]))
+
+    return (classes == PUNCTUATION) | ((classes == WORD) & (previous_classes != WORD))
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text, its words and punctuation marks, like the chunks are measured in tokens."""
+    _, classes = _character_classes(text)
+
+    return int(np.count_nonzero(_token_starts(classes)))
+
+
+class TextChunker:
+    """
+    Splits texts into overlapping chunks, working on offsets into the text.
+
+    Args:
+        - chunk_size (int | None): The maximum size of a chunk, a single word larger than that is kept as its own chunk, CHUNK_SIZE in the .env file if None.
+        - chunk_overlap (int | None): The maximum size of the end of a chunk repeated at the start of the next one, CHUNK_OVERLAP in the .env file if None.
+        - size_unit (str | None): "characters" or "tokens", the unit of chunk_size and chunk_overlap, CHUNK_SIZE_UNIT in the .env file if None.
+        - boundary (str | None): "word" or "sentence", where the chunks end, CHUNK_BOUNDARY in the .env file if None.
+        - dedup (bool | None): Whether the identical chunks of a document are only kept once, CHUNK_DEDUP in the .env file if None.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int | None = None,
+        chunk_overlap: int | None = None,
+        size_unit: str | None = None,
+        boundary: str | None = None,
+        dedup: bool | None = None,
+    ) -> None:
+        if chunk_size is None:
+            chunk_size = int(os.getenv("CHUNK_SIZE", "800"))
+        if chunk_overlap is None:
+            chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "80"))
+        if size_unit is None:
+            size_unit = os.getenv("CHUNK_SIZE_UNIT", "characters")
+        if boundary is None:
+            boundary = os.getenv("CHUNK_BOUNDARY", "sentence")
+        if dedup is None:
+            dedup = os.getenv("CHUNK_DEDUP", "true").lower() == "true"
+
+        if chunk_overlap >= chunk_size:
+            raise ValueError(
+                f"The chunk overlap ({chunk_overlap}) must be smaller than the chunk size ({chunk_size})"
+            )
+        if size_unit not in CHUNK_SIZE_UNITS:
+            raise ValueError(
+                f"Unknown chunk size unit {size_unit}, expected one of {CHUNK_SIZE_UNITS}"
+            )
+        if boundary not in CHUNK_BOUNDARIES:
+            raise ValueError(
+                f"Unknown chunk boundary {boundary}, expected one of {CHUNK_BOUNDARIES}"
+            )
+
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.size_unit = size_unit
+        self.boundary = boundary
+        self.dedup = dedup
+
+    @staticmethod
+    def _sentence_ends(
+        codes: np.ndarray, starts: np.ndarray, ends: np.ndarray
+    ) -> np.ndarray:
+        """
+        Return whether each word ends a sentence: it ends with a period, an exclamation or a question mark
+        (maybe followed by a closing quote or bracket), or a line break follows it.
+        """
+        last = np.minimum(codes[ends - 1], 128)
+        before_last = np.minimum(codes[np.maximum(ends - 2, starts)], 128)
+        punctuated = SENTENCE_END_CHARACTERS[last] | (
+            CLOSING_CHARACTERS[last] & SENTENCE_END_CHARACTERS[before_last]
+        )
+
+        line_breaks = np.concatenate(([0], np.cumsum(codes == ord("\n"))))
+        followed_by_line_break = np.zeros(len(starts), dtype=bool)
+        followed_by_line_break[:-1] = line_breaks[starts[1:]] > line_breaks[ends[:-1]]
+
+        sentence_ends = punctuated | followed_by_line_break
+        sentence_ends[-1] = True
+
+        return sentence_ends
+
+    def split_spans(self, text: str) -> List[Tuple[int, int]]:
+        """
+        Split a text into overlapping chunks.
+
+        Args:
+            - text (str): The text to split.
+
+        Returns:
+            - List[Tuple[int, int]]: The start and end offsets of each chunk in the text, in order.
+        """
+
+        codes, classes = _character_classes(text)
+
+        # The words are the runs of characters that aren't spaces
+        in_word = classes != SPACE
+        edges = np.diff(np.concatenate(([False], in_word, [False])).astype(np.int8))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        count = len(starts)
+        if not count:
+            return []
+
+        # The size of the words i to j is right[j] - left[i], both arrays are non decreasing
+        if self.size_unit == "characters":
+            left, right = starts, ends
+        else:
+            tokens_before = np.concatenate(([0], np.cumsum(_token_starts(classes))))
+            left, right = tokens_before[starts], tokens_before[ends]
+
+        positions = np.arange(count)
+
+        # The last word fitting in a chunk starting at each word, at least that word
+        last = np.maximum(
+            np.searchsorted(right, left + self.chunk_size, side="right") - 1, positions
+        )
+        # The first word of the overlap of a chunk ending at each word
+        next_first = np.searchsorted(left, right - self.chunk_overlap, side="left")
+
+        if self.boundary == "sentence":
+            sentence_ends = self._sentence_ends(codes, starts, ends)
+
+            # End the chunks on the last sentence end that fits, if there is one after their first word
+            last_sentence_end = np.maximum.accumulate(
+                np.where(sentence_ends, positions, -1)
+            )[last]
+            last = np.where(last_sentence_end >= positions, last_sentence_end, last)
+
+            # Start the overlap on the first sentence start after its first word
+            sentence_starts = np.concatenate(([True], sentence_ends[:-1]))
+            next_sentence_start = np.minimum.accumulate(
+                np.where(sentence_starts, positions, count)[::-1]
+            )[::-1]
+            next_first = next_sentence_start[np.minimum(next_first, count - 1)]
+
+        # Walk from chunk to chunk, with plain integers
+        last, next_first = last.tolist(), next_first.tolist()
+        starts, ends = starts.tolist(), ends.tolist()
+
+        spans = []
+        first = 0
+        while True:
+            chunk_last = last[first]
+            spans.append((starts[first], ends[chunk_last]))
+            if chunk_last == count - 1:
+                break
+            # Like the CharacterTextSplitter, drop words from the start of the overlap until the next chunk
+            # reaches past this one, so no chunk is only the end of the previous one
+            first = min(max(next_first[chunk_last], first + 1), chunk_last + 1)
+            while first <= chunk_last and last[first] <= chunk_last:
+                first += 1
+
+        return spans
+
+    def split_texts(self, texts: List[str]) -> List[str]:
+        """
+        Split several texts (the pages of a document) into overlapping chunks.
+
+        Args:
+            - texts (List[str]): The texts to split.
+
+        Returns:
+            - List[str]: The texts of the chunks, in order, without the duplicates if dedup is set.
+        """
+
+        chunks = [
+            text[start:end] for text in texts for start, end in self.split_spans(text)
+        ]
+        if not self.dedup:
+            return chunks
+
+        # dict keeps the first occurrence of each chunk, in order
+        return list(dict.fromkeys(chunks))
+
+    def split_text(self, text: str) -> List[str]:
+        """Split a text into overlapping chunks, see split_texts."""
+        return self.split_texts([text])
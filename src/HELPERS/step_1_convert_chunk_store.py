@@ -0,0 +1,139 @@
+"""
+    This code converts the chunks saved in the legacy formats to the binary chunk store ("chunks.bin").
+
+    Two legacy formats are read:
+        the JSONL chunk store ("chunks.jsonl"), one chunk per line, whose chunk ids are kept as they are, and
+        the "<document name> Chunks.json" files, one per document, each a JSON list of single key dictionaries
+        like {"chunk_1": text}, whose chunks get their stable ids computed from the document name, the chunk index and the text.
+
+    The chunks are streamed into the new chunk store one document (or one line) at a time.
+    The legacy files are left in place, unless --remove-legacy is given.
+
+    Example:
+        python src/HELPERS/step_1_convert_chunk_store.py ./data/chunked_data --remove-legacy
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Dict, Iterator, List, Union
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.config import load_config
+from HELPERS.step_1_chunk_store import CHUNK_STORE_FILE_NAME, ChunkStoreWriter
+from HELPERS.step_1_save_chunked_docs import chunk_records
+
+LEGACY_JSONL_FILE_NAME = "chunks.jsonl"
+LEGACY_JSON_SUFFIX = " Chunks.json"
+
+
+def legacy_chunk_files(directory: str) -> List[str]:
+    """
+    List the files of a directory holding chunks in the legacy formats.
+
+    Args:
+        - directory (str): The directory of the chunks.
+
+    Returns:
+        - List[str]: The paths to the legacy files, the JSONL chunk store first, then the JSON files sorted by name.
+    """
+
+    file_names = sorted(os.listdir(directory))
+    jsonl_file_names = [name for name in file_names if name == LEGACY_JSONL_FILE_NAME]
+    json_file_names = [name for name in file_names if name.endswith(LEGACY_JSON_SUFFIX)]
+
+    return [os.path.join(directory, name) for name in jsonl_file_names + json_file_names]
+
+
+def iter_legacy_records(file_path: str) -> Iterator[Dict[str, Union[str, int, None]]]:
+    """
+    Read the chunks of a legacy file as chunk store records.
+
+    Args:
+        - file_path (str): The path to the "chunks.jsonl" file or to a "<document name> Chunks.json" file.
+
+    Returns:
+        - Iterator[Dict[str, Union[str, int, None]]]: The chunks, with their "id", "document", "chunk_index", "page" and "text".
+    """
+
+    if os.path.basename(file_path) == LEGACY_JSONL_FILE_NAME:
+        with open(file_path, "r") as f:
+            for line in f:
+                record = json.loads(line)
+                record.setdefault("page", None)
+                yield record
+        return
+
+    with open(file_path, "r") as f:
+        legacy_chunks = json.load(f)
+
+    # Each chunk is a dictionary with a single "chunk_<number>" key, in order
+    document = {
+        "name": os.path.basename(file_path)[: -len(LEGACY_JSON_SUFFIX)],
+        "chunks": [next(iter(chunk.values())) for chunk in legacy_chunks],
+    }
+    yield from chunk_records(document)
+
+
+def convert_chunk_directory(directory: str, remove_legacy: bool = False) -> int:
+    """
+    Convert the legacy chunk files of a directory to the binary chunk store.
+
+    Args:
+        - directory (str): The directory of the chunks.
+        - remove_legacy (bool): Whether to delete the legacy files once the chunk store is written.
+
+    Returns:
+        - int: The number of chunks converted.
+    """
+
+    chunk_store_path = os.path.join(directory, CHUNK_STORE_FILE_NAME)
+    if os.path.exists(chunk_store_path):
+        raise ValueError(f"{chunk_store_path} already exists")
+
+    file_paths = legacy_chunk_files(directory)
+    if not file_paths:
+        raise ValueError(f"No legacy chunk files in {directory}")
+
+    with ChunkStoreWriter(chunk_store_path + ".tmp") as writer:
+        for file_path in file_paths:
+            for record in iter_legacy_records(file_path):
+                writer.add(record)
+        chunk_count = len(writer)
+
+    os.replace(chunk_store_path + ".tmp", chunk_store_path)
+
+    if remove_legacy:
+        for file_path in file_paths:
+            os.remove(file_path)
+
+    return chunk_count
+
+
+def main() -> None:
+    load_config()
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "directory",
+        nargs="?",
+        default=os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS"),
+        help="The directory of the chunks, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS by default",
+    )
+    parser.add_argument(
+        "--remove-legacy",
+        action="store_true",
+        help="Delete the legacy files once the chunk store is written",
+    )
+    args = parser.parse_args()
+
+    chunk_count = convert_chunk_directory(
+        directory=args.directory, remove_legacy=args.remove_legacy
+    )
+    print(f"Converted {chunk_count} chunks to {os.path.join(args.directory, CHUNK_STORE_FILE_NAME)}")
+
+
+if __name__ == "__main__":
+    main()
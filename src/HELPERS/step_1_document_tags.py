@@ -0,0 +1,73 @@
+"""
+    This code defines the functions giving the documents their custom tags, saved with their chunks and used to filter the searches.
+
+    The tags are set in a JSON file (DOCUMENT_TAGS_FILE_PATH in the .env file) mapping patterns of document names to lists of tags:
+        {"annual_report_*": ["finance", "annual"], "handbook": ["hr"]}
+    the patterns are matched against the names of the documents (without their extension) with fnmatch,
+    and a document gets the tags of every pattern it matches.
+
+    The function load_tag_rules loads the file, or returns no rules if there is no such file,
+    and the function document_tags returns the tags of a document.
+
+    The tags are saved with the chunks when a document is chunked, so changing the file only changes the tags
+    of the documents chunked afterwards.
+"""
+
+import fnmatch
+import json
+import os
+from typing import Dict, List
+
+
+def load_tag_rules(
+    tags_file_path: str | None = None,
+) -> Dict[str, List[str]]:
+    """
+    Load the tags of the documents.
+
+    Args:
+        - tags_file_path (str | None): The path to the JSON file of the tags, DOCUMENT_TAGS_FILE_PATH in the .env file if None.
+
+    Returns:
+        - Dict[str, List[str]]: The tags of each pattern of document names, empty if there is no such file.
+    """
+
+    if tags_file_path is None:
+        tags_file_path = os.getenv("DOCUMENT_TAGS_FILE_PATH")
+
+    if not tags_file_path or not os.path.exists(tags_file_path):
+        return {}
+
+    with open(tags_file_path, "r") as f:
+        tag_rules = json.load(f)
+
+    if not isinstance(tag_rules, dict) or not all(
+        isinstance(tags, list) for tags in tag_rules.values()
+    ):
+        raise ValueError(
+            f"{tags_file_path} should map patterns of document names to lists of tags"
+        )
+
+    return tag_rules
+
+
+def document_tags(document_name: str, tag_rules: Dict[str, List[str]]) -> List[str]:
+    """
+    Return the tags of a document.
+
+    Args:
+        - document_name (str): The name of the document.
+        - tag_rules (Dict[str, List[str]]): The tags of each pattern of document names.
+
+    Returns:
+        - List[str]: The tags of every pattern the name matches, sorted and without duplicates.
+    """
+
+    return sorted(
+        {
+            str(tag)
+            for pattern, tags in tag_rules.items()
+            if fnmatch.fnmatchcase(document_name, pattern)
+            for tag in tags
+        }
+    )
@@ -0,0 +1,154 @@
+"""
+    This code defines the functions used to keep track of which documents changed between two runs of the pipeline.
+
+    The manifest is a JSON file saved next to the chunked documents (INGEST_MANIFEST_FILE_PATH in the .env file).
+    For each source file it records:
+        the name of the document,
+        the sha256 hash, size and modification time of the file,
+        the hash the embeddings were created from (embedded_sha256, written by STEP 2),
+        the hash the vectorstore was built from (indexed_sha256, written by STEP 3), and
+        the digests of the ids of the chunks embedded and indexed after the near duplicate elimination
+        (embedded_chunks_sha256 and indexed_chunks_sha256, see step_2_near_duplicates).
+
+    The function load_manifest loads the manifest, or returns an empty one if it doesn't exist yet.
+
+    The function save_manifest saves the manifest, writing to a temporary file first so an interrupted run
+    never leaves a half written manifest behind.
+
+    The function scan_documents compares the files in the documents directory against the manifest and returns
+    the files that are new or changed and the files that were removed.
+    The hash of a file is only computed when its size or modification time changed.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Tuple, Union
+
+
+def load_manifest(
+    manifest_file_path: str | None = None,
+) -> Dict[str, Dict[str, Dict[str, Union[str, int, float]]]]:
+    """
+    Load the ingest manifest, or return an empty one if it doesn't exist yet.
+
+    Args:
+        - manifest_file_path (str | None): The path to the manifest file, INGEST_MANIFEST_FILE_PATH in the .env file if None.
+
+    Returns:
+        - Dict[str, Dict[str, Dict[str, Union[str, int, float]]]]: The manifest, with one entry per source file under "documents".
+    """
+
+    if manifest_file_path is None:
+        manifest_file_path = os.getenv("INGEST_MANIFEST_FILE_PATH")
+
+    if not os.path.exists(manifest_file_path):
+        return {"documents": {}}
+
+    with open(manifest_file_path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(
+    manifest: Dict[str, Dict[str, Dict[str, Union[str, int, float]]]],
+    manifest_file_path: str | None = None,
+) -> None:
+    """
+    Save the ingest manifest.
+
+    Args:
+        - manifest (Dict[str, Dict[str, Dict[str, Union[str, int, float]]]]): The manifest to save.
+        - manifest_file_path (str | None): The path to the manifest file, INGEST_MANIFEST_FILE_PATH in the .env file if None.
+
+    Returns:
+        - None
+    """
+
+    if manifest_file_path is None:
+        manifest_file_path = os.getenv("INGEST_MANIFEST_FILE_PATH")
+
+    directory = os.path.dirname(manifest_file_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    # Write to a temporary file first and swap it in, so the manifest is never half written
+    temporary_file_path = manifest_file_path + ".tmp"
+    with open(temporary_file_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary_file_path, manifest_file_path)
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Compute the sha256 hash of a file, reading it in blocks.
+
+    Args:
+        - file_path (str): The path to the file.
+
+    Returns:
+        - str: The hex digest of the file content.
+    """
+
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+
+    return sha256.hexdigest()
+
+
+def scan_documents(
+    docs_directory_path: str,
+    manifest: Dict[str, Dict[str, Dict[str, Union[str, int, float]]]],
+) -> Tuple[Dict[str, Dict[str, Union[str, int, float]]], List[str]]:
+    """
+    Compare the files in the documents directory against the manifest.
+
+    Files whose size and modification time didn't change are skipped without being read.
+    Files that were only touched (same hash, new modification time) get their manifest entry updated in place.
+
+    Args:
+        - docs_directory_path (str): The path to the directory containing the documents.
+        - manifest (Dict[str, Dict[str, Dict[str, Union[str, int, float]]]]): The manifest of the previous run.
+
+    Returns:
+        - Tuple[Dict[str, Dict[str, Union[str, int, float]]], List[str]]:
+            - the new manifest entries of the files that are new or changed, by file name,
+            - and the names of the files that were removed.
+    """
+
+    known_documents = manifest["documents"]
+    changed_documents = {}
+
+    file_names = sorted(os.listdir(docs_directory_path))
+    for file_name in file_names:
+        file_path = os.path.join(docs_directory_path, file_name)
+        stat = os.stat(file_path)
+        known = known_documents.get(file_name)
+
+        # Same size and modification time, the file didn't change
+        if (
+            known is not None
+            and known["size"] == stat.st_size
+            and known["mtime"] == stat.st_mtime
+        ):
+            continue
+
+        sha256 = hash_file(file_path)
+
+        # Only the modification time changed, keep the existing chunks and embeddings
+        if known is not None and known["sha256"] == sha256:
+            known["size"] = stat.st_size
+            known["mtime"] = stat.st_mtime
+            continue
+
+        changed_documents[file_name] = {
+            "name": os.path.splitext(file_name)[0],
+            "sha256": sha256,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        }
+
+    removed_file_names = sorted(set(known_documents) - set(file_names))
+
+    return changed_documents, removed_file_names
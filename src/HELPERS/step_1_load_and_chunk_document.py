@@ -0,0 +1,206 @@
+"""
+    This code defines a function called load_and_chunk_document that loads a single document (or a range of its pages)
+    and splits it into chunks.
+
+    The functions are kept at module level (and free of import-time work) so they can be pickled and sent
+    to the worker processes of a process pool. langchain is only imported to load the files that aren't pdf files,
+    so loading pdf files doesn't pay for its import.
+
+    The function load_and_chunk_document:
+        reads the pdf files lazily, one page at a time with iter_pdf_pages, and streams the text of each page
+        straight into the TextChunker (configured in the .env file), so only one page is held in memory at a time,
+        loads the other files with the UnstructuredFileLoader and splits them the same way, and
+        returns a dictionary with the name of the document, the texts of its chunks and the page number of each chunk.
+
+    The pages of a large pdf file can be spread across the workers of a pool:
+        plan_document_parts splits the pdf files of more than PDF_PAGES_PER_PART pages (in the .env file) into ranges of pages,
+        each range is loaded and chunked with load_and_chunk_document, and
+        merge_document_parts puts the chunks of the ranges back together, in order.
+
+    The time spent parsing and splitting the document, and the number of documents, pages, bytes and chunks,
+    are recorded in the instrumentation registry.
+"""
+
+import os
+import sys
+from typing import Dict, Iterator, List, Tuple, Union
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+from HELPERS.step_1_chunker import TextChunker
+
+
+def iter_pdf_pages(
+    file_path: str,
+    first_page: int = 0,
+    last_page: int | None = None,
+) -> Iterator[Tuple[int, str]]:
+    """
+    Extract the text of the pages of a pdf file, one page at a time.
+
+    Args:
+        - file_path (str): The path to the pdf file.
+        - first_page (int): The index of the first page to extract, from 0.
+        - last_page (int | None): The index after the last page to extract, up to the last page of the file if None.
+
+    Returns:
+        - Iterator[Tuple[int, str]]: The number of each page, from 1, and its text.
+    """
+
+    import pypdf
+
+    with open(file_path, "rb") as f:
+        reader = pypdf.PdfReader(f)
+        last_page = len(reader.pages) if last_page is None else min(last_page, len(reader.pages))
+        for page_index in range(first_page, last_page):
+            yield page_index + 1, reader.pages[page_index].extract_text()
+
+
+def count_pdf_pages(file_path: str) -> int:
+    """Return the number of pages of a pdf file, without extracting their text."""
+    import pypdf
+
+    with open(file_path, "rb") as f:
+        return len(pypdf.PdfReader(f).pages)
+
+
+def load_and_chunk_document(
+    file_path: str,
+    first_page: int = 0,
+    last_page: int | None = None,
+) -> Dict[str, Union[str, List[str], List[int | None]]]:
+    """
+    Load a single document, or a range of the pages of a pdf file, and split it into chunks.
+
+    Args:
+        - file_path (str): The path to the document to load.
+        - first_page (int): The index of the first page to load, from 0, only used for pdf files.
+        - last_page (int | None): The index after the last page to load, up to the last page if None, only used for pdf files.
+
+    Returns:
+        - Dict[str, Union[str, List[str], List[int | None]]]: A dictionary containing the name of the document,
+            the texts of its chunks and the page number of each chunk (None for the files that aren't pdf files).
+    """
+
+    file_name = os.path.basename(file_path)
+    chunker = TextChunker()
+    chunks: List[str] = []
+    pages: List[int | None] = []
+
+    if file_name.endswith(".pdf"):
+        # Extract and split the pages one at a time
+        page_count = 0
+        page_iterator = iter_pdf_pages(file_path, first_page=first_page, last_page=last_page)
+        while True:
+            with METRICS.timer("parse_document"):
+                page = next(page_iterator, None)
+            if page is None:
+                break
+            page_number, text = page
+            page_count += 1
+
+            with METRICS.timer("split_document"):
+                for start, end in chunker.split_spans(text):
+                    chunks.append(text[start:end])
+                    pages.append(page_number)
+    else:
+        # langchain is only needed for the files that aren't pdf files
+        from langchain.document_loaders import UnstructuredFileLoader
+
+        with METRICS.timer("parse_document"):
+            document = UnstructuredFileLoader(file_path=file_path).load()
+        page_count = len(document)
+
+        with METRICS.timer("split_document"):
+            for page in document:
+                for start, end in chunker.split_spans(page.page_content):
+                    chunks.append(page.page_content[start:end])
+                    pages.append(None)
+
+    if chunker.dedup:
+        chunks, pages = _dedup_chunks(chunks, pages)
+
+    # A document split into several ranges of pages is counted with its first range
+    if first_page == 0:
+        METRICS.increment("documents_loaded")
+        METRICS.increment("document_bytes", os.path.getsize(file_path))
+    METRICS.increment("document_pages", page_count)
+    METRICS.increment("chunks_created", len(chunks))
+
+    # Return document name and chunked data
+    return {"name": os.path.splitext(file_name)[0], "chunks": chunks, "pages": pages}
+
+
+def _dedup_chunks(
+    chunks: List[str], pages: List[int | None]
+) -> Tuple[List[str], List[int | None]]:
+    """Keep the first occurrence of each chunk, with its page number."""
+    first_pages: Dict[str, int | None] = {}
+    for chunk, page in zip(chunks, pages):
+        first_pages.setdefault(chunk, page)
+
+    return list(first_pages), list(first_pages.values())
+
+
+def plan_document_parts(
+    file_paths: List[str],
+    pages_per_part: int | None = None,
+) -> List[Tuple[str, int, int | None]]:
+    """
+    Split the pdf files of more than pages_per_part pages into ranges of pages, to be loaded by different workers.
+
+    Args:
+        - file_paths (List[str]): The paths to the documents.
+        - pages_per_part (int | None): The number of pages of each range, 0 never splits a file, PDF_PAGES_PER_PART in the .env file if None.
+
+    Returns:
+        - List[Tuple[str, int, int | None]]: The path, the first page and the page after the last page of each part,
+            in the order of file_paths, the files that aren't split are a single part ending at None.
+    """
+
+    if pages_per_part is None:
+        pages_per_part = int(os.getenv("PDF_PAGES_PER_PART", "64"))
+
+    parts = []
+    for file_path in file_paths:
+        page_count = (
+            count_pdf_pages(file_path)
+            if pages_per_part and file_path.endswith(".pdf")
+            else 0
+        )
+        if page_count <= pages_per_part:
+            parts.append((file_path, 0, None))
+            continue
+
+        for first_page in range(0, page_count, pages_per_part):
+            parts.append(
+                (file_path, first_page, min(first_page + pages_per_part, page_count))
+            )
+
+    return parts
+
+
+def merge_document_parts(
+    parts: List[Dict[str, Union[str, List[str], List[int | None]]]],
+) -> Dict[str, Union[str, List[str], List[int | None]]]:
+    """
+    Put the chunks of the ranges of pages of a document back together.
+
+    Args:
+        - parts (List[Dict[str, Union[str, List[str], List[int | None]]]]): The ranges of pages of the document, in order.
+
+    Returns:
+        - Dict[str, Union[str, List[str], List[int | None]]]: The name of the document, the texts of its chunks
+            and the page number of each chunk.
+    """
+
+    if len(parts) == 1:
+        return parts[0]
+
+    chunks = [chunk for part in parts for chunk in part["chunks"]]
+    pages = [page for part in parts for page in part["pages"]]
+    if TextChunker().dedup:
+        chunks, pages = _dedup_chunks(chunks, pages)
+
+    return {"name": parts[0]["name"], "chunks": chunks, "pages": pages}
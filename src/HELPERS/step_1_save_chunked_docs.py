@@ -1,61 +1,162 @@
 """
-    This code defines a function called save_documents that saves a list of objects to JSON files. 
-    
-    Each object in the list should have two properties: 
-    the name of the document that was chunked, and the chunked data itself. 
-    
-    The JSON file should be named after the document name, with "Chunks" appended to the end of the name. 
-    
-    The content of the JSON file should be the chunked data. 
-    
-    The function uses the os and json modules to create the directory for the chunked data if it doesn't exist, 
-    and to save the documents to JSON files with dynamic names. 
-    
-    The resulting JSON files are saved in the directory specified by the save_json_chunks_directory argument.
+    This code defines a function called save_documents that saves the chunks of a list of documents to the chunk store.
+
+    Each object in the list should have two properties:
+    the name of the document that was chunked, and the texts of its chunks,
+    and can have a third one, the page number of each chunk.
+
+    The chunk store is a single binary file ("chunks.bin", see step_1_chunk_store) in the directory specified by
+    the save_json_chunks_directory argument. It holds, for each chunk:
+        "id": a stable id computed from the document name, the chunk index and the text,
+        "document": the name of the document,
+        "chunk_index": the position of the chunk in the document,
+        "page": the number of the page of the chunk, from 1 (None for the documents that aren't pdf files),
+        "text": the text of the chunk,
+        "ingested_at": when the document was chunked and saved, as a Unix timestamp, and
+        "tags": the custom tags of the document (see step_1_document_tags).
+
+    The chunks of a document are always saved together and in order.
+
+    The function rewrites the chunk store in a single pass:
+        the chunks of the documents that were not changed or removed are copied from the previous chunk store,
+        and the chunks of the new and changed documents are appended.
+
+    The new chunk store is written to a temporary file first and swapped in.
 """
 
+import hashlib
 import os
-import json
 import sys
-from dotenv import load_dotenv
+import time
 
 from typing import List, Dict, Union
 
-load_dotenv()  # Load environment variables from .env file
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+from HELPERS.step_1_chunk_store import (
+    ChunkStore,
+    ChunkStoreWriter,
+    chunk_store_file_path,
+)
+from HELPERS.step_1_document_tags import document_tags, load_tag_rules
+
+
+def chunk_id(document_name: str, chunk_index: int, text: str) -> str:
+    """
+    Compute the stable id of a chunk, the same chunk of the same document always gets the same id.
+
+    Args:
+        - document_name (str): The name of the document.
+        - chunk_index (int): The position of the chunk in the document.
+        - text (str): The text of the chunk.
+
+    Returns:
+        - str: The 16 characters id of the chunk.
+    """
+
+    return hashlib.sha1(
+        f"{document_name}\0{chunk_index}\0{text}".encode("utf-8")
+    ).hexdigest()[:16]
 
 
+def chunk_records(
+    document: Dict[str, Union[str, List[str], List[int | None]]],
+    ingested_at: float | None = None,
+    tags: List[str] | None = None,
+) -> List[Dict[str, Union[str, int, float, List[str], None]]]:
+    """
+    Build the chunk store records of a document.
+
+    Args:
+        - document (Dict[str, Union[str, List[str], List[int | None]]]): The name of the document, the texts of its chunks
+            and, optionally, their page numbers.
+        - ingested_at (float | None): When the document was ingested, as a Unix timestamp.
+        - tags (List[str] | None): The custom tags of the document.
+
+    Returns:
+        - List[Dict[str, Union[str, int, float, List[str], None]]]: The records of the chunks,
+            with their "id", "document", "chunk_index", "page", "text", "ingested_at" and "tags".
+    """
+
+    pages = document.get("pages") or [None] * len(document["chunks"])
+
+    return [
+        {
+            "id": chunk_id(document["name"], chunk_index, text),
+            "document": document["name"],
+            "chunk_index": chunk_index,
+            "page": page,
+            "text": text,
+            "ingested_at": ingested_at,
+            "tags": tags or [],
+        }
+        for chunk_index, (text, page) in enumerate(zip(document["chunks"], pages))
+    ]
+
+
+@METRICS.timed("save_documents")
 def save_documents(
-    documents: List[Dict[str, Union[str, List[Dict[str, str]]]]],
-    save_json_chunks_directory: str = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS"),
+    documents: List[Dict[str, Union[str, List[str]]]],
+    save_json_chunks_directory: str | None = None,
+    removed_document_names: List[str] | None = None,
 ) -> None:
     """
-    Saves a list of objects to JSON files. Each object in the list should have two properties:
+    Saves the chunks of a list of documents to the chunk store. Each object in the list should have two properties:
         - the name of the document that was chunked,
-        - and the chunked data itself.
+        - and the texts of its chunks.
 
-    The JSON file should be named after the document name, with "Chunks"
-    appended to the end of the name.
-    The content of the JSON file should be the chunked data.
+    The chunks these documents had in the previous chunk store are replaced,
+    and the chunks of the removed documents are dropped.
+    The chunks of the documents saved are given the current time as their ingest time, and the tags of their documents.
 
     Args:
-        - documents (List[Dict[str, Union[str, List[Dict[str, str]]]]]):
+        - documents (List[Dict[str, Union[str, List[str]]]]):
             - A list of objects, where each object has two properties:
                 - the name of the document that was chunked,
-                - and the chunked data itself.
-        - save_json_chunks_directory (str): The path to the directory where the JSON files will be saved.
+                - and the texts of its chunks.
+        - save_json_chunks_directory (str | None): The path to the directory where the chunk store is saved, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
+        - removed_document_names (List[str] | None): The names of the documents whose chunks are dropped.
 
     Returns:
         - None
     """
 
+    if save_json_chunks_directory is None:
+        save_json_chunks_directory = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS")
+
     # Create directory for chunked data if it doesn't exist
     if not os.path.exists(save_json_chunks_directory):
         os.makedirs(save_json_chunks_directory)
 
-    # Save documents to JSON file with dynamic name
-    for doc in documents:
-        json_file_path = os.path.join(
-            save_json_chunks_directory, f"{doc['name']} Chunks.json"
-        )
-        with open(json_file_path, "w") as f:
-            json.dump(doc["chunks"], f)
+    chunk_store_path = chunk_store_file_path(save_json_chunks_directory)
+    replaced_document_names = {doc["name"] for doc in documents} | set(
+        removed_document_names or []
+    )
+
+    with ChunkStoreWriter(chunk_store_path + ".tmp") as writer:
+        # Copy the chunks of the documents that were not changed or removed
+        if os.path.exists(chunk_store_path):
+            with ChunkStore(chunk_store_path) as previous:
+                kept_document_names = [
+                    document_name
+                    for document_name in previous.documents
+                    if document_name not in replaced_document_names
+                ]
+                for record in previous.iter_records(document_names=kept_document_names):
+                    writer.add(record)
+
+        # Append the chunks of the new and changed documents
+        ingested_at = time.time()
+        tag_rules = load_tag_rules()
+        for doc in documents:
+            for record in chunk_records(
+                doc,
+                ingested_at=ingested_at,
+                tags=document_tags(doc["name"], tag_rules=tag_rules),
+            ):
+                writer.add(record)
+            METRICS.increment("chunks_saved", len(doc["chunks"]))
+
+    METRICS.increment("chunk_store_bytes_written", os.path.getsize(chunk_store_path + ".tmp"))
+    os.replace(chunk_store_path + ".tmp", chunk_store_path)
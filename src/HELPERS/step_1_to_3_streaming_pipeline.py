@@ -0,0 +1,385 @@
+"""
+    This code defines the streaming pipeline, which runs STEP 1, STEP 2 and STEP 3 together with a bounded memory use.
+
+    Instead of building the full list of chunks, then the full list of embeddings, then the vectorstore,
+    the documents flow through a chain of generators, each running in its own thread and connected by bounded queues:
+        the documents are loaded and chunked (in a pool of worker processes, with a bounded number of files in flight),
+        the chunks are written to the chunk store and grouped into batches,
+        each batch is embedded, and
+        the embeddings of each batch are written to disk and added to the FAISS index.
+
+    A stage that gets ahead of the next one blocks on its queue, so only max_queue_size documents or batches are
+    held by each stage at any time, whatever the size of the corpus.
+    The FAISS index and the docstore, which are kept in memory by design, are the only things that grow with the corpus.
+
+    The FAISS index is of the type set in the .env file. The ivf_flat and ivf_pq indexes are trained on the first
+    training_sample_size embeddings, which are held back until then, since the embeddings can't be sampled before they exist.
+
+    The function run_streaming_pipeline runs the pipeline and returns the vectorstore,
+    the chunk store and the embeddings are saved as they go.
+"""
+
+import itertools
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+from langchain import FAISS
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS, collect_metrics
+from HELPERS.step_1_load_and_chunk_document import (
+    load_and_chunk_document,
+    merge_document_parts,
+    plan_document_parts,
+)
+from HELPERS.step_1_chunk_store import CHUNK_STORE_FILE_NAME, ChunkStoreWriter
+from HELPERS.step_1_document_tags import document_tags, load_tag_rules
+from HELPERS.step_1_save_chunked_docs import chunk_records
+from HELPERS.step_2_save_embeddings import EmbeddingsWriter
+from HELPERS.step_3_index_types import build_index, index_config_from_env, needs_training
+
+# Marks the end of a stage in its queue
+_END = object()
+
+
+def iter_in_background(iterable: Iterable, max_queue_size: int) -> Iterator:
+    """
+    Run an iterable in a background thread, handing its items over through a bounded queue.
+
+    The thread stops producing whenever max_queue_size items are waiting to be consumed.
+    An exception raised by the iterable is raised again in the consumer.
+
+    Args:
+        - iterable (Iterable): The iterable to run in the background.
+        - max_queue_size (int): The maximum number of items waiting to be consumed.
+
+    Returns:
+        - Iterator: The items of the iterable, in order.
+    """
+
+    items: queue.Queue = queue.Queue(maxsize=max_queue_size)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        # Give up if the consumer went away
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as exception:
+            put((_END, exception))
+            return
+        put((_END, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    try:
+        while True:
+            item = items.get()
+            if isinstance(item, tuple) and len(item) == 2 and item[0] is _END:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def iter_loaded_documents(
+    file_paths: List[str],
+    max_workers: int = 1,
+) -> Iterator[Dict[str, Union[str, List[str]]]]:
+    """
+    Load and chunk the documents one at a time, in the order of file_paths.
+
+    With more than one worker, the documents are loaded in a pool of worker processes,
+    with at most twice as many files (or ranges of pages of the large pdf files) in flight as there are workers.
+
+    Args:
+        - file_paths (List[str]): The paths to the documents to load.
+        - max_workers (int): The number of worker processes.
+
+    Returns:
+        - Iterator[Dict[str, Union[str, List[str]]]]: The name of each document, the texts of its chunks and their page numbers.
+    """
+
+    if max_workers <= 1:
+        for file_path in file_paths:
+            yield load_and_chunk_document(file_path)
+        return
+
+    document_parts = []
+
+    def collected(file_path: str, future) -> Iterator[Dict[str, Union[str, List[str]]]]:
+        # Hand the measures of the worker process back to the registry of this process
+        document, snapshot = future.result()
+        METRICS.merge(snapshot)
+
+        # Put the parts of each document back together, the parts of a document come one after the other
+        if document_parts and document_parts[0][0] != file_path:
+            yield merge_document_parts([part for _, part in document_parts])
+            document_parts.clear()
+        document_parts.append((file_path, document))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for file_path in file_paths:
+            for _, first_page, last_page in plan_document_parts(file_paths=[file_path]):
+                pending.append(
+                    (
+                        file_path,
+                        executor.submit(
+                            collect_metrics,
+                            load_and_chunk_document,
+                            file_path,
+                            first_page,
+                            last_page,
+                        ),
+                    )
+                )
+                if len(pending) >= 2 * max_workers:
+                    yield from collected(*pending.popleft())
+        while pending:
+            yield from collected(*pending.popleft())
+        if document_parts:
+            yield merge_document_parts([part for _, part in document_parts])
+
+
+def iter_chunk_batches(
+    documents: Iterable[Dict[str, Union[str, List[str]]]],
+    batch_size: int,
+    chunk_store_writer: ChunkStoreWriter,
+) -> Iterator[List[Dict[str, Union[str, int]]]]:
+    """
+    Write the chunks of the documents to the chunk store, with their ingest time and tags, and group them into batches, across documents.
+
+    Args:
+        - documents (Iterable[Dict[str, Union[str, List[str]]]]): The name of each document and the texts of its chunks.
+        - batch_size (int): The number of chunks in each batch.
+        - chunk_store_writer (ChunkStoreWriter): The writer of the chunk store the chunks are written to.
+
+    Returns:
+        - Iterator[List[Dict[str, Union[str, int]]]]: The batches of chunk records.
+    """
+
+    batch = []
+    ingested_at = time.time()
+    tag_rules = load_tag_rules()
+    for document in documents:
+        for record in chunk_records(
+            document,
+            ingested_at=ingested_at,
+            tags=document_tags(document["name"], tag_rules=tag_rules),
+        ):
+            chunk_store_writer.add(record)
+            batch.append(record)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def iter_embedded_batches(
+    batches: Iterable[List[Dict[str, Union[str, int]]]],
+    embeddings: Embeddings,
+) -> Iterator[Tuple[List[Dict[str, Union[str, int]]], np.ndarray]]:
+    """
+    Embed each batch of chunks.
+
+    Args:
+        - batches (Iterable[List[Dict[str, Union[str, int]]]]): The batches of chunk records.
+        - embeddings (Embeddings): The embeddings model.
+
+    Returns:
+        - Iterator[Tuple[List[Dict[str, Union[str, int]]], np.ndarray]]: Each batch with the float32 matrix of its embeddings.
+    """
+
+    for batch in batches:
+        with METRICS.timer("embed_batch"):
+            vectors = embeddings.embed_documents([record["text"] for record in batch])
+        METRICS.increment("chunks_embedded", len(batch))
+        yield batch, np.asarray(vectors, dtype=np.float32)
+
+
+def _build_index_from(vectors: List[np.ndarray], index_config: Dict[str, Any]):
+    """Create the FAISS index, trained on the given embeddings if its type needs it, and add them to it."""
+    vectors = np.concatenate(vectors)
+    index = build_index(
+        dimension=vectors.shape[1],
+        index_config=index_config,
+        training_vectors=vectors if needs_training(index_config) else None,
+    )
+    with METRICS.timer("index_add"):
+        index.add(vectors)
+    METRICS.increment("vectors_indexed", len(vectors))
+
+    return index
+
+
+def run_streaming_pipeline(
+    file_paths: List[str],
+    embeddings: Embeddings,
+    model_id: str | None = None,
+    save_json_chunks_directory: str | None = None,
+    saving_embeddings_file_name: str | None = None,
+    saving_embeddings_directory: str | None = None,
+    max_workers: int | None = None,
+    batch_size: int | None = None,
+    max_queue_size: int | None = None,
+    index_config: Dict[str, Any] | None = None,
+) -> FAISS:
+    """
+    Load, chunk, embed and index the documents in a single streaming pass.
+
+    The chunk store and the embeddings are replaced by the ones of the given documents.
+
+    Args:
+        - file_paths (List[str]): The paths to the documents to load, in the order they are indexed.
+        - embeddings (Embeddings): The embeddings model, also used to embed the queries of the vectorstore.
+        - model_id (str | None): The id of the embeddings model, saved with the embeddings.
+        - save_json_chunks_directory (str | None): The path to the directory where the chunk store is saved, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
+        - saving_embeddings_file_name (str | None): The name of the file the embeddings are saved to, SAVING_EMBEDDINGS_FILE_NAME in the .env file if None.
+        - saving_embeddings_directory (str | None): The path to the directory where the embeddings are saved, SAVING_EMBEDDINGS_DIRECTORY in the .env file if None.
+        - max_workers (int | None): The number of worker processes used to load and chunk the documents, INGEST_MAX_WORKERS in the .env file if None.
+        - batch_size (int | None): The number of chunks embedded together, STREAMING_BATCH_SIZE in the .env file if None.
+        - max_queue_size (int | None): The maximum number of documents or batches waiting between two stages, STREAMING_MAX_QUEUE_SIZE in the .env file if None.
+        - index_config (Dict[str, Any] | None): The type of the FAISS index and its parameters, read from the .env file if None.
+
+    Returns:
+        - FAISS: The vectorstore of the documents.
+    """
+
+    if save_json_chunks_directory is None:
+        save_json_chunks_directory = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS")
+    if saving_embeddings_file_name is None:
+        saving_embeddings_file_name = os.getenv("SAVING_EMBEDDINGS_FILE_NAME")
+    if saving_embeddings_directory is None:
+        saving_embeddings_directory = os.getenv("SAVING_EMBEDDINGS_DIRECTORY")
+    if max_workers is None:
+        max_workers = int(os.getenv("INGEST_MAX_WORKERS", "1"))
+    if batch_size is None:
+        batch_size = int(os.getenv("STREAMING_BATCH_SIZE", "256"))
+    if max_queue_size is None:
+        max_queue_size = int(os.getenv("STREAMING_MAX_QUEUE_SIZE", "8"))
+
+    if not os.path.exists(save_json_chunks_directory):
+        os.makedirs(save_json_chunks_directory)
+    chunk_store_path = os.path.join(save_json_chunks_directory, CHUNK_STORE_FILE_NAME)
+
+    if index_config is None:
+        index_config = index_config_from_env()
+
+    writer = EmbeddingsWriter(
+        saving_embeddings_file_name=saving_embeddings_file_name,
+        saving_embeddings_directory=saving_embeddings_directory,
+        model_id=model_id,
+    )
+    index = None
+    # Embeddings held back until there are enough of them to train the index
+    held_back_vectors: List[np.ndarray] = []
+    held_back_count = 0
+    docstore_documents: Dict[str, Document] = {}
+    index_to_docstore_id: Dict[int, str] = {}
+
+    with ChunkStoreWriter(chunk_store_path + ".tmp") as chunk_store_writer:
+        # Chain the stages, each one running in its own thread
+        documents = iter_in_background(
+            iter_loaded_documents(file_paths=file_paths, max_workers=max_workers),
+            max_queue_size=max_queue_size,
+        )
+        batches = iter_in_background(
+            iter_chunk_batches(
+                documents=documents,
+                batch_size=batch_size,
+                chunk_store_writer=chunk_store_writer,
+            ),
+            max_queue_size=max_queue_size,
+        )
+        embedded_batches = iter_in_background(
+            iter_embedded_batches(batches=batches, embeddings=embeddings),
+            max_queue_size=max_queue_size,
+        )
+
+        for batch, vectors in embedded_batches:
+            # Add the batch to the index, once it is created and trained
+            if index is not None:
+                with METRICS.timer("index_add"):
+                    index.add(vectors)
+                METRICS.increment("vectors_indexed", len(vectors))
+            else:
+                held_back_vectors.append(vectors)
+                held_back_count += len(vectors)
+                if (
+                    not needs_training(index_config)
+                    or held_back_count >= index_config["training_sample_size"]
+                ):
+                    index = _build_index_from(held_back_vectors, index_config)
+                    held_back_vectors = []
+
+            # Add the batch to the docstore
+            for record in batch:
+                docstore_id = str(uuid.uuid4())
+                index_to_docstore_id[len(index_to_docstore_id)] = docstore_id
+                docstore_documents[docstore_id] = Document(
+                    page_content=record["text"],
+                    metadata={
+                        "source": record["document"],
+                        "chunk_index": record["chunk_index"],
+                        "chunk_id": record["id"],
+                        "page": record["page"],
+                        "ingested_at": record["ingested_at"],
+                        "tags": record["tags"],
+                    },
+                )
+
+            # Write the embeddings of the batch, document by document
+            start = 0
+            for document_name, records in itertools.groupby(
+                batch, key=lambda record: record["document"]
+            ):
+                chunk_ids = [record["id"] for record in records]
+                writer.add(
+                    document_name=document_name,
+                    chunk_ids=chunk_ids,
+                    embeddings=vectors[start : start + len(chunk_ids)],
+                )
+                start += len(chunk_ids)
+
+    # Swap the new chunk store and embeddings in
+    writer.close()
+    os.replace(chunk_store_path + ".tmp", chunk_store_path)
+
+    if index is None:
+        if not held_back_vectors:
+            raise ValueError("No chunks were loaded from the documents")
+        # Fewer embeddings than the training sample size, train on all of them
+        index = _build_index_from(held_back_vectors, index_config)
+
+    return FAISS(
+        embedding_function=embeddings.embed_query,
+        index=index,
+        docstore=InMemoryDocstore(docstore_documents),
+        index_to_docstore_id=index_to_docstore_id,
+    )
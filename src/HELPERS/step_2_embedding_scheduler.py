@@ -0,0 +1,197 @@
+"""
+    This code defines the EmbeddingScheduler class, which sends embedding requests to the Hugging Face Hub inference API
+    in batches, several at a time, and retries the ones that are rate limited.
+
+    The EmbeddingScheduler implements the langchain Embeddings interface, so it can be used in place of
+    HuggingFaceHubEmbeddings (and wrapped in the embeddings cache).
+
+    The scheduler:
+        splits the texts into batches of batch_size texts, whatever file they come from,
+        sends at most max_concurrent_requests batches at the same time from a pool of threads,
+        reuses the HTTP connections to the inference API,
+        retries with an exponential backoff when the API answers 429 (rate limited) or 503 (model loading), and
+        keeps track of the number of chunks embedded, the number of retries and the throughput in chunks per second.
+
+    The inference API url can be changed (HUGGINGFACEHUB_INFERENCE_ENDPOINT in the .env file) to point the scheduler
+    to a local stub server, such as the one in local_stub_hub_server.py.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+from requests.adapters import HTTPAdapter
+from langchain.embeddings.base import Embeddings
+from langchain.embeddings.huggingface_hub import DEFAULT_REPO_ID
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+
+# Status codes answered by the inference API when it is rate limited or the model is loading
+RETRY_STATUS_CODES = (429, 503)
+
+
+class EmbeddingScheduler(Embeddings):
+    """
+    Embeddings object sending batched, concurrent and retried requests to the Hugging Face Hub inference API.
+
+    Args:
+        - huggingfacehub_api_token (str | None): The Hugging Face Hub API token.
+        - repo_id (str): The id of the sentence-transformers model to use.
+        - endpoint_url (str | None): The url of the inference API, HUGGINGFACEHUB_INFERENCE_ENDPOINT in the .env file if None.
+        - batch_size (int | None): The number of texts sent in each request, EMBEDDINGS_BATCH_SIZE in the .env file if None.
+        - max_concurrent_requests (int | None): The maximum number of requests sent at the same time, EMBEDDINGS_MAX_CONCURRENT_REQUESTS in the .env file if None.
+        - max_retries (int | None): The number of times a rate limited request is retried before giving up, EMBEDDINGS_MAX_RETRIES in the .env file if None.
+        - backoff_seconds (float): The wait before the first retry, doubled for each following retry.
+        - timeout_seconds (float): The timeout of each request.
+    """
+
+    def __init__(
+        self,
+        huggingfacehub_api_token: str | None = None,
+        repo_id: str = DEFAULT_REPO_ID,
+        endpoint_url: str | None = None,
+        batch_size: int | None = None,
+        max_concurrent_requests: int | None = None,
+        max_retries: int | None = None,
+        backoff_seconds: float = 1.0,
+        timeout_seconds: float = 120.0,
+    ) -> None:
+        if endpoint_url is None:
+            endpoint_url = os.getenv(
+                "HUGGINGFACEHUB_INFERENCE_ENDPOINT", "https://api-inference.huggingface.co"
+            )
+        if batch_size is None:
+            batch_size = int(os.getenv("EMBEDDINGS_BATCH_SIZE", "32"))
+        if max_concurrent_requests is None:
+            max_concurrent_requests = int(os.getenv("EMBEDDINGS_MAX_CONCURRENT_REQUESTS", "4"))
+        if max_retries is None:
+            max_retries = int(os.getenv("EMBEDDINGS_MAX_RETRIES", "5"))
+
+        self.repo_id = repo_id
+        self.url = f"{endpoint_url.rstrip('/')}/pipeline/feature-extraction/{repo_id}"
+        self.batch_size = batch_size
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout_seconds = timeout_seconds
+
+        self.chunks_embedded = 0
+        self.requests_sent = 0
+        self.retries = 0
+        self.seconds_embedding = 0.0
+        self._counters_lock = threading.Lock()
+
+        # Keep one connection per concurrent request alive between batches
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(1, max_concurrent_requests)
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if huggingfacehub_api_token:
+            self.session.headers["Authorization"] = f"Bearer {huggingfacehub_api_token}"
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_concurrent_requests),
+            thread_name_prefix="embedding-scheduler",
+        )
+
+    def _post_batch(self, texts: List[str]) -> List[List[float]]:
+        """Send one batch of texts to the inference API, retrying while it is rate limited."""
+        for attempt in range(self.max_retries + 1):
+            with METRICS.timer("embedding_request"):
+                response = self.session.post(
+                    self.url,
+                    json={"inputs": texts, "options": {"wait_for_model": True}},
+                    timeout=self.timeout_seconds,
+                )
+            with self._counters_lock:
+                self.requests_sent += 1
+            METRICS.increment("embedding_api_calls")
+
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+
+            if attempt == self.max_retries:
+                break
+
+            with self._counters_lock:
+                self.retries += 1
+            METRICS.increment("embedding_api_retries")
+
+            # Wait as long as the API asks to, or back off exponentially with some jitter
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None and retry_after.isdigit():
+                wait_seconds = float(retry_after)
+            else:
+                wait_seconds = self.backoff_seconds * 2**attempt
+            time.sleep(wait_seconds * random.uniform(1.0, 1.5))
+
+        if response.status_code != 200:
+            raise ValueError(
+                f"Error raised by inference API: {response.status_code} {response.text}"
+            )
+
+        embeddings = response.json()
+        if len(embeddings) != len(texts):
+            raise ValueError(
+                f"The inference API returned {len(embeddings)} embeddings for {len(texts)} texts"
+            )
+
+        return embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed the texts in batches, sending up to max_concurrent_requests batches at the same time.
+
+        Args:
+            - texts (List[str]): The texts to embed.
+
+        Returns:
+            - List[List[float]]: The embeddings, in the same order as the texts.
+        """
+
+        # replace newlines, which can negatively affect performance.
+        texts = [text.replace("\n", " ") for text in texts]
+
+        batches = [
+            texts[start : start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+
+        start_time = time.perf_counter()
+
+        # executor.map hands the results back in the order of the batches
+        embeddings: List[List[float]] = []
+        for batch_embeddings in self._executor.map(self._post_batch, batches):
+            embeddings.extend(batch_embeddings)
+
+        with self._counters_lock:
+            self.chunks_embedded += len(texts)
+            self.seconds_embedding += time.perf_counter() - start_time
+        METRICS.increment("texts_embedded", len(texts))
+
+        return embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed query text."""
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> Dict[str, float]:
+        """Return the counters of the scheduler and its throughput in chunks per second."""
+        return {
+            "chunks_embedded": self.chunks_embedded,
+            "requests_sent": self.requests_sent,
+            "retries": self.retries,
+            "seconds_embedding": self.seconds_embedding,
+            "chunks_per_second": self.chunks_embedded / self.seconds_embedding
+            if self.seconds_embedding
+            else 0.0,
+        }
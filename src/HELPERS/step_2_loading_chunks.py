@@ -0,0 +1,72 @@
+"""
+    This code defines a function called iter_chunks that streams the chunks saved by save_documents from the chunk store.
+
+    The function takes two arguments:
+        load_json_chunks_directory which is the directory where the chunk store is saved, and
+        document_names which restricts the chunks to some documents.
+
+    The function memory-maps the chunk store and yields each chunk with its id, document name, chunk index, page and text,
+    in the order they were saved, so the chunks of a document always come together and in order.
+    Only the texts of the chunks that are yielded are read and decoded.
+
+    The function iter_documents groups the streamed chunks by document.
+"""
+
+import itertools
+import os
+import sys
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.step_1_chunk_store import ChunkStore, chunk_store_file_path
+
+
+def iter_chunks(
+    load_json_chunks_directory: str | None = None,
+    document_names: Iterable[str] | None = None,
+) -> Iterator[Dict[str, Union[str, int]]]:
+    """
+    Stream the chunks of the chunk store.
+
+    Args:
+        - load_json_chunks_directory (str | None): The directory where the chunk store is saved, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
+        - document_names (Iterable[str] | None): The names of the documents to stream the chunks of, all the chunks if None.
+
+    Returns:
+        - Iterator[Dict[str, Union[str, int]]]: The chunks, with their "id", "document", "chunk_index", "page" and "text".
+    """
+
+    if load_json_chunks_directory is None:
+        load_json_chunks_directory = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS")
+
+    with ChunkStore(chunk_store_file_path(load_json_chunks_directory)) as chunk_store:
+        yield from chunk_store.iter_records(document_names=document_names)
+
+
+def iter_documents(
+    load_json_chunks_directory: str | None = None,
+    document_names: Iterable[str] | None = None,
+) -> Iterator[Tuple[str, List[Dict[str, Union[str, int]]]]]:
+    """
+    Stream the chunks of the chunk store, grouped by document.
+
+    Args:
+        - load_json_chunks_directory (str | None): The directory where the chunk store is saved, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
+        - document_names (Iterable[str] | None): The names of the documents to stream, all the documents if None.
+
+    Returns:
+        - Iterator[Tuple[str, List[Dict[str, Union[str, int]]]]]: The name of each document and its chunks.
+    """
+
+    if load_json_chunks_directory is None:
+        load_json_chunks_directory = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS")
+
+    chunks = iter_chunks(
+        load_json_chunks_directory=load_json_chunks_directory,
+        document_names=document_names,
+    )
+    for document_name, document_chunks in itertools.groupby(
+        chunks, key=lambda chunk: chunk["document"]
+    ):
+        yield document_name, list(document_chunks)
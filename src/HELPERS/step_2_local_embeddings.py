@@ -0,0 +1,313 @@
+"""
+    This code defines the LocalEmbeddings class, which runs a sentence-transformers model on the CPU of this machine,
+    as a drop-in alternative to the Hugging Face Hub inference API.
+
+    The model is loaded from a local directory (LOCAL_EMBEDDINGS_MODEL_DIRECTORY in the .env file), without any network access,
+    for example a directory saved with:
+        AutoTokenizer.from_pretrained("sentence-transformers/all-mpnet-base-v2").save_pretrained("./models/all-mpnet-base-v2")
+        AutoModel.from_pretrained("sentence-transformers/all-mpnet-base-v2").save_pretrained("./models/all-mpnet-base-v2")
+
+    The LocalEmbeddings class:
+        sorts the texts by length and batches them under a budget of tokens (LOCAL_EMBEDDINGS_MAX_BATCH_TOKENS),
+        so short texts are embedded in large batches and little compute is spent on padding,
+        embeds each text as the mean of its token embeddings, normalized, like the sentence-transformers models do,
+        uses LOCAL_EMBEDDINGS_NUM_THREADS threads for the matrix products (all the cores if 0), and
+        can run the model with ONNX Runtime instead of torch, and quantize its weights to int8 (LOCAL_EMBEDDINGS_RUNTIME and
+        LOCAL_EMBEDDINGS_QUANTIZE).
+
+    The ONNX runtime loads "model.onnx" from the model directory, exported for example with:
+        optimum-cli export onnx --model ./models/all-mpnet-base-v2 --task feature-extraction ./models/all-mpnet-base-v2
+    and the int8 model is written next to it, as "model_int8.onnx", the first time it is needed.
+
+    torch and transformers (and onnxruntime for the ONNX runtime) are only imported when a LocalEmbeddings object is created,
+    so the Hub backend doesn't need them.
+"""
+
+import hashlib
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+
+LOCAL_EMBEDDINGS_RUNTIMES = ("torch", "onnx")
+
+
+def _model_fingerprint(model_directory: str) -> str:
+    """
+    Hash the config.json of a model with the names and sizes of its weight files (the torch ones, or model.onnx
+    for a directory holding only the exported model), without reading the weights.
+    """
+
+    file_names = sorted(os.listdir(model_directory)) if os.path.isdir(model_directory) else []
+    weight_file_names = [
+        file_name for file_name in file_names if file_name.endswith((".bin", ".safetensors"))
+    ] or [file_name for file_name in file_names if file_name == "model.onnx"]
+
+    digest = hashlib.sha256()
+    config_path = os.path.join(model_directory, "config.json")
+    if os.path.isfile(config_path):
+        with open(config_path, "rb") as f:
+            digest.update(f.read())
+    for file_name in weight_file_names:
+        size = os.path.getsize(os.path.join(model_directory, file_name))
+        digest.update(f"\0{file_name}\0{size}".encode("utf-8"))
+
+    return digest.hexdigest()[:12]
+
+
+def local_model_id(model_directory: str, quantize: bool = False) -> str:
+    """
+    Return the id of a local model, saved with the embeddings and part of the embeddings cache keys.
+
+    The id ends with a fingerprint of the config and the weight files of the model, so two models in directories
+    of the same name, or a model replaced in its directory, never share embeddings.
+    The int8 model gets its own id, since its embeddings differ slightly from the ones of the float32 model.
+
+    Args:
+        - model_directory (str): The directory of the model.
+        - quantize (bool): Whether the weights of the model are quantized to int8.
+
+    Returns:
+        - str: The id of the model, "local/<model directory name>@<fingerprint>".
+    """
+
+    model_id = (
+        f"local/{os.path.basename(os.path.normpath(model_directory))}"
+        f"@{_model_fingerprint(model_directory)}"
+    )
+
+    return f"{model_id}-int8" if quantize else model_id
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Embeddings object running a sentence-transformers model locally, on the CPU.
+
+    Args:
+        - model_directory (str | None): The directory of the model and its tokenizer, LOCAL_EMBEDDINGS_MODEL_DIRECTORY in the .env file if None.
+        - runtime (str | None): "torch" to run the model with torch, "onnx" to run the exported model with ONNX Runtime, LOCAL_EMBEDDINGS_RUNTIME in the .env file if None.
+        - quantize (bool | None): Whether to quantize the weights of the model to int8, LOCAL_EMBEDDINGS_QUANTIZE in the .env file if None.
+        - num_threads (int | None): The number of threads used by the model, 0 uses all the cores, LOCAL_EMBEDDINGS_NUM_THREADS in the .env file if None.
+        - max_batch_tokens (int | None): The maximum number of tokens (padding included) in a batch, LOCAL_EMBEDDINGS_MAX_BATCH_TOKENS in the .env file if None.
+        - max_sequence_length (int | None): The number of tokens a text is truncated to, LOCAL_EMBEDDINGS_MAX_SEQUENCE_LENGTH in the .env file if None.
+    """
+
+    def __init__(
+        self,
+        model_directory: str | None = None,
+        runtime: str | None = None,
+        quantize: bool | None = None,
+        num_threads: int | None = None,
+        max_batch_tokens: int | None = None,
+        max_sequence_length: int | None = None,
+    ) -> None:
+        if model_directory is None:
+            model_directory = os.getenv("LOCAL_EMBEDDINGS_MODEL_DIRECTORY")
+        if runtime is None:
+            runtime = os.getenv("LOCAL_EMBEDDINGS_RUNTIME", "torch")
+        if quantize is None:
+            quantize = os.getenv("LOCAL_EMBEDDINGS_QUANTIZE", "false").lower() == "true"
+        if num_threads is None:
+            num_threads = int(os.getenv("LOCAL_EMBEDDINGS_NUM_THREADS", "0"))
+        if max_batch_tokens is None:
+            max_batch_tokens = int(os.getenv("LOCAL_EMBEDDINGS_MAX_BATCH_TOKENS", "8192"))
+        if max_sequence_length is None:
+            max_sequence_length = int(os.getenv("LOCAL_EMBEDDINGS_MAX_SEQUENCE_LENGTH", "256"))
+
+        if not model_directory or not os.path.isdir(model_directory):
+            raise ValueError(
+                f"The local embeddings model directory {model_directory} doesn't exist, "
+                "set LOCAL_EMBEDDINGS_MODEL_DIRECTORY in the .env file"
+            )
+        if runtime not in LOCAL_EMBEDDINGS_RUNTIMES:
+            raise ValueError(
+                f"Unknown runtime {runtime}, expected one of {LOCAL_EMBEDDINGS_RUNTIMES}"
+            )
+
+        try:
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+        except ImportError:
+            raise ValueError(
+                "Could not import torch or transformers. "
+                "Please install them with `pip install torch transformers`."
+            )
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.repo_id = local_model_id(model_directory=model_directory, quantize=quantize)
+        self.runtime = runtime
+        self.max_batch_tokens = max_batch_tokens
+        self.max_sequence_length = max_sequence_length
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            model_directory, local_files_only=True
+        )
+
+        if runtime == "torch":
+            model = AutoModel.from_pretrained(model_directory, local_files_only=True)
+            model.eval()
+            if quantize:
+                model = torch.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            self.model = model
+        else:
+            self.session = self._load_onnx_session(
+                model_directory=model_directory, quantize=quantize, num_threads=num_threads
+            )
+
+        self._torch = torch
+        # A batch uses all the threads of the model, batches of different callers run one after the other
+        self._lock = threading.Lock()
+        self.chunks_embedded = 0
+        self.batches = 0
+        self.seconds_embedding = 0.0
+
+    @staticmethod
+    def _load_onnx_session(model_directory: str, quantize: bool, num_threads: int):
+        """Load the exported model with ONNX Runtime, quantizing it to int8 first if needed."""
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ValueError(
+                "Could not import onnxruntime python package. "
+                "Please install it with `pip install onnxruntime`."
+            )
+
+        model_path = os.path.join(model_directory, "model.onnx")
+        if not os.path.exists(model_path):
+            raise ValueError(
+                f"No model.onnx in {model_directory}, export the model to ONNX first"
+            )
+
+        if quantize:
+            quantized_model_path = os.path.join(model_directory, "model_int8.onnx")
+            if not os.path.exists(quantized_model_path):
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+
+                quantize_dynamic(
+                    model_path, quantized_model_path, weight_type=QuantType.QInt8
+                )
+            model_path = quantized_model_path
+
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        return onnxruntime.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+
+    def _batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Group the positions of the texts into batches of texts of similar lengths,
+        each batch holding at most max_batch_tokens tokens once padded to its longest text.
+        """
+        lengths = [
+            len(ids)
+            for ids in self.tokenizer(
+                texts, truncation=True, max_length=self.max_sequence_length
+            )["input_ids"]
+        ]
+
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        for position in sorted(range(len(texts)), key=lambda position: lengths[position]):
+            # Sorted by length, the text being added is the longest of the batch
+            if batch and (len(batch) + 1) * lengths[position] > self.max_batch_tokens:
+                batches.append(batch)
+                batch = []
+            batch.append(position)
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed a batch of texts as the normalized mean of their token embeddings."""
+        if self.runtime == "torch":
+            inputs = self.tokenizer(
+                texts,
+                padding=True,
+                truncation=True,
+                max_length=self.max_sequence_length,
+                return_tensors="pt",
+            )
+            with self._torch.inference_mode():
+                token_embeddings = self.model(**inputs)[0].numpy()
+            attention_mask = inputs["attention_mask"].numpy()
+        else:
+            inputs = self.tokenizer(
+                texts,
+                padding=True,
+                truncation=True,
+                max_length=self.max_sequence_length,
+                return_tensors="np",
+            )
+            input_names = {model_input.name for model_input in self.session.get_inputs()}
+            token_embeddings = self.session.run(
+                None,
+                {
+                    name: value.astype(np.int64)
+                    for name, value in inputs.items()
+                    if name in input_names
+                },
+            )[0]
+            attention_mask = inputs["attention_mask"]
+
+        # Mean of the embeddings of the tokens, ignoring the padding
+        mask = attention_mask[:, :, None].astype(np.float32)
+        vectors = (token_embeddings * mask).sum(axis=1) / np.clip(
+            mask.sum(axis=1), 1e-9, None
+        )
+        vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+        return vectors.astype(np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed search docs."""
+        if not texts:
+            return []
+
+        start_time = time.perf_counter()
+        vectors: List[np.ndarray | None] = [None] * len(texts)
+
+        with self._lock:
+            batches = self._batches(texts)
+            for batch in batches:
+                with METRICS.timer("local_embedding_batch"):
+                    batch_vectors = self._embed_batch([texts[position] for position in batch])
+                for position, vector in zip(batch, batch_vectors):
+                    vectors[position] = vector
+
+            self.chunks_embedded += len(texts)
+            self.batches += len(batches)
+            self.seconds_embedding += time.perf_counter() - start_time
+
+        METRICS.increment("texts_embedded", len(texts))
+
+        return [vector.tolist() for vector in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed query text."""
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> Dict[str, float]:
+        """Return the counters of the local model and its throughput in chunks per second."""
+        return {
+            "chunks_embedded": self.chunks_embedded,
+            "batches": self.batches,
+            "seconds_embedding": self.seconds_embedding,
+            "chunks_per_second": self.chunks_embedded / self.seconds_embedding
+            if self.seconds_embedding
+            else 0.0,
+        }
@@ -0,0 +1,711 @@
+"""
+    This code defines the near duplicate elimination run by STEP 2 between the chunking and the embedding:
+    the chunks whose text is nearly the same as the text of another chunk (versions of the same document, templates,
+    repeated headers and footers) are mapped to that representative chunk, and are neither embedded by STEP 2 nor indexed by STEP 3.
+
+    Two chunks are near duplicates when the Jaccard similarity of their shingles (the runs of SHINGLE_SIZE lower case words
+    of their texts) is at least the threshold, estimated with MinHash and found with locality sensitive hashing (LSH),
+    in a time linear in the number of chunks instead of comparing every pair of chunks:
+        the MinHash signature of each chunk keeps the smallest hash of its shingles for num_perm hash functions
+        (the share of equal values of two signatures estimates the Jaccard similarity of the chunks), only the lower 16 bits
+        of each value are kept (2 * num_perm bytes per chunk),
+        the signatures are cut into bands of rows values, chosen so that the chunks above the threshold very likely share a band,
+        and the chunks sharing a band with an earlier chunk are compared to its representative, the only pairs ever compared.
+
+    The chunks are processed from the oldest to the newest (by ingest time, then in the order of the chunk store),
+    so the representative of a group of near duplicates is its oldest chunk, and adding documents doesn't change
+    the representatives of the chunks already ingested. A chunk is only mapped to a representative, never to another duplicate.
+
+    The signatures, the band keys and the representatives of the chunks are saved in "near_duplicates.npz" (see NearDuplicateIndex),
+    so each run of STEP 2 only hashes the chunks added to the chunk store since the previous run.
+
+    The map from each duplicate to its representative is saved with a report of the savings in "near_duplicates.json",
+    next to the chunk store, where STEP 3 reads it. The digest of the ids of the chunks kept for each document is recorded
+    in the ingest manifest by STEP 2 and STEP 3, so a document whose kept chunks changed (because the representative
+    of one of its chunks was removed, for example) is embedded and indexed again even if its own file didn't change.
+    The digests are computed once by STEP 2 and saved in "near_duplicates.json" too.
+
+    The threshold (NEAR_DUPLICATE_THRESHOLD, 0 disables the elimination) and the number of hash functions
+    (NEAR_DUPLICATE_NUM_PERM) are set in the .env file.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+from HELPERS.step_1_chunk_store import ID_LENGTH, ChunkStore, chunk_store_file_path
+
+NEAR_DUPLICATES_FILE_NAME = "near_duplicates.json"
+NEAR_DUPLICATE_INDEX_FILE_NAME = "near_duplicates.npz"
+
+# The number of words of the shingles compared, as in the context packing of step_4B_context_packing
+SHINGLE_SIZE = 3
+
+# The hash functions of the signatures are the upper 32 bits of a * x + b modulo 2**64 (multiply-shift hashing),
+# with a odd and b drawn from a fixed seed
+SIGNATURE_SEED = 1
+
+# The number of chunks whose signatures are computed together
+SIGNATURE_BATCH_SIZE = 1024
+
+_WORDS = re.compile(r"\w+")
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    """Return the 32 bit hashes of the distinct shingles of a text (a single one for the texts shorter than a shingle)."""
+    words = _WORDS.findall(text.lower())
+    shingles = {
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))
+    }
+
+    return np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+def _hash_functions(num_perm: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the a and b coefficients of the hash functions of the signatures, the same in every run."""
+    random_state = np.random.RandomState(SIGNATURE_SEED)
+    a = random_state.randint(0, 2**64 - 1, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = random_state.randint(0, 2**64 - 1, size=num_perm, dtype=np.uint64)
+
+    return a, b
+
+
+def minhash_signatures(texts: List[str], num_perm: int = 128) -> np.ndarray:
+    """
+    Compute the MinHash signatures of some texts.
+
+    Args:
+        - texts (List[str]): The texts.
+        - num_perm (int): The number of hash functions, the length of the signatures.
+
+    Returns:
+        - np.ndarray: The (len(texts), num_perm) uint16 matrix of the signatures, the lower 16 bits of each MinHash value.
+    """
+
+    if not texts:
+        return np.empty((0, num_perm), dtype=np.uint16)
+
+    a, b = _hash_functions(num_perm)
+    shingle_hashes = [_shingle_hashes(text) for text in texts]
+    starts = np.cumsum([0] + [len(hashes) for hashes in shingle_hashes[:-1]])
+
+    # Hash all the shingles of all the texts with every function at once (the products wrap around 2**64),
+    # and keep the smallest hash of the shingles of each text
+    hashes = (np.concatenate(shingle_hashes)[None, :] * a[:, None] + b[:, None]) >> np.uint64(32)
+    signatures = np.minimum.reduceat(hashes, starts, axis=1).T
+
+    return (signatures & np.uint64(0xFFFF)).astype(np.uint16)
+
+
+def lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    Choose how the signatures are cut into bands for a threshold.
+
+    Two chunks of Jaccard similarity s share at least one of b bands of r rows with the probability 1 - (1 - s**r)**b,
+    which goes from 0 to 1 around (1 / b)**(1 / r): the bands whose turning point is the closest below the threshold are chosen,
+    so the chunks above the threshold are found, and the ones below it are rejected when they are compared.
+
+    Args:
+        - num_perm (int): The length of the signatures.
+        - threshold (float): The Jaccard similarity above which two chunks are near duplicates.
+
+    Returns:
+        - Tuple[int, int]: The number of bands and the number of rows of each band.
+    """
+
+    options = [
+        (bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0
+    ]
+    below = [
+        (bands, rows) for bands, rows in options if (1 / bands) ** (1 / rows) <= threshold
+    ]
+    if not below:
+        return options[-1]
+
+    return max(below, key=lambda option: (1 / option[0]) ** (1 / option[1]))
+
+
+def _band_keys(band: np.ndarray) -> np.ndarray:
+    """Hash the rows of a band of the signatures into one 64 bit key per chunk."""
+    keys = np.zeros(len(band), dtype=np.uint64)
+    for column in band.T:
+        keys = keys * np.uint64(0x100000001B3) + column.astype(np.uint64)
+
+    return keys
+
+
+def _band_tables(signatures: np.ndarray, bands: int, rows: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hash the bands of the signatures and sort the chunks by the key of each band.
+
+    Returns:
+        - Tuple[np.ndarray, np.ndarray]: The (chunks, bands) uint64 keys of the bands of each chunk, and the (bands, chunks)
+            positions of the chunks sorted by the key of each band, the earliest chunk first among the chunks having the same key.
+    """
+
+    band_keys = np.empty((len(signatures), bands), dtype=np.uint64)
+    band_order = np.empty((bands, len(signatures)), dtype=np.uint32)
+    for band in range(bands):
+        band_keys[:, band] = _band_keys(signatures[:, band * rows : (band + 1) * rows])
+        # The stable sort keeps the chunks having the same key in order
+        band_order[band] = np.argsort(band_keys[:, band], kind="stable")
+
+    return band_keys, band_order
+
+
+def _candidate_pairs(
+    band_keys: np.ndarray, band_order: np.ndarray, positions: np.ndarray
+) -> np.ndarray:
+    """
+    Pair each chunk with the earliest chunk sharing one of its bands, for each band, the only pairs ever compared.
+
+    Returns:
+        - np.ndarray: The (pairs, 2) positions of the chunks and of their candidates, sorted, each candidate earlier than its chunk.
+    """
+
+    candidate_pairs = [np.empty((0, 2), dtype=np.int64)]
+    for band in range(band_keys.shape[1]):
+        sorted_keys = band_keys[band_order[band], band]
+        first = band_order[band][
+            np.searchsorted(sorted_keys, band_keys[positions, band], side="left")
+        ].astype(np.int64)
+        paired = first != positions
+        candidate_pairs.append(np.stack([positions[paired], first[paired]], axis=1))
+
+    return np.unique(np.concatenate(candidate_pairs), axis=0)
+
+
+def _assign_representatives(
+    signatures: np.ndarray,
+    representatives: np.ndarray,
+    candidate_pairs: np.ndarray,
+    minimum_equal_values: float,
+) -> None:
+    """
+    Compare each chunk to the representatives of its earlier candidates, in order, and map it to the first one it matches.
+
+    The pairs are sorted by chunk, so the representative of each candidate is known when it is compared.
+    """
+
+    for chunk, candidate in candidate_pairs.tolist():
+        if representatives[chunk] != chunk:
+            continue
+        representative = representatives[candidate]
+        if (
+            np.count_nonzero(signatures[chunk] == signatures[representative])
+            >= minimum_equal_values
+        ):
+            representatives[chunk] = representative
+
+
+def find_near_duplicates(
+    chunks: Iterable[Dict[str, Union[str, int]]],
+    threshold: float | None = None,
+    num_perm: int | None = None,
+) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """
+    Find the near duplicate chunks and map each one to its representative, the oldest chunk it is a near duplicate of.
+
+    The signatures of all the chunks are computed, see NearDuplicateIndex to only compute the ones of the new chunks.
+
+    Args:
+        - chunks (Iterable[Dict[str, Union[str, int]]]): The chunks, with their "id", "text" and "ingested_at", as streamed by iter_chunks.
+        - threshold (float | None): The Jaccard similarity of their shingles above which two chunks are near duplicates, 0 finds none, NEAR_DUPLICATE_THRESHOLD in the .env file if None.
+        - num_perm (int | None): The number of hash functions of the MinHash signatures, NEAR_DUPLICATE_NUM_PERM in the .env file if None.
+
+    Returns:
+        - Tuple[Dict[str, str], Dict[str, Any]]: The id of the representative of each duplicate, by id of the duplicate,
+            and the report of the elimination (the number of chunks, representatives and duplicates, and the characters saved).
+    """
+
+    index = NearDuplicateIndex(threshold=threshold, num_perm=num_perm)
+    report = index.add(chunks)
+
+    return index.duplicates(), report
+
+
+class NearDuplicateIndex:
+    """
+    The MinHash signatures and the LSH band keys of the chunks, with the representative of each chunk,
+    kept from one run of STEP 2 to the next so only the chunks added since are hashed.
+
+    The chunks are kept from the oldest to the newest. The new chunks are usually the newest ones: they are hashed,
+    looked up in the sorted band keys of the chunks already known and appended, without comparing the other chunks again.
+    When a new chunk is older than a known one, or a removed chunk was the representative of another chunk or the earliest chunk
+    of one of its bands, the representatives are found again from the saved signatures, still without hashing the known chunks.
+
+    Args:
+        - threshold (float | None): The Jaccard similarity above which two chunks are near duplicates, NEAR_DUPLICATE_THRESHOLD in the .env file if None.
+        - num_perm (int | None): The number of hash functions of the MinHash signatures, NEAR_DUPLICATE_NUM_PERM in the .env file if None.
+    """
+
+    def __init__(self, threshold: float | None = None, num_perm: int | None = None) -> None:
+        if threshold is None:
+            threshold = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+        if num_perm is None:
+            num_perm = int(os.getenv("NEAR_DUPLICATE_NUM_PERM", "128"))
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = lsh_bands(num_perm=num_perm, threshold=threshold) if threshold > 0 else (0, 0)
+
+        # One entry per chunk, from the oldest to the newest
+        self.ids = np.empty(0, dtype=f"S{ID_LENGTH}")
+        self.ingested_at = np.empty(0, dtype=np.float64)
+        self.lengths = np.empty(0, dtype=np.int64)
+        self.signatures = np.empty((0, num_perm), dtype=np.uint16)
+        self.representatives = np.empty(0, dtype=np.int64)
+        self.band_keys = np.empty((0, self.bands), dtype=np.uint64)
+        self.band_order = np.empty((self.bands, 0), dtype=np.uint32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def duplicates(self) -> Dict[str, str]:
+        """Return the id of the representative of each duplicate, by id of the duplicate."""
+        chunks = np.flatnonzero(self.representatives != np.arange(len(self)))
+        ids = np.char.decode(self.ids, "ascii")
+
+        return dict(zip(ids[chunks].tolist(), ids[self.representatives[chunks]].tolist()))
+
+    def _report(self, start_time: float, **counts: int) -> Dict[str, Any]:
+        """The report of the elimination."""
+        duplicated = self.representatives != np.arange(len(self))
+        duplicates = int(np.count_nonzero(duplicated))
+        if duplicates:
+            METRICS.increment("near_duplicate_chunks", duplicates)
+
+        return {
+            "threshold": self.threshold,
+            "num_perm": self.num_perm,
+            "bands": self.bands,
+            "rows": self.rows,
+            "chunks": len(self),
+            "representatives": len(self) - duplicates,
+            "duplicates": duplicates,
+            **counts,
+            "characters_saved": int(self.lengths[duplicated].sum()),
+            "seconds": time.perf_counter() - start_time,
+        }
+
+    def _rebuild(self) -> int:
+        """Sort the chunks from the oldest to the newest and find all their representatives again, from their signatures."""
+        order = np.lexsort((np.arange(len(self)), self.ingested_at))
+        self.ids, self.ingested_at, self.lengths, self.signatures = (
+            self.ids[order],
+            self.ingested_at[order],
+            self.lengths[order],
+            self.signatures[order],
+        )
+
+        with METRICS.timer("lsh_candidates"):
+            self.band_keys, self.band_order = _band_tables(self.signatures, self.bands, self.rows)
+            candidate_pairs = _candidate_pairs(
+                self.band_keys, self.band_order, np.arange(len(self))
+            )
+
+        self.representatives = np.arange(len(self))
+        with METRICS.timer("near_duplicate_comparisons"):
+            _assign_representatives(
+                self.signatures, self.representatives, candidate_pairs, self.threshold * self.num_perm
+            )
+
+        return len(candidate_pairs)
+
+    def _remove(self, removed: np.ndarray) -> bool:
+        """
+        Remove chunks, given as a mask.
+
+        Returns:
+            - bool: Whether the representatives of the chunks kept must be found again: a removed chunk was the representative
+                of a kept chunk, or the earliest chunk of a band shared with later chunks.
+        """
+
+        kept = ~removed
+        rebuild = bool(np.any(removed[self.representatives[kept]]))
+        new_positions = np.cumsum(kept) - 1
+        band_order = np.empty((self.bands, int(kept.sum())), dtype=np.uint32)
+        for band in range(self.bands):
+            order = self.band_order[band]
+            sorted_keys = self.band_keys[order, band]
+            # The kept chunks of a group of chunks having the same key were paired with its first chunk,
+            # which must still be the first one
+            group_starts = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+            groups = np.cumsum(group_starts) - 1
+            kept_order = order[kept[order]]
+            kept_groups, first_kept = np.unique(groups[kept[order]], return_index=True)
+            rebuild = rebuild or bool(
+                np.any(kept_order[first_kept] != order[group_starts][kept_groups])
+            )
+            band_order[band] = new_positions[kept_order]
+
+        self.ids, self.ingested_at, self.lengths, self.signatures, self.band_keys = (
+            self.ids[kept],
+            self.ingested_at[kept],
+            self.lengths[kept],
+            self.signatures[kept],
+            self.band_keys[kept],
+        )
+        self.representatives = new_positions[self.representatives[kept]]
+        self.band_order = band_order
+
+        return rebuild
+
+    def add(self, chunks: Iterable[Dict[str, Union[str, int]]]) -> Dict[str, Any]:
+        """
+        Hash new chunks and find their representatives.
+
+        Args:
+            - chunks (Iterable[Dict[str, Union[str, int]]]): The new chunks, with their "id", "text" and "ingested_at".
+
+        Returns:
+            - Dict[str, Any]: The report of the elimination.
+        """
+
+        return self.update(chunks=chunks, chunk_ids=None)
+
+    def update(
+        self,
+        chunks: Iterable[Dict[str, Union[str, int]]],
+        chunk_ids: np.ndarray | None,
+    ) -> Dict[str, Any]:
+        """
+        Remove the chunks that aren't in the chunk store anymore, hash the new chunks and find their representatives.
+
+        Args:
+            - chunks (Iterable[Dict[str, Union[str, int]]]): The new chunks, with their "id", "text" and "ingested_at".
+            - chunk_ids (np.ndarray | None): The ids of all the chunks of the chunk store, the chunks kept, None keeps all the chunks.
+
+        Returns:
+            - Dict[str, Any]: The report of the elimination, with the number of chunks hashed and whether the representatives
+                of all the chunks were found again ("rebuilt").
+        """
+
+        start_time = time.perf_counter()
+        if self.threshold <= 0:
+            return {"threshold": self.threshold, "chunks": None, "duplicates": 0}
+
+        rebuild = False
+        if chunk_ids is not None:
+            removed = ~np.isin(self.ids, chunk_ids)
+            if removed.any():
+                rebuild = self._remove(removed)
+
+        # Compute the signatures of the new chunks, a batch at a time
+        ids: List[bytes] = []
+        lengths: List[int] = []
+        ingested_at: List[float] = []
+        signature_batches = [np.empty((0, self.num_perm), dtype=np.uint16)]
+        texts: List[str] = []
+        with METRICS.timer("minhash_signatures"):
+            for chunk in chunks:
+                ids.append(chunk["id"].encode("ascii"))
+                lengths.append(len(chunk["text"]))
+                ingested_at.append(
+                    chunk["ingested_at"] if chunk.get("ingested_at") is not None else np.inf
+                )
+                texts.append(chunk["text"])
+                if len(texts) == SIGNATURE_BATCH_SIZE:
+                    signature_batches.append(minhash_signatures(texts, num_perm=self.num_perm))
+                    texts = []
+            signature_batches.append(minhash_signatures(texts, num_perm=self.num_perm))
+
+        # The new chunks are appended from the oldest to the newest, after the known ones if none of them is older
+        start = len(self)
+        order = np.lexsort((np.arange(len(ids)), np.asarray(ingested_at, dtype=np.float64)))
+        new_ingested_at = np.asarray(ingested_at, dtype=np.float64)[order]
+        if start and len(ids) and new_ingested_at[0] < self.ingested_at.max():
+            rebuild = True
+        new_signatures = np.concatenate(signature_batches)[order]
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=f"S{ID_LENGTH}")[order]])
+        self.ingested_at = np.concatenate([self.ingested_at, new_ingested_at])
+        self.lengths = np.concatenate([self.lengths, np.asarray(lengths, dtype=np.int64)[order]])
+        self.signatures = np.concatenate([self.signatures, new_signatures])
+        self.representatives = np.concatenate([self.representatives, np.arange(start, len(self))])
+        METRICS.increment("near_duplicate_chunks_hashed", len(ids))
+
+        if rebuild:
+            candidate_pairs = self._rebuild()
+            return self._report(start_time, chunks_hashed=len(ids), candidate_pairs=candidate_pairs, rebuilt=True)
+
+        # Merge the keys of the new chunks into the sorted keys of each band,
+        # after the known chunks having the same key since the new chunks are newer
+        positions = np.arange(start, len(self))
+        with METRICS.timer("lsh_candidates"):
+            new_band_keys, new_band_order = _band_tables(new_signatures, self.bands, self.rows)
+            band_order = np.empty((self.bands, len(self)), dtype=np.uint32)
+            for band in range(self.bands):
+                sorted_keys = self.band_keys[self.band_order[band], band]
+                new_sorted_keys = new_band_keys[new_band_order[band], band]
+                band_order[band] = np.insert(
+                    self.band_order[band],
+                    np.searchsorted(sorted_keys, new_sorted_keys, side="right"),
+                    new_band_order[band] + start,
+                )
+            self.band_keys = np.concatenate([self.band_keys, new_band_keys])
+            self.band_order = band_order
+            candidate_pairs = _candidate_pairs(self.band_keys, self.band_order, positions)
+
+        with METRICS.timer("near_duplicate_comparisons"):
+            _assign_representatives(
+                self.signatures, self.representatives, candidate_pairs, self.threshold * self.num_perm
+            )
+
+        return self._report(start_time, chunks_hashed=len(ids), candidate_pairs=len(candidate_pairs), rebuilt=False)
+
+    def save(self, file_path: str) -> None:
+        """Save the index, as an uncompressed numpy archive."""
+        with open(file_path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                threshold=self.threshold,
+                num_perm=self.num_perm,
+                ids=self.ids,
+                ingested_at=self.ingested_at,
+                lengths=self.lengths,
+                signatures=self.signatures,
+                representatives=self.representatives,
+                band_keys=self.band_keys,
+                band_order=self.band_order,
+            )
+        os.replace(file_path + ".tmp", file_path)
+
+    @classmethod
+    def load(
+        cls, file_path: str, threshold: float | None = None, num_perm: int | None = None
+    ) -> "NearDuplicateIndex":
+        """
+        Load the index saved by the previous run.
+
+        Args:
+            - file_path (str): The path to the index.
+            - threshold (float | None): The threshold, NEAR_DUPLICATE_THRESHOLD in the .env file if None.
+            - num_perm (int | None): The number of hash functions, NEAR_DUPLICATE_NUM_PERM in the .env file if None.
+
+        Returns:
+            - NearDuplicateIndex: The index, empty if none was saved or it was saved with another number of hash functions,
+                with its representatives found again if it was saved with another threshold.
+        """
+
+        index = cls(threshold=threshold, num_perm=num_perm)
+        if index.threshold <= 0 or not os.path.exists(file_path):
+            return index
+
+        with np.load(file_path) as saved:
+            if int(saved["num_perm"]) != index.num_perm:
+                return index
+            index.ids = saved["ids"]
+            index.ingested_at = saved["ingested_at"]
+            index.lengths = saved["lengths"]
+            index.signatures = saved["signatures"]
+            if float(saved["threshold"]) == index.threshold:
+                index.representatives = saved["representatives"]
+                index.band_keys = saved["band_keys"]
+                index.band_order = saved["band_order"]
+            else:
+                index._rebuild()
+
+        return index
+
+
+def update_near_duplicates(
+    json_files_directory: str | None = None,
+    threshold: float | None = None,
+    num_perm: int | None = None,
+) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """
+    Update the near duplicates of the chunk store since the previous run: only the chunks added since are hashed.
+
+    The index of the signatures is saved at once, the map from the duplicates to their representatives is saved
+    by save_near_duplicates.
+
+    Args:
+        - json_files_directory (str | None): The directory where the chunk store is saved, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
+        - threshold (float | None): The Jaccard similarity above which two chunks are near duplicates, NEAR_DUPLICATE_THRESHOLD in the .env file if None.
+        - num_perm (int | None): The number of hash functions of the MinHash signatures, NEAR_DUPLICATE_NUM_PERM in the .env file if None.
+
+    Returns:
+        - Tuple[Dict[str, str], Dict[str, Any]]: The id of the representative of each duplicate, by id of the duplicate,
+            and the report of the elimination.
+    """
+
+    if json_files_directory is None:
+        json_files_directory = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS")
+
+    file_path = os.path.join(json_files_directory, NEAR_DUPLICATE_INDEX_FILE_NAME)
+    index = NearDuplicateIndex.load(file_path=file_path, threshold=threshold, num_perm=num_perm)
+    if index.threshold <= 0:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return index.duplicates(), index.update(chunks=[], chunk_ids=None)
+
+    with ChunkStore(chunk_store_file_path(json_files_directory)) as chunk_store:
+        chunk_ids = np.array(chunk_store.index["id"])
+        new_positions = np.flatnonzero(~np.isin(chunk_ids, index.ids))
+        report = index.update(
+            chunks=(chunk_store.record(position) for position in new_positions.tolist()),
+            chunk_ids=chunk_ids,
+        )
+    index.save(file_path)
+
+    return index.duplicates(), report
+
+
+def savings_report(report: Dict[str, Any], dimension: int) -> Dict[str, Any]:
+    """
+    Add what the elimination saved to its report, for embeddings of a dimension.
+
+    Args:
+        - report (Dict[str, Any]): The report of update_near_duplicates or find_near_duplicates.
+        - dimension (int): The dimension of the embeddings.
+
+    Returns:
+        - Dict[str, Any]: The report, with the embeddings saved, the share of the chunks they are,
+            and the bytes of float32 vectors not added to the index.
+    """
+
+    duplicates = report["duplicates"]
+    return {
+        **report,
+        "embeddings_saved": duplicates,
+        "embeddings_saved_ratio": duplicates / report["chunks"] if report.get("chunks") else 0.0,
+        "index_vector_bytes_saved": duplicates * dimension * 4,
+    }
+
+
+def save_near_duplicates(
+    duplicates: Dict[str, str],
+    report: Dict[str, Any],
+    json_files_directory: str | None = None,
+    chunk_digests: Dict[str, Dict[str, str]] | None = None,
+) -> None:
+    """
+    Save the map from the duplicates to their representatives, its report and the digests of the chunks, next to the chunk store.
+
+    Args:
+        - duplicates (Dict[str, str]): The id of the representative of each duplicate, by id of the duplicate.
+        - report (Dict[str, Any]): The report of the elimination.
+        - json_files_directory (str | None): The directory where the chunk store is saved, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
+        - chunk_digests (Dict[str, Dict[str, str]] | None): The digests of chunk_digests, read by STEP 3 instead of digesting
+            the chunk store again, None if they weren't computed.
+
+    Returns:
+        - None
+    """
+
+    if json_files_directory is None:
+        json_files_directory = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS")
+
+    file_path = os.path.join(json_files_directory, NEAR_DUPLICATES_FILE_NAME)
+    with open(file_path + ".tmp", "w") as f:
+        json.dump(
+            {"report": report, "duplicates": duplicates, "chunk_digests": chunk_digests}, f
+        )
+    os.replace(file_path + ".tmp", file_path)
+
+
+def _load_near_duplicates_file(json_files_directory: str | None) -> Dict[str, Any]:
+    if json_files_directory is None:
+        json_files_directory = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS")
+
+    file_path = os.path.join(json_files_directory, NEAR_DUPLICATES_FILE_NAME)
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path) as f:
+        return json.load(f)
+
+
+def load_near_duplicates(
+    json_files_directory: str | None = None,
+) -> Dict[str, str]:
+    """
+    Load the map from the duplicates to their representatives saved by STEP 2.
+
+    Args:
+        - json_files_directory (str | None): The directory where the chunk store is saved, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
+
+    Returns:
+        - Dict[str, str]: The id of the representative of each duplicate, by id of the duplicate, empty if none was saved.
+    """
+
+    return _load_near_duplicates_file(json_files_directory).get("duplicates", {})
+
+
+def load_chunk_digests(
+    json_files_directory: str | None = None,
+) -> Dict[str, Dict[str, str]]:
+    """
+    Load the digests of the chunks saved by STEP 2, or digest the chunk store if they weren't saved.
+
+    Args:
+        - json_files_directory (str | None): The directory where the chunk store is saved, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
+
+    Returns:
+        - Dict[str, Dict[str, str]]: The digests, see chunk_digests.
+    """
+
+    saved = _load_near_duplicates_file(json_files_directory)
+    if saved.get("chunk_digests") is not None:
+        return saved["chunk_digests"]
+
+    return chunk_digests(
+        duplicates=saved.get("duplicates", {}), json_files_directory=json_files_directory
+    )
+
+
+def chunk_digests(
+    duplicates: Dict[str, str],
+    json_files_directory: str | None = None,
+) -> Dict[str, Dict[str, str]]:
+    """
+    Digest the ids of the chunks of each document, with and without the duplicates, read from the index of the chunk store.
+
+    The ids of the chunks of a document are hashed together, a single call to sha256 per document.
+
+    Args:
+        - duplicates (Dict[str, str]): The id of the representative of each duplicate, by id of the duplicate.
+        - json_files_directory (str | None): The directory where the chunk store is saved, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
+
+    Returns:
+        - Dict[str, Dict[str, str]]: The sha256 of the ids of the chunks of each document that aren't duplicates ("kept"),
+            and of all of them ("all"), by document name.
+    """
+
+    if json_files_directory is None:
+        json_files_directory = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS")
+
+    with ChunkStore(chunk_store_file_path(json_files_directory)) as chunk_store:
+        documents = np.array(chunk_store.index["document"])
+        ids = np.array(chunk_store.index["id"])
+        kept = ~np.isin(ids, np.array(list(duplicates), dtype=ids.dtype))
+        document_names = chunk_store.documents
+
+    digests: Dict[str, Dict[str, str]] = {}
+    for name, mask in (("kept", kept), ("all", np.ones(len(ids), dtype=bool))):
+        # The stable sort keeps the chunks of each document in the order of the chunk store
+        order = np.argsort(documents[mask], kind="stable")
+        document_ids = ids[mask][order]
+        bounds = np.searchsorted(documents[mask][order], np.arange(len(document_names) + 1))
+        digests[name] = {
+            document_name: hashlib.sha256(
+                document_ids[bounds[number] : bounds[number + 1]].tobytes()
+            ).hexdigest()
+            for number, document_name in enumerate(document_names)
+        }
+
+    return digests
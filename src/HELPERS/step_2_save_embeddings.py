@@ -1,48 +1,194 @@
 """
-    This function takes in three parameters: 
-    
-    "embeddings" which is an instance of the "Embeddings" class, 
-    "saving_embeddings_file_name" which is a string representing the name of the file to be saved, and 
-    "saving_embeddings_directory" which is a string representing the path to the directory where the file will be saved.
-
-    The function first creates a directory at the specified path if it does not already exist. 
-    It then creates a file path by joining the directory path and file name with a ".pkl" extension. 
-    Finally, it saves the embeddings object to the binary file using the "pickle" module.
+    This function takes in five parameters:
+
+    "embeddings" which is a dictionary of the embeddings of the chunks of each document, by document name,
+    "chunk_ids" which is a dictionary of the ids of the chunks of each document, in the same order as their embeddings,
+    "saving_embeddings_file_name" which is a string representing the name of the file to be saved,
+    "saving_embeddings_directory" which is a string representing the path to the directory where the file will be saved, and
+    "model_id" which is the id of the model the embeddings were created with.
+
+    The function first creates a directory at the specified path if it does not already exist.
+    It then writes the embeddings of all the documents, one after another, as a contiguous float32 matrix in a ".npy" file,
+    the id of the chunk of each row in a ".ids.npy" file,
+    and a small ".json" header with the dimension, the count, the model id and the rows of each document.
+
+    The files are written by the EmbeddingsWriter class, which can also be fed one batch of embeddings at a time
+    (by the streaming pipeline) since it writes each batch straight to disk and only fills in the shapes when it is closed.
+
+    The files are written to temporary files first and swapped in, so the saved embeddings can be memory mapped
+    (by load_embeddings) while new ones are being saved.
 """
 
 
-import pickle
+import json
 import os
+import struct
+
+from typing import Dict, List, Union
+
+import numpy as np
+
+# Version of the embeddings header, bumped when the format changes
+EMBEDDINGS_FORMAT_VERSION = 2
+
+# Chunk ids are 16 hexadecimal characters
+CHUNK_ID_DTYPE = "S16"
+
+# Room left in the ".npy" headers for the shapes, which are only known once all the embeddings are written
+NPY_HEADER_LENGTH = 128
+
+
+def _write_npy_header(f, descr: str, shape: tuple) -> None:
+    """Write a version 1.0 ".npy" header padded to NPY_HEADER_LENGTH bytes at the start of the file."""
+    header = repr({"descr": descr, "fortran_order": False, "shape": shape})
+    header = header.ljust(NPY_HEADER_LENGTH - 10 - 1) + "\n"
+    f.seek(0)
+    f.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+
+
+class EmbeddingsWriter:
+    """
+    Writes embeddings to disk one batch at a time, in the format read by load_embeddings.
+
+    The embeddings of a document can be added in several calls, as long as they follow each other.
+    Call close to write the header and swap the new files in.
+
+    Args:
+        - saving_embeddings_file_name (str | None): The name of the file to save the embeddings to, SAVING_EMBEDDINGS_FILE_NAME in the .env file if None.
+        - saving_embeddings_directory (str | None): The path to the directory where the file will be saved, SAVING_EMBEDDINGS_DIRECTORY in the .env file if None.
+        - model_id (str | None): The id of the model the embeddings were created with.
+    """
+
+    def __init__(
+        self,
+        saving_embeddings_file_name: str | None = None,
+        saving_embeddings_directory: str | None = None,
+        model_id: str | None = None,
+    ) -> None:
+        if saving_embeddings_file_name is None:
+            saving_embeddings_file_name = os.getenv("SAVING_EMBEDDINGS_FILE_NAME")
+        if saving_embeddings_directory is None:
+            saving_embeddings_directory = os.getenv("SAVING_EMBEDDINGS_DIRECTORY")
+
+        directory = os.path.join(os.getcwd(), saving_embeddings_directory)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.file_path = os.path.join(directory, saving_embeddings_file_name)
+        self.model_id = model_id
+        self.documents: List[Dict[str, Union[str, int]]] = []
+        self.count = 0
+        self.dimension = 0
+
+        # Leave room for the headers, the rows are written right after them
+        self._matrix_file = open(self.file_path + ".npy.tmp", "wb")
+        self._ids_file = open(self.file_path + ".ids.npy.tmp", "wb")
+        self._matrix_file.write(b" " * NPY_HEADER_LENGTH)
+        self._ids_file.write(b" " * NPY_HEADER_LENGTH)
+
+    def add(
+        self,
+        document_name: str,
+        chunk_ids: Union[List[str], np.ndarray],
+        embeddings: Union[List[List[float]], np.ndarray],
+    ) -> None:
+        """
+        Write the embeddings of some chunks of a document.
+
+        Args:
+            - document_name (str): The name of the document.
+            - chunk_ids (Union[List[str], np.ndarray]): The ids of the chunks.
+            - embeddings (Union[List[List[float]], np.ndarray]): The embeddings of the chunks, in the same order.
+
+        Returns:
+            - None
+        """
+
+        if len(chunk_ids) != len(embeddings):
+            raise ValueError(
+                f"The document {document_name} has {len(chunk_ids)} chunk ids but {len(embeddings)} embeddings"
+            )
+
+        if len(embeddings):
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            if not self.dimension:
+                self.dimension = embeddings.shape[1]
+            elif embeddings.shape[1] != self.dimension:
+                raise ValueError(
+                    f"The document {document_name} has embeddings of dimension {embeddings.shape[1]} instead of {self.dimension}"
+                )
+            self._matrix_file.write(embeddings.tobytes())
+            self._ids_file.write(np.asarray(chunk_ids, dtype=CHUNK_ID_DTYPE).tobytes())
+
+        # Extend the rows of the document if its embeddings follow the previous ones
+        if self.documents and self.documents[-1]["name"] == document_name:
+            self.documents[-1]["count"] += len(embeddings)
+        else:
+            self.documents.append(
+                {"name": document_name, "start": self.count, "count": len(embeddings)}
+            )
+        self.count += len(embeddings)
+
+    def close(self) -> None:
+        """Write the headers and swap the new files in."""
 
-from langchain.embeddings.base import Embeddings
+        _write_npy_header(self._matrix_file, "<f4", (self.count, self.dimension))
+        _write_npy_header(self._ids_file, "|" + CHUNK_ID_DTYPE, (self.count,))
+        self._matrix_file.close()
+        self._ids_file.close()
 
-from dotenv import load_dotenv
+        header = {
+            "format_version": EMBEDDINGS_FORMAT_VERSION,
+            "dtype": "float32",
+            "dimension": self.dimension,
+            "count": self.count,
+            "model_id": self.model_id,
+            "documents": self.documents,
+        }
+        with open(self.file_path + ".json.tmp", "w") as f:
+            json.dump(header, f)
 
-load_dotenv()  # Load environment variables from .env file
+        # Swap the new files in
+        os.replace(self.file_path + ".npy.tmp", self.file_path + ".npy")
+        os.replace(self.file_path + ".ids.npy.tmp", self.file_path + ".ids.npy")
+        os.replace(self.file_path + ".json.tmp", self.file_path + ".json")
 
 
 def save_embeddings(
-    embeddings: Embeddings,
-    saving_embeddings_file_name: str = os.getenv("SAVING_EMBEDDINGS_FILE_NAME"),
-    saving_embeddings_directory: str = os.getenv("SAVING_EMBEDDINGS_DIRECTORY"),
+    embeddings: Dict[str, Union[List[List[float]], np.ndarray]],
+    chunk_ids: Dict[str, Union[List[str], np.ndarray]],
+    saving_embeddings_file_name: str | None = None,
+    saving_embeddings_directory: str | None = None,
+    model_id: str | None = None,
 ) -> None:
     """
-    Save embeddings to a binary file with the specified file name and directory path.
+    Save embeddings to a float32 matrix file and its header with the specified file name and directory path.
 
     Args:
-        - embeddings (Embeddings): The embeddings to be saved.
-        - saving_embeddings_file_name (str): The name of the file to save the embeddings to.
-        - saving_embeddings_directory (str): The path to the directory where the file will be saved.
+        - embeddings (Dict[str, Union[List[List[float]], np.ndarray]]): The embeddings of the chunks of each document, by document name.
+        - chunk_ids (Dict[str, Union[List[str], np.ndarray]]): The ids of the chunks of each document, in the same order as their embeddings.
+        - saving_embeddings_file_name (str | None): The name of the file to save the embeddings to, SAVING_EMBEDDINGS_FILE_NAME in the .env file if None.
+        - saving_embeddings_directory (str | None): The path to the directory where the file will be saved, SAVING_EMBEDDINGS_DIRECTORY in the .env file if None.
+        - model_id (str | None): The id of the model the embeddings were created with.
 
     Returns:
         - None
     """
 
-    directory = os.path.join(os.getcwd(), saving_embeddings_directory)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    file_path = os.path.join(directory, saving_embeddings_file_name + ".pkl")
+    if saving_embeddings_file_name is None:
+        saving_embeddings_file_name = os.getenv("SAVING_EMBEDDINGS_FILE_NAME")
+    if saving_embeddings_directory is None:
+        saving_embeddings_directory = os.getenv("SAVING_EMBEDDINGS_DIRECTORY")
 
-    # Save embeddings to binary file
-    with open(file_path, "wb") as f:
-        pickle.dump(embeddings, f)
+    writer = EmbeddingsWriter(
+        saving_embeddings_file_name=saving_embeddings_file_name,
+        saving_embeddings_directory=saving_embeddings_directory,
+        model_id=model_id,
+    )
+    for document_name, document_embeddings in embeddings.items():
+        writer.add(
+            document_name=document_name,
+            chunk_ids=chunk_ids[document_name],
+            embeddings=document_embeddings,
+        )
+    writer.close()
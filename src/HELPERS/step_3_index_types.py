@@ -0,0 +1,242 @@
+"""
+    This code defines the index types the vectorstore can be built with, and how their parameters are saved and restored.
+
+    The index type is chosen in the .env file (VECTORSTORE_INDEX_TYPE):
+        "flat" is the exact, brute force index (the default, and the only type before),
+        "ivf_flat" splits the vectors into nlist clusters and only searches the nprobe clusters closest to the query,
+        "hnsw" searches a graph linking each vector to M neighbours, exploring efSearch candidates per query, and
+        "ivf_pq" splits the vectors into clusters like "ivf_flat" and compresses each of them into pq_m codes of pq_nbits bits,
+        so the index takes a fraction of the memory of the float32 embeddings.
+
+    The "ivf_flat" and "ivf_pq" types are trained on a random sample of the embeddings they index before the vectors are added,
+    each shard of a sharded vectorstore on a sample of its own embeddings, with a number of clusters sized to it.
+
+    The function build_index creates and trains an empty index of the configured type,
+    describe_index reads the type and parameters back from an index, save_index_config saves them next to the index
+    (in the ".faiss" folder of the vectorstore) and apply_search_params restores them when the vectorstore is loaded.
+"""
+
+import json
+import os
+import sys
+from typing import Any, Dict
+
+import numpy as np
+from langchain.vectorstores.faiss import dependable_faiss_import
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+
+# Name of the file holding the parameters of the index, in the ".faiss" folder of the vectorstore
+INDEX_CONFIG_FILE_NAME = "index_config.json"
+
+# k-means needs about 39 training vectors per cluster
+MIN_TRAINING_VECTORS_PER_CLUSTER = 39
+
+
+def index_config_from_env() -> Dict[str, Any]:
+    """
+    Read the type and parameters of the index from the environment.
+
+    Returns:
+        - Dict[str, Any]: The type of the index and its parameters.
+    """
+
+    index_config = {
+        "type": os.getenv("VECTORSTORE_INDEX_TYPE", "flat"),
+        "nlist": int(os.getenv("VECTORSTORE_IVF_NLIST", "1024")),
+        "nprobe": int(os.getenv("VECTORSTORE_IVF_NPROBE", "16")),
+        "m": int(os.getenv("VECTORSTORE_HNSW_M", "32")),
+        "ef_construction": int(os.getenv("VECTORSTORE_HNSW_EF_CONSTRUCTION", "200")),
+        "ef_search": int(os.getenv("VECTORSTORE_HNSW_EF_SEARCH", "64")),
+        "pq_m": int(os.getenv("VECTORSTORE_PQ_M", "16")),
+        "pq_nbits": int(os.getenv("VECTORSTORE_PQ_NBITS", "8")),
+        "training_sample_size": int(
+            os.getenv("VECTORSTORE_TRAINING_SAMPLE_SIZE", "100000")
+        ),
+    }
+
+    if index_config["type"] not in INDEX_TYPES:
+        raise ValueError(
+            f"Unknown index type {index_config['type']}, expected one of {INDEX_TYPES}"
+        )
+
+    return index_config
+
+
+def needs_training(index_config: Dict[str, Any]) -> bool:
+    """Whether the index type has to be trained on a sample of the embeddings before vectors are added."""
+    return index_config["type"] in ("ivf_flat", "ivf_pq")
+
+
+def sample_training_vectors(
+    matrix: np.ndarray, sample_size: int, seed: int = 0, rows: np.ndarray | None = None
+) -> np.ndarray:
+    """
+    Pick a random sample of the rows of an embeddings matrix, in order, so a memory mapped matrix is read front to back.
+
+    Args:
+        - matrix (np.ndarray): The embeddings matrix.
+        - sample_size (int): The number of rows to pick.
+        - seed (int): The seed of the random sample.
+        - rows (np.ndarray | None): The sorted rows to pick from (the rows of the documents of a shard), all the rows if None.
+
+    Returns:
+        - np.ndarray: The sampled rows, as a float32 matrix in memory.
+    """
+
+    if rows is None:
+        if len(matrix) <= sample_size:
+            return np.ascontiguousarray(matrix, dtype=np.float32)
+        rows = np.arange(len(matrix))
+
+    if len(rows) > sample_size:
+        rows = np.sort(
+            np.random.default_rng(seed).choice(rows, size=sample_size, replace=False)
+        )
+
+    return np.ascontiguousarray(matrix[rows], dtype=np.float32)
+
+
+def build_index(
+    dimension: int,
+    index_config: Dict[str, Any],
+    training_vectors: np.ndarray | None = None,
+):
+    """
+    Create an empty index of the configured type, trained on the training vectors if the type needs it.
+
+    The number of clusters of the "ivf_flat" and "ivf_pq" types is lowered when there are too few training vectors for it.
+
+    Args:
+        - dimension (int): The dimension of the embeddings.
+        - index_config (Dict[str, Any]): The type of the index and its parameters.
+        - training_vectors (np.ndarray | None): The vectors the index is trained on.
+
+    Returns:
+        - The empty FAISS index.
+    """
+
+    faiss = dependable_faiss_import()
+    index_config = dict(index_config)
+    index_type = index_config["type"]
+
+    if needs_training(index_config):
+        if training_vectors is None or not len(training_vectors):
+            raise ValueError(f"The {index_type} index needs training vectors")
+        index_config["nlist"] = max(
+            1,
+            min(
+                index_config["nlist"],
+                len(training_vectors) // MIN_TRAINING_VECTORS_PER_CLUSTER,
+            ),
+        )
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == "ivf_flat":
+        index = faiss.index_factory(dimension, f"IVF{index_config['nlist']},Flat")
+    elif index_type == "hnsw":
+        index = faiss.index_factory(dimension, f"HNSW{index_config['m']},Flat")
+        index.hnsw.efConstruction = index_config["ef_construction"]
+    elif index_type == "ivf_pq":
+        if dimension % index_config["pq_m"]:
+            raise ValueError(
+                f"The dimension {dimension} is not a multiple of VECTORSTORE_PQ_M={index_config['pq_m']}"
+            )
+        if len(training_vectors) < 2 ** index_config["pq_nbits"]:
+            raise ValueError(
+                f"The ivf_pq index needs at least {2 ** index_config['pq_nbits']} training vectors, "
+                f"got {len(training_vectors)}, lower VECTORSTORE_PQ_NBITS"
+            )
+        index = faiss.index_factory(
+            dimension,
+            f"IVF{index_config['nlist']},PQ{index_config['pq_m']}x{index_config['pq_nbits']}",
+        )
+    else:
+        raise ValueError(
+            f"Unknown index type {index_type}, expected one of {INDEX_TYPES}"
+        )
+
+    if not index.is_trained:
+        with METRICS.timer("index_training"):
+            index.train(np.ascontiguousarray(training_vectors, dtype=np.float32))
+
+    apply_search_params(index=index, index_config=index_config)
+
+    return index
+
+
+def describe_index(index) -> Dict[str, Any]:
+    """
+    Read the type and parameters of an index.
+
+    Args:
+        - index: The FAISS index.
+
+    Returns:
+        - Dict[str, Any]: The type of the index and its parameters.
+    """
+
+    faiss = dependable_faiss_import()
+    index = faiss.downcast_index(index)
+    index_config: Dict[str, Any] = {"dimension": index.d, "count": index.ntotal}
+
+    if isinstance(index, faiss.IndexHNSW):
+        index_config.update(
+            type="hnsw",
+            m=index.hnsw.nb_neighbors(1),
+            ef_construction=index.hnsw.efConstruction,
+            ef_search=index.hnsw.efSearch,
+        )
+    elif isinstance(index, faiss.IndexIVF):
+        index_config.update(nlist=index.nlist, nprobe=index.nprobe)
+        if isinstance(index, faiss.IndexIVFPQ):
+            index_config.update(type="ivf_pq", pq_m=index.pq.M, pq_nbits=index.pq.nbits)
+        else:
+            index_config.update(type="ivf_flat")
+    else:
+        index_config.update(type="flat")
+
+    return index_config
+
+
+def apply_search_params(index, index_config: Dict[str, Any] | None) -> None:
+    """
+    Set the search parameters of an index (nprobe for the "ivf_flat" and "ivf_pq" types, efSearch for the "hnsw" type).
+
+    Args:
+        - index: The FAISS index.
+        - index_config (Dict[str, Any] | None): The type of the index and its parameters, nothing is set if None.
+
+    Returns:
+        - None
+    """
+
+    if index_config is None:
+        return
+
+    parameter_space = dependable_faiss_import().ParameterSpace()
+    if index_config["type"] in ("ivf_flat", "ivf_pq"):
+        parameter_space.set_index_parameter(index, "nprobe", index_config["nprobe"])
+    elif index_config["type"] == "hnsw":
+        parameter_space.set_index_parameter(index, "efSearch", index_config["ef_search"])
+
+
+def save_index_config(folder_path: str, index_config: Dict[str, Any]) -> None:
+    """Save the parameters of the index in the folder of the vectorstore."""
+    with open(os.path.join(folder_path, INDEX_CONFIG_FILE_NAME), "w") as f:
+        json.dump(index_config, f, indent=2)
+
+
+def load_index_config(folder_path: str) -> Dict[str, Any] | None:
+    """Load the parameters of the index from the folder of the vectorstore, None for vectorstores saved without them."""
+    path = os.path.join(folder_path, INDEX_CONFIG_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as f:
+        return json.load(f)
@@ -0,0 +1,492 @@
+"""
+    This code defines the lexical index of the vectorstore: a BM25 inverted index over the words of its chunks,
+    built by STEP 3 from the same chunk texts as the FAISS index and searched next to it by the hybrid search (see step_4A_hybrid_search).
+
+    The texts are split into lower case words, a word joined by "-", ".", "/", ":" or "@" (a part number, a version,
+    a file name, an email address) is kept whole and also split into its parts, so "ABC-123" matches both "abc-123" and "123".
+
+    Each word is identified by a 64 bit hash, and the index is a set of flat numpy arrays (a compressed sparse row layout):
+        "term_hashes": the sorted hashes of the words, a word is found by binary search,
+        "offsets": where the posting list of each word starts and ends in the two next arrays,
+        "postings": the positions in the FAISS index of the chunks having the word (int32, sorted in each posting list),
+        "term_frequencies": how many times each of these chunks has the word (uint16),
+        "document_lengths": the number of words of each chunk (int32), and
+        "champion_terms", "champion_offsets" and "champions": the champion lists of the words found in more than
+        CHAMPION_LIST_SIZE chunks, their CHAMPION_LIST_SIZE chunks with the best BM25 weights (int32, sorted in each champion list).
+    They are saved as ".npy" files in a "lexical_index" folder inside the ".faiss" folder of the vectorstore, so the lexical index
+    is swapped in with the FAISS index it was built with, and memory mapped when it is loaded.
+
+    A query is scored with BM25 (k1=1.2, b=0.75). Its words are read from the rarest to the most common,
+    the chunks of a word being its whole posting list, or its champion list for the words having one:
+    the chunks of the rarest words are found while they are at most max_postings together,
+    and the more common words only add their scores to these chunks, found by binary search in their posting lists.
+    So a query never reads more than max_postings postings to find its chunks (plus a champion list), however common its words are,
+    and only the best k chunks are sorted. The scores of the chunks found are exact, but a query made only of very common words
+    only finds the chunks of their champion lists.
+
+    The LexicalIndex of a vectorstore is loaded with it, and built again when the number of chunks of the vectorstore changes.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+from langchain.schema import Document
+from langchain.vectorstores.faiss import FAISS
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+from HELPERS.step_4A_metadata_index import metadata_index_of
+
+# Name of the folder holding the lexical index, in the ".faiss" folder of the vectorstore
+LEXICAL_INDEX_FOLDER_NAME = "lexical_index"
+LEXICAL_INDEX_FORMAT_VERSION = 1
+LEXICAL_INDEX_ARRAYS = (
+    "term_hashes",
+    "offsets",
+    "postings",
+    "term_frequencies",
+    "document_lengths",
+    "champion_terms",
+    "champion_offsets",
+    "champions",
+)
+
+# The number of chunks kept in the champion list of a word found in more chunks
+CHAMPION_LIST_SIZE = 10000
+
+# The parameters of BM25: how fast the score saturates with the frequency of a word, and how much the length of the chunk counts
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# The words, kept whole when joined by a separator, and the separators they are also split on
+_TOKEN_PATTERN = re.compile(r"\w+(?:[-./:@]\w+)*")
+_SEPARATOR_PATTERN = re.compile(r"[-./:@]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into the words indexed by the lexical index.
+
+    Args:
+        - text (str): The text.
+
+    Returns:
+        - List[str]: The lower case words of the text, followed by the parts of its compound words.
+    """
+
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    parts = [
+        part
+        for token in tokens
+        if _SEPARATOR_PATTERN.search(token)
+        for part in _SEPARATOR_PATTERN.split(token)
+    ]
+
+    return tokens + parts
+
+
+def _term_hash(term: str) -> int:
+    """The 64 bit hash of a word, the same in every process (unlike the hash of Python strings)."""
+    return int.from_bytes(
+        hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index from the words of the chunks of a vectorstore to their positions in its FAISS index.
+
+    Args:
+        - term_hashes (np.ndarray): The sorted hashes of the words.
+        - offsets (np.ndarray): The start of the posting list of each word, followed by the number of postings.
+        - postings (np.ndarray): The positions of the chunks having each word, sorted in each posting list.
+        - term_frequencies (np.ndarray): The number of times each chunk of the postings has the word.
+        - document_lengths (np.ndarray): The number of words of each chunk.
+        - champion_terms (np.ndarray | None): The sorted numbers of the words having a champion list, built from the postings if None.
+        - champion_offsets (np.ndarray | None): The start of the champion list of each of these words, followed by the number of champions.
+        - champions (np.ndarray | None): The positions of the chunks with the best weights for each of these words, sorted in each champion list.
+        - k1 (float): The BM25 saturation of the frequency of a word.
+        - b (float): The BM25 normalization by the length of the chunk.
+    """
+
+    def __init__(
+        self,
+        term_hashes: np.ndarray,
+        offsets: np.ndarray,
+        postings: np.ndarray,
+        term_frequencies: np.ndarray,
+        document_lengths: np.ndarray,
+        champion_terms: np.ndarray | None = None,
+        champion_offsets: np.ndarray | None = None,
+        champions: np.ndarray | None = None,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ) -> None:
+        self.term_hashes = term_hashes
+        self.offsets = offsets
+        self.postings = postings
+        self.term_frequencies = term_frequencies
+        self.document_lengths = document_lengths
+        self.k1 = k1
+        self.b = b
+        self.count = len(document_lengths)
+        self.average_document_length = (
+            max(float(np.mean(document_lengths)), 1.0) if self.count else 1.0
+        )
+
+        if champion_terms is None:
+            champion_terms, champion_offsets, champions = self._champion_lists()
+        self.champion_terms = champion_terms
+        self.champion_offsets = champion_offsets
+        self.champions = champions
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "LexicalIndex":
+        """
+        Build the lexical index of some texts.
+
+        Args:
+            - texts (Iterable[str]): The texts of the chunks, in the order of their positions in the FAISS index.
+
+        Returns:
+            - LexicalIndex: The lexical index of the texts.
+        """
+
+        vocabulary: Dict[str, int] = {}
+        term_ids = array("i")
+        term_frequencies = array("I")
+        unique_terms = array("i")
+        document_lengths = array("i")
+
+        with METRICS.timer("build_lexical_index"):
+            for text in texts:
+                tokens = tokenize(text)
+                counts = Counter(tokens)
+                # A new word gets the next id
+                term_ids.extend([vocabulary.setdefault(term, len(vocabulary)) for term in counts])
+                term_frequencies.extend(counts.values())
+                unique_terms.append(len(counts))
+                document_lengths.append(len(tokens))
+
+            count = len(document_lengths)
+            positions = np.repeat(
+                np.arange(count, dtype=np.int32), np.frombuffer(unique_terms, dtype=np.int32)
+            )
+            hashes = np.fromiter(
+                (_term_hash(term) for term in vocabulary), dtype=np.uint64, count=len(vocabulary)
+            )
+
+            # Number the words in the order of their hashes (two words with the same hash share a posting list)
+            term_hashes, sorted_term_ids = np.unique(hashes, return_inverse=True)
+            sorted_term_ids = sorted_term_ids[np.frombuffer(term_ids, dtype=np.int32)]
+
+            # Group the postings by word, the stable sort keeps the positions sorted in each posting list
+            order = np.argsort(sorted_term_ids, kind="stable")
+            offsets = np.zeros(len(term_hashes) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(sorted_term_ids, minlength=len(term_hashes)), out=offsets[1:])
+
+            lexical_index = cls(
+                term_hashes=term_hashes,
+                offsets=offsets,
+                postings=positions[order],
+                term_frequencies=np.minimum(
+                    np.frombuffer(term_frequencies, dtype=np.uint32)[order], np.iinfo(np.uint16).max
+                ).astype(np.uint16),
+                document_lengths=np.frombuffer(document_lengths, dtype=np.int32).copy(),
+            )
+
+        METRICS.increment("lexical_index_postings", len(lexical_index.postings))
+
+        return lexical_index
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore: FAISS) -> "LexicalIndex":
+        """Build the lexical index of the chunks of a vectorstore, read from its docstore."""
+        return cls.build(
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[position]).page_content
+            for position in range(len(vectorstore.index_to_docstore_id))
+        )
+
+    def save(self, folder_path: str) -> None:
+        """
+        Save the lexical index in the "lexical_index" folder of a ".faiss" folder, its header last.
+
+        Args:
+            - folder_path (str): The path to the ".faiss" folder of the vectorstore.
+
+        Returns:
+            - None
+        """
+
+        lexical_index_path = os.path.join(folder_path, LEXICAL_INDEX_FOLDER_NAME)
+        os.makedirs(lexical_index_path, exist_ok=True)
+        for name in LEXICAL_INDEX_ARRAYS:
+            np.save(os.path.join(lexical_index_path, name + ".npy"), getattr(self, name))
+
+        with open(os.path.join(lexical_index_path, "lexical_index.json"), "w") as f:
+            json.dump(
+                {
+                    "format_version": LEXICAL_INDEX_FORMAT_VERSION,
+                    "count": self.count,
+                    "terms": len(self.term_hashes),
+                    "postings": len(self.postings),
+                },
+                f,
+                indent=2,
+            )
+
+    @classmethod
+    def load(cls, folder_path: str) -> "LexicalIndex | None":
+        """
+        Load the lexical index saved in a ".faiss" folder, memory mapping its arrays.
+
+        Args:
+            - folder_path (str): The path to the ".faiss" folder of the vectorstore.
+
+        Returns:
+            - LexicalIndex | None: The lexical index, None if none was saved or it was saved in another format.
+        """
+
+        lexical_index_path = os.path.join(folder_path, LEXICAL_INDEX_FOLDER_NAME)
+        header_path = os.path.join(lexical_index_path, "lexical_index.json")
+        if not os.path.exists(header_path):
+            return None
+        with open(header_path) as f:
+            header = json.load(f)
+        if header.get("format_version") != LEXICAL_INDEX_FORMAT_VERSION:
+            return None
+
+        return cls(
+            **{
+                name: np.load(os.path.join(lexical_index_path, name + ".npy"), mmap_mode="r")
+                for name in LEXICAL_INDEX_ARRAYS
+            }
+        )
+
+    def _champion_lists(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Keep the CHAMPION_LIST_SIZE chunks with the best BM25 weights of each word found in more chunks, sorted by position."""
+        document_frequencies = np.diff(self.offsets)
+        champion_terms = np.flatnonzero(document_frequencies > CHAMPION_LIST_SIZE).astype(np.int32)
+
+        champion_lists = []
+        for term in champion_terms:
+            term_positions = np.asarray(self.postings[self.offsets[term] : self.offsets[term + 1]])
+            # The idf of the word is the same for all its chunks, so the weights alone rank them
+            weights = self._scores(term, slice(None), term_positions)
+            best = np.argpartition(-weights, CHAMPION_LIST_SIZE - 1)[:CHAMPION_LIST_SIZE]
+            champion_lists.append(np.sort(term_positions[best]))
+
+        champion_offsets = np.zeros(len(champion_terms) + 1, dtype=np.int64)
+        champion_offsets[1:] = np.cumsum([len(champion_list) for champion_list in champion_lists])
+        champions = (
+            np.concatenate(champion_lists) if champion_lists else np.empty(0, dtype=np.int32)
+        )
+
+        return champion_terms, champion_offsets, champions
+
+    def _terms(self, query: str) -> List[int]:
+        """Return the numbers of the words of the query found in the index, the rarest first."""
+        hashes = np.array(
+            [_term_hash(term) for term in set(tokenize(query))], dtype=np.uint64
+        )
+        if not len(hashes) or not len(self.term_hashes):
+            return []
+
+        found = np.minimum(np.searchsorted(self.term_hashes, hashes), len(self.term_hashes) - 1)
+        found = found[self.term_hashes[found] == hashes]
+
+        return sorted(
+            (int(term) for term in found),
+            key=lambda term: self.offsets[term + 1] - self.offsets[term],
+        )
+
+    def _finding_postings(self, term: int) -> Tuple[np.ndarray, bool]:
+        """Return the postings a word finds chunks with, its champion list if it has one, and whether it is its whole posting list."""
+        if len(self.champion_terms):
+            champion = int(np.searchsorted(self.champion_terms, term))
+            if champion < len(self.champion_terms) and self.champion_terms[champion] == term:
+                return (
+                    np.asarray(
+                        self.champions[self.champion_offsets[champion] : self.champion_offsets[champion + 1]]
+                    ),
+                    False,
+                )
+
+        return np.asarray(self.postings[self.offsets[term] : self.offsets[term + 1]]), True
+
+    def _scores(
+        self, term: int, postings: np.ndarray | slice, positions: np.ndarray
+    ) -> np.ndarray:
+        """The BM25 score of a word for some of its postings (indexes in its posting list) and the positions of their chunks."""
+        start, end = self.offsets[term], self.offsets[term + 1]
+        document_frequency = end - start
+        idf = np.log(1 + (self.count - document_frequency + 0.5) / (document_frequency + 0.5))
+        term_frequencies = self.term_frequencies[start:end][postings].astype(np.float64)
+        normalization = self.k1 * (
+            1 - self.b + self.b * self.document_lengths[positions] / self.average_document_length
+        )
+
+        return idf * term_frequencies * (self.k1 + 1) / (term_frequencies + normalization)
+
+    def search(
+        self,
+        query: str,
+        k: int = 4,
+        candidates: np.ndarray | None = None,
+        max_postings: int | None = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the chunks with the best BM25 scores for a query.
+
+        Args:
+            - query (str): The query string.
+            - k (int): The number of chunks returned.
+            - candidates (np.ndarray | None): The sorted positions of the chunks to search, all the chunks if None.
+            - max_postings (int | None): The largest number of postings read to find the chunks, the rarest words of the query
+                are read first, the chunks only having the words read afterwards aren't returned,
+                LEXICAL_SEARCH_MAX_POSTINGS in the .env file if None.
+
+        Returns:
+            - Tuple[np.ndarray, np.ndarray]: The scores and the positions of the best chunks, best first.
+        """
+
+        if max_postings is None:
+            max_postings = int(os.getenv("LEXICAL_SEARCH_MAX_POSTINGS", "100000"))
+
+        terms = self._terms(query)
+        if not terms or k <= 0 or (candidates is not None and not len(candidates)):
+            return np.empty(0), np.empty(0, dtype=np.int64)
+
+        if candidates is not None and len(candidates) <= max_postings:
+            # Few chunks match the filter, all of them are scored
+            positions = np.asarray(candidates, dtype=np.int64)
+            scores = np.zeros(len(positions))
+            scoring_terms = terms
+        else:
+            # The rarest words find the chunks (by their champion lists for the most common ones), at least the rarest one
+            finding_terms = []
+            total_postings = 0
+            for term in terms:
+                finding_postings, whole = self._finding_postings(term)
+                if finding_terms and total_postings + len(finding_postings) > max_postings:
+                    break
+                finding_terms.append((term, finding_postings, whole))
+                total_postings += len(finding_postings)
+            METRICS.increment("lexical_search_postings", total_postings)
+
+            positions_of_terms = []
+            scores_of_terms = []
+            for term, finding_postings, whole in finding_terms:
+                if candidates is not None:
+                    found = np.minimum(np.searchsorted(candidates, finding_postings), len(candidates) - 1)
+                    kept = np.flatnonzero(candidates[found] == finding_postings)
+                else:
+                    kept = slice(None)
+                positions_of_terms.append(finding_postings[kept])
+                # The words found by their champion lists are scored with the common words below
+                scores_of_terms.append(
+                    self._scores(term, kept, finding_postings[kept])
+                    if whole
+                    else np.zeros(len(positions_of_terms[-1]))
+                )
+
+            positions, inverse = np.unique(np.concatenate(positions_of_terms), return_inverse=True)
+            scores = np.bincount(
+                inverse, weights=np.concatenate(scores_of_terms), minlength=len(positions)
+            )
+            scoring_terms = [term for term, _, whole in finding_terms if not whole]
+            scoring_terms += terms[len(finding_terms) :]
+
+        # The other words add their scores to the chunks found, looked up in their posting lists
+        for term in scoring_terms:
+            if not len(positions):
+                break
+            term_positions = self.postings[self.offsets[term] : self.offsets[term + 1]]
+            found = np.minimum(np.searchsorted(term_positions, positions), len(term_positions) - 1)
+            hits = np.flatnonzero(term_positions[found] == positions)
+            scores[hits] += self._scores(term, found[hits], positions[hits])
+
+        # The chunks of the filter having none of the words
+        matched = np.flatnonzero(scores > 0)
+        positions, scores = positions[matched], scores[matched]
+
+        # The k best chunks, best first
+        if len(positions) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(len(positions))
+        best = best[np.argsort(-scores[best], kind="stable")]
+
+        return scores[best], positions[best].astype(np.int64)
+
+
+def lexical_index_of(vectorstore: FAISS) -> LexicalIndex:
+    """
+    Return the LexicalIndex of a vectorstore, building it if it doesn't exist or the vectorstore changed size.
+
+    Args:
+        - vectorstore (FAISS): The vectorstore.
+
+    Returns:
+        - LexicalIndex: The lexical index of its chunks.
+    """
+
+    lexical_index = getattr(vectorstore, "lexical_index", None)
+    if lexical_index is None or lexical_index.count != len(vectorstore.index_to_docstore_id):
+        lexical_index = LexicalIndex.from_vectorstore(vectorstore)
+        vectorstore.lexical_index = lexical_index
+
+    return lexical_index
+
+
+def search_lexical_vectorstore(
+    vectorstore: FAISS,
+    queries: List[str],
+    k: int = 4,
+    metadata_filter: Dict[str, Any] | None = None,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    Find the chunks with the best BM25 scores for each query, among the chunks matching the filter.
+
+    Args:
+        - vectorstore (FAISS): The vectorstore to search.
+        - queries (List[str]): The query strings.
+        - k (int): The number of chunks returned for each query.
+        - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+    Returns:
+        - List[List[Tuple[Document, float]]]: For each query, the chunks and their BM25 scores, best first.
+    """
+
+    lexical_index = lexical_index_of(vectorstore)
+
+    candidates = None
+    if metadata_filter:
+        candidates = metadata_index_of(vectorstore).candidates(metadata_filter)
+        if candidates is not None and not len(candidates):
+            return [[] for _ in queries]
+
+    results = []
+    with METRICS.timer("lexical_search"):
+        for query in queries:
+            scores, positions = lexical_index.search(query=query, k=k, candidates=candidates)
+            results.append(
+                [
+                    (
+                        vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(position)]),
+                        float(score),
+                    )
+                    for score, position in zip(scores, positions)
+                ]
+            )
+    METRICS.increment("lexical_searches", len(queries))
+
+    return results
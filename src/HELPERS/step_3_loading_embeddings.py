@@ -1,45 +1,177 @@
 """
-    This code defines a function called load_embeddings that loads embeddings from a file using the pickle module. 
-        
-    The function takes one argument: 
-        file_path which is the path to the file containing the embeddings. 
-    
-    The function: 
-        opens the file in binary mode, 
-        loads the embeddings using pickle.load(), and 
-        returns the embeddings.
+    This code defines a function called load_embeddings that loads embeddings saved by save_embeddings.
+
+    The function takes one argument:
+        embeddings_path which is the path to the embeddings, without the file extension
+        (SAVING_EMBEDDINGS_FILE_NAME in SAVING_EMBEDDINGS_DIRECTORY, set in the .env file, if not given).
+
+    The function:
+        reads the ".json" header with the dimension, the count, the model id and the rows of each document,
+        memory maps the float32 matrix of the ".npy" file, so nothing is copied into memory until it is used,
+        loads the id of the chunk of each row from the ".ids.npy" file, and
+        returns an EmbeddingMatrix giving access to the embeddings of each document.
+
+    Embeddings pickled (".pkl") by older versions are still loaded, into memory.
 """
+import json
 import os
 
 import pickle
-from langchain.embeddings.base import Embeddings
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+def default_embeddings_path() -> str:
+    """The path to the embeddings saved by STEP 2, without the file extension, as set in the .env file."""
+    return os.path.join(
+        os.getenv("SAVING_EMBEDDINGS_DIRECTORY"), os.getenv("SAVING_EMBEDDINGS_FILE_NAME")
+    )
+
+
+class EmbeddingMatrix:
+    """
+    The embeddings of the chunks of all the documents, as a single float32 matrix.
+
+    Args:
+        - matrix (np.ndarray): The (count, dimension) float32 matrix, usually memory mapped.
+        - documents (Dict[str, Tuple[int, int]] | None): The first row and the number of rows of each document,
+            None for embeddings pickled as a single list by older versions.
+        - model_id (str | None): The id of the model the embeddings were created with.
+        - ids (np.ndarray | None): The id of the chunk of each row, None for embeddings pickled by older versions.
+    """
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        documents: Dict[str, Tuple[int, int]] | None,
+        model_id: str | None = None,
+        ids: np.ndarray | None = None,
+    ) -> None:
+        self.matrix = matrix
+        self.documents = documents
+        self.model_id = model_id
+        self.ids = ids
+        self._rows_by_id: Dict[str, int] | None = None
+
+    @property
+    def dimension(self) -> int:
+        return self.matrix.shape[1]
+
+    @property
+    def count(self) -> int:
+        return self.matrix.shape[0]
 
-from dotenv import load_dotenv
+    def __contains__(self, document_name: str) -> bool:
+        return self.documents is not None and document_name in self.documents
 
-load_dotenv()  # Load environment variables from .env file
+    def __getitem__(self, document_name: str) -> np.ndarray:
+        """Return the embeddings of a document, as a view of the matrix."""
+        start, count = self.documents[document_name]
+        return self.matrix[start : start + count]
 
-load_embeddings_directory: str = os.getenv("SAVING_EMBEDDINGS_DIRECTORY")
-load_embeddings_file_name: str = os.getenv("SAVING_EMBEDDINGS_FILE_NAME")
+    def names(self) -> List[str]:
+        """Return the names of the documents, in the order of their rows."""
+        return list(self.documents or {})
 
-embeddings_path = os.path.join(
-    load_embeddings_directory, load_embeddings_file_name + ".pkl"
-)
+    def chunk_ids(self, document_name: str) -> np.ndarray:
+        """Return the ids of the chunks of a document, in the order of their rows."""
+        start, count = self.documents[document_name]
+        return self.ids[start : start + count]
+
+    def row_of(self, chunk_id: str) -> int | None:
+        """Return the row of the embedding of a chunk, or None if the chunk has no embedding."""
+        if self._rows_by_id is None:
+            self._rows_by_id = {
+                chunk_id.decode("ascii"): row for row, chunk_id in enumerate(self.ids)
+            }
+        return self._rows_by_id.get(chunk_id)
 
 
 def load_embeddings(
-    embeddings_path: str = embeddings_path,
-) -> Embeddings:
+    embeddings_path: str | None = None,
+) -> EmbeddingMatrix:
+    """
+    Loads embeddings from the specified path, memory mapping the float32 matrix.
+
+    Falls back to the ".pkl" file pickled by older versions if there is no ".npy" file.
+
+    Args:
+        - embeddings_path (str | None): Path to the embeddings, without the file extension, the one set in the .env file if None.
+
+    Returns:
+        - EmbeddingMatrix: Loaded embeddings.
+    """
+
+    if embeddings_path is None:
+        embeddings_path = default_embeddings_path()
+
+    if not os.path.exists(embeddings_path + ".npy"):
+        return _load_pickled_embeddings(embeddings_path + ".pkl")
+
+    with open(embeddings_path + ".json", "r") as f:
+        header = json.load(f)
+
+    matrix = np.load(embeddings_path + ".npy", mmap_mode="r")
+
+    if matrix.dtype != np.float32 or matrix.shape != (
+        header["count"],
+        header["dimension"],
+    ):
+        raise ValueError(
+            f"The embeddings matrix {embeddings_path}.npy doesn't match its header"
+        )
+
+    documents = {
+        document["name"]: (document["start"], document["count"])
+        for document in header["documents"]
+    }
+
+    ids = None
+    if os.path.exists(embeddings_path + ".ids.npy"):
+        ids = np.load(embeddings_path + ".ids.npy")
+
+    return EmbeddingMatrix(
+        matrix=matrix, documents=documents, model_id=header["model_id"], ids=ids
+    )
+
+
+def _load_pickled_embeddings(pickle_path: str) -> EmbeddingMatrix:
+    """Load embeddings pickled by older versions, as a dictionary by document name or as a single list."""
+
+    with open(pickle_path, "rb") as f:
+        embeddings = pickle.load(f)
+
+    documents = None
+    rows = embeddings
+    if isinstance(embeddings, dict):
+        documents = {}
+        rows = []
+        for document_name, document_embeddings in embeddings.items():
+            documents[document_name] = (len(rows), len(document_embeddings))
+            rows.extend(document_embeddings)
+
+    matrix = np.asarray(rows, dtype=np.float32)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(0, 0)
+
+    return EmbeddingMatrix(matrix=matrix, documents=documents)
+
+
+def embeddings_exist(embeddings_path: str | None = None) -> bool:
     """
-    Loads embeddings from the specified file path using pickle.
+    Check whether embeddings were saved at the specified path, in the current or the pickled format.
 
     Args:
-        - embeddings_path (str): Path to file containing embeddings.
+        - embeddings_path (str | None): Path to the embeddings, without the file extension, the one set in the .env file if None.
 
     Returns:
-        - Embeddings: Loaded embeddings.
+        - bool: True if embeddings were saved.
     """
 
-    with open(embeddings_path, "rb") as f:
-        embeddings: Embeddings = pickle.load(f)
+    if embeddings_path is None:
+        embeddings_path = default_embeddings_path()
 
-    return embeddings
+    return os.path.exists(embeddings_path + ".npy") or os.path.exists(
+        embeddings_path + ".pkl"
+    )
@@ -12,37 +12,69 @@
         creates the directory if it doesn't exist, 
         creates the file path, and 
         saves the FAISS index to the file.
+
+    The type and parameters of the index are saved next to it (in "index_config.json"), so they can be restored when it is loaded.
+
+    The lexical index of the chunks (see step_3_lexical_index) is built again from the docstore and saved in the same folder,
+    so the FAISS index and the lexical index are always swapped in together.
+
+    The vectorstore is saved to a temporary folder first and swapped in, so a process watching the saved vectorstore
+    (such as the query server) never loads a half written one.
 """
 
 import os
+import shutil
+import sys
 from langchain.vectorstores.faiss import FAISS
 
 
-from dotenv import load_dotenv
-
-load_dotenv()  # Load environment variables from .env file
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.step_3_index_types import describe_index, save_index_config
+from HELPERS.step_3_lexical_index import LexicalIndex
 
 
 def save_vectorstore(
     vectorstore: FAISS,
-    directory_path: str = os.getenv("SAVING_VECTORSTORE_DIRECTORY"),
-    file_name: str = os.getenv("SAVING_VECTORSTORE_FILE_NAME"),
+    directory_path: str | None = None,
+    file_name: str | None = None,
+    model_id: str | None = None,
 ) -> None:
     """
     Saves a FAISS index as a file at the specified directory path and file name.
 
     Args:
         - vectorstore (FAISS): FAISS index to be saved.
-        - directory_path (str): Path to directory where file will be saved.
-        - file_name (str): Name of file to be saved.
+        - directory_path (str | None): Path to directory where file will be saved, SAVING_VECTORSTORE_DIRECTORY in the .env file if None.
+        - file_name (str | None): Name of file to be saved, SAVING_VECTORSTORE_FILE_NAME in the .env file if None.
+        - model_id (str | None): The id of the embeddings model, saved with the parameters of the index.
 
     Returns:
         - None
     """
 
+    if directory_path is None:
+        directory_path = os.getenv("SAVING_VECTORSTORE_DIRECTORY")
+    if file_name is None:
+        file_name = os.getenv("SAVING_VECTORSTORE_FILE_NAME")
+
     directory = os.path.join(os.getcwd(), directory_path)
     if not os.path.exists(directory):
         os.makedirs(directory)
     file_path = os.path.join(directory, file_name + ".faiss")
 
-    vectorstore.save_local(file_path)
+    # Save to a temporary folder and swap it in
+    shutil.rmtree(file_path + ".tmp", ignore_errors=True)
+    vectorstore.save_local(file_path + ".tmp")
+    save_index_config(
+        folder_path=file_path + ".tmp",
+        index_config={**describe_index(vectorstore.index), "model_id": model_id},
+    )
+    vectorstore.lexical_index = LexicalIndex.from_vectorstore(vectorstore)
+    vectorstore.lexical_index.save(folder_path=file_path + ".tmp")
+
+    if os.path.exists(file_path):
+        shutil.rmtree(file_path + ".old", ignore_errors=True)
+        os.replace(file_path, file_path + ".old")
+    os.replace(file_path + ".tmp", file_path)
+    shutil.rmtree(file_path + ".old", ignore_errors=True)
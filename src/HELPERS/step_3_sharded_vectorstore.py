@@ -0,0 +1,115 @@
+"""
+    This code defines the layout of the sharded vectorstore, which splits the chunks of the corpus across several vectorstores.
+
+    A sharded vectorstore is a ".shards" folder next to where the ".faiss" folder of the unsharded vectorstore would be,
+    holding one vectorstore per shard ("shard_000.faiss", "shard_001.faiss", ...), each a regular vectorstore folder
+    with its own FAISS index, docstore and index parameters, and the shard manifest ("shards.json") describing the layout:
+        "shard_count" and "shard_by": the number of shards and how the documents were assigned to them,
+        "model_id" and "index_type": the embeddings model and the index type the shards were built with, and
+        "shards": for each shard, its name, the names of its documents and its number of chunks.
+
+    All the chunks of a document are in the same shard. The documents are assigned to VECTORSTORE_SHARDS shards
+    (in the .env file) according to VECTORSTORE_SHARD_BY:
+        "document_hash" puts each document in the shard given by the hash of its name, so a document stays in its shard
+        when other documents are added or removed, and only the shards of the changed documents are built again, and
+        "size" balances the number of chunks of the shards, putting the largest documents first in the smallest shard.
+
+    The shard manifest is written last, when every shard is saved, and swapped in, so a process watching it
+    (such as the query server) only loads complete layouts.
+"""
+
+import hashlib
+import heapq
+import json
+import os
+from typing import Any, Dict, List
+
+SHARD_BY = ("document_hash", "size")
+
+# Name of the file describing the layout of the shards, in the ".shards" folder
+SHARD_MANIFEST_FILE_NAME = "shards.json"
+
+
+def shards_path(path_to_vectorstore: str) -> str:
+    """Return the path to the ".shards" folder of a vectorstore, from the path to its ".faiss" folder."""
+    return os.path.splitext(path_to_vectorstore)[0] + ".shards"
+
+
+def shard_name(shard: int) -> str:
+    """Return the name of the vectorstore of a shard, its folder being this name followed by ".faiss"."""
+    return f"shard_{shard:03d}"
+
+
+def shard_of(document_name: str, shard_count: int) -> int:
+    """Return the shard of a document, from the hash of its name."""
+    digest = hashlib.sha1(document_name.encode("utf-8")).hexdigest()
+
+    return int(digest[:8], 16) % shard_count
+
+
+def assign_shards(
+    document_sizes: Dict[str, int],
+    shard_count: int | None = None,
+    shard_by: str | None = None,
+) -> List[List[str]]:
+    """
+    Assign the documents to the shards.
+
+    Args:
+        - document_sizes (Dict[str, int]): The number of chunks of each document, by name.
+        - shard_count (int | None): The number of shards, VECTORSTORE_SHARDS in the .env file if None.
+        - shard_by (str | None): "document_hash" or "size", how the documents are assigned to the shards, VECTORSTORE_SHARD_BY in the .env file if None.
+
+    Returns:
+        - List[List[str]]: The names of the documents of each shard, in the order of document_sizes.
+    """
+
+    if shard_count is None:
+        shard_count = int(os.getenv("VECTORSTORE_SHARDS", "1"))
+    if shard_by is None:
+        shard_by = os.getenv("VECTORSTORE_SHARD_BY", "document_hash")
+
+    if shard_count < 1:
+        raise ValueError(f"The number of shards must be at least 1, got {shard_count}")
+    if shard_by not in SHARD_BY:
+        raise ValueError(f"Unknown shard assignment {shard_by}, expected one of {SHARD_BY}")
+
+    if shard_by == "document_hash":
+        shard_of_document = {
+            document_name: shard_of(document_name, shard_count)
+            for document_name in document_sizes
+        }
+    else:
+        # The largest documents first, each one in the shard with the fewest chunks so far
+        shard_sizes = [(0, shard) for shard in range(shard_count)]
+        shard_of_document = {}
+        for document_name in sorted(
+            document_sizes, key=lambda document_name: -document_sizes[document_name]
+        ):
+            size, shard = heapq.heappop(shard_sizes)
+            shard_of_document[document_name] = shard
+            heapq.heappush(shard_sizes, (size + document_sizes[document_name], shard))
+
+    shards: List[List[str]] = [[] for _ in range(shard_count)]
+    for document_name in document_sizes:
+        shards[shard_of_document[document_name]].append(document_name)
+
+    return shards
+
+
+def save_shard_manifest(folder_path: str, shard_manifest: Dict[str, Any]) -> None:
+    """Save the shard manifest in the ".shards" folder, writing to a temporary file first and swapping it in."""
+    path = os.path.join(folder_path, SHARD_MANIFEST_FILE_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(shard_manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def load_shard_manifest(folder_path: str) -> Dict[str, Any] | None:
+    """Load the shard manifest from the ".shards" folder, None if the vectorstore isn't sharded."""
+    path = os.path.join(folder_path, SHARD_MANIFEST_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as f:
+        return json.load(f)
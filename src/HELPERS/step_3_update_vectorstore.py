@@ -0,0 +1,65 @@
+"""
+    This code defines a function called remove_documents_from_vectorstore that removes the vectors of documents
+    from a saved FAISS vectorstore, so the vectorstore can be updated without being rebuilt from scratch.
+
+    Every chunk added to the vectorstore by STEP 3 carries the name of its document in the "source" metadata field.
+
+    The function:
+        finds the positions of the chunks whose document should not be kept,
+        removes them from the FAISS index and the docstore, and
+        renumbers the index_to_docstore_id mapping to match the compacted index.
+"""
+
+from typing import Set
+
+import numpy as np
+from langchain.vectorstores.faiss import FAISS
+
+
+def remove_documents_from_vectorstore(
+    vectorstore: FAISS,
+    keep_document_names: Set[str],
+) -> int:
+    """
+    Removes from the vectorstore every chunk whose document is not in keep_document_names.
+
+    Chunks without a "source" metadata field (vectorstores built by older versions) are removed too.
+
+    Args:
+        - vectorstore (FAISS): The vectorstore to update in place.
+        - keep_document_names (Set[str]): The names of the documents whose chunks are kept.
+
+    Returns:
+        - int: The number of chunks removed.
+    """
+
+    index_to_docstore_id = vectorstore.index_to_docstore_id
+
+    removed_positions = [
+        position
+        for position, docstore_id in index_to_docstore_id.items()
+        if vectorstore.docstore.search(docstore_id).metadata.get("source")
+        not in keep_document_names
+    ]
+
+    if not removed_positions:
+        return 0
+
+    # Remove the vectors, the index is compacted and keeps the order of the remaining vectors
+    vectorstore.index.remove_ids(np.array(removed_positions, dtype=np.int64))
+
+    # Remove the documents, the in memory docstore has no delete method
+    removed_set = set(removed_positions)
+    for position in removed_positions:
+        del vectorstore.docstore._dict[index_to_docstore_id[position]]
+
+    # Renumber the remaining positions to match the compacted index
+    kept_positions = [
+        position for position in sorted(index_to_docstore_id) if position not in removed_set
+    ]
+    vectorstore.index_to_docstore_id = {
+        new_position: index_to_docstore_id[old_position]
+        for new_position, old_position in enumerate(kept_positions)
+    }
+
+    return len(removed_positions)
@@ -7,42 +7,161 @@
     
     The function returns a list of documents that are most similar to the query.
 
-    The function first loads the environment variables from the .env file using the load_dotenv() method. 
-    
-    It then sets the values of two variables named saving_vectorstore_file_name and saving_vectorstore_directory to the values of the environment variables with the same names. 
-    
-    It then creates a variable named vectorstore_path which is set to the path of the vectorstore file.
+    When path_to_vectorstore is not given, the path of the vectorstore file is built by default_vectorstore_path()
+    from the environment variables SAVING_VECTORSTORE_DIRECTORY and SAVING_VECTORSTORE_FILE_NAME.
 
-    The function then loads an object of type HuggingFaceHubEmbeddings using the HuggingFaceHubEmbeddings() method. 
+    The function then loads the embeddings backend chosen in the .env file, wrapped in the persistent embeddings cache, using the load_cached_embeddings() method. 
     
     It then loads a FAISS vectorstore using the FAISS.load_local() method. 
     
     The function then finds the most similar documents to the query using the faiss.similarity_search()
+
+    The search parameters of the index saved with the vectorstore (nprobe for the IVF indexes, efSearch for the HNSW index)
+    are restored when it is loaded, and can be overridden with the search_params argument of load_vectorstore.
+
+    The vectorstore can be loaded once with load_vectorstore and passed to the function, so a long-lived process
+    (such as the query server) doesn't load it from disk for every query.
+
+    Both functions take an optional metadata_filter, restricting the search to the chunks whose metadata match it
+    (their documents, pages, tags or ingest time), found in the inverted index of step_4A_metadata_index before the vectors are compared.
+
+    The function create_similarity_search_docs_batch searches for many queries at once:
+    the queries are embedded in batches of batch_size queries, and each batch is searched with a single FAISS search
+    over the matrix of its query embeddings, instead of one embedding call and one search per query.
+
+    When STEP 3 saved a sharded vectorstore (a ".shards" folder next to the vectorstore path, see step_3_sharded_vectorstore),
+    load_vectorstore loads all its shards into a ShardedVectorstore, which both functions search like a single vectorstore.
+    When VECTORSTORE_SHARD_URLS (in the .env file) lists the urls of shard servers, the shards are searched over HTTP instead
+    (see step_4A_sharded_search).
+
+    Both functions search the vectorstore with the hybrid search of step_4A_hybrid_search: the lexical index of the chunks
+    (BM25, see step_3_lexical_index) is searched at the same time as the FAISS index, and the two rankings are fused,
+    unless SEARCH_MODE (in the .env file) is "vector". load_vectorstore loads the lexical index saved with the vectorstore.
+
+    Both functions write the queries, the chunks retrieved, their scores and the time of each stage to the query log
+    (see step_4_query_log), when QUERY_LOG_FILE_PATH is set in the .env file.
 """
 
 import os
-from typing import List
-from dotenv import load_dotenv
+import sys
+from typing import Any, Dict, List, Tuple
 
-from langchain.embeddings import HuggingFaceHubEmbeddings
 from langchain import FAISS
+from langchain.embeddings.base import Embeddings
 
 from langchain.schema import Document
 
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.embeddings_cache import load_cached_embeddings
+from HELPERS.instrumentation import METRICS
+from HELPERS.step_3_index_types import apply_search_params, load_index_config
+from HELPERS.step_3_lexical_index import LexicalIndex, lexical_index_of
+from HELPERS.step_3_sharded_vectorstore import load_shard_manifest, shards_path
+from HELPERS.step_4A_hybrid_search import hybrid_search
+from HELPERS.step_4A_metadata_index import metadata_index_of
+from HELPERS.step_4A_sharded_search import (
+    RemoteShard,
+    ShardedVectorstore,
+    shard_urls_from_env,
+)
+from HELPERS.step_4_query_log import logged_queries, serialize_results
 
-load_dotenv()  # Load environment variables from .env file
 
-saving_vectorstore_file_name: str = os.getenv("SAVING_VECTORSTORE_FILE_NAME")
-saving_vectorstore_directory: str = os.getenv("SAVING_VECTORSTORE_DIRECTORY")
-vectorstore_path = os.path.join(
-    saving_vectorstore_directory, saving_vectorstore_file_name + ".faiss"
-)
+def default_vectorstore_path() -> str:
+    """The path to the vectorstore saved by STEP 3, as set in the .env file."""
+    return os.path.join(
+        os.getenv("SAVING_VECTORSTORE_DIRECTORY"),
+        os.getenv("SAVING_VECTORSTORE_FILE_NAME") + ".faiss",
+    )
+
 
+def load_vectorstore(
+    huggingfacehub_api_token: str | None = None,
+    path_to_vectorstore: str | None = None,
+    embeddings: Embeddings | None = None,
+    search_params: Dict[str, Any] | None = None,
+    build_metadata_index: bool = False,
+    shard_urls: List[str] | None = None,
+) -> FAISS | ShardedVectorstore:
+    """
+    Load the FAISS vectorstore, with the search parameters of its index, or all the shards of a sharded vectorstore.
+
+    Parameters:
+        - huggingfacehub_api_token (str | None): The Hugging Face Hub API token.
+        - path_to_vectorstore (str | None): The path to the vectorstore file, the one set in the .env file if None.
+        - embeddings (Embeddings | None): The embeddings used to embed the queries, if None the ones of the vectorstore when it is given,
+            or the embeddings backend chosen in the .env file (EMBEDDINGS_BACKEND) behind the embeddings cache when it is loaded.
+        - search_params (Dict[str, Any] | None): The search parameters overriding the saved ones ("nprobe" or "ef_search").
+        - build_metadata_index (bool): Whether to build the inverted indexes of the metadata (and the lexical index, if it wasn't saved)
+            now rather than at the first search.
+        - shard_urls (List[str] | None): The urls of the shard servers to search, VECTORSTORE_SHARD_URLS in the .env file if None.
+
+    Returns:
+        - FAISS | ShardedVectorstore: The vectorstore, a ShardedVectorstore if it is sharded.
+    """
+
+    # Load the embeddings backend chosen in the .env file, behind the embeddings cache
+    if embeddings is None:
+        embeddings = load_cached_embeddings(
+            huggingfacehub_api_token=huggingfacehub_api_token
+        )
+
+    # The shards served by shard servers
+    if shard_urls is None:
+        shard_urls = shard_urls_from_env()
+    if shard_urls:
+        return ShardedVectorstore(
+            shards=[RemoteShard(url=url) for url in shard_urls], embeddings=embeddings
+        )
+
+    if path_to_vectorstore is None:
+        path_to_vectorstore = default_vectorstore_path()
+
+    # The shards saved by STEP 3, each one loaded like an unsharded vectorstore
+    folder_path = shards_path(path_to_vectorstore)
+    shard_manifest = load_shard_manifest(folder_path)
+    if shard_manifest is not None:
+        return ShardedVectorstore(
+            shards=[
+                load_vectorstore(
+                    path_to_vectorstore=os.path.join(folder_path, shard["name"] + ".faiss"),
+                    embeddings=embeddings,
+                    search_params=search_params,
+                    build_metadata_index=build_metadata_index,
+                    shard_urls=[],
+                )
+                for shard in shard_manifest["shards"]
+            ],
+            embeddings=embeddings,
+        )
+
+    faiss = FAISS.load_local(folder_path=path_to_vectorstore, embeddings=embeddings)
 
+    # Restore the search parameters of the index
+    index_config = load_index_config(folder_path=path_to_vectorstore)
+    if index_config is not None:
+        apply_search_params(
+            index=faiss.index, index_config={**index_config, **(search_params or {})}
+        )
+
+    # The lexical index saved with the vectorstore, memory mapped
+    faiss.lexical_index = LexicalIndex.load(folder_path=path_to_vectorstore)
+
+    if build_metadata_index:
+        metadata_index_of(faiss)
+        lexical_index_of(faiss)
+
+    return faiss
+
+
+@METRICS.timed("similarity_search")
 def create_similarity_search_docs(
     query: str,
     huggingfacehub_api_token: str | None = None,
-    path_to_vectorstore: str = vectorstore_path,
+    path_to_vectorstore: str | None = None,
+    vectorstore: FAISS | ShardedVectorstore | None = None,
+    metadata_filter: Dict[str, Any] | None = None,
 ) -> List[Document]:
     """
     This function takes in three arguments: query, huggingfacehub_api_token, and path_to_vectorstore.
@@ -51,21 +170,114 @@ def create_similarity_search_docs(
     Parameters:
         - query (str): The query string.
         - huggingfacehub_api_token (str | None): The Hugging Face Hub API token.
-        - path_to_vectorstore (str): The path to the vectorstore file.
+        - path_to_vectorstore (str | None): The path to the vectorstore file, the one set in the .env file if None.
+        - vectorstore (FAISS | ShardedVectorstore | None): The vectorstore to search, loaded from path_to_vectorstore if None.
+        - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the documents must match, see step_4A_metadata_index.
 
     Returns:
         - List[Document]: A list of documents that are most similar to the query.
     """
 
-    # Load the HuggingFaceHubEmbeddings object
-    embeddings = HuggingFaceHubEmbeddings(
-        huggingfacehub_api_token=huggingfacehub_api_token
-    )
-
     # Load the FAISS vectorstore
-    faiss = FAISS.load_local(folder_path=path_to_vectorstore, embeddings=embeddings)
+    faiss = vectorstore
+    if faiss is None:
+        faiss = load_vectorstore(
+            huggingfacehub_api_token=huggingfacehub_api_token,
+            path_to_vectorstore=path_to_vectorstore,
+        )
 
     # Find the most similar documents to the query
-    answer_docs = faiss.similarity_search(query, k=4)
+    with logged_queries(
+        kind="search", queries=[query], k=4, metadata_filter=metadata_filter
+    ) as record:
+        _, [docs_and_scores] = hybrid_search(
+            vectorstore=faiss,
+            queries=[query],
+            embed_queries=lambda queries: [faiss.embedding_function(text) for text in queries],
+            k=4,
+            metadata_filter=metadata_filter,
+        )
+        record["results"] = [serialize_results(docs_and_scores)]
+    answer_docs = [doc for doc, _ in docs_and_scores]
 
     return answer_docs
+
+
+@METRICS.timed("similarity_search_batch")
+def create_similarity_search_docs_batch(
+    queries: List[str],
+    huggingfacehub_api_token: str | None = None,
+    path_to_vectorstore: str | None = None,
+    vectorstore: FAISS | ShardedVectorstore | None = None,
+    embeddings: Embeddings | None = None,
+    k: int = 4,
+    batch_size: int | None = None,
+    metadata_filter: Dict[str, Any] | None = None,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    Find the documents most similar to each query of a list, embedding and searching the queries in batches.
+
+    Parameters:
+        - queries (List[str]): The query strings.
+        - huggingfacehub_api_token (str | None): The Hugging Face Hub API token.
+        - path_to_vectorstore (str | None): The path to the vectorstore file, the one set in the .env file if None.
+        - vectorstore (FAISS | ShardedVectorstore | None): The vectorstore to search, loaded from path_to_vectorstore if None.
+        - embeddings (Embeddings | None): The embeddings used to embed the queries, if None the ones of the vectorstore when it is given,
+            or the embeddings backend chosen in the .env file (EMBEDDINGS_BACKEND) behind the embeddings cache when it is loaded.
+        - k (int): The number of documents returned for each query.
+        - batch_size (int | None): The number of queries embedded and searched together, SIMILARITY_SEARCH_BATCH_SIZE in the .env file if None.
+        - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the documents must match, see step_4A_metadata_index.
+
+    Returns:
+        - List[List[Tuple[Document, float]]]: For each query, the most similar documents and their scores, best first
+            (their distances to the query when SEARCH_MODE is "vector").
+    """
+
+    if batch_size is None:
+        batch_size = int(os.getenv("SIMILARITY_SEARCH_BATCH_SIZE", "256"))
+
+    # Load the FAISS vectorstore, with the embeddings backend chosen in the .env file behind the embeddings cache
+    faiss = vectorstore
+    if faiss is None:
+        if embeddings is None:
+            embeddings = load_cached_embeddings(
+                huggingfacehub_api_token=huggingfacehub_api_token
+            )
+        faiss = load_vectorstore(
+            path_to_vectorstore=path_to_vectorstore, embeddings=embeddings
+        )
+
+    # Otherwise reuse the embeddings the vectorstore embeds its queries with
+    if embeddings is None:
+        embeddings = getattr(faiss.embedding_function, "__self__", None)
+
+    # Embed the queries of a batch together
+    if hasattr(embeddings, "embed_queries"):
+        embed_queries = embeddings.embed_queries
+    elif embeddings is not None:
+        embed_queries = embeddings.embed_documents
+    else:
+        embed_queries = lambda queries: [faiss.embedding_function(text) for text in queries]
+
+    results: List[List[Tuple[Document, float]]] = []
+
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start : start + batch_size]
+
+        # Search the whole batch at once
+        with logged_queries(
+            kind="search_batch", queries=batch, k=k, metadata_filter=metadata_filter
+        ) as record:
+            _, batch_results = hybrid_search(
+                vectorstore=faiss,
+                queries=batch,
+                embed_queries=embed_queries,
+                k=k,
+                metadata_filter=metadata_filter,
+            )
+            record["results"] = [
+                serialize_results(docs_and_scores) for docs_and_scores in batch_results
+            ]
+        results.extend(batch_results)
+
+    return results
@@ -0,0 +1,177 @@
+"""
+    This code defines the hybrid search: every query is searched both by its meaning, in the FAISS index,
+    and by its words, in the lexical index of step_3_lexical_index, and the two rankings are fused into one.
+
+    The similarity of the embeddings finds the chunks saying the same thing in other words, but misses exact terms
+    the embeddings model doesn't know (part numbers, error codes, names), which BM25 finds by their words.
+
+    The two searches run at the same time: the lexical search runs in a thread of the hybrid search pool
+    while the query is embedded and the FAISS index is searched, so the lexical side adds almost nothing to the latency of a query.
+    Each side returns its best candidates (at least k) chunks, and they are fused by reciprocal rank fusion:
+    a chunk scores 1 / (rrf_k + rank) in each ranking it appears in (rank 1 being the best), and the k chunks with the best
+    total score are returned, with that score. RRF only uses the ranks, so the BM25 scores and the L2 distances don't need
+    to be put on the same scale.
+
+    The search mode is set in the .env file (SEARCH_MODE):
+        "hybrid" (the default) fuses the lexical and the vector searches, the scores returned are RRF scores (higher is better), and
+        "vector" only searches the FAISS index, the scores returned are distances (lower is better), like before.
+"""
+
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+from langchain import FAISS
+from langchain.schema import Document
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+from HELPERS.step_4A_sharded_search import (
+    ShardedVectorstore,
+    search_lexical,
+    search_vectors,
+)
+
+SEARCH_MODES = ("vector", "hybrid")
+
+# The threads running the lexical searches, next to the vector searches of the threads answering the queries
+_hybrid_pool: ThreadPoolExecutor | None = None
+_hybrid_pool_lock = threading.Lock()
+
+
+def _get_hybrid_pool(
+    max_workers: int | None = None
+) -> ThreadPoolExecutor:
+    global _hybrid_pool
+    with _hybrid_pool_lock:
+        if _hybrid_pool is None:
+            if max_workers is None:
+                max_workers = int(os.getenv("HYBRID_SEARCH_MAX_WORKERS", "8"))
+            _hybrid_pool = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="lexical_search"
+            )
+    return _hybrid_pool
+
+
+def _document_key(doc: Document) -> Any:
+    """Identify a chunk in both rankings, by its stable id (by its document and text for the chunks saved without one)."""
+    chunk_id = doc.metadata.get("chunk_id")
+    if chunk_id is not None:
+        return chunk_id
+    return (doc.metadata.get("source"), doc.page_content)
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Tuple[Document, float]]],
+    k: int = 4,
+    rrf_k: int | None = None,
+) -> List[Tuple[Document, float]]:
+    """
+    Fuse several rankings of chunks with reciprocal rank fusion.
+
+    Args:
+        - rankings (List[List[Tuple[Document, float]]]): The rankings, each one best first, their scores are ignored.
+        - k (int): The number of chunks returned.
+        - rrf_k (int | None): The constant added to the ranks, the higher it is the less the first ranks weigh, HYBRID_SEARCH_RRF_K in the .env file if None.
+
+    Returns:
+        - List[Tuple[Document, float]]: The chunks with the best fused scores and their scores, best first.
+    """
+
+    if rrf_k is None:
+        rrf_k = int(os.getenv("HYBRID_SEARCH_RRF_K", "60"))
+
+    docs: Dict[Any, Document] = {}
+    scores: Dict[Any, float] = {}
+    for ranking in rankings:
+        for rank, (doc, _) in enumerate(ranking, start=1):
+            key = _document_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+
+    # sorted is stable, the ties keep the order of the first ranking
+    best = sorted(scores, key=lambda key: scores[key], reverse=True)[:k]
+
+    return [(docs[key], scores[key]) for key in best]
+
+
+def hybrid_search(
+    vectorstore: FAISS | ShardedVectorstore,
+    queries: List[str],
+    embed_queries: Callable[[List[str]], List[List[float]]],
+    k: int = 4,
+    metadata_filter: Dict[str, Any] | None = None,
+    search_mode: str | None = None,
+    candidates: int | None = None,
+) -> Tuple[np.ndarray, List[List[Tuple[Document, float]]]]:
+    """
+    Find the best chunks for each query, by fusing the lexical and the vector searches or with the vector search only.
+
+    Args:
+        - vectorstore (FAISS | ShardedVectorstore): The vectorstore to search.
+        - queries (List[str]): The query strings.
+        - embed_queries (Callable[[List[str]], List[List[float]]]): The function embedding the queries.
+        - k (int): The number of chunks returned for each query.
+        - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+        - search_mode (str | None): "hybrid" or "vector", SEARCH_MODE in the .env file if None.
+        - candidates (int | None): The number of chunks taken from each search before they are fused (at least k), HYBRID_SEARCH_CANDIDATES in the .env file if None.
+
+    Returns:
+        - Tuple[np.ndarray, List[List[Tuple[Document, float]]]]: The embeddings of the queries, one per row,
+            and for each query the best chunks and their scores (RRF scores in hybrid mode, distances in vector mode), best first.
+    """
+
+    if search_mode is None:
+        search_mode = os.getenv("SEARCH_MODE", "hybrid")
+    if candidates is None:
+        candidates = int(os.getenv("HYBRID_SEARCH_CANDIDATES", "20"))
+
+    if search_mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode {search_mode}, expected one of {SEARCH_MODES}")
+
+    if search_mode == "vector":
+        with METRICS.timer("embed_queries"):
+            query_embeddings = np.asarray(embed_queries(queries), dtype=np.float32)
+        with METRICS.timer("vector_search"):
+            return query_embeddings, search_vectors(
+                vectorstore=vectorstore,
+                query_embeddings=query_embeddings,
+                k=k,
+                metadata_filter=metadata_filter,
+            )
+
+    candidates = max(candidates, k)
+
+    with METRICS.timer("hybrid_search"):
+        # The lexical search runs while the queries are embedded and the FAISS index is searched
+        lexical_future = _get_hybrid_pool().submit(
+            search_lexical,
+            vectorstore=vectorstore,
+            queries=queries,
+            k=candidates,
+            metadata_filter=metadata_filter,
+        )
+        with METRICS.timer("embed_queries"):
+            query_embeddings = np.asarray(embed_queries(queries), dtype=np.float32)
+        with METRICS.timer("vector_search"):
+            vector_results = search_vectors(
+                vectorstore=vectorstore,
+                query_embeddings=query_embeddings,
+                k=candidates,
+                metadata_filter=metadata_filter,
+            )
+        # The time the lexical search adds, once the vector search is done
+        with METRICS.timer("lexical_search_wait"):
+            lexical_results = lexical_future.result()
+
+        results = [
+            reciprocal_rank_fusion(rankings=[vector_ranking, lexical_ranking], k=k)
+            for vector_ranking, lexical_ranking in zip(vector_results, lexical_results)
+        ]
+    METRICS.increment("hybrid_searches", len(queries))
+
+    return query_embeddings, results
@@ -0,0 +1,305 @@
+"""
+    This code defines the filtered search of the vectorstore: the search for the chunks most similar to a query
+    among the chunks whose metadata match a filter, such as the chunks of some documents, pages or tags.
+
+    Every chunk of the vectorstore carries the metadata of its document in its docstore entry:
+        "source": the name of its document,
+        "page": the number of its page (None for the documents that aren't pdf files),
+        "chunk_index" and "chunk_id": its position in its document and its stable id,
+        "ingested_at": when its document was ingested, as a Unix timestamp, and
+        "tags": the custom tags of its document.
+
+    The MetadataIndex is an inverted index over these metadata: for each value of the "source", "page" and "tags" fields,
+    the sorted positions of the chunks having it in the FAISS index, and the positions of the chunks sorted by "ingested_at".
+    A filter is a dictionary of conditions, all of which must match:
+        {"source": "handbook"} or {"source": ["handbook", "policies"]} keeps the chunks of one of the documents,
+        {"page": [1, 2]} keeps the chunks of one of the pages,
+        {"tags": ["hr", "finance"]} keeps the chunks having one of the tags, and
+        {"ingested_at": {"min": ..., "max": ...}} keeps the chunks ingested between two times (both bounds are optional).
+
+    The positions of the matching chunks are found in the inverted index before any vector is compared, then:
+        when there are at most exact_max_candidates of them, their vectors are read from the index and compared
+        to the query exactly, so a filtered search costs in proportion to the number of matching chunks, and
+        when there are more of them, the index is searched with an IDSelectorBatch restricting it to those chunks.
+
+    The MetadataIndex of a vectorstore is built the first time it is filtered (or when it is loaded, for the query server)
+    and built again when the number of chunks of the vectorstore changes.
+"""
+
+import os
+import sys
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from langchain.schema import Document
+from langchain.vectorstores.faiss import FAISS, dependable_faiss_import
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+
+# The metadata fields a filter can match by value, and the one it can match by range
+VALUE_FIELDS = ("source", "page", "tags")
+RANGE_FIELDS = ("ingested_at",)
+FILTER_FIELDS = VALUE_FIELDS + RANGE_FIELDS
+
+
+def validate_metadata_filter(metadata_filter: Dict[str, Any]) -> None:
+    """
+    Check that a filter only has conditions the MetadataIndex can match.
+
+    Args:
+        - metadata_filter (Dict[str, Any]): The filter.
+
+    Returns:
+        - None
+    """
+
+    if not isinstance(metadata_filter, dict):
+        raise ValueError("The filter should be a dictionary of conditions on the metadata")
+
+    for field, condition in metadata_filter.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(
+                f"Unknown filter field {field}, expected one of {FILTER_FIELDS}"
+            )
+        if field in RANGE_FIELDS and (
+            not isinstance(condition, dict) or not set(condition) <= {"min", "max"}
+        ):
+            raise ValueError(
+                f'The {field} filter should be a dictionary with "min" and/or "max"'
+            )
+        if field in VALUE_FIELDS and not all(
+            isinstance(value, (str, int, float)) or value is None
+            for value in (condition if isinstance(condition, list) else [condition])
+        ):
+            raise ValueError(f"The {field} filter should be a value or a list of values")
+
+
+class MetadataIndex:
+    """
+    Inverted index from the metadata of the chunks of a vectorstore to their positions in its FAISS index.
+
+    Args:
+        - vectorstore (FAISS): The vectorstore to index.
+    """
+
+    def __init__(self, vectorstore: FAISS) -> None:
+        self.count = len(vectorstore.index_to_docstore_id)
+
+        postings: Dict[str, Dict[Any, List[int]]] = {field: {} for field in VALUE_FIELDS}
+        ingested_at = np.full(self.count, np.nan)
+
+        with METRICS.timer("build_metadata_index"):
+            for position, docstore_id in sorted(vectorstore.index_to_docstore_id.items()):
+                metadata = vectorstore.docstore.search(docstore_id).metadata
+                postings["source"].setdefault(metadata.get("source"), []).append(position)
+                postings["page"].setdefault(metadata.get("page"), []).append(position)
+                for tag in metadata.get("tags") or []:
+                    postings["tags"].setdefault(tag, []).append(position)
+                if metadata.get("ingested_at") is not None:
+                    ingested_at[position] = metadata["ingested_at"]
+
+            # The positions were added in order, so each posting list is sorted
+            self.postings = {
+                field: {
+                    value: np.array(positions, dtype=np.int64)
+                    for value, positions in values.items()
+                }
+                for field, values in postings.items()
+            }
+
+            # The chunks without ingest time (NaN) are sorted last and never match a range
+            self._ingested_at_order = np.argsort(ingested_at, kind="stable")
+            self._sorted_ingested_at = ingested_at[self._ingested_at_order]
+
+    def values(self, field: str) -> List[Any]:
+        """Return the values of a field found in the vectorstore."""
+        return list(self.postings[field])
+
+    def _positions(self, field: str, condition: Any) -> np.ndarray:
+        """Return the sorted positions of the chunks matching a single condition."""
+        if field in RANGE_FIELDS:
+            start = np.searchsorted(
+                self._sorted_ingested_at, condition.get("min", -np.inf), side="left"
+            )
+            end = np.searchsorted(
+                self._sorted_ingested_at, condition.get("max", np.inf), side="right"
+            )
+            return np.sort(self._ingested_at_order[start:end]).astype(np.int64)
+
+        values = condition if isinstance(condition, list) else [condition]
+        posting_lists = [
+            self.postings[field][value]
+            for value in values
+            if value in self.postings[field]
+        ]
+        if not posting_lists:
+            return np.empty(0, dtype=np.int64)
+        if len(posting_lists) == 1:
+            return posting_lists[0]
+
+        return np.unique(np.concatenate(posting_lists))
+
+    def candidates(self, metadata_filter: Dict[str, Any]) -> np.ndarray | None:
+        """
+        Find the chunks matching a filter.
+
+        Args:
+            - metadata_filter (Dict[str, Any]): The filter, all its conditions must match.
+
+        Returns:
+            - np.ndarray | None: The sorted positions of the matching chunks, None if the filter has no conditions.
+        """
+
+        validate_metadata_filter(metadata_filter)
+        if not metadata_filter:
+            return None
+
+        # Intersect the smallest lists first, so each intersection is as cheap as possible
+        position_lists = sorted(
+            (self._positions(field, condition) for field, condition in metadata_filter.items()),
+            key=len,
+        )
+        candidates = position_lists[0]
+        for positions in position_lists[1:]:
+            if not len(candidates):
+                break
+            candidates = np.intersect1d(candidates, positions, assume_unique=True)
+
+        return candidates
+
+
+def metadata_index_of(vectorstore: FAISS) -> MetadataIndex:
+    """
+    Return the MetadataIndex of a vectorstore, building it if it doesn't exist or the vectorstore changed size.
+
+    Args:
+        - vectorstore (FAISS): The vectorstore.
+
+    Returns:
+        - MetadataIndex: The inverted index of the metadata of its chunks.
+    """
+
+    metadata_index = getattr(vectorstore, "metadata_index", None)
+    if metadata_index is None or metadata_index.count != len(vectorstore.index_to_docstore_id):
+        metadata_index = MetadataIndex(vectorstore)
+        vectorstore.metadata_index = metadata_index
+
+    return metadata_index
+
+
+def _reconstruct(index, positions: np.ndarray) -> np.ndarray:
+    """Read the vectors at some positions of the index (decoded for the ivf_pq index)."""
+    faiss = dependable_faiss_import()
+    downcast_index = faiss.downcast_index(index)
+    if isinstance(downcast_index, faiss.IndexIVF):
+        # The IVF indexes need a map from the positions to their lists, built once
+        if downcast_index.direct_map.type == faiss.DirectMap.NoMap:
+            downcast_index.make_direct_map()
+
+    return index.reconstruct_batch(positions)
+
+
+def _search_candidates_exactly(
+    index, query_embeddings: np.ndarray, candidates: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Compare the queries to the vectors of the candidates, returning the squared L2 distances like the FAISS index."""
+    vectors = _reconstruct(index, candidates)
+    distances = (
+        (query_embeddings**2).sum(axis=1)[:, None]
+        - 2 * query_embeddings @ vectors.T
+        + (vectors**2).sum(axis=1)[None, :]
+    )
+
+    # The k closest candidates of each query, closest first
+    k = min(k, len(candidates))
+    closest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    closest_distances = np.take_along_axis(distances, closest, axis=1)
+    order = np.argsort(closest_distances, axis=1)
+
+    return (
+        np.take_along_axis(closest_distances, order, axis=1),
+        candidates[np.take_along_axis(closest, order, axis=1)],
+    )
+
+
+def _search_with_selector(
+    index, query_embeddings: np.ndarray, candidates: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Search the index, restricted to the candidates, keeping its search parameters."""
+    faiss = dependable_faiss_import()
+    selector = faiss.IDSelectorBatch(candidates)
+    downcast_index = faiss.downcast_index(index)
+    if isinstance(downcast_index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=downcast_index.nprobe)
+    elif isinstance(downcast_index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(
+            sel=selector, efSearch=downcast_index.hnsw.efSearch
+        )
+    else:
+        params = faiss.SearchParameters(sel=selector)
+
+    return index.search(query_embeddings, k, params=params)
+
+
+def search_vectorstore(
+    vectorstore: FAISS,
+    query_embeddings: np.ndarray,
+    k: int = 4,
+    metadata_filter: Dict[str, Any] | None = None,
+    exact_max_candidates: int | None = None,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    Find the chunks most similar to each query, among the chunks matching the filter.
+
+    Args:
+        - vectorstore (FAISS): The vectorstore to search.
+        - query_embeddings (np.ndarray): The embeddings of the queries, one per row.
+        - k (int): The number of chunks returned for each query.
+        - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+        - exact_max_candidates (int | None): The largest number of matching chunks compared to the queries exactly,
+            more are searched through the index, restricted to them, FILTERED_SEARCH_EXACT_MAX_CANDIDATES in the .env file if None.
+
+    Returns:
+        - List[List[Tuple[Document, float]]]: For each query, the chunks and their distances to the query, closest first.
+    """
+
+    if exact_max_candidates is None:
+        exact_max_candidates = int(os.getenv("FILTERED_SEARCH_EXACT_MAX_CANDIDATES", "20000"))
+
+    query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+
+    candidates = None
+    if metadata_filter:
+        candidates = metadata_index_of(vectorstore).candidates(metadata_filter)
+        METRICS.increment("filtered_searches")
+        METRICS.increment("filtered_search_candidates", len(candidates))
+
+    if candidates is None or len(candidates) == vectorstore.index.ntotal:
+        scores, indices = vectorstore.index.search(query_embeddings, k)
+    elif not len(candidates):
+        return [[] for _ in query_embeddings]
+    elif len(candidates) <= exact_max_candidates:
+        with METRICS.timer("filtered_search_exact"):
+            scores, indices = _search_candidates_exactly(
+                vectorstore.index, query_embeddings, candidates, k
+            )
+    else:
+        with METRICS.timer("filtered_search_selector"):
+            scores, indices = _search_with_selector(
+                vectorstore.index, query_embeddings, candidates, k
+            )
+
+    results = []
+    for query_scores, query_indices in zip(scores, indices):
+        docs_and_scores = []
+        for score, i in zip(query_scores, query_indices):
+            # FAISS pads the results with -1 when there are fewer than k documents
+            if i == -1:
+                continue
+            doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)])
+            docs_and_scores.append((doc, float(score)))
+        results.append(docs_and_scores)
+
+    return results
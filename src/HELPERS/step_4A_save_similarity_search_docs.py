@@ -12,22 +12,14 @@ import json
 import os
 from typing import List
 
-from dotenv import load_dotenv
-
 from langchain.schema import Document
 
-load_dotenv()  # Load environment variables from .env file
-
 
 def save_similarity_search_docs(
     similarity_search_docs: List[Document],
     query: str,
-    save_similarity_search_docs_directory: str = os.getenv(
-        "SAVING_SIMILARITY_SEARCH_DOCS_DIRECTORY"
-    ),
-    save_similarity_search_docs_file_name: str = os.getenv(
-        "SAVING_SIMILARITY_SEARCH_DOCS_FILE_NAME"
-    ),
+    save_similarity_search_docs_directory: str | None = None,
+    save_similarity_search_docs_file_name: str | None = None,
 ):
     """
     Save similarity search documents in a JSON file.
@@ -35,13 +27,18 @@ def save_similarity_search_docs(
     Args:
         - similarity_search_docs (List[Document]): A list of Document objects.
         - query (str): The query string.
-        - save_similarity_search_docs_directory (str): The directory where the output file will be saved.
-        - save_similarity_search_docs_file_name (str): The name of the output file.
+        - save_similarity_search_docs_directory (str | None): The directory where the output file will be saved, SAVING_SIMILARITY_SEARCH_DOCS_DIRECTORY in the .env file if None.
+        - save_similarity_search_docs_file_name (str | None): The name of the output file, SAVING_SIMILARITY_SEARCH_DOCS_FILE_NAME in the .env file if None.
 
     Returns:
         - None
     """
 
+    if save_similarity_search_docs_directory is None:
+        save_similarity_search_docs_directory = os.getenv("SAVING_SIMILARITY_SEARCH_DOCS_DIRECTORY")
+    if save_similarity_search_docs_file_name is None:
+        save_similarity_search_docs_file_name = os.getenv("SAVING_SIMILARITY_SEARCH_DOCS_FILE_NAME")
+
     # Write the output to a JSON file
     if not os.path.exists(save_similarity_search_docs_directory):
         os.makedirs(save_similarity_search_docs_directory)
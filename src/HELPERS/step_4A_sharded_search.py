@@ -0,0 +1,405 @@
+"""
+    This code defines the search of a sharded vectorstore (see step_3_sharded_vectorstore): every query is sent
+    to all the shards at the same time, and the k closest chunks of all the shards are merged into its k closest chunks.
+
+    A shard is either:
+        a vectorstore loaded in the same process, searched by a thread of the search pool
+        (FAISS releases the GIL while searching, so the shards are searched in parallel), or
+        a RemoteShard, a query server serving one shard, searched over HTTP with the query embeddings
+        (POST /search_vectors), so the shards can be spread over several processes or machines.
+
+    The distances of all the shards are squared L2 distances between the same query embeddings and the chunks,
+    so the closest chunks of the shards can be merged by distance whatever the index type of each shard.
+
+    The ShardedVectorstore can be used instead of a FAISS vectorstore by the similarity search and the query server:
+    it embeds the queries with the same embeddings and has the same similarity_search and similarity_search_with_score methods,
+    and the function search_vectors searches either of them with query embeddings and an optional metadata filter.
+
+    The lexical search (see step_3_lexical_index) is fanned out the same way: search_lexical sends the query strings
+    to all the shards (POST /search_lexical for a RemoteShard), and the best chunks of the shards are merged by BM25 score.
+    The scores of the shards are close but not equal to the ones of an unsharded vectorstore, each shard weighs the words
+    by how rare they are among its own chunks.
+"""
+
+import heapq
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from langchain import FAISS
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+from HELPERS.step_3_lexical_index import search_lexical_vectorstore
+from HELPERS.step_4A_metadata_index import search_vectorstore
+
+# The threads searching the local shards, shared by all the sharded vectorstores of the process
+_search_pool: ThreadPoolExecutor | None = None
+_search_pool_lock = threading.Lock()
+
+
+def _get_search_pool(
+    max_workers: int | None = None
+) -> ThreadPoolExecutor:
+    global _search_pool
+    with _search_pool_lock:
+        if _search_pool is None:
+            if max_workers is None:
+                max_workers = int(os.getenv("VECTORSTORE_SHARD_MAX_WORKERS", "4"))
+            _search_pool = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="shard_search"
+            )
+    return _search_pool
+
+
+def shard_urls_from_env(
+    shard_urls: str | None = None,
+) -> List[str]:
+    """Return the urls of the shard servers set in the .env file (comma separated), empty if the shards are local."""
+    if shard_urls is None:
+        shard_urls = os.getenv("VECTORSTORE_SHARD_URLS", "")
+    return [url.strip().rstrip("/") for url in shard_urls.split(",") if url.strip()]
+
+
+class RemoteShard:
+    """
+    A shard served by a query server, searched over pooled HTTP connections.
+
+    Args:
+        - url (str): The url of the query server of the shard.
+        - timeout_seconds (float): The timeout of each search.
+    """
+
+    def __init__(self, url: str, timeout_seconds: float = 30.0) -> None:
+        self.url = url
+        self.timeout_seconds = timeout_seconds
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=32))
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=32))
+
+    @property
+    def count(self) -> int:
+        """The number of chunks of the shard."""
+        response = self.session.get(f"{self.url}/health", timeout=self.timeout_seconds)
+        response.raise_for_status()
+        return int(response.json()["chunks"])
+
+    def search(
+        self,
+        query_embeddings: np.ndarray,
+        k: int = 4,
+        metadata_filter: Dict[str, Any] | None = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Find the chunks of the shard most similar to each query.
+
+        Args:
+            - query_embeddings (np.ndarray): The embeddings of the queries, one per row.
+            - k (int): The number of chunks returned for each query.
+            - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+        Returns:
+            - List[List[Tuple[Document, float]]]: For each query, the chunks and their distances to the query, closest first.
+        """
+
+        return self._post(
+            route="/search_vectors",
+            request={
+                "embeddings": np.asarray(query_embeddings, dtype=np.float32).tolist(),
+                "k": k,
+                "filter": metadata_filter,
+            },
+        )
+
+    def search_lexical(
+        self,
+        queries: List[str],
+        k: int = 4,
+        metadata_filter: Dict[str, Any] | None = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Find the chunks of the shard with the best BM25 scores for each query.
+
+        Args:
+            - queries (List[str]): The query strings.
+            - k (int): The number of chunks returned for each query.
+            - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+        Returns:
+            - List[List[Tuple[Document, float]]]: For each query, the chunks and their BM25 scores, best first.
+        """
+
+        return self._post(
+            route="/search_lexical",
+            request={"queries": queries, "k": k, "filter": metadata_filter},
+        )
+
+    def _post(
+        self, route: str, request: Dict[str, Any]
+    ) -> List[List[Tuple[Document, float]]]:
+        """Send a search request to the shard server and read the chunks and scores of each query."""
+        response = self.session.post(
+            f"{self.url}{route}", json=request, timeout=self.timeout_seconds
+        )
+        if response.status_code != 200:
+            raise ValueError(
+                f"The shard server {self.url} answered {response.status_code}: {response.text}"
+            )
+
+        return [
+            [
+                (
+                    Document(page_content=doc["page_content"], metadata=doc["metadata"]),
+                    float(doc["score"]),
+                )
+                for doc in docs
+            ]
+            for docs in response.json()["results"]
+        ]
+
+
+class ShardedVectorstore:
+    """
+    Vectorstore searching all its shards for every query and merging their closest chunks.
+
+    Args:
+        - shards (List[FAISS | RemoteShard]): The shards, loaded in the process or served by query servers.
+        - embeddings (Embeddings): The embeddings used to embed the queries, the ones the shards were built with.
+    """
+
+    def __init__(self, shards: List[FAISS | RemoteShard], embeddings: Embeddings) -> None:
+        if not shards:
+            raise ValueError("A sharded vectorstore needs at least one shard")
+
+        self.shards = shards
+        self.embeddings = embeddings
+        self.embedding_function = embeddings.embed_query
+
+    @property
+    def count(self) -> int:
+        """The number of chunks of all the shards."""
+        return sum(
+            shard.count if isinstance(shard, RemoteShard) else shard.index.ntotal
+            for shard in self.shards
+        )
+
+    @staticmethod
+    def _search_shard(
+        shard: FAISS | RemoteShard,
+        query_embeddings: np.ndarray,
+        k: int,
+        metadata_filter: Dict[str, Any] | None,
+    ) -> List[List[Tuple[Document, float]]]:
+        with METRICS.timer("shard_search"):
+            if isinstance(shard, RemoteShard):
+                return shard.search(
+                    query_embeddings=query_embeddings, k=k, metadata_filter=metadata_filter
+                )
+            return search_vectorstore(
+                vectorstore=shard,
+                query_embeddings=query_embeddings,
+                k=k,
+                metadata_filter=metadata_filter,
+            )
+
+    def search(
+        self,
+        query_embeddings: np.ndarray,
+        k: int = 4,
+        metadata_filter: Dict[str, Any] | None = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Find the chunks most similar to each query in all the shards.
+
+        Args:
+            - query_embeddings (np.ndarray): The embeddings of the queries, one per row.
+            - k (int): The number of chunks returned for each query.
+            - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+        Returns:
+            - List[List[Tuple[Document, float]]]: For each query, the chunks and their distances to the query, closest first.
+        """
+
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+
+        # Search all the shards at the same time, each one for its own k closest chunks
+        with METRICS.timer("sharded_search"):
+            if len(self.shards) == 1:
+                shard_results = [
+                    self._search_shard(self.shards[0], query_embeddings, k, metadata_filter)
+                ]
+            else:
+                shard_results = list(
+                    _get_search_pool().map(
+                        lambda shard: self._search_shard(
+                            shard, query_embeddings, k, metadata_filter
+                        ),
+                        self.shards,
+                    )
+                )
+        METRICS.increment("shard_searches", len(self.shards))
+
+        # Merge the closest chunks of the shards by distance
+        return [
+            heapq.nsmallest(
+                k,
+                (
+                    doc_and_score
+                    for results in shard_results
+                    for doc_and_score in results[query]
+                ),
+                key=lambda doc_and_score: doc_and_score[1],
+            )
+            for query in range(len(query_embeddings))
+        ]
+
+    @staticmethod
+    def _search_shard_lexical(
+        shard: FAISS | RemoteShard,
+        queries: List[str],
+        k: int,
+        metadata_filter: Dict[str, Any] | None,
+    ) -> List[List[Tuple[Document, float]]]:
+        with METRICS.timer("shard_lexical_search"):
+            if isinstance(shard, RemoteShard):
+                return shard.search_lexical(
+                    queries=queries, k=k, metadata_filter=metadata_filter
+                )
+            return search_lexical_vectorstore(
+                vectorstore=shard, queries=queries, k=k, metadata_filter=metadata_filter
+            )
+
+    def search_lexical(
+        self,
+        queries: List[str],
+        k: int = 4,
+        metadata_filter: Dict[str, Any] | None = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Find the chunks with the best BM25 scores for each query in all the shards.
+
+        Args:
+            - queries (List[str]): The query strings.
+            - k (int): The number of chunks returned for each query.
+            - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+        Returns:
+            - List[List[Tuple[Document, float]]]: For each query, the chunks and their BM25 scores, best first.
+        """
+
+        if len(self.shards) == 1:
+            shard_results = [
+                self._search_shard_lexical(self.shards[0], queries, k, metadata_filter)
+            ]
+        else:
+            shard_results = list(
+                _get_search_pool().map(
+                    lambda shard: self._search_shard_lexical(
+                        shard, queries, k, metadata_filter
+                    ),
+                    self.shards,
+                )
+            )
+
+        # Merge the best chunks of the shards by score
+        return [
+            heapq.nlargest(
+                k,
+                (
+                    doc_and_score
+                    for results in shard_results
+                    for doc_and_score in results[query]
+                ),
+                key=lambda doc_and_score: doc_and_score[1],
+            )
+            for query in range(len(queries))
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4
+    ) -> List[Tuple[Document, float]]:
+        """Find the chunks most similar to the query and their distances to it, like FAISS.similarity_search_with_score."""
+        [docs_and_scores] = self.search(
+            query_embeddings=np.asarray([self.embedding_function(query)]), k=k
+        )
+        return docs_and_scores
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        """Find the chunks most similar to the query, like FAISS.similarity_search."""
+        return [doc for doc, _ in self.similarity_search_with_score(query=query, k=k)]
+
+
+def vectorstore_size(vectorstore: FAISS | ShardedVectorstore) -> int:
+    """Return the number of chunks of a vectorstore, sharded or not."""
+    if isinstance(vectorstore, ShardedVectorstore):
+        return vectorstore.count
+    return vectorstore.index.ntotal
+
+
+def search_vectors(
+    vectorstore: FAISS | ShardedVectorstore,
+    query_embeddings: np.ndarray,
+    k: int = 4,
+    metadata_filter: Dict[str, Any] | None = None,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    Find the chunks most similar to each query in a vectorstore, sharded or not.
+
+    Args:
+        - vectorstore (FAISS | ShardedVectorstore): The vectorstore to search.
+        - query_embeddings (np.ndarray): The embeddings of the queries, one per row.
+        - k (int): The number of chunks returned for each query.
+        - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+    Returns:
+        - List[List[Tuple[Document, float]]]: For each query, the chunks and their distances to the query, closest first.
+    """
+
+    if isinstance(vectorstore, ShardedVectorstore):
+        return vectorstore.search(
+            query_embeddings=query_embeddings, k=k, metadata_filter=metadata_filter
+        )
+
+    return search_vectorstore(
+        vectorstore=vectorstore,
+        query_embeddings=query_embeddings,
+        k=k,
+        metadata_filter=metadata_filter,
+    )
+
+
+def search_lexical(
+    vectorstore: FAISS | ShardedVectorstore,
+    queries: List[str],
+    k: int = 4,
+    metadata_filter: Dict[str, Any] | None = None,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    Find the chunks with the best BM25 scores for each query in a vectorstore, sharded or not.
+
+    Args:
+        - vectorstore (FAISS | ShardedVectorstore): The vectorstore to search.
+        - queries (List[str]): The query strings.
+        - k (int): The number of chunks returned for each query.
+        - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+    Returns:
+        - List[List[Tuple[Document, float]]]: For each query, the chunks and their BM25 scores, best first.
+    """
+
+    if isinstance(vectorstore, ShardedVectorstore):
+        return vectorstore.search_lexical(
+            queries=queries, k=k, metadata_filter=metadata_filter
+        )
+
+    return search_lexical_vectorstore(
+        vectorstore=vectorstore, queries=queries, k=k, metadata_filter=metadata_filter
+    )
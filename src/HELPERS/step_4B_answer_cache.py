@@ -0,0 +1,275 @@
+"""
+    This code defines the AnswerCache, a two-tier cache of the answers of the question answering chain,
+    so the questions asked again (or asked again in other words) don't call the language model again.
+
+    The language model is by far the slowest and most expensive stage of answering a query, and the same questions
+    keep coming back, so the query server looks the answer up before calling it:
+        the exact tier is keyed by the normalized query (lower case, single spaces, without the trailing punctuation)
+        and the ids of the chunks retrieved for it, so it only returns an answer written from the same chunks, and
+        the semantic tier compares the embedding of the query to the embeddings of the cached queries, and returns the answer
+        of the closest one when their cosine similarity is at least similarity_threshold (a paraphrase of a cached question).
+
+    The semantic tier only compares queries searched with the same filter and the same k, its embeddings are kept normalized
+    in a matrix with one row per entry, so a lookup is a single matrix product.
+
+    Each answer is kept for at most ttl_seconds, and the cache keeps at most max_entries answers, evicting the least recently used first.
+    The query server clears the cache whenever it loads a new vectorstore, so an answer is never written from the chunks of an older one:
+    the answers computed while the cache was cleared carry the generation they started with, and are not stored.
+
+    The hits of each tier, the misses, the evictions and the expired answers are counted in METRICS
+    (and served by the query server on GET /metrics), stats returns them with the hit rate.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+
+# The punctuation dropped from the end of the queries, "What is it about?" and "what is it about" are the same query
+TRAILING_PUNCTUATION = " ?!.;:,"
+
+
+def normalize_query(query: str) -> str:
+    """Return the query in lower case, with single spaces and without its trailing punctuation."""
+    return " ".join(query.lower().split()).rstrip(TRAILING_PUNCTUATION)
+
+
+def _scope_key(k: int, metadata_filter: Dict[str, Any] | None) -> str:
+    """Identify the searches whose answers can be compared: same k and same filter."""
+    return json.dumps([k, metadata_filter or None], sort_keys=True)
+
+
+class AnswerCache:
+    """
+    Thread safe two-tier cache of the answers to the queries, by exact query and retrieved chunks, and by similar query.
+
+    Args:
+        - max_entries (int | None): The maximum number of answers kept, 0 disables the cache, ANSWER_CACHE_MAX_ENTRIES in the .env file if None.
+        - ttl_seconds (float | None): How long an answer is kept, 0 keeps it until it is evicted, ANSWER_CACHE_TTL_SECONDS in the .env file if None.
+        - similarity_threshold (float | None): The cosine similarity above which a cached query answers a new one, above 1 disables the semantic tier, ANSWER_CACHE_SIMILARITY_THRESHOLD in the .env file if None.
+    """
+
+    def __init__(
+        self,
+        max_entries: int | None = None,
+        ttl_seconds: float | None = None,
+        similarity_threshold: float | None = None,
+    ) -> None:
+        if max_entries is None:
+            max_entries = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+        if similarity_threshold is None:
+            similarity_threshold = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.generation = 0
+
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self) -> None:
+        # The entries by exact key, least recently used first
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        # The normalized query embeddings of the entries, one row per slot, allocated at the first store
+        self._vectors: np.ndarray | None = None
+        self._slot_scopes = np.full(max(self.max_entries, 0), -1, dtype=np.int64)
+        self._slot_keys: List[Tuple | None] = [None] * max(self.max_entries, 0)
+        self._free_slots = list(range(max(self.max_entries, 0) - 1, -1, -1))
+        self._scope_ids: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the cache keeps any answer."""
+        return self.max_entries > 0
+
+    def clear(self) -> None:
+        """Drop every answer, the answers being computed are not stored either."""
+        with self._lock:
+            self._clear()
+            self.generation += 1
+
+    def _remove(self, key: Tuple) -> None:
+        entry = self._entries.pop(key)
+        self._slot_scopes[entry["slot"]] = -1
+        self._slot_keys[entry["slot"]] = None
+        self._free_slots.append(entry["slot"])
+
+    def _expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return bool(self.ttl_seconds) and now - entry["stored_at"] > self.ttl_seconds
+
+    def _hit(self, key: Tuple, tier: str) -> Tuple[str, List[Tuple[Document, float]]]:
+        self._entries.move_to_end(key)
+        entry = self._entries[key]
+        if tier == "exact":
+            self.exact_hits += 1
+        else:
+            self.semantic_hits += 1
+        METRICS.increment(f"answer_cache_{tier}_hits")
+
+        return entry["answer"], entry["docs_and_scores"]
+
+    def lookup(
+        self,
+        query: str,
+        query_embedding: List[float] | np.ndarray,
+        docs_and_scores: List[Tuple[Document, float]],
+        k: int = 4,
+        metadata_filter: Dict[str, Any] | None = None,
+    ) -> Tuple[str, List[Tuple[Document, float]], str] | None:
+        """
+        Find the cached answer of a query, by exact query and retrieved chunks first, then by similar query.
+
+        Args:
+            - query (str): The query string.
+            - query_embedding (List[float] | np.ndarray): The embedding of the query.
+            - docs_and_scores (List[Tuple[Document, float]]): The chunks retrieved for the query.
+            - k (int): The number of chunks retrieved.
+            - metadata_filter (Dict[str, Any] | None): The filter the chunks were retrieved with.
+
+        Returns:
+            - Tuple[str, List[Tuple[Document, float]], str] | None: The cached answer, the chunks it was written from
+                and the tier it was found in ("exact" or "semantic"), None if there is no cached answer.
+        """
+
+        if not self.enabled:
+            return None
+
+        scope = _scope_key(k, metadata_filter)
+        key = (normalize_query(query), scope, _chunk_ids(docs_and_scores))
+        now = time.time()
+
+        with self._lock:
+            # The exact tier
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._remove(key)
+                METRICS.increment("answer_cache_expired")
+                entry = None
+            if entry is not None:
+                return (*self._hit(key, "exact"), "exact")
+
+            # The semantic tier, among the queries searched the same way
+            scope_id = self._scope_ids.get(scope)
+            if (
+                self.similarity_threshold <= 1
+                and self._vectors is not None
+                and scope_id is not None
+            ):
+                similarities = self._vectors @ _normalize(query_embedding)
+                similarities[self._slot_scopes != scope_id] = -np.inf
+                # The closest queries first, skipping the expired ones
+                for slot in np.argsort(-similarities):
+                    if similarities[slot] < self.similarity_threshold:
+                        break
+                    slot_key = self._slot_keys[slot]
+                    if self._expired(self._entries[slot_key], now):
+                        self._remove(slot_key)
+                        METRICS.increment("answer_cache_expired")
+                        continue
+                    return (*self._hit(slot_key, "semantic"), "semantic")
+
+            self.misses += 1
+            METRICS.increment("answer_cache_misses")
+
+            return None
+
+    def store(
+        self,
+        query: str,
+        query_embedding: List[float] | np.ndarray,
+        docs_and_scores: List[Tuple[Document, float]],
+        answer: str,
+        k: int = 4,
+        metadata_filter: Dict[str, Any] | None = None,
+        generation: int | None = None,
+    ) -> None:
+        """
+        Cache the answer of a query.
+
+        Args:
+            - query (str): The query string.
+            - query_embedding (List[float] | np.ndarray): The embedding of the query.
+            - docs_and_scores (List[Tuple[Document, float]]): The chunks the answer was written from.
+            - answer (str): The answer.
+            - k (int): The number of chunks retrieved.
+            - metadata_filter (Dict[str, Any] | None): The filter the chunks were retrieved with.
+            - generation (int | None): The generation of the cache when the query started, the answer isn't stored if it was cleared since.
+
+        Returns:
+            - None
+        """
+
+        if not self.enabled:
+            return
+
+        scope = _scope_key(k, metadata_filter)
+        key = (normalize_query(query), scope, _chunk_ids(docs_and_scores))
+        vector = _normalize(query_embedding)
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            if key in self._entries:
+                self._remove(key)
+
+            # Evict the least recently used answer to make room
+            if not self._free_slots:
+                self._remove(next(iter(self._entries)))
+                METRICS.increment("answer_cache_evictions")
+
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+
+            slot = self._free_slots.pop()
+            self._vectors[slot] = vector
+            self._slot_scopes[slot] = self._scope_ids.setdefault(scope, len(self._scope_ids))
+            self._slot_keys[slot] = key
+            self._entries[key] = {
+                "answer": answer,
+                "docs_and_scores": docs_and_scores,
+                "stored_at": time.time(),
+                "slot": slot,
+            }
+
+    def stats(self) -> Dict[str, float]:
+        """Return the hit and miss counters of the cache and its hit rate."""
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+def _chunk_ids(docs_and_scores: List[Tuple[Document, float]]) -> Tuple:
+    """The ids of the chunks, in the order they were retrieved."""
+    return tuple(doc.metadata.get("chunk_id") for doc, _ in docs_and_scores)
+
+
+def _normalize(vector: List[float] | np.ndarray) -> np.ndarray:
+    """Return the vector scaled to unit length, so dot products are cosine similarities."""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+
+    return vector / norm if norm else vector
@@ -0,0 +1,239 @@
+"""
+    This code defines the context packing of the question answering chain: the assembly of the chunks retrieved for a query
+    into the passages "stuffed" into the prompt of the language model, within a budget of tokens.
+
+    The chunks retrieved for a query overlap (each chunk repeats the end of the previous one of its document, CHUNK_OVERLAP)
+    and often repeat each other (the same paragraph in several documents), so stuffing them as they are
+    spends input tokens of the language model on repeated text and can overflow its context. The function pack_context:
+        merges the chunks of a document that follow each other (consecutive chunk indexes) into a single passage,
+        writing the text they share only once,
+        removes the passages whose words are nearly all in a better ranked passage (their shingles of SHINGLE_SIZE words
+        overlapping by at least duplicate_threshold), and
+        packs the passages into token_budget tokens, best ranked first (a passage ranks like its best ranked chunk),
+        skipping the passages that don't fit and cutting the first passage on a word boundary if it doesn't fit on its own.
+
+    The tokens are counted with the tokenizer of the language model when it is saved in a local directory
+    (QA_CONTEXT_TOKENIZER_DIRECTORY in the .env file, for example saved with
+    AutoTokenizer.from_pretrained("google/flan-ul2").save_pretrained("./models/flan-ul2")),
+    and approximated by the words and punctuation marks of the text otherwise (see count_tokens in step_1_chunker).
+
+    The report of each query gives the tokens of the retrieved chunks and of the packed passages, and how many chunks were
+    merged, removed as duplicates or left out of the budget, the totals are counted in METRICS.
+"""
+
+import functools
+import os
+import re
+import sys
+from typing import Callable, Dict, List, Tuple
+
+from langchain.schema import Document
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+from HELPERS.step_1_chunker import count_tokens
+
+# The number of words of the shingles compared to find the near duplicate passages
+SHINGLE_SIZE = 3
+
+_WORDS = re.compile(r"\w+")
+
+
+@functools.lru_cache(maxsize=None)
+def load_token_counter(
+    tokenizer_directory: str | None = None,
+) -> Callable[[str], int]:
+    """
+    Return the function counting the tokens of a text for the language model.
+
+    Args:
+        - tokenizer_directory (str | None): The directory of the tokenizer of the language model, the tokens are approximated if it is empty,
+            QA_CONTEXT_TOKENIZER_DIRECTORY in the .env file if None.
+
+    Returns:
+        - Callable[[str], int]: The function counting the tokens of a text.
+    """
+
+    if tokenizer_directory is None:
+        tokenizer_directory = os.getenv("QA_CONTEXT_TOKENIZER_DIRECTORY")
+
+    if not tokenizer_directory:
+        return count_tokens
+
+    # transformers is only needed when the tokenizer of the model is used
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_directory)
+
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def _join_overlapping(first: str, second: str) -> str:
+    """Join two consecutive chunks, writing the end of the first one that starts the second one only once."""
+    # The longest suffix of the first chunk that is a prefix of the second one, made of whole words
+    tail = first[-len(second) :]
+    offset = len(first) - len(tail)
+    position = tail.find(second[:1])
+    while position != -1:
+        overlap = len(tail) - position
+        if (
+            second.startswith(tail[position:])
+            and (offset + position == 0 or first[offset + position - 1].isspace())
+            and (overlap == len(second) or second[overlap].isspace())
+        ):
+            return first + second[overlap:]
+        position = tail.find(second[:1], position + 1)
+
+    return first + " " + second
+
+
+def _merge_consecutive_chunks(docs: List[Document]) -> List[Tuple[int, Document, int]]:
+    """Merge the consecutive chunks of each document, returning the passages with their rank and number of chunks."""
+    runs: Dict[str, List[Tuple[int, Document]]] = {}
+    passages = []
+    for rank, doc in enumerate(docs):
+        if doc.metadata.get("chunk_index") is None:
+            passages.append((rank, doc, 1))
+        else:
+            runs.setdefault(doc.metadata.get("source"), []).append((rank, doc))
+
+    for chunks in runs.values():
+        chunks.sort(key=lambda chunk: chunk[1].metadata["chunk_index"])
+        run: List[Tuple[int, Document]] = []
+        for rank, doc in chunks + [(-1, None)]:
+            if run and doc is not None:
+                last_index = run[-1][1].metadata["chunk_index"]
+                # The same chunk retrieved twice (from two shards) is only kept once
+                if doc.metadata["chunk_index"] == last_index:
+                    run[-1] = (min(run[-1][0], rank), run[-1][1])
+                    continue
+                if doc.metadata["chunk_index"] == last_index + 1:
+                    run.append((rank, doc))
+                    continue
+            if run:
+                text = run[0][1].page_content
+                for _, chunk in run[1:]:
+                    text = _join_overlapping(text, chunk.page_content)
+                metadata = dict(run[0][1].metadata)
+                if len(run) > 1:
+                    metadata["chunk_ids"] = [chunk.metadata.get("chunk_id") for _, chunk in run]
+                passages.append(
+                    (
+                        min(rank for rank, _ in run),
+                        Document(page_content=text, metadata=metadata),
+                        len(run),
+                    )
+                )
+            run = [(rank, doc)]
+
+    return sorted(passages, key=lambda passage: passage[0])
+
+
+def _shingles(text: str) -> set:
+    words = _WORDS.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+
+    return {tuple(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _truncate(text: str, token_budget: int, token_counter: Callable[[str], int]) -> str:
+    """Cut the text on the last word boundary keeping it within the budget, found by binary search."""
+    word_ends = [match.end() for match in re.finditer(r"\S+", text)]
+    low, high = 0, len(word_ends)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if token_counter(text[: word_ends[middle - 1]]) <= token_budget:
+            low = middle
+        else:
+            high = middle - 1
+
+    return text[: word_ends[low - 1]] if low else ""
+
+
+@METRICS.timed("pack_context")
+def pack_context(
+    docs: List[Document],
+    token_budget: int | None = None,
+    duplicate_threshold: float | None = None,
+    token_counter: Callable[[str], int] | None = None,
+) -> Tuple[List[Document], Dict[str, int]]:
+    """
+    Assemble the chunks retrieved for a query into the passages given to the question answering chain.
+
+    Args:
+        - docs (List[Document]): The chunks retrieved for the query, best ranked first.
+        - token_budget (int | None): The maximum number of tokens of the passages, 0 doesn't limit them, QA_CONTEXT_TOKEN_BUDGET in the .env file if None.
+        - duplicate_threshold (float | None): The share of the shingles of a passage found in a better ranked one above which it is removed,
+            above 1 keeps every passage, QA_CONTEXT_DUPLICATE_THRESHOLD in the .env file if None.
+        - token_counter (Callable[[str], int] | None): The function counting the tokens of a text, the one of load_token_counter if None.
+
+    Returns:
+        - Tuple[List[Document], Dict[str, int]]: The passages, best ranked first, and the report of the packing:
+            "tokens_before", "tokens_after" and "tokens_saved", and the number of "chunks", "passages",
+            "merged_chunks", "duplicate_passages" and "dropped_passages".
+    """
+
+    if token_budget is None:
+        token_budget = int(os.getenv("QA_CONTEXT_TOKEN_BUDGET", "1500"))
+    if duplicate_threshold is None:
+        duplicate_threshold = float(os.getenv("QA_CONTEXT_DUPLICATE_THRESHOLD", "0.9"))
+
+    if token_counter is None:
+        token_counter = load_token_counter()
+
+    tokens_before = sum(token_counter(doc.page_content) for doc in docs)
+
+    # Merge the consecutive chunks of each document
+    passages = _merge_consecutive_chunks(docs)
+    merged_chunks = sum(chunk_count - 1 for _, _, chunk_count in passages)
+
+    # Remove the passages nearly contained in a better ranked one
+    kept: List[Tuple[Document, set]] = []
+    duplicate_passages = 0
+    for _, passage, _ in passages:
+        shingles = _shingles(passage.page_content)
+        if any(
+            len(shingles & kept_shingles) >= duplicate_threshold * len(shingles)
+            for _, kept_shingles in kept
+        ):
+            duplicate_passages += 1
+            continue
+        kept.append((passage, shingles))
+
+    # Pack the best ranked passages into the budget
+    packed: List[Document] = []
+    tokens_after = 0
+    dropped_passages = 0
+    for passage, _ in kept:
+        tokens = token_counter(passage.page_content)
+        if token_budget and tokens_after + tokens > token_budget:
+            if packed:
+                dropped_passages += 1
+                continue
+            # The best passage alone is over the budget, keep its beginning
+            passage = Document(
+                page_content=_truncate(passage.page_content, token_budget, token_counter),
+                metadata=passage.metadata,
+            )
+            tokens = token_counter(passage.page_content)
+        packed.append(passage)
+        tokens_after += tokens
+
+    report = {
+        "chunks": len(docs),
+        "passages": len(packed),
+        "merged_chunks": merged_chunks,
+        "duplicate_passages": duplicate_passages,
+        "dropped_passages": dropped_passages,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+    }
+    METRICS.increment("qa_context_tokens_before", tokens_before)
+    METRICS.increment("qa_context_tokens_after", tokens_after)
+    METRICS.increment("qa_context_tokens_saved", tokens_before - tokens_after)
+    METRICS.increment("qa_context_duplicate_passages", duplicate_passages)
+
+    return packed, report
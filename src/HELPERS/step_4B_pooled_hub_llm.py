@@ -0,0 +1,196 @@
+"""
+    This code defines the PooledHuggingFaceHub class, a langchain LLM calling a text generation model
+    of the Hugging Face Hub inference API over pooled HTTP connections.
+
+    The HuggingFaceHub class of langchain opens a new connection to the inference API for every call,
+    the PooledHuggingFaceHub keeps its connections alive between calls (and between the threads of the query server),
+    and retries the calls that are rate limited, like the EmbeddingScheduler does for the embeddings.
+
+    The stream method generates the text token by token, reading the server-sent events of the inference API
+    (the text-generation-inference streaming format, {"inputs": ..., "stream": true}), so the first tokens of an answer
+    can be shown while the next ones are generated.
+
+    The inference API url can be changed (HUGGINGFACEHUB_INFERENCE_ENDPOINT in the .env file) to point it
+    to a local stub server, such as the one in local_stub_hub_server.py.
+"""
+
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+
+import requests
+from pydantic import Field, root_validator
+from requests.adapters import HTTPAdapter
+from langchain.llms.base import LLM
+from langchain.llms.utils import enforce_stop_tokens
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+from HELPERS.step_2_embedding_scheduler import RETRY_STATUS_CODES
+
+
+class PooledHuggingFaceHub(LLM):
+    """
+    LLM calling a text generation model of the Hugging Face Hub inference API over pooled HTTP connections.
+
+    Args:
+        - huggingfacehub_api_token (str | None): The Hugging Face Hub API token.
+        - repo_id (str): The id of the text generation model to use, HUGGINGFACE_REPO_ID in the .env file by default.
+        - endpoint_url (str): The url of the inference API, HUGGINGFACEHUB_INFERENCE_ENDPOINT in the .env file by default.
+        - model_kwargs (Dict[str, Any]): The parameters sent with each call.
+        - max_connections (int): The maximum number of connections kept alive.
+        - max_retries (int): The number of times a rate limited call is retried before giving up, EMBEDDINGS_MAX_RETRIES in the .env file by default.
+        - backoff_seconds (float): The wait before the first retry, doubled for each following retry.
+        - timeout_seconds (float): The timeout of each call.
+    """
+
+    huggingfacehub_api_token: Optional[str] = None
+    repo_id: str = Field(
+        default_factory=lambda: os.getenv("HUGGINGFACE_REPO_ID", "google/flan-ul2")
+    )
+    endpoint_url: str = Field(
+        default_factory=lambda: os.getenv(
+            "HUGGINGFACEHUB_INFERENCE_ENDPOINT", "https://api-inference.huggingface.co"
+        )
+    )
+    model_kwargs: Dict[str, Any] = {}
+    max_connections: int = 10
+    max_retries: int = Field(
+        default_factory=lambda: int(os.getenv("EMBEDDINGS_MAX_RETRIES", "5"))
+    )
+    backoff_seconds: float = 1.0
+    timeout_seconds: float = 120.0
+    session: Any = None
+
+    @root_validator()
+    def create_session(cls, values: Dict) -> Dict:
+        """Create the session whose connections are reused between calls."""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(1, values["max_connections"])
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if values.get("huggingfacehub_api_token"):
+            session.headers[
+                "Authorization"
+            ] = f"Bearer {values['huggingfacehub_api_token']}"
+        values["session"] = session
+        return values
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        """Get the identifying parameters."""
+        return {"repo_id": self.repo_id, "model_kwargs": self.model_kwargs}
+
+    @property
+    def _llm_type(self) -> str:
+        """Return type of llm."""
+        return "pooled_huggingface_hub"
+
+    def _post(self, prompt: str, stream: bool = False) -> requests.Response:
+        """Call the inference API, retrying while it is rate limited."""
+        url = f"{self.endpoint_url.rstrip('/')}/models/{self.repo_id}"
+        payload = {
+            "inputs": prompt,
+            "parameters": self.model_kwargs,
+            "options": {"wait_for_model": True},
+        }
+        if stream:
+            payload["stream"] = True
+
+        for attempt in range(self.max_retries + 1):
+            with METRICS.timer("llm_request"):
+                response = self.session.post(
+                    url, json=payload, timeout=self.timeout_seconds, stream=stream
+                )
+            METRICS.increment("llm_api_calls")
+
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+
+            if attempt == self.max_retries:
+                break
+
+            METRICS.increment("llm_api_retries")
+            response.close()
+
+            # Wait as long as the API asks to, or back off exponentially with some jitter
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None and retry_after.isdigit():
+                wait_seconds = float(retry_after)
+            else:
+                wait_seconds = self.backoff_seconds * 2**attempt
+            time.sleep(wait_seconds * random.uniform(1.0, 1.5))
+
+        if response.status_code != 200:
+            raise ValueError(
+                f"Error raised by inference API: {response.status_code} {response.text}"
+            )
+
+        return response
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs) -> str:
+        """Call the inference API and return the generated text."""
+        text = self._post(prompt).json()[0]["generated_text"]
+
+        # Text generation models return the prompt followed by the generated text
+        if text.startswith(prompt):
+            text = text[len(prompt) :]
+
+        if stop is not None:
+            text = enforce_stop_tokens(text, stop)
+
+        # The tokens are approximated by the words, the tokenizer of the model isn't loaded
+        METRICS.increment("llm_prompt_tokens", len(prompt.split()))
+        METRICS.increment("llm_generated_tokens", len(text.split()))
+
+        return text
+
+    def stream(self, prompt: str, stop: Optional[List[str]] = None) -> Iterator[str]:
+        """
+        Generate the text token by token, from the server-sent events of the inference API.
+
+        Args:
+            - prompt (str): The prompt.
+            - stop (Optional[List[str]]): The texts ending the generation, the text is cut before the first one.
+
+        Returns:
+            - Iterator[str]: The text of each generated token, as soon as it is received.
+        """
+
+        response = self._post(prompt, stream=True)
+
+        text = ""
+        try:
+            for line in response.iter_lines():
+                # Each event is a "data:" line holding a JSON object, with the generated token
+                if not line.startswith(b"data:"):
+                    continue
+                event = json.loads(line[len(b"data:") :])
+                if "error" in event:
+                    raise ValueError(f"Error raised by inference API: {event['error']}")
+
+                token = event.get("token") or {}
+                if token.get("special") or not token.get("text"):
+                    continue
+
+                if stop is not None:
+                    stopped_text = enforce_stop_tokens(text + token["text"], stop)
+                    if len(stopped_text) < len(text + token["text"]):
+                        if len(stopped_text) > len(text):
+                            yield stopped_text[len(text) :]
+                        break
+
+                text += token["text"]
+                yield token["text"]
+        finally:
+            response.close()
+
+            # Counted like the tokens of _call, by the words
+            METRICS.increment("llm_prompt_tokens", len(prompt.split()))
+            METRICS.increment("llm_generated_tokens", len(text.split()))
@@ -3,31 +3,84 @@
     
     The function takes in a list of Document objects, a query string, and two optional parameters for the Hugging Face Hub API token and repository ID.
 
-    The function uses the HuggingFaceHub class from the llms module to load a pre-trained language model from the Hugging Face Hub. 
+    The function uses the PooledHuggingFaceHub class to call a pre-trained language model of the Hugging Face Hub over pooled HTTP connections. 
     
     It then uses the load_qa_chain() function from the question_answering module to load a question answering chain. 
     
     Finally, it uses the chain to find the answer to the query.
+
+    The chain can be loaded once with load_hub_qa_chain and passed to the function, so a long-lived process
+    (such as the query server) doesn't rebuild the model and the chain for every query.
+
+    The documents are packed before they are stuffed into the prompt (see step_4B_context_packing): the consecutive chunks
+    of a document are merged, the near duplicates removed, and the best passages kept within QA_CONTEXT_TOKEN_BUDGET tokens.
+
+    The function stream_Q_and_A_implementation is the streaming variant: it builds the prompt of the "stuff" chain
+    and yields the tokens of the answer as the language model generates them (see PooledHuggingFaceHub.stream),
+    instead of waiting for the whole answer. astream_Q_and_A_implementation yields them as an async iterator,
+    reading the stream in a background thread so the event loop is never blocked.
+    Both record the time to the first token and the rate of the following tokens in METRICS, and in stream_stats for each request.
 """
 
+import asyncio
 import os
-from typing import List
-
-from langchain.llms import HuggingFaceHub
+import sys
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, List
 
 from langchain.schema import Document
+from langchain.chains.combine_documents.base import BaseCombineDocumentsChain
 from langchain.chains.question_answering import load_qa_chain
 
-from dotenv import load_dotenv
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+from HELPERS.step_4B_context_packing import pack_context
+from HELPERS.step_4B_pooled_hub_llm import PooledHuggingFaceHub
+
+
+def load_hub_qa_chain(
+    huggingfacehub_api_token: str | None = None,
+    huggingfacehub_repo_id: str | None = None,
+    verbose: bool = True,
+) -> BaseCombineDocumentsChain:
+    """
+    Load the question answering chain.
+
+    Args:
+        - huggingfacehub_api_token (str): The Hugging Face Hub API token.
+        - huggingfacehub_repo_id (str | None): The repository name, HUGGINGFACE_REPO_ID in the .env file if None.
+        - verbose (bool): Print the prompts sent to the model.
+
+    Returns:
+        - BaseCombineDocumentsChain: The question answering chain.
+    """
+
+    if huggingfacehub_repo_id is None:
+        huggingfacehub_repo_id = os.getenv("HUGGINGFACE_REPO_ID")
+
+    llm = PooledHuggingFaceHub(
+        huggingfacehub_api_token=huggingfacehub_api_token,
+        repo_id=huggingfacehub_repo_id,
+        model_kwargs={"temperature": 0.1, "max_new_tokens": 300},
+    )
 
-load_dotenv()  # Load environment variables from .env file
+    return load_qa_chain(
+        llm=llm,
+        chain_type="stuff",
+        verbose=verbose,
+    )
 
 
+@METRICS.timed("question_answering")
 def Q_and_A_implementation(
     similarity_search_docs: List[Document],
     query: str,
     huggingfacehub_api_token: str | None = None,
-    huggingfacehub_repo_id: str = os.getenv("HUGGINGFACE_REPO_ID"),
+    huggingfacehub_repo_id: str | None = None,
+    chain: BaseCombineDocumentsChain | None = None,
+    pack_context_docs: bool = True,
 ) -> str:
     """
     Implement a question answering system.
@@ -36,24 +89,24 @@ def Q_and_A_implementation(
         - similarity_search_docs (List[Document]): A list of Document objects.
         - query (str): The query string.
         - huggingfacehub_api_token (str): The Hugging Face Hub API token.
-        - huggingfacehub_repo_id (str): The repository name.
+        - huggingfacehub_repo_id (str | None): The repository name, HUGGINGFACE_REPO_ID in the .env file if None.
+        - chain (BaseCombineDocumentsChain | None): The question answering chain, loaded with load_hub_qa_chain if None.
+        - pack_context_docs (bool): Whether to pack the documents into the token budget first, False if they are packed already.
 
     Returns:
         - str: The answer to the query.
     """
 
-    llm = HuggingFaceHub(
-        huggingfacehub_api_token=huggingfacehub_api_token,
-        repo_id=huggingfacehub_repo_id,
-        model_kwargs={"temperature": 0.1, "max_new_tokens": 300},
-    )
-
     # Load the question answering chain
-    chain = load_qa_chain(
-        llm=llm,
-        chain_type="stuff",
-        verbose=True,
-    )
+    if chain is None:
+        chain = load_hub_qa_chain(
+            huggingfacehub_api_token=huggingfacehub_api_token,
+            huggingfacehub_repo_id=huggingfacehub_repo_id,
+        )
+
+    # Merge the overlapping chunks, remove the duplicates and keep the best passages within the token budget
+    if pack_context_docs:
+        similarity_search_docs, _ = pack_context(docs=similarity_search_docs)
 
     # Use the chain to find the answer to the query
     Q_and_A_answer = chain.run(
@@ -61,3 +114,164 @@ def Q_and_A_implementation(
     )
 
     return Q_and_A_answer
+
+
+def _stuffed_prompt(
+    chain: BaseCombineDocumentsChain, docs: List[Document], query: str
+) -> str:
+    """Build the prompt the "stuff" chain sends to the language model for the documents and the query."""
+    return chain.llm_chain.prompt.format(**chain._get_inputs(docs, question=query))
+
+
+def stream_Q_and_A_implementation(
+    similarity_search_docs: List[Document],
+    query: str,
+    huggingfacehub_api_token: str | None = None,
+    huggingfacehub_repo_id: str | None = None,
+    chain: BaseCombineDocumentsChain | None = None,
+    pack_context_docs: bool = True,
+    started_at: float | None = None,
+    stream_stats: Dict[str, float] | None = None,
+) -> Iterator[str]:
+    """
+    Answer the query, yielding the tokens of the answer as they are generated.
+
+    Args:
+        - similarity_search_docs (List[Document]): A list of Document objects.
+        - query (str): The query string.
+        - huggingfacehub_api_token (str): The Hugging Face Hub API token.
+        - huggingfacehub_repo_id (str | None): The repository name, HUGGINGFACE_REPO_ID in the .env file if None.
+        - chain (BaseCombineDocumentsChain | None): The question answering chain, loaded with load_hub_qa_chain if None.
+        - pack_context_docs (bool): Whether to pack the documents into the token budget first, False if they are packed already.
+        - started_at (float | None): When the request started (time.perf_counter), to count the retrieval in the time to the first token,
+            when the answer is first asked for if None.
+        - stream_stats (Dict[str, float] | None): Filled when the answer ends with "time_to_first_token_seconds", "tokens",
+            "tokens_per_second" (after the first token) and "total_seconds".
+
+    Returns:
+        - Iterator[str]: The text of each token of the answer.
+    """
+
+    if started_at is None:
+        started_at = time.perf_counter()
+
+    # Load the question answering chain
+    if chain is None:
+        chain = load_hub_qa_chain(
+            huggingfacehub_api_token=huggingfacehub_api_token,
+            huggingfacehub_repo_id=huggingfacehub_repo_id,
+            verbose=False,
+        )
+
+    # Merge the overlapping chunks, remove the duplicates and keep the best passages within the token budget
+    if pack_context_docs:
+        similarity_search_docs, _ = pack_context(docs=similarity_search_docs)
+
+    prompt = _stuffed_prompt(chain=chain, docs=similarity_search_docs, query=query)
+
+    # Stream the tokens from the language model, or its whole answer at once if it can't stream
+    llm = chain.llm_chain.llm
+    tokens = llm.stream(prompt) if hasattr(llm, "stream") else iter([llm(prompt)])
+
+    first_token_at = None
+    count = 0
+    try:
+        for token in tokens:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                METRICS.record("time_to_first_token", first_token_at - started_at)
+            count += 1
+            yield token
+    finally:
+        ended_at = time.perf_counter()
+        generation_seconds = ended_at - (first_token_at or ended_at)
+        METRICS.increment("streamed_tokens", count)
+        if count > 1:
+            METRICS.record("token_generation", generation_seconds)
+
+        if stream_stats is not None:
+            stream_stats.update(
+                {
+                    "time_to_first_token_seconds": (
+                        first_token_at - started_at if first_token_at else None
+                    ),
+                    "tokens": count,
+                    "tokens_per_second": (
+                        (count - 1) / generation_seconds if generation_seconds else None
+                    ),
+                    "total_seconds": ended_at - started_at,
+                }
+            )
+
+
+# Marks the end of the tokens in the queue of astream_Q_and_A_implementation
+_END_OF_STREAM = object()
+
+
+async def astream_Q_and_A_implementation(
+    similarity_search_docs: List[Document],
+    query: str,
+    huggingfacehub_api_token: str | None = None,
+    huggingfacehub_repo_id: str | None = None,
+    chain: BaseCombineDocumentsChain | None = None,
+    pack_context_docs: bool = True,
+    started_at: float | None = None,
+    stream_stats: Dict[str, float] | None = None,
+) -> AsyncIterator[str]:
+    """
+    Answer the query, yielding the tokens of the answer as they are generated, as an async iterator.
+
+    The tokens are read from stream_Q_and_A_implementation in a background thread and handed to the event loop,
+    so the HTTP reads never block it, and the stream is closed when the iteration stops early.
+
+    Args:
+        - see stream_Q_and_A_implementation.
+
+    Returns:
+        - AsyncIterator[str]: The text of each token of the answer.
+    """
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stopped = threading.Event()
+
+    def put(item) -> None:
+        # The event loop may be closed once the iteration stopped early
+        if not stopped.is_set():
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass
+
+    def produce() -> None:
+        try:
+            for token in stream_Q_and_A_implementation(
+                similarity_search_docs=similarity_search_docs,
+                query=query,
+                huggingfacehub_api_token=huggingfacehub_api_token,
+                huggingfacehub_repo_id=huggingfacehub_repo_id,
+                chain=chain,
+                pack_context_docs=pack_context_docs,
+                started_at=started_at,
+                stream_stats=stream_stats,
+            ):
+                if stopped.is_set():
+                    break
+                put(token)
+        except Exception as exception:
+            put(exception)
+            return
+        put(_END_OF_STREAM)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    try:
+        while True:
+            token = await queue.get()
+            if token is _END_OF_STREAM:
+                return
+            if isinstance(token, Exception):
+                raise token
+            yield token
+    finally:
+        stopped.set()
@@ -0,0 +1,238 @@
+"""
+    This code defines the query log: an append-only record of the queries searched and answered,
+    to tune the retrieval and to replay the real traffic against the pipeline (see BENCHMARKS/benchmark_replay.py).
+
+    Each query is written as one JSON line, with:
+        when it was asked ("time"), what was asked ("kind": "search", "search_batch", "answer" or "answer_stream"),
+        the query strings ("queries", a single one except for the batches), the number of chunks asked ("k"), the metadata "filter"
+        and the "search_mode",
+        the chunks retrieved for each query ("results", their chunk ids, documents and scores, best first),
+        how long the request took ("seconds") and how long each of its stages took ("stages", timed with METRICS.trace),
+        and, for the answers, whether the answer came from the answer cache ("cache") and the tokens of the packed context.
+    A request failing is also logged, with its "error".
+
+    The log is written to QUERY_LOG_FILE_PATH (set in the .env file, no log is written if it is empty) and rotated
+    when it grows past QUERY_LOG_MAX_BYTES: the current file is renamed with the suffix ".1", the previous ".1" becomes ".2"
+    and so on, and only the QUERY_LOG_BACKUP_COUNT most recent rotated files are kept.
+    The lines are written whole under a lock, so the threads of the query server can share the log,
+    but two processes must not write to the same log.
+
+    The function iter_query_log reads the log back, from the oldest rotated file to the current one.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+from langchain.schema import Document
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.instrumentation import METRICS
+
+QUERY_LOG_KINDS = ("search", "search_batch", "answer", "answer_stream")
+
+
+class QueryLog:
+    """
+    Append-only JSON lines file, rotated by size.
+
+    Args:
+        - file_path (str): The path to the log file.
+        - max_bytes (int | None): The size past which the log file is rotated, 0 never rotates it, QUERY_LOG_MAX_BYTES in the .env file if None.
+        - backup_count (int | None): The number of rotated files kept, QUERY_LOG_BACKUP_COUNT in the .env file if None.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        max_bytes: int | None = None,
+        backup_count: int | None = None,
+    ) -> None:
+        if max_bytes is None:
+            max_bytes = int(os.getenv("QUERY_LOG_MAX_BYTES", "10000000"))
+        if backup_count is None:
+            backup_count = int(os.getenv("QUERY_LOG_BACKUP_COUNT", "5"))
+
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(file_path, "ab")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """Append a record to the log, rotating it first if the record would take it past max_bytes."""
+        line = (json.dumps(record, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            if (
+                self.max_bytes
+                and self._file.tell()
+                and self._file.tell() + len(line) > self.max_bytes
+            ):
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+        METRICS.increment("queries_logged")
+
+    def _rotate(self) -> None:
+        """Shift the rotated files by one, the oldest one is overwritten, and start a new log file."""
+        self._file.close()
+        if self.backup_count:
+            for number in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{self.file_path}.{number}"):
+                    os.replace(f"{self.file_path}.{number}", f"{self.file_path}.{number + 1}")
+            os.replace(self.file_path, f"{self.file_path}.1")
+        else:
+            os.remove(self.file_path)
+        self._file = open(self.file_path, "ab")
+
+    def close(self) -> None:
+        """Close the log file."""
+        with self._lock:
+            self._file.close()
+
+
+# The query log of the process, opened at the first query logged
+_query_log: QueryLog | None = None
+_query_log_lock = threading.Lock()
+
+
+def _get_query_log(
+    file_path: str | None = None,
+) -> QueryLog | None:
+    if file_path is None:
+        file_path = os.getenv("QUERY_LOG_FILE_PATH", "")
+
+    global _query_log
+    if not file_path:
+        return None
+    with _query_log_lock:
+        if _query_log is None:
+            _query_log = QueryLog(file_path=file_path)
+    return _query_log
+
+
+def serialize_results(docs_and_scores: List[Tuple[Document, float]]) -> List[Dict[str, Any]]:
+    """Keep the chunk id, the document and the score of each chunk retrieved, not its text."""
+    return [
+        {
+            "chunk_id": doc.metadata.get("chunk_id"),
+            "source": doc.metadata.get("source"),
+            "score": float(score),
+        }
+        for doc, score in docs_and_scores
+    ]
+
+
+@contextmanager
+def logged_queries(
+    kind: str,
+    queries: List[str],
+    k: int,
+    metadata_filter: Dict[str, Any] | None = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Time a request and its stages, and write it to the query log when it ends, even if it fails.
+
+    The block adds what it found to the record yielded: the "results" (see serialize_results), one list per query,
+    and, for the answers, the "cache" tier and the "context" report.
+
+    Args:
+        - kind (str): What the request does, one of QUERY_LOG_KINDS.
+        - queries (List[str]): The query strings of the request.
+        - k (int): The number of chunks asked for each query.
+        - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match.
+
+    Returns:
+        - Iterator[Dict[str, Any]]: The record of the request.
+    """
+
+    if kind not in QUERY_LOG_KINDS:
+        raise ValueError(f"Unknown query log kind {kind}, expected one of {QUERY_LOG_KINDS}")
+
+    record: Dict[str, Any] = {
+        "time": time.time(),
+        "kind": kind,
+        "queries": queries,
+        "k": k,
+        "filter": metadata_filter,
+        "search_mode": os.getenv("SEARCH_MODE", "hybrid"),
+    }
+    start_time = time.perf_counter()
+    try:
+        with METRICS.trace() as stages:
+            yield record
+    except Exception as exception:
+        record["error"] = repr(exception)
+        raise
+    finally:
+        record["seconds"] = time.perf_counter() - start_time
+        record["stages"] = stages
+        query_log = _get_query_log()
+        if query_log is not None:
+            query_log.write(record)
+
+
+def query_log_file_paths(
+    file_path: str | None = None,
+) -> List[str]:
+    """
+    List the files of the query log, from the oldest rotated file to the current one.
+
+    Args:
+        - file_path (str | None): The path to the log file, QUERY_LOG_FILE_PATH in the .env file if None.
+
+    Returns:
+        - List[str]: The paths to the files of the log that exist.
+    """
+
+    if file_path is None:
+        file_path = os.getenv("QUERY_LOG_FILE_PATH", "")
+
+    rotated = []
+    number = 1
+    while os.path.exists(f"{file_path}.{number}"):
+        rotated.append(f"{file_path}.{number}")
+        number += 1
+    file_paths = rotated[::-1]
+    if os.path.exists(file_path):
+        file_paths.append(file_path)
+
+    return file_paths
+
+
+def iter_query_log(
+    file_path: str | None = None,
+    kinds: Tuple[str, ...] = QUERY_LOG_KINDS,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Read the records of the query log, oldest first.
+
+    Args:
+        - file_path (str | None): The path to the log file, its rotated files are read first, QUERY_LOG_FILE_PATH in the .env file if None.
+        - kinds (Tuple[str, ...]): The kinds of the records read.
+
+    Returns:
+        - Iterator[Dict[str, Any]]: The records.
+    """
+
+    if file_path is None:
+        file_path = os.getenv("QUERY_LOG_FILE_PATH", "")
+
+    for log_file_path in query_log_file_paths(file_path=file_path):
+        with open(log_file_path, encoding="utf-8") as f:
+            for line in f:
+                # The last line of a log being written can be incomplete
+                if not line.endswith("\n"):
+                    break
+                record = json.loads(line)
+                if record["kind"] in kinds:
+                    yield record
@@ -0,0 +1,739 @@
+"""
+    This code defines the query server, a long-lived process answering queries over HTTP with the vectorstore kept in memory.
+
+    Running STEP 4 as a script loads the embeddings, the vectorstore, the language model and the question answering chain
+    for every query, the QueryService loads them once and reuses them:
+        the queries are embedded by the embeddings backend (behind the embeddings cache), over pooled HTTP connections
+        for the Hub backend or by the model kept in memory for the local backend,
+        the answers are written by the question answering chain, whose PooledHuggingFaceHub model also reuses its connections, and
+        the vectorstore stays in memory and is only loaded again when the saved vectorstore changes on disk.
+
+    A background thread checks the saved vectorstore every reload_interval_seconds, loads the new one next to the current one
+    and swaps them in a single assignment, so the queries being answered keep the vectorstore they started with
+    and a vectorstore that fails to load never replaces a working one.
+
+    The QueryServer is a threaded HTTP server, so several queries are answered at the same time:
+        GET /health returns the number of chunks in the vectorstore, when it was loaded and the stats of the answer cache,
+        POST /search with {"query": ..., "k": ...} returns the k most similar chunks and their scores,
+        POST /search_batch with {"queries": [...], "k": ...} returns them for each query, searched in batches,
+        POST /search_vectors with {"embeddings": [[...]], "k": ...} returns them for each query embedding (see below),
+        POST /search_lexical with {"queries": [...], "k": ...} returns the k chunks with the best BM25 scores for each query (see below),
+        POST /answer with {"query": ..., "k": ...} also returns the answer of the question answering chain,
+        POST /answer_stream with {"query": ..., "k": ...} streams it token by token (see below), and
+        GET /metrics returns the stage timers and counters of the process, in the Prometheus text format.
+
+    The search and answer requests take an optional "filter", restricting the search to the chunks whose metadata match it,
+    for example {"query": ..., "filter": {"source": ["handbook"], "tags": ["hr"]}} (see step_4A_metadata_index).
+    The inverted index of the metadata is built when the vectorstore is loaded, not by the first filtered query.
+
+    A sharded vectorstore (see step_3_sharded_vectorstore) is loaded as a ShardedVectorstore, searching all its shards
+    for every query, and loaded again when its shard manifest changes. A query server can also serve a single shard
+    to the query server of a sharded vectorstore (VECTORSTORE_SHARD_URLS in its .env file):
+        POST /search_vectors with {"embeddings": [[...]], "k": ..., "filter": ...} returns the k closest chunks
+        to each query embedding, so the query is embedded once by the server fanning it out to the shards, and
+        POST /search_lexical with {"queries": [...], "k": ..., "filter": ...} returns the k chunks of the shard
+        with the best BM25 scores for each query, for the lexical side of the hybrid search.
+
+    The queries are searched with the hybrid search (see step_4A_hybrid_search): the lexical index of the vectorstore
+    is searched while the query is embedded and the FAISS index is searched, and the two rankings are fused,
+    so the scores returned are RRF scores (higher is better), or distances when SEARCH_MODE is "vector".
+
+    The answers are cached in an AnswerCache (see step_4B_answer_cache): a query asked again with the same retrieved chunks,
+    or a query close enough to a cached one, is answered without calling the language model.
+    The cache is cleared whenever a new vectorstore is loaded, and its hit rate is returned by GET /health.
+
+    The chunks are packed into the token budget of the prompt before the question answering chain is called
+    (see step_4B_context_packing), and POST /answer returns the report of the packing, with the tokens saved, under "context".
+
+    The searches and the answers are written to the query log (see step_4_query_log) when QUERY_LOG_FILE_PATH is set
+    in the .env file, with the chunks retrieved, their scores, the time of each stage and, for the answers, the cache tier.
+
+    POST /answer_stream takes the same requests as POST /answer and streams the answer as server-sent events:
+        a "documents" event with the retrieved chunks, sent as soon as they are found, before the language model is called,
+        a "token" event for each token of the answer, as soon as the language model generates it, and
+        a "done" event with the whole answer, the packing report and the time to the first token and the tokens per second of the request,
+    or an "error" event if the answer fails once the stream has started.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+from langchain import FAISS
+from langchain.schema import Document
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.embeddings_cache import load_cached_embeddings
+from HELPERS.instrumentation import METRICS, prometheus_text
+from HELPERS.step_3_sharded_vectorstore import SHARD_MANIFEST_FILE_NAME, shards_path
+from HELPERS.step_4A_create_similarity_search_docs import (
+    create_similarity_search_docs_batch,
+    default_vectorstore_path,
+    load_vectorstore,
+)
+from HELPERS.step_4A_hybrid_search import hybrid_search
+from HELPERS.step_4A_metadata_index import validate_metadata_filter
+from HELPERS.step_4A_sharded_search import (
+    ShardedVectorstore,
+    search_lexical,
+    search_vectors,
+    shard_urls_from_env,
+    vectorstore_size,
+)
+from HELPERS.step_4_query_log import logged_queries, serialize_results
+from HELPERS.step_4B_answer_cache import AnswerCache
+from HELPERS.step_4B_context_packing import pack_context
+from HELPERS.step_4B_using_similarity_search_docs_for_QA import (
+    Q_and_A_implementation,
+    load_hub_qa_chain,
+    stream_Q_and_A_implementation,
+)
+
+# The routes answering POST requests
+POST_ROUTES = (
+    "/search",
+    "/search_batch",
+    "/search_vectors",
+    "/search_lexical",
+    "/answer",
+    "/answer_stream",
+)
+
+
+def _vectorstore_signature(path_to_vectorstore: str) -> Tuple | None:
+    """Identify the saved vectorstore by the inode, modification time and size of its files, None if it isn't saved."""
+    # The shard servers are loaded once, a sharded vectorstore is identified by its shard manifest, saved last
+    shard_urls = shard_urls_from_env()
+    if shard_urls:
+        return tuple(shard_urls)
+    shard_manifest_path = os.path.join(
+        shards_path(path_to_vectorstore), SHARD_MANIFEST_FILE_NAME
+    )
+    file_paths = [shard_manifest_path]
+    if not os.path.exists(shard_manifest_path):
+        file_paths = [
+            os.path.join(path_to_vectorstore, file_name)
+            for file_name in ("index.faiss", "index.pkl")
+        ]
+
+    try:
+        stats = [os.stat(file_path) for file_path in file_paths]
+    except FileNotFoundError:
+        return None
+
+    return tuple((stat.st_ino, stat.st_mtime_ns, stat.st_size) for stat in stats)
+
+
+class QueryService:
+    """
+    Answers queries with the embeddings, the vectorstore and the question answering chain kept in memory.
+
+    Args:
+        - huggingfacehub_api_token (str | None): The Hugging Face Hub API token.
+        - path_to_vectorstore (str | None): The path to the vectorstore file, the one set in the .env file if None.
+        - reload_interval_seconds (float | None): How often the saved vectorstore is checked for changes, 0 never checks, QUERY_SERVER_RELOAD_INTERVAL_SECONDS in the .env file if None.
+        - answer_cache (AnswerCache | None): The cache of the answers, configured from the .env file if None.
+    """
+
+    def __init__(
+        self,
+        huggingfacehub_api_token: str | None = None,
+        path_to_vectorstore: str | None = None,
+        reload_interval_seconds: float | None = None,
+        answer_cache: AnswerCache | None = None,
+    ) -> None:
+        if reload_interval_seconds is None:
+            reload_interval_seconds = float(os.getenv("QUERY_SERVER_RELOAD_INTERVAL_SECONDS", "5"))
+
+        self.path_to_vectorstore = path_to_vectorstore or default_vectorstore_path()
+        self.reload_interval_seconds = reload_interval_seconds
+        self.answer_cache = answer_cache if answer_cache is not None else AnswerCache()
+
+        # Embed the queries with the embeddings backend, behind the embeddings cache
+        self.embeddings = load_cached_embeddings(
+            huggingfacehub_api_token=huggingfacehub_api_token
+        )
+        self.chain = load_hub_qa_chain(
+            huggingfacehub_api_token=huggingfacehub_api_token, verbose=False
+        )
+
+        self.vectorstore: FAISS | ShardedVectorstore | None = None
+        self.signature: Tuple | None = None
+        self.loaded_at: float | None = None
+        self.reloads = 0
+        self._reload_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        if not self.reload_if_changed():
+            raise ValueError(f"No vectorstore could be loaded from {self.path_to_vectorstore}")
+
+        if reload_interval_seconds:
+            threading.Thread(target=self._watch, daemon=True).start()
+
+    def reload_if_changed(self) -> bool:
+        """
+        Load the saved vectorstore again if it changed on disk, and swap it in.
+
+        Returns:
+            - bool: Whether a new vectorstore was swapped in.
+        """
+
+        with self._reload_lock:
+            signature = _vectorstore_signature(self.path_to_vectorstore)
+            if signature is None or signature == self.signature:
+                return False
+
+            try:
+                vectorstore = load_vectorstore(
+                    path_to_vectorstore=self.path_to_vectorstore,
+                    embeddings=self.embeddings,
+                    build_metadata_index=True,
+                )
+            except Exception as exception:
+                # Keep the current vectorstore, the next check tries again
+                print(f"Could not load the vectorstore: {exception!r}")
+                return False
+
+            # A single assignment, the queries in flight keep the vectorstore they started with
+            self.vectorstore = vectorstore
+            # The cached answers were written from the chunks of the previous vectorstore
+            self.answer_cache.clear()
+            self.signature = signature
+            self.loaded_at = time.time()
+            self.reloads += 1
+
+            return True
+
+    def _watch(self) -> None:
+        """Check the saved vectorstore for changes until the service is closed."""
+        while not self._stopped.wait(self.reload_interval_seconds):
+            self.reload_if_changed()
+
+    def close(self) -> None:
+        """Stop checking the saved vectorstore for changes."""
+        self._stopped.set()
+
+    def search(
+        self, query: str, k: int = 4, metadata_filter: Dict[str, Any] | None = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        Find the chunks most similar to the query.
+
+        Args:
+            - query (str): The query string.
+            - k (int): The number of chunks to return.
+            - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+        Returns:
+            - List[Tuple[Document, float]]: The chunks and their scores, best first.
+        """
+
+        with logged_queries(
+            kind="search", queries=[query], k=k, metadata_filter=metadata_filter
+        ) as record:
+            _, docs_and_scores = self._search_query(
+                query=query, k=k, metadata_filter=metadata_filter
+            )
+            record["results"] = [serialize_results(docs_and_scores)]
+
+        return docs_and_scores
+
+    def _search_query(
+        self, query: str, k: int, metadata_filter: Dict[str, Any] | None
+    ) -> Tuple[np.ndarray, List[Tuple[Document, float]]]:
+        """Embed the query and find the chunks most similar to it, returning both."""
+        with METRICS.timer("similarity_search"):
+            query_embeddings, [docs_and_scores] = hybrid_search(
+                vectorstore=self.vectorstore,
+                queries=[query],
+                embed_queries=lambda queries: [
+                    self.embeddings.embed_query(text) for text in queries
+                ],
+                k=k,
+                metadata_filter=metadata_filter,
+            )
+
+        return query_embeddings[0], docs_and_scores
+
+    def search_vectors(
+        self,
+        query_embeddings: List[List[float]],
+        k: int = 4,
+        metadata_filter: Dict[str, Any] | None = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Find the chunks closest to query embeddings, for the query server of a sharded vectorstore.
+
+        Args:
+            - query_embeddings (List[List[float]]): The embeddings of the queries.
+            - k (int): The number of chunks to return for each query.
+            - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+        Returns:
+            - List[List[Tuple[Document, float]]]: For each query, the chunks and their distances to the query, closest first.
+        """
+
+        with METRICS.timer("search_vectors"):
+            return search_vectors(
+                vectorstore=self.vectorstore,
+                query_embeddings=np.asarray(query_embeddings, dtype=np.float32),
+                k=k,
+                metadata_filter=metadata_filter,
+            )
+
+    def search_lexical(
+        self,
+        queries: List[str],
+        k: int = 4,
+        metadata_filter: Dict[str, Any] | None = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Find the chunks with the best BM25 scores for each query, for the query server of a sharded vectorstore.
+
+        Args:
+            - queries (List[str]): The query strings.
+            - k (int): The number of chunks to return for each query.
+            - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+        Returns:
+            - List[List[Tuple[Document, float]]]: For each query, the chunks and their BM25 scores, best first.
+        """
+
+        return search_lexical(
+            vectorstore=self.vectorstore,
+            queries=queries,
+            k=k,
+            metadata_filter=metadata_filter,
+        )
+
+    def search_batch(
+        self,
+        queries: List[str],
+        k: int = 4,
+        metadata_filter: Dict[str, Any] | None = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Find the chunks most similar to each query, embedding and searching the queries in batches.
+
+        Args:
+            - queries (List[str]): The query strings.
+            - k (int): The number of chunks to return for each query.
+            - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+        Returns:
+            - List[List[Tuple[Document, float]]]: For each query, the chunks and their scores, best first.
+        """
+
+        return create_similarity_search_docs_batch(
+            queries=queries,
+            vectorstore=self.vectorstore,
+            embeddings=self.embeddings,
+            k=k,
+            metadata_filter=metadata_filter,
+        )
+
+    def answer(
+        self, query: str, k: int = 4, metadata_filter: Dict[str, Any] | None = None
+    ) -> Tuple[str, List[Tuple[Document, float]], Dict[str, int] | None]:
+        """
+        Answer the query from the chunks most similar to it, or from the answer cache.
+
+        Args:
+            - query (str): The query string.
+            - k (int): The number of chunks given to the question answering chain.
+            - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+        Returns:
+            - Tuple[str, List[Tuple[Document, float]], Dict[str, int] | None]: The answer, the chunks it was written from
+                with their scores, and the report of the packing of the chunks into the prompt (None for a cached answer).
+        """
+
+        with logged_queries(
+            kind="answer", queries=[query], k=k, metadata_filter=metadata_filter
+        ) as record:
+            answer, docs_and_scores, context_report, tier = self._answer(
+                query=query, k=k, metadata_filter=metadata_filter
+            )
+            record["results"] = [serialize_results(docs_and_scores)]
+            record["cache"] = tier
+            record["context"] = context_report
+
+        return answer, docs_and_scores, context_report
+
+    def _answer(
+        self, query: str, k: int, metadata_filter: Dict[str, Any] | None
+    ) -> Tuple[str, List[Tuple[Document, float]], Dict[str, int] | None, str | None]:
+        """Answer the query, returning the cache tier the answer came from as well (None if it was written now)."""
+        # The generation before the search, an answer written from a vectorstore replaced since isn't cached
+        generation = self.answer_cache.generation
+        query_embedding, docs_and_scores = self._search_query(
+            query=query, k=k, metadata_filter=metadata_filter
+        )
+
+        cached = self.answer_cache.lookup(
+            query=query,
+            query_embedding=query_embedding,
+            docs_and_scores=docs_and_scores,
+            k=k,
+            metadata_filter=metadata_filter,
+        )
+        if cached is not None:
+            answer, docs_and_scores, tier = cached
+            return answer, docs_and_scores, None, tier
+
+        passages, context_report = pack_context(docs=[doc for doc, _ in docs_and_scores])
+        answer = Q_and_A_implementation(
+            similarity_search_docs=passages,
+            query=query,
+            chain=self.chain,
+            pack_context_docs=False,
+        )
+        self.answer_cache.store(
+            query=query,
+            query_embedding=query_embedding,
+            docs_and_scores=docs_and_scores,
+            answer=answer,
+            k=k,
+            metadata_filter=metadata_filter,
+            generation=generation,
+        )
+
+        return answer, docs_and_scores, context_report, None
+
+    def stream_answer(
+        self, query: str, k: int = 4, metadata_filter: Dict[str, Any] | None = None
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Answer the query from the chunks most similar to it, or from the answer cache, streaming the tokens of the answer.
+
+        Args:
+            - query (str): The query string.
+            - k (int): The number of chunks given to the question answering chain.
+            - metadata_filter (Dict[str, Any] | None): The conditions the metadata of the chunks must match, all the chunks if None.
+
+        Returns:
+            - Iterator[Tuple[str, Dict[str, Any]]]: The events of the answer and their data: "documents" with the chunks
+                and their scores, "token" with the text of each token, and "done" with the whole answer and the stats of the request.
+        """
+
+        with logged_queries(
+            kind="answer_stream", queries=[query], k=k, metadata_filter=metadata_filter
+        ) as record:
+            for event, data in self._stream_answer(
+                query=query, k=k, metadata_filter=metadata_filter
+            ):
+                if event == "documents":
+                    record["results"] = [serialize_results(data["documents"])]
+                elif event == "done":
+                    record["cache"] = data["cache"]
+                    record["context"] = data["context"]
+                    record["stream"] = data["stream"]
+                yield event, data
+
+    def _stream_answer(
+        self, query: str, k: int, metadata_filter: Dict[str, Any] | None
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Answer the query, streaming the events of the answer."""
+        started_at = time.perf_counter()
+        generation = self.answer_cache.generation
+        query_embedding, docs_and_scores = self._search_query(
+            query=query, k=k, metadata_filter=metadata_filter
+        )
+
+        cached = self.answer_cache.lookup(
+            query=query,
+            query_embedding=query_embedding,
+            docs_and_scores=docs_and_scores,
+            k=k,
+            metadata_filter=metadata_filter,
+        )
+        if cached is not None:
+            answer, docs_and_scores, tier = cached
+            yield "documents", {"documents": docs_and_scores}
+            yield "token", {"text": answer}
+            yield "done", {
+                "answer": answer,
+                "context": None,
+                "cache": tier,
+                "stream": {
+                    "time_to_first_token_seconds": time.perf_counter() - started_at,
+                    "tokens": 1,
+                },
+            }
+            return
+
+        # The chunks are sent before the language model is called, so they can be shown while the answer is generated
+        yield "documents", {"documents": docs_and_scores}
+
+        passages, context_report = pack_context(docs=[doc for doc, _ in docs_and_scores])
+        stream_stats: Dict[str, float] = {}
+        tokens = []
+        for token in stream_Q_and_A_implementation(
+            similarity_search_docs=passages,
+            query=query,
+            chain=self.chain,
+            pack_context_docs=False,
+            started_at=started_at,
+            stream_stats=stream_stats,
+        ):
+            tokens.append(token)
+            yield "token", {"text": token}
+
+        answer = "".join(tokens)
+        self.answer_cache.store(
+            query=query,
+            query_embedding=query_embedding,
+            docs_and_scores=docs_and_scores,
+            answer=answer,
+            k=k,
+            metadata_filter=metadata_filter,
+            generation=generation,
+        )
+
+        yield "done", {
+            "answer": answer,
+            "context": context_report,
+            "cache": None,
+            "stream": stream_stats,
+        }
+
+    def health(self) -> Dict[str, Any]:
+        """Return the number of chunks in the vectorstore, when it was loaded and how many times, and the stats of the answer cache."""
+        return {
+            "chunks": vectorstore_size(self.vectorstore),
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "answer_cache": self.answer_cache.stats(),
+        }
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering queries with a QueryService.
+
+    Args:
+        - server_address (Tuple[str, int]): The host and port to listen on, port 0 picks a free port.
+        - service (QueryService): The service answering the queries.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address: Tuple[str, int], service: QueryService) -> None:
+        super().__init__(server_address, QueryRequestHandler)
+        self.service = service
+
+    @property
+    def url(self) -> str:
+        """The url of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def _serialize_docs_and_scores(
+    docs_and_scores: List[Tuple[Document, float]]
+) -> List[Dict]:
+    return [
+        {"page_content": doc.page_content, "metadata": doc.metadata, "score": float(score)}
+        for doc, score in docs_and_scores
+    ]
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """Request handler of the QueryServer."""
+
+    server: QueryServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        """Keep the console quiet."""
+
+    def _send_json(self, status_code: int, body) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_events(self, events: Iterator[Tuple[str, Dict[str, Any]]]) -> None:
+        """Send the events as server-sent events, each one in its own chunk as soon as it is produced."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(event: str, data: Dict[str, Any]) -> None:
+            if "documents" in data:
+                data = {**data, "documents": _serialize_docs_and_scores(data["documents"])}
+            payload = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(payload):X}\r\n".encode("ascii") + payload + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            for event, data in events:
+                send(event, data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away, dropping the events closes the stream of the language model
+            return
+        except Exception as exception:
+            # The status was sent already, the error is sent as an event
+            send("error", {"error": repr(exception)})
+
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._send_json(200, self.server.service.health())
+            return
+
+        if self.path == "/metrics":
+            payload = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self._send_json(404, {"error": f"Unknown route {self.path}"})
+
+    def do_POST(self) -> None:
+        # Read the body even for an unknown route, so the connection can be reused
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.path not in POST_ROUTES:
+            self._send_json(404, {"error": f"Unknown route {self.path}"})
+            return
+
+        try:
+            request = json.loads(body or b"{}")
+            if self.path in ("/search_batch", "/search_lexical"):
+                queries = [str(query) for query in request["queries"]]
+            elif self.path == "/search_vectors":
+                query_embeddings = [
+                    [float(value) for value in embedding]
+                    for embedding in request["embeddings"]
+                ]
+            else:
+                query = request["query"]
+            k = int(request.get("k", 4))
+            metadata_filter = request.get("filter")
+        except (ValueError, KeyError, TypeError):
+            self._send_json(
+                400,
+                {
+                    "error": 'Expected {"query": ..., "k": ...}, {"queries": [...], "k": ...} or {"embeddings": [[...]], "k": ...}'
+                },
+            )
+            return
+
+        if metadata_filter is not None:
+            try:
+                validate_metadata_filter(metadata_filter)
+            except ValueError as exception:
+                self._send_json(400, {"error": str(exception)})
+                return
+
+        try:
+            if self.path == "/search_batch":
+                results = self.server.service.search_batch(
+                    queries=queries, k=k, metadata_filter=metadata_filter
+                )
+                self._send_json(
+                    200,
+                    {
+                        "results": [
+                            _serialize_docs_and_scores(docs_and_scores)
+                            for docs_and_scores in results
+                        ]
+                    },
+                )
+                return
+
+            if self.path in ("/search_vectors", "/search_lexical"):
+                if self.path == "/search_vectors":
+                    results = self.server.service.search_vectors(
+                        query_embeddings=query_embeddings, k=k, metadata_filter=metadata_filter
+                    )
+                else:
+                    results = self.server.service.search_lexical(
+                        queries=queries, k=k, metadata_filter=metadata_filter
+                    )
+                self._send_json(
+                    200,
+                    {
+                        "results": [
+                            _serialize_docs_and_scores(docs_and_scores)
+                            for docs_and_scores in results
+                        ]
+                    },
+                )
+                return
+
+            if self.path == "/search":
+                docs_and_scores = self.server.service.search(
+                    query=query, k=k, metadata_filter=metadata_filter
+                )
+                self._send_json(
+                    200, {"documents": _serialize_docs_and_scores(docs_and_scores)}
+                )
+                return
+
+            if self.path == "/answer_stream":
+                self._send_events(
+                    self.server.service.stream_answer(
+                        query=query, k=k, metadata_filter=metadata_filter
+                    )
+                )
+                return
+
+            if self.path == "/answer":
+                answer, docs_and_scores, context_report = self.server.service.answer(
+                    query=query, k=k, metadata_filter=metadata_filter
+                )
+                self._send_json(
+                    200,
+                    {
+                        "answer": answer,
+                        "documents": _serialize_docs_and_scores(docs_and_scores),
+                        "context": context_report,
+                    },
+                )
+                return
+        except Exception as exception:
+            self._send_json(500, {"error": repr(exception)})
+
+
+def start_query_server(
+    service: QueryService,
+    host: str | None = None,
+    port: int | None = None,
+) -> QueryServer:
+    """
+    Start the query server in a background thread.
+
+    Args:
+        - service (QueryService): The service answering the queries.
+        - host (str | None): The host to listen on, QUERY_SERVER_HOST in the .env file if None.
+        - port (int | None): The port to listen on, 0 picks a free port, QUERY_SERVER_PORT in the .env file if None.
+
+    Returns:
+        - QueryServer: The running server, its url attribute is the url to query and shutdown() stops it.
+    """
+
+    if host is None:
+        host = os.getenv("QUERY_SERVER_HOST", "127.0.0.1")
+    if port is None:
+        port = int(os.getenv("QUERY_SERVER_PORT", "8000"))
+
+    server = QueryServer(server_address=(host, port), service=service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
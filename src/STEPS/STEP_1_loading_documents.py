@@ -3,92 +3,169 @@
     
     The function uses the langchain package to load documents from different file types such as pdf or unstructured files. 
     
-    It then splits each document into smaller chunks using the CharacterTextSplitter class from the same package. 
+    It then splits each document into smaller chunks using the TextChunker class, configured in the .env file. 
+
+    The documents can be loaded and chunked in a pool of worker processes (INGEST_MAX_WORKERS in the .env file),
+    the files are processed in sorted order so the result comes back in the same order whatever the worker count.
     
-    The chunks are then saved in a dictionary format with keys such as “chunk_1”, “chunk_2”, etc. 
+    The texts of the chunks are kept in order, the chunk store gives each of them a stable id when they are saved. 
     
     Finally, the function returns a list of dictionaries containing the name of each document and its chunks.
+
+    When run, the script only loads the documents that are new or changed since the last run (according to the ingest manifest),
+    drops the chunks of the documents that were removed from the chunk store and saves the new state of the documents in the manifest.
 """
 
 import os
 import sys
-from dotenv import load_dotenv
-
-from langchain.document_loaders import UnstructuredFileLoader
-from langchain.document_loaders import PyPDFLoader
-
-from langchain.text_splitter import CharacterTextSplitter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 from typing import List, Dict, Union
 
-load_dotenv()  # Load environment variables from .env file
-
 # Add src directory to Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.config import load_config
+from HELPERS.instrumentation import (
+    METRICS,
+    collect_metrics,
+    save_run_report,
+    start_metrics_server,
+)
+from HELPERS.step_1_load_and_chunk_document import (
+    load_and_chunk_document,
+    merge_document_parts,
+    plan_document_parts,
+)
+from HELPERS.step_1_ingest_manifest import load_manifest, save_manifest, scan_documents
 from HELPERS.step_1_save_chunked_docs import save_documents
 
 
+@METRICS.timed("load_documents")
 def load_documents(
-    docs_directory_path: str = os.getenv("DIRECTORY_DOCUMENTS_TO_LOAD"),
-) -> List[Dict[str, Union[str, List[Dict[str, str]]]]]:
+    docs_directory_path: str | None = None,
+    max_workers: int | None = None,
+    file_names: List[str] | None = None,
+) -> List[Dict[str, Union[str, List[str]]]]:
     """
     Load documents from a directory and return a list of dictionaries containing the name of each document and its chunks.
 
+    When max_workers is greater than 1, the documents are parsed and chunked in a pool of worker processes,
+    the pages of the large pdf files being spread across the workers.
+    The files are always processed in sorted order, so the result is the same whatever the worker count.
+
     Args:
-        docs_directory_path (str): The path to the directory containing the documents to load.
+        docs_directory_path (str | None): The path to the directory containing the documents to load, DIRECTORY_DOCUMENTS_TO_LOAD in the .env file if None.
+        max_workers (int | None): The number of worker processes used to load and chunk the documents, INGEST_MAX_WORKERS in the .env file if None.
+        file_names (List[str] | None): The names of the files to load, all the files in the directory are loaded if None.
 
     Returns:
-        List[Dict[str, Union[str, List[Dict[str, str]]]]]: A list of dictionaries containing the name of each document and its chunks.
+        List[Dict[str, Union[str, List[str]]]]: A list of dictionaries containing the name of each document and its chunks.
     """
 
+    if docs_directory_path is None:
+        docs_directory_path = os.getenv("DIRECTORY_DOCUMENTS_TO_LOAD")
+    if max_workers is None:
+        max_workers = int(os.getenv("INGEST_MAX_WORKERS", "1"))
+
+    if file_names is None:
+        file_names = os.listdir(docs_directory_path)
+
+    # Sort the files so the order of the result doesn't depend on the file system
+    file_paths = [
+        os.path.join(docs_directory_path, file_name)
+        for file_name in sorted(file_names)
+    ]
+
+    # Load and chunk the documents one after another
+    if max_workers <= 1:
+        return [load_and_chunk_document(file_path) for file_path in file_paths]
+
+    # Split the large pdf files into ranges of pages, so a single file doesn't hold up the pool
+    # (a single large pdf file is still spread across the workers)
+    parts = plan_document_parts(file_paths=file_paths)
+    if len(parts) <= 1:
+        return [load_and_chunk_document(file_path) for file_path in file_paths]
+    part_file_paths, first_pages, last_pages = zip(*parts)
+
+    # Send the parts to the workers in small batches to cut down on the inter-process overhead,
+    # executor.map hands the results back in the order of parts
+    chunksize = max(1, len(parts) // (max_workers * 4))
     result = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        document_parts = []
+        for part_file_path, (document, measures) in zip(
+            part_file_paths,
+            executor.map(
+                collect_metrics,
+                repeat(load_and_chunk_document),
+                part_file_paths,
+                first_pages,
+                last_pages,
+                chunksize=chunksize,
+            ),
+        ):
+            # Add the measures taken in the worker processes
+            METRICS.merge(measures)
+
+            # Put the parts of each document back together
+            if document_parts and document_parts[0][0] != part_file_path:
+                result.append(merge_document_parts([part for _, part in document_parts]))
+                document_parts = []
+            document_parts.append((part_file_path, document))
+        result.append(merge_document_parts([part for _, part in document_parts]))
 
-    # Iterate through all the files in the directory
-    for file_name in os.listdir(docs_directory_path):
-        file_path = os.path.join(docs_directory_path, file_name)
+    return result
 
-        # Determine loader based on file type
-        if file_name.endswith(".pdf"):
-            loader = PyPDFLoader(file_path=file_path)
-        else:
-            loader = UnstructuredFileLoader(file_path=file_path)
 
-        # Load document
-        document = loader.load()
+"""################# CALLING THE FUNCTION #################"""
 
-        # Split document into smaller chunks
-        text_splitter = CharacterTextSplitter(
-            separator=" ",
-            chunk_size=200,
-            chunk_overlap=75,
-            length_function=len,
-        )
 
-        chunks = [
-            {"chunk_" + str(i + 1): chunk.page_content}
-            for i, chunk in enumerate(text_splitter.split_documents(documents=document))
-        ]
+def main() -> None:
+    """Load and chunk the new and changed documents and save their chunks."""
 
-        # Add document name and chunked data to result list
-        file_name = os.path.splitext(file_name)[0]
-        result.append({"name": file_name, "chunks": chunks})
+    load_config()  # Load environment variables from .env file
+    start_metrics_server()  # Serve the measures on METRICS_SERVER_PORT, if it is set
 
-    return result
+    print("\n####################### LOADING DOCUMENTS ########################\n")
 
+    # Find the documents that changed since the last run
+    manifest = load_manifest()
+    changed_documents, removed_file_names = scan_documents(
+        docs_directory_path=os.getenv("DIRECTORY_DOCUMENTS_TO_LOAD"),
+        manifest=manifest,
+    )
+
+    print(
+        f"{len(changed_documents)} new or changed documents, {len(removed_file_names)} removed documents"
+    )
+
+    # Load only the new and changed documents
+    loaded_and_chunked_docs = load_documents(file_names=list(changed_documents))
+
+    print("\n####################### DOCUMENTS LOADED ########################\n")
 
-"""################# CALLING THE FUNCTION #################"""
 
-print("\n####################### LOADING DOCUMENTS ########################\n")
+    print("\n####################### DOCUMENT CHUNKS LOADED ########################\n")
 
-# Load documents
-loaded_and_chunked_docs = load_documents()
+    # Save the chunks of the new and changed documents and drop the chunks of the removed documents
+    save_documents(
+        documents=loaded_and_chunked_docs,
+        removed_document_names=[
+            manifest["documents"][file_name]["name"] for file_name in removed_file_names
+        ],
+    )
 
-print("\n####################### DOCUMENTS LOADED ########################\n")
+    # Record the new state of the documents
+    for file_name in removed_file_names:
+        del manifest["documents"][file_name]
+    manifest["documents"].update(changed_documents)
+    save_manifest(manifest=manifest)
 
+    print("\n####################### DOCUMENT CHUNKS SAVED ########################\n")
 
-print("\n####################### DOCUMENT CHUNKS LOADED ########################\n")
+    save_run_report(name="STEP_1")
 
-# Save documents
-save_documents(documents=loaded_and_chunked_docs)
 
-print("\n####################### DOCUMENT CHUNKS SAVED ########################\n")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+    This code runs STEP 1, STEP 2 and STEP 3 in a single streaming pass, with a bounded memory use.
+
+    The documents are loaded and chunked, the chunks are embedded and the embeddings are added to the vectorstore
+    as they come, through the streaming pipeline, instead of holding every chunk and every embedding in memory between the steps.
+
+    The script always rebuilds everything from the documents directory: the chunk store, the embeddings and the vectorstore
+    are replaced, and the ingest manifest records every document as chunked, embedded and indexed,
+    so STEP 1, STEP 2 and STEP 3 can be used afterwards to update them incrementally.
+    The near duplicate chunks aren't eliminated (every chunk is embedded as it comes, before the whole chunk store is known),
+    the map of the near duplicates is emptied, and the next run of STEP 2 and STEP 3 eliminates them.
+
+    The size of the batches of chunks (STREAMING_BATCH_SIZE) and of the queues between the stages (STREAMING_MAX_QUEUE_SIZE)
+    are set in the .env file.
+"""
+
+import os
+import sys
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.config import load_config
+from HELPERS.embeddings_cache import load_cached_embeddings, load_embeddings_backend
+from HELPERS.instrumentation import METRICS, save_run_report, start_metrics_server
+from HELPERS.step_1_ingest_manifest import save_manifest, scan_documents
+from HELPERS.step_1_to_3_streaming_pipeline import run_streaming_pipeline
+from HELPERS.step_2_near_duplicates import find_near_duplicates, save_near_duplicates
+from HELPERS.step_3_save_vectorstore import save_vectorstore
+
+
+"""################# CALLING THE FUNCTION #################"""
+
+
+def main() -> None:
+    """Rebuild the chunk store, the embeddings and the vectorstore in a single streaming pass."""
+
+    load_config()  # Load environment variables from .env file
+    start_metrics_server()  # Serve the measures on METRICS_SERVER_PORT, if it is set
+
+    print("\n####################### STREAMING INGEST ########################\n")
+
+    docs_directory_path = os.getenv("DIRECTORY_DOCUMENTS_TO_LOAD")
+
+    # Hash every document, against an empty manifest since everything is rebuilt
+    manifest = {"documents": {}}
+    documents, _ = scan_documents(
+        docs_directory_path=docs_directory_path, manifest=manifest
+    )
+
+    # Load the embeddings backend, behind the embeddings cache
+    backend = load_embeddings_backend(
+        huggingfacehub_api_token=os.getenv("HUGGINGFACEHUB_API_TOKEN"),
+    )
+    embeddings = load_cached_embeddings(embeddings=backend)
+
+    vectorstore = run_streaming_pipeline(
+        file_paths=[
+            os.path.join(docs_directory_path, file_name)
+            for file_name in sorted(documents)
+        ],
+        embeddings=embeddings,
+        model_id=backend.repo_id,
+    )
+
+    print(f"Embeddings cache: {embeddings.stats()}")
+    print(f"Embeddings backend: {backend.stats()}")
+
+    print("\n####################### VECTORSTORE CREATED ########################\n")
+
+    with METRICS.timer("save_vectorstore"):
+        save_vectorstore(vectorstore=vectorstore, model_id=backend.repo_id)
+
+    # Every chunk was embedded and indexed, none is mapped to a representative
+    duplicates, near_duplicates_report = find_near_duplicates(chunks=[], threshold=0)
+    save_near_duplicates(duplicates=duplicates, report=near_duplicates_report)
+
+    # Record every document as chunked, embedded and indexed
+    for document in documents.values():
+        document["embedded_sha256"] = document["sha256"]
+        document["indexed_sha256"] = document["sha256"]
+    manifest["documents"].update(documents)
+    save_manifest(manifest=manifest)
+
+    print("\n####################### VECTORSTORE SAVED ########################\n")
+
+    save_run_report(name="STEP_1_to_3_streaming_ingest")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,86 +1,230 @@
 """ 
-    This code creates embeddings for a list of documents stored in JSON format. 
+    This code creates embeddings for the chunks stored in the chunk store written by STEP 1. 
 
     The create_embeddings function takes:
-        - a directory path as an argument, which contains JSON files with documents to be processed. 
+        - a directory path as an argument, which contains the chunk store to be processed. 
+
+    It streams the chunks from the chunk store in a single pass and keeps the id of each chunk with its embedding.
     
-    It uses the HuggingFaceHubEmbeddings object to create embeddings for each document and appends them to a list. 
-    The function then returns the list of embeddings.
+    It uses the embeddings backend chosen in the .env file (behind the embeddings cache) to create embeddings for the chunks of all the documents,
+    in batched, concurrent and rate limit aware requests to the Hugging Face Hub (EMBEDDINGS_BACKEND="hub"),
+    or with a model run locally on the CPU (EMBEDDINGS_BACKEND="local"), and stores them by document name. 
+    The function then returns the embeddings of each document.
+
+    When run, the script first maps the near duplicate chunks of the chunk store to their representative chunks
+    (see step_2_near_duplicates), they aren't embedded, and saves the map and a report of the savings for STEP 3.
+
+    It then only embeds the documents that are new or changed since the embeddings were last saved
+    (according to the ingest manifest written by STEP 1), or whose chunks kept after the near duplicate elimination changed,
+    and reuses the saved embeddings of the other documents.
 
     The script also includes a function called save_embeddings, which is used to save the embeddings to a 
-    binary file with a specified file name and directory path
+    float32 matrix file (with a small header) with a specified file name and directory path
 """
 
 import os
 import sys
-import json
-from typing import List
-
-from langchain.embeddings.base import Embeddings
-from langchain.embeddings import HuggingFaceHubEmbeddings
+from typing import Dict, List, Tuple
 
-from dotenv import load_dotenv
-
-load_dotenv()  # Load environment variables from .env file
+import numpy as np
 
 # Add src directory to Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.config import load_config
+from HELPERS.embeddings_cache import (
+    embeddings_model_id,
+    load_cached_embeddings,
+    load_embeddings_backend,
+)
+from HELPERS.instrumentation import METRICS, save_run_report, start_metrics_server
+from HELPERS.step_1_ingest_manifest import load_manifest, save_manifest
+from HELPERS.step_2_loading_chunks import iter_chunks
+from HELPERS.step_2_near_duplicates import (
+    chunk_digests,
+    save_near_duplicates,
+    savings_report,
+    update_near_duplicates,
+)
 from HELPERS.step_2_save_embeddings import save_embeddings
+from HELPERS.step_3_loading_embeddings import load_embeddings, embeddings_exist
 
 
+@METRICS.timed("create_embeddings")
 def create_embeddings(
-    load_json_chunks_directory: str = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS"),
-) -> List[Embeddings]:
+    load_json_chunks_directory: str | None = None,
+    document_names: List[str] | None = None,
+    duplicates: Dict[str, str] | None = None,
+) -> Tuple[Dict[str, List[List[float]]], Dict[str, List[str]]]:
     """
-    This function creates embeddings for a list of documents stored in JSON format.
+    This function creates embeddings for the chunks stored in the chunk store.
 
     Args:
-    - load_json_chunks_directory (str): The directory containing the JSON files to be processed.
+    - load_json_chunks_directory (str | None): The directory containing the chunk store, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
+    - document_names (List[str] | None): The names of the documents to embed, all the documents in the chunk store are embedded if None.
+    - duplicates (Dict[str, str] | None): The id of the representative of each near duplicate chunk, the near duplicates aren't embedded.
 
     Returns:
-    - List[Embeddings]: A list of embeddings for the documents.
+    - Tuple[Dict[str, List[List[float]]], Dict[str, List[str]]]:
+        - the embeddings of the chunks of each document, by document name,
+        - and the ids of the chunks of each document, in the same order.
     """
-    # Load the HuggingFaceHubEmbeddings object
-    embeddings = HuggingFaceHubEmbeddings(
-        huggingfacehub_api_token=os.getenv("HUGGINGFACEHUB_API_TOKEN")
+
+    if load_json_chunks_directory is None:
+        load_json_chunks_directory = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS")
+
+    # Load the embeddings backend, behind the embeddings cache
+    backend = load_embeddings_backend(
+        huggingfacehub_api_token=os.getenv("HUGGINGFACEHUB_API_TOKEN"),
     )
+    embeddings = load_cached_embeddings(embeddings=backend)
 
-    all_embeddings: list[Embeddings] = []
+    texts: list[str] = []
+    all_chunk_ids: Dict[str, List[str]] = {}
+    duplicates = duplicates or {}
 
-    # Loop through each JSON file in the directory
-    for filename in os.listdir(load_json_chunks_directory):
-        if filename.endswith(".json"):
-            # Load the documents from the JSON file
-            with open(os.path.join(load_json_chunks_directory, filename), "r") as f:
-                documents = json.load(f)
+    # Stream the chunks from the chunk store, in a single pass
+    for chunk in iter_chunks(
+        load_json_chunks_directory=load_json_chunks_directory,
+        document_names=document_names,
+    ):
+        # A document whose chunks are all near duplicates is kept, without embeddings
+        document_chunk_ids = all_chunk_ids.setdefault(chunk["document"], [])
+        if chunk["id"] in duplicates:
+            continue
+        texts.append(chunk["text"])
+        document_chunk_ids.append(chunk["id"])
 
-            texts: list[str] = []
-            # Extract the text from each document
-            for doc in documents:
-                for key, value in doc.items():
-                    texts.append(value)
-                    break
+    # Embed the chunks of all the documents together, so the backend packs them into full batches
+    embeddings_list = embeddings.embed_documents(texts) if texts else []
 
-            # Embed the documents using the HuggingFaceHubEmbeddings object
-            embeddings_list = embeddings.embed_documents(texts)
+    # Split the embeddings back by document name
+    all_embeddings: Dict[str, List[List[float]]] = {}
+    start = 0
+    for document_name, chunk_ids in all_chunk_ids.items():
+        all_embeddings[document_name] = embeddings_list[start : start + len(chunk_ids)]
+        start += len(chunk_ids)
 
-            # Add the embeddings to the list of all embeddings
-            all_embeddings.extend(embeddings_list)
+    print(f"Embeddings cache: {embeddings.stats()}")
+    print(f"Embeddings backend: {backend.stats()}")
 
-    return all_embeddings
+    return all_embeddings, all_chunk_ids
 
 
 """################# CALLING THE FUNCTION #################"""
 
 
-print("\n####################### CREATING EMBEDDINGS ########################\n")
+def main() -> None:
+    """Embed the chunks of the new and changed documents and save the embeddings."""
+
+    load_config()  # Load environment variables from .env file
+    start_metrics_server()  # Serve the measures on METRICS_SERVER_PORT, if it is set
+
+    print("\n####################### CREATING EMBEDDINGS ########################\n")
+
+    # The id of the model the embeddings are created with, saved with the embeddings
+    model_id = embeddings_model_id()
+
+    manifest = load_manifest()
+    documents = manifest["documents"].values()
+
+    # Map the near duplicate chunks of the whole chunk store to their representatives, they aren't embedded,
+    # only the chunks added since the last run are hashed
+    duplicates, near_duplicates_report = update_near_duplicates()
+    digests = chunk_digests(duplicates=duplicates)
+    kept_digests, all_digests = digests["kept"], digests["all"]
+
+    # Reuse the embeddings of the documents that didn't change since the last run
+    previous_embeddings = None
+    if documents and embeddings_exist():
+        previous_embeddings = load_embeddings()
+
+        # Embeddings saved by older versions can't be matched to their chunks,
+        # and embeddings of another model can't be mixed with new ones
+        if previous_embeddings.ids is None or previous_embeddings.model_id not in (
+            None,
+            model_id,
+        ):
+            previous_embeddings = None
+
+    if documents:
+        # The embeddings saved before the elimination of the near duplicates were created from all the chunks
+        document_names = [
+            document["name"]
+            for document in documents
+            if document.get("embedded_sha256") != document["sha256"]
+            or previous_embeddings is None
+            or document["name"] not in previous_embeddings
+            or document.get("embedded_chunks_sha256", all_digests.get(document["name"]))
+            != kept_digests.get(document["name"])
+        ]
+    else:
+        # No manifest, embed every document in the chunk store
+        document_names = None
+
+    print(
+        f"Embedding {'all' if document_names is None else len(document_names)} documents"
+    )
+
+    # Creating the embeddings
+    new_embeddings, new_chunk_ids = create_embeddings(
+        document_names=document_names, duplicates=duplicates
+    )
+
+    # Drop the embeddings of removed documents and replace the ones of changed documents,
+    # the embeddings kept are views of the memory mapped matrix and are copied straight to the new file
+    current_document_names = {document["name"] for document in documents}
+    embeddings = {}
+    chunk_ids = {}
+    if previous_embeddings is not None:
+        for document_name in previous_embeddings.names():
+            if document_name in current_document_names:
+                embeddings[document_name] = previous_embeddings[document_name]
+                chunk_ids[document_name] = previous_embeddings.chunk_ids(document_name)
+    embeddings.update(new_embeddings)
+    chunk_ids.update(new_chunk_ids)
+
+    print("\n####################### EMBEDDINGS CREATED ########################\n")
+
+    print("\n####################### SAVING EMBEDDINGS ########################\n")
+    with METRICS.timer("save_embeddings"):
+        save_embeddings(
+            embeddings=embeddings, chunk_ids=chunk_ids, model_id=model_id
+        )
+
+    # Save the map of the near duplicates for STEP 3, with what not embedding them saved
+    dimension = next(
+        (
+            np.shape(document_embeddings)[1]
+            for document_embeddings in embeddings.values()
+            if len(document_embeddings)
+        ),
+        0,
+    )
+    if near_duplicates_report["duplicates"]:
+        near_duplicates_report = savings_report(
+            report=near_duplicates_report, dimension=dimension
+        )
+        print(
+            f"Near duplicates: {near_duplicates_report['duplicates']} of {near_duplicates_report['chunks']} chunks "
+            f"({near_duplicates_report['embeddings_saved_ratio']:.1%}) mapped to a representative, "
+            f"{near_duplicates_report['index_vector_bytes_saved']:,} bytes of vectors not indexed"
+        )
+        METRICS.increment("embeddings_saved", near_duplicates_report["embeddings_saved"])
+    save_near_duplicates(
+        duplicates=duplicates, report=near_duplicates_report, chunk_digests=digests
+    )
+
+    # Record which version of each document, and which of its chunks, the embeddings were created from
+    for document in documents:
+        if document["name"] in embeddings:
+            document["embedded_sha256"] = document["sha256"]
+            document["embedded_chunks_sha256"] = kept_digests.get(document["name"])
+    save_manifest(manifest=manifest)
 
-# Creating the embeddings
-embeddings = create_embeddings()
+    print("\n####################### EMBEDDINGS SAVED ########################\n")
 
-print("\n####################### EMBEDDINGS CREATED ########################\n")
+    save_run_report(name="STEP_2")
 
-print("\n####################### SAVING EMBEDDINGS ########################\n")
-save_embeddings(embeddings=embeddings)
 
-print("\n####################### EMBEDDINGS SAVED ########################\n")
+if __name__ == "__main__":
+    main()
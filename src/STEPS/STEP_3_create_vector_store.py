@@ -1,100 +1,505 @@
 """
-    This code creates a vector store from JSON files. The function takes two arguments: 
+    This code creates a vector store from the chunk store written by STEP 1. The function takes two arguments: 
         - json_files_directory and huggingfacehub_api_token. 
     
-    The json_files_directory argument is the directory where the JSON files are stored. 
+    The json_files_directory argument is the directory where the chunk store is saved. 
     The huggingfacehub_api_token argument is the API token for Hugging Face Hub.
 
-    The function loads the HuggingFaceHubEmbeddings object and the embeddings from disk. 
+    The function loads the embeddings backend chosen in the .env file and the embeddings from disk. 
     
-    It then creates an empty list to store the texts. 
-    
-    The function loops through each file in the directory and adds the text to the list of texts. 
-    
-    It then combines the texts and embeddings into a list of tuples.
+    The function streams the chunks from the chunk store one document at a time, finds the embedding of each chunk by its id,
+    adds the embeddings of each document to a FAISS index (straight from the memory mapped matrix when their rows are contiguous),
+    and adds the text of each chunk to the docstore, with its document name, page, chunk index, ingest time and tags as metadata.
+    The near duplicate chunks found by STEP 2 (see step_2_near_duplicates) are skipped, only their representatives are indexed.
+
+    The type of the FAISS index (flat, ivf_flat, hnsw or ivf_pq) and its parameters are set in the .env file,
+    the ivf_flat and ivf_pq indexes are trained on a random sample of the loaded embeddings before the vectors are added.
+
+    Finally, it creates a FAISS object from the index and the docstore and returns it.
+
+    When run, the script updates the saved vectorstore instead of rebuilding it: the chunks of removed and changed documents
+    (according to the ingest manifest written by STEP 1) are removed and the chunks of new and changed documents are added,
+    a document whose chunks kept after the near duplicate elimination changed counts as changed.
+    Only flat indexes are updated this way: the other index types are rebuilt from the saved embeddings,
+    which also trains them again on the current documents.
 
-    Finally, it creates a FAISS object from the embeddings and text embeddings and returns it.
+    When VECTORSTORE_SHARDS (in the .env file) is greater than 1, the script builds a sharded vectorstore instead
+    (see step_3_sharded_vectorstore): the documents are assigned to the shards, each shard is built and saved
+    as its own vectorstore by a pool of VECTORSTORE_SHARD_MAX_WORKERS threads, and the shard manifest is saved last.
+    The shards whose documents are the same and unchanged since the last build are kept as they are.
 """
 
-import json
 import os
+import shutil
 import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
 
-from langchain import FAISS
-from langchain.embeddings import HuggingFaceHubEmbeddings
-from dotenv import load_dotenv
+import numpy as np
 
-load_dotenv()  # Load environment variables from .env file
+from langchain import FAISS
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
 
 # Add src directory to Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from HELPERS.step_3_loading_embeddings import load_embeddings
+from HELPERS.config import load_config
+from HELPERS.embeddings_cache import embeddings_model_id, load_cached_embeddings
+from HELPERS.instrumentation import METRICS, save_run_report, start_metrics_server
+from HELPERS.step_1_chunk_store import ChunkStore, chunk_store_file_path
+from HELPERS.step_1_ingest_manifest import load_manifest, save_manifest
+from HELPERS.step_2_loading_chunks import iter_documents
+from HELPERS.step_2_near_duplicates import load_chunk_digests, load_near_duplicates
+from HELPERS.step_3_index_types import (
+    build_index,
+    index_config_from_env,
+    load_index_config,
+    needs_training,
+    sample_training_vectors,
+)
+from HELPERS.step_3_loading_embeddings import EmbeddingMatrix, load_embeddings
 from HELPERS.step_3_save_vectorstore import save_vectorstore
+from HELPERS.step_3_sharded_vectorstore import (
+    assign_shards,
+    load_shard_manifest,
+    save_shard_manifest,
+    shard_name,
+    shards_path,
+)
+from HELPERS.step_3_update_vectorstore import remove_documents_from_vectorstore
+
 
+def changed_documents(
+    documents: List[Dict[str, Any]],
+    json_files_directory: str | None = None,
+) -> List[str]:
+    """
+    Find the documents whose chunks must be indexed again: the ones that changed since they were indexed,
+    and the ones whose chunks kept after the near duplicate elimination changed.
+
+    Args:
+        documents (List[Dict[str, Any]]): The documents of the ingest manifest.
+        json_files_directory (str | None): The directory where the chunk store is saved, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
+
+    Returns:
+        List[str]: The names of the documents to index again.
+    """
+
+    # The digests saved by STEP 2, the vectorstores built before the elimination of the near duplicates have all the chunks
+    digests = load_chunk_digests(json_files_directory=json_files_directory)
+    kept_digests, all_digests = digests["kept"], digests["all"]
+
+    return [
+        document["name"]
+        for document in documents
+        if document.get("indexed_sha256") != document["sha256"]
+        or document.get("indexed_chunks_sha256", all_digests.get(document["name"]))
+        != kept_digests.get(document["name"])
+    ]
 
+
+@METRICS.timed("create_vectorstore")
 def create_vectorstore_from_json(
-    json_files_directory: str = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS"),
+    json_files_directory: str | None = None,
     huggingfacehub_api_token: str | None = None,
+    document_names: List[str] | None = None,
+    index_config: Dict[str, Any] | None = None,
+    embeddings: Embeddings | None = None,
+    loaded_embeddings: EmbeddingMatrix | None = None,
+    duplicates: Dict[str, str] | None = None,
 ) -> FAISS:
     """
-    This function creates a vector store from JSON files.
+    This function creates a vector store from the chunk store.
+
+    Each chunk is matched to its embedding by id, and the embeddings of a document are added to the FAISS index
+    straight from the memory mapped matrix when their rows are contiguous.
 
     Args:
-        json_files_directory (str): The directory where the JSON files are stored.
+        json_files_directory (str | None): The directory where the chunk store is saved, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
         huggingfacehub_api_token (str): The API token for Hugging Face Hub.
+        document_names (List[str] | None): The names of the documents to add, all the documents in the chunk store are added if None.
+        index_config (Dict[str, Any] | None): The type of the FAISS index and its parameters, read from the .env file if None.
+        embeddings (Embeddings | None): The embeddings backend embedding the queries, the one chosen in the .env file if None.
+        loaded_embeddings (EmbeddingMatrix | None): The embeddings of the chunks, loaded from disk if None.
+        duplicates (Dict[str, str] | None): The id of the representative of each near duplicate chunk, not indexed, the map saved by STEP 2 if None.
 
     Returns:
         FAISS: A FAISS object containing the embeddings.
     """
 
-    # Load the HuggingFaceHubEmbeddings object
-    embeddings = HuggingFaceHubEmbeddings(
-        huggingfacehub_api_token=huggingfacehub_api_token
-    )
+    if json_files_directory is None:
+        json_files_directory = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS")
+
+    # Load the embeddings backend chosen in the .env file, behind the embeddings cache
+    if embeddings is None:
+        embeddings = load_cached_embeddings(
+            huggingfacehub_api_token=huggingfacehub_api_token
+        )
 
     # Load the embeddings from disk
-    loaded_embeddings = load_embeddings()
+    if loaded_embeddings is None:
+        loaded_embeddings = load_embeddings()
+
+    if loaded_embeddings.ids is None:
+        raise ValueError(
+            "The embeddings were saved without chunk ids by an older version, run STEP 2 again"
+        )
 
-    # Create an empty list to store the texts
-    texts: list = []
+    # The near duplicate chunks have no embeddings, their representatives are indexed instead
+    if duplicates is None:
+        duplicates = load_near_duplicates(json_files_directory=json_files_directory)
 
-    # Loop through each file in the directory
-    for filename in os.listdir(json_files_directory):
-        if filename.endswith(".json"):
-            with open(os.path.join(json_files_directory, filename), "r") as f:
-                chunks = json.load(f)
+    # Create the FAISS index, trained on a sample of the embeddings it indexes if its type needs it,
+    # so the clusters of a shard fit its own documents and their number is capped by its own size
+    if index_config is None:
+        index_config = index_config_from_env()
+    training_vectors = None
+    if needs_training(index_config):
+        rows = None
+        if document_names is not None:
+            rows = np.concatenate(
+                [np.empty(0, dtype=np.int64)]
+                + [
+                    np.arange(start, start + count)
+                    for start, count in sorted(
+                        loaded_embeddings.documents[document_name]
+                        for document_name in document_names
+                        if document_name in loaded_embeddings
+                    )
+                ]
+            )
+        # A shard too small to train the index on is trained on a sample of all the embeddings
+        minimum_rows = 2 ** index_config["pq_nbits"] if index_config["type"] == "ivf_pq" else 1
+        training_vectors = sample_training_vectors(
+            matrix=loaded_embeddings.matrix,
+            sample_size=index_config["training_sample_size"],
+            rows=rows if rows is not None and len(rows) >= minimum_rows else None,
+        )
+    index = build_index(
+        dimension=loaded_embeddings.dimension,
+        index_config=index_config,
+        training_vectors=training_vectors,
+    )
+    docstore_documents = {}
+    index_to_docstore_id = {}
+
+    # Stream the chunks from the chunk store, one document at a time
+    for document_name, chunks in iter_documents(
+        load_json_chunks_directory=json_files_directory,
+        document_names=document_names,
+    ):
+        kept_chunks = [chunk for chunk in chunks if chunk["id"] not in duplicates]
+        METRICS.increment("near_duplicates_skipped", len(chunks) - len(kept_chunks))
+        chunks = kept_chunks
+        if not chunks:
+            continue
 
-            # Loop through each chunk in the file and add the text to the list of texts
-            for chunk in chunks:
-                for key, value in chunk.items():
-                    texts.append(value)
-                    break
+        # Find the embedding of each chunk by id
+        rows = [loaded_embeddings.row_of(chunk["id"]) for chunk in chunks]
+        if None in rows:
+            raise ValueError(
+                f"Some chunks of the document {document_name} have no embeddings, run STEP 2 again"
+            )
 
-    # Combine the texts and embeddings into a list of tuples
-    text_embedding = list(zip(texts, loaded_embeddings))
+        # Add the embeddings of the document, in the same order as its chunks
+        with METRICS.timer("index_add"):
+            if rows == list(range(rows[0], rows[0] + len(rows))):
+                index.add(loaded_embeddings.matrix[rows[0] : rows[0] + len(rows)])
+            else:
+                index.add(loaded_embeddings.matrix[rows])
+        METRICS.increment("vectors_indexed", len(rows))
 
-    # Create a FAISS object from the embeddings and text embeddings
-    faiss = FAISS.from_embeddings(embedding=embeddings, text_embeddings=text_embedding)
+        # Add the text of each chunk to the docstore
+        for chunk in chunks:
+            docstore_id = str(uuid.uuid4())
+            index_to_docstore_id[len(index_to_docstore_id)] = docstore_id
+            docstore_documents[docstore_id] = Document(
+                page_content=chunk["text"],
+                metadata={
+                    "source": document_name,
+                    "chunk_index": chunk["chunk_index"],
+                    "chunk_id": chunk["id"],
+                    "page": chunk["page"],
+                    "ingested_at": chunk["ingested_at"],
+                    "tags": chunk["tags"],
+                },
+            )
+
+    # Create a FAISS object from the index and the documents
+    faiss = FAISS(
+        embedding_function=embeddings.embed_query,
+        index=index,
+        docstore=InMemoryDocstore(docstore_documents),
+        index_to_docstore_id=index_to_docstore_id,
+    )
 
     return faiss
 
 
+@METRICS.timed("create_sharded_vectorstore")
+def create_sharded_vectorstore(
+    documents: List[Dict[str, Any]],
+    path_to_vectorstore: str,
+    json_files_directory: str | None = None,
+    huggingfacehub_api_token: str | None = None,
+    shard_count: int | None = None,
+    shard_by: str | None = None,
+    max_workers: int | None = None,
+) -> Dict[str, Any]:
+    """
+    This function builds and saves the sharded vectorstore, in the ".shards" folder next to path_to_vectorstore.
+
+    The shards are built in parallel from the same loaded embeddings, and the shards whose documents
+    are the same and unchanged since the last build are kept as they are.
+
+    Args:
+        documents (List[Dict[str, Any]]): The documents of the ingest manifest.
+        path_to_vectorstore (str): The path to the ".faiss" folder of the unsharded vectorstore.
+        json_files_directory (str | None): The directory where the chunk store is saved, DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS in the .env file if None.
+        huggingfacehub_api_token (str): The API token for Hugging Face Hub.
+        shard_count (int | None): The number of shards, VECTORSTORE_SHARDS in the .env file if None.
+        shard_by (str | None): "document_hash" or "size", how the documents are assigned to the shards, VECTORSTORE_SHARD_BY in the .env file if None.
+        max_workers (int | None): The number of shards built at the same time, VECTORSTORE_SHARD_MAX_WORKERS in the .env file if None.
+
+    Returns:
+        Dict[str, Any]: The shard manifest.
+    """
+
+    if json_files_directory is None:
+        json_files_directory = os.getenv("DIRECTORY_FOR_DOCUMENTS_JSON_CHUNKS")
+    if shard_count is None:
+        shard_count = int(os.getenv("VECTORSTORE_SHARDS", "1"))
+    if shard_by is None:
+        shard_by = os.getenv("VECTORSTORE_SHARD_BY", "document_hash")
+    if max_workers is None:
+        max_workers = int(os.getenv("VECTORSTORE_SHARD_MAX_WORKERS", "4"))
+
+    folder_path = shards_path(path_to_vectorstore)
+    index_config = index_config_from_env()
+    model_id = embeddings_model_id()
+
+    # The number of chunks of each document indexed, counted in the index of the chunk store without the near duplicates
+    duplicates = load_near_duplicates(json_files_directory=json_files_directory)
+    with ChunkStore(chunk_store_file_path(json_files_directory)) as chunk_store:
+        kept = ~np.isin(
+            chunk_store.index["id"],
+            np.array(list(duplicates), dtype=chunk_store.index["id"].dtype),
+        )
+        chunk_counts = np.bincount(
+            chunk_store.index["document"][kept], minlength=len(chunk_store.documents)
+        )
+        document_sizes = dict(zip(chunk_store.documents, chunk_counts.tolist()))
+
+    assignments = assign_shards(
+        document_sizes=document_sizes, shard_count=shard_count, shard_by=shard_by
+    )
+
+    # The shards of the previous build can only be kept if they were built the same way
+    previous_shard_manifest = load_shard_manifest(folder_path)
+    previous_shard_documents = {}
+    if previous_shard_manifest is not None and (
+        previous_shard_manifest["shard_count"],
+        previous_shard_manifest["shard_by"],
+        previous_shard_manifest["model_id"],
+        previous_shard_manifest["index_type"],
+    ) == (shard_count, shard_by, model_id, index_config["type"]):
+        previous_shard_documents = {
+            shard["name"]: shard["documents"]
+            for shard in previous_shard_manifest["shards"]
+        }
+    changed_document_names = set(
+        changed_documents(
+            documents=documents, json_files_directory=json_files_directory
+        )
+    )
+
+    # Load the embeddings backend and the embeddings once, for all the shards
+    embeddings = load_cached_embeddings(
+        huggingfacehub_api_token=huggingfacehub_api_token
+    )
+    loaded_embeddings = load_embeddings()
+
+    def build_shard(shard: int, document_names: List[str]) -> int:
+        name = shard_name(shard)
+        if (
+            previous_shard_documents.get(name) == document_names
+            and not changed_document_names.intersection(document_names)
+            and os.path.exists(os.path.join(folder_path, name + ".faiss"))
+        ):
+            METRICS.increment("shards_kept")
+            return sum(document_sizes[document_name] for document_name in document_names)
+
+        vectorstore = create_vectorstore_from_json(
+            json_files_directory=json_files_directory,
+            document_names=document_names,
+            index_config=index_config,
+            embeddings=embeddings,
+            loaded_embeddings=loaded_embeddings,
+            duplicates=duplicates,
+        )
+        save_vectorstore(
+            vectorstore=vectorstore,
+            directory_path=folder_path,
+            file_name=name,
+            model_id=model_id,
+        )
+        METRICS.increment("shards_built")
+
+        return vectorstore.index.ntotal
+
+    # Build the shards that have documents in parallel, FAISS releases the GIL while adding and training
+    shards = [
+        (shard, document_names)
+        for shard, document_names in enumerate(assignments)
+        if document_names
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        shard_chunk_counts = list(
+            executor.map(lambda shard: build_shard(*shard), shards)
+        )
+
+    shard_manifest = {
+        "shard_count": shard_count,
+        "shard_by": shard_by,
+        "model_id": model_id,
+        "index_type": index_config["type"],
+        "created_at": time.time(),
+        "shards": [
+            {"name": shard_name(shard), "documents": document_names, "chunks": chunks}
+            for (shard, document_names), chunks in zip(shards, shard_chunk_counts)
+        ],
+    }
+    save_shard_manifest(folder_path=folder_path, shard_manifest=shard_manifest)
+
+    # Remove the shards that are no longer in the layout, once the new manifest is saved
+    kept_folders = {shard["name"] + ".faiss" for shard in shard_manifest["shards"]}
+    for entry in os.listdir(folder_path):
+        if entry.endswith(".faiss") and entry not in kept_folders:
+            shutil.rmtree(os.path.join(folder_path, entry), ignore_errors=True)
+
+    return shard_manifest
+
+
 """################# CALLING THE FUNCTION #################"""
 
 
-print("\n####################### CREATING VECTORSTORE ########################\n")
+def main() -> None:
+    """Update the saved vectorstore with the new and changed documents, or build the sharded vectorstore."""
 
-huggingfacehub_api_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
+    load_config()  # Load environment variables from .env file
+    start_metrics_server()  # Serve the measures on METRICS_SERVER_PORT, if it is set
 
-vectorstore = create_vectorstore_from_json(
-    huggingfacehub_api_token=huggingfacehub_api_token
-)
+    print("\n####################### CREATING VECTORSTORE ########################\n")
+
+    huggingfacehub_api_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
+
+    manifest = load_manifest()
+    documents = manifest["documents"].values()
+
+    vectorstore_path = os.path.join(
+        os.getenv("SAVING_VECTORSTORE_DIRECTORY"),
+        os.getenv("SAVING_VECTORSTORE_FILE_NAME") + ".faiss",
+    )
+
+    shard_count = int(os.getenv("VECTORSTORE_SHARDS", "1"))
+
+    if shard_count > 1:
+        shard_manifest = create_sharded_vectorstore(
+            documents=list(documents),
+            path_to_vectorstore=vectorstore_path,
+            huggingfacehub_api_token=huggingfacehub_api_token,
+            shard_count=shard_count,
+        )
+
+        print(
+            f"Saved {len(shard_manifest['shards'])} shards: "
+            + ", ".join(
+                f"{shard['name']} ({shard['chunks']} chunks)"
+                for shard in shard_manifest["shards"]
+            )
+        )
+
+        # The shards replace the unsharded vectorstore
+        shutil.rmtree(vectorstore_path, ignore_errors=True)
+
+        # Record which version of each document, and which of its chunks, the shards were built from
+        kept_digests = load_chunk_digests()["kept"]
+        for document in documents:
+            document["indexed_sha256"] = document["sha256"]
+            document["indexed_chunks_sha256"] = kept_digests.get(document["name"])
+        save_manifest(manifest=manifest)
+
+        print("\n####################### SHARDED VECTORSTORE SAVED ########################\n")
+    else:
+        # Only flat indexes are updated in place, the other index types are rebuilt,
+        # and so are vectorstores built with the embeddings of another model
+        saved_index_config = load_index_config(folder_path=vectorstore_path)
+        updatable = index_config_from_env()["type"] == "flat" and (
+            saved_index_config is None
+            or (
+                saved_index_config["type"] == "flat"
+                and saved_index_config.get("model_id") in (None, embeddings_model_id())
+            )
+        )
+
+        if documents and os.path.exists(vectorstore_path) and updatable:
+            # Update the saved vectorstore with the documents that changed since it was built
+            vectorstore = FAISS.load_local(
+                folder_path=vectorstore_path,
+                embeddings=load_cached_embeddings(
+                    huggingfacehub_api_token=huggingfacehub_api_token
+                ),
+            )
+
+            changed_document_names = changed_documents(documents=documents)
+            unchanged_document_names = {
+                document["name"] for document in documents
+            } - set(changed_document_names)
+
+            removed_chunks = remove_documents_from_vectorstore(
+                vectorstore=vectorstore, keep_document_names=unchanged_document_names
+            )
+
+            print(
+                f"Removed {removed_chunks} chunks, adding {len(changed_document_names)} documents"
+            )
+
+            if changed_document_names:
+                vectorstore.merge_from(
+                    create_vectorstore_from_json(
+                        huggingfacehub_api_token=huggingfacehub_api_token,
+                        document_names=changed_document_names,
+                    )
+                )
+        else:
+            vectorstore = create_vectorstore_from_json(
+                huggingfacehub_api_token=huggingfacehub_api_token
+            )
+
+        print("\n####################### VECTORSTORE CREATED ########################\n")
+
+        print("\n####################### SAVING VECTORSTORE ########################\n")
+
+        with METRICS.timer("save_vectorstore"):
+            save_vectorstore(vectorstore=vectorstore, model_id=embeddings_model_id())
+
+        # The unsharded vectorstore replaces the shards of a previous build
+        shutil.rmtree(shards_path(vectorstore_path), ignore_errors=True)
 
-print("\n####################### VECTORSTORE CREATED ########################\n")
+        # Record which version of each document, and which of its chunks, the vectorstore was built from
+        kept_digests = load_chunk_digests()["kept"]
+        for document in documents:
+            document["indexed_sha256"] = document["sha256"]
+            document["indexed_chunks_sha256"] = kept_digests.get(document["name"])
+        save_manifest(manifest=manifest)
 
+        print("\n####################### VECTORSTORE SAVED ########################\n")
 
-print("\n####################### SAVING VECTORSTORE ########################\n")
+    save_run_report(name="STEP_3")
 
-save_vectorstore(vectorstore=vectorstore)
 
-print("\n####################### VECTORSTORE SAVED ########################\n")
+if __name__ == "__main__":
+    main()
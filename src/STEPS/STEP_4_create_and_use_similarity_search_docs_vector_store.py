@@ -4,6 +4,9 @@
     The create_similarity_search_docs() function creates a similarity search document using the Hugging Face API. 
     The function takes a query and an API token as input and returns a similarity search document.
 
+    The pack_context() function merges the overlapping chunks of the similarity search docs, removes their near duplicates
+    and keeps the best passages within the token budget of the prompt, and its report (the tokens saved) is printed.
+
     The Q_and_A_implementation() function takes the query, API token, and similarity search document as input and returns an answer to the query.
 
     Finally, the answer is printed using the print() function.
@@ -11,46 +14,68 @@
 
 import os
 import sys
-from dotenv import load_dotenv
-
-
-load_dotenv()  # Load environment variables from .env file
 
 # Add src directory to Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.config import load_config
+from HELPERS.instrumentation import save_run_report, start_metrics_server
 from HELPERS.step_4A_create_similarity_search_docs import (
     create_similarity_search_docs,
 )
+from HELPERS.step_4B_context_packing import pack_context
 from HELPERS.step_4B_using_similarity_search_docs_for_QA import Q_and_A_implementation
 
 
 """################# CALLING THE FUNCTION #################"""
 
 
-huggingfacehub_api_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
+def main(query: str = "What is is document about?") -> None:
+    """Answer the query with the documents most similar to it."""
 
-query = "What is is document about?"
+    load_config()  # Load environment variables from .env file
+    start_metrics_server()  # Serve the measures on METRICS_SERVER_PORT, if it is set
 
-print(
-    "\n####################### CREATING SIMILARITY SEARCH DOCS ########################\n"
-)
+    huggingfacehub_api_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
 
-similarity_search_docs = create_similarity_search_docs(
-    query=query,
-    huggingfacehub_api_token=huggingfacehub_api_token,
-)
+    print(
+        "\n####################### CREATING SIMILARITY SEARCH DOCS ########################\n"
+    )
 
-print(
-    "\n####################### USING SIMILARITY SEARCH DOCS AND QUERY ########################\n"
-)
+    similarity_search_docs = create_similarity_search_docs(
+        query=query,
+        huggingfacehub_api_token=huggingfacehub_api_token,
+    )
 
-Q_and_A_answer = Q_and_A_implementation(
-    query=query,
-    huggingfacehub_api_token=huggingfacehub_api_token,
-    similarity_search_docs=similarity_search_docs,
-)
+    print(
+        "\n####################### PACKING SIMILARITY SEARCH DOCS ########################\n"
+    )
+
+    similarity_search_docs, context_report = pack_context(docs=similarity_search_docs)
+
+    print(
+        f"{context_report['chunks']} chunks packed into {context_report['passages']} passages, "
+        f"{context_report['tokens_after']} tokens instead of {context_report['tokens_before']} "
+        f"({context_report['tokens_saved']} saved)"
+    )
+
+    print(
+        "\n####################### USING SIMILARITY SEARCH DOCS AND QUERY ########################\n"
+    )
+
+    Q_and_A_answer = Q_and_A_implementation(
+        query=query,
+        huggingfacehub_api_token=huggingfacehub_api_token,
+        similarity_search_docs=similarity_search_docs,
+        pack_context_docs=False,
+    )
+
+
+    print("\n####################### ANSWERING THE QUERY ########################\n")
+
+    print(Q_and_A_answer)
 
+    save_run_report(name="STEP_4")
 
-print("\n####################### ANSWERING THE QUERY ########################\n")
 
-print(Q_and_A_answer)
+if __name__ == "__main__":
+    main()
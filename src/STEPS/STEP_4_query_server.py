@@ -0,0 +1,60 @@
+"""
+    This code starts the query server, which answers queries over HTTP with the vectorstore kept in memory.
+
+    The embeddings, the vectorstore, the language model and the question answering chain are loaded once,
+    the vectorstore is loaded again whenever STEP 3 saves a new one.
+
+    The host and the port of the server (QUERY_SERVER_HOST and QUERY_SERVER_PORT) and how often the saved vectorstore
+    is checked for changes (QUERY_SERVER_RELOAD_INTERVAL_SECONDS) are set in the .env file.
+
+    Example:
+        curl -X POST http://127.0.0.1:8000/answer -d '{"query": "What is is document about?", "k": 4}'
+        curl -N -X POST http://127.0.0.1:8000/answer_stream -d '{"query": "What is is document about?", "k": 4}'
+"""
+
+import os
+import sys
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from HELPERS.config import load_config
+from HELPERS.instrumentation import save_run_report
+from HELPERS.step_4_query_server import QueryServer, QueryService
+
+
+"""################# CALLING THE FUNCTION #################"""
+
+
+def main() -> None:
+    """Serve the queries until the process is interrupted."""
+
+    load_config()  # Load environment variables from .env file
+
+    print("\n####################### LOADING THE QUERY SERVICE ########################\n")
+
+    service = QueryService(
+        huggingfacehub_api_token=os.getenv("HUGGINGFACEHUB_API_TOKEN"),
+    )
+
+    server = QueryServer(
+        server_address=(
+            os.getenv("QUERY_SERVER_HOST", "127.0.0.1"),
+            int(os.getenv("QUERY_SERVER_PORT", "8000")),
+        ),
+        service=service,
+    )
+
+    print(f"Query server listening on {server.url}, {service.health()['chunks']} chunks loaded")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        server.server_close()
+        save_run_report(name="STEP_4_query_server")
+
+
+if __name__ == "__main__":
+    main()
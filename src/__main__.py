@@ -0,0 +1,125 @@
+"""
+    This code is the command line interface of the pipeline, run from the root of the repository with python -m src:
+        python -m src ingest loads and chunks the new and changed documents (STEP 1),
+        python -m src embed embeds their chunks (STEP 2),
+        python -m src build updates the vectorstore (STEP 3),
+        python -m src stream-ingest rebuilds the chunks, the embeddings and the vectorstore in a single streaming pass,
+        python -m src query "..." answers a query (STEP 4), and
+        python -m src serve starts the query server.
+
+    Only the standard library is imported to parse the command line. The .env file is loaded next (--env-file,
+    or the first .env file found from the src directory upwards), and only then the STEP module of the command is imported,
+    with the dependencies it needs: "python -m src --help" starts at once, and each command only pays for the imports it uses
+    (ingesting pdf files doesn't import langchain for example).
+
+    --import-only loads the configuration and imports the command without running it, which is how
+    the import time benchmark (src/BENCHMARKS/benchmark_import_time.py) measures the startup of each command.
+
+    Example:
+        python -m src query "What is is document about?"
+"""
+
+import argparse
+import importlib
+import os
+import sys
+from typing import Dict, List, Tuple
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+# The STEP module run by each command, and what it does
+COMMANDS: Dict[str, Tuple[str, str]] = {
+    "ingest": (
+        "STEPS.STEP_1_loading_documents",
+        "Load and chunk the new and changed documents (STEP 1)",
+    ),
+    "embed": (
+        "STEPS.STEP_2_create_HuggingFaceHub_embeddings",
+        "Embed the chunks of the new and changed documents (STEP 2)",
+    ),
+    "build": (
+        "STEPS.STEP_3_create_vector_store",
+        "Update the vectorstore with the new and changed documents (STEP 3)",
+    ),
+    "stream-ingest": (
+        "STEPS.STEP_1_to_3_streaming_ingest",
+        "Rebuild the chunks, the embeddings and the vectorstore in a single streaming pass (STEP 1 to 3)",
+    ),
+    "query": (
+        "STEPS.STEP_4_create_and_use_similarity_search_docs_vector_store",
+        "Answer a query with the documents most similar to it (STEP 4)",
+    ),
+    "serve": (
+        "STEPS.STEP_4_query_server",
+        "Start the query server",
+    ),
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Build the parser of the command line.
+
+    Returns:
+        - argparse.ArgumentParser: The parser, with a subcommand for each command.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="python -m src", description="Run the steps of the pipeline."
+    )
+    parser.add_argument(
+        "--env-file",
+        default=None,
+        help="The .env file to load, the first .env file found from the src directory upwards by default",
+    )
+    parser.add_argument(
+        "--import-only",
+        action="store_true",
+        help="Load the configuration and import the command without running it",
+    )
+
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="command")
+    for command, (_, description) in COMMANDS.items():
+        subparser = subparsers.add_parser(command, help=description, description=description)
+        if command == "query":
+            subparser.add_argument(
+                "query", nargs="?", default="What is is document about?", help="The query to answer"
+            )
+
+    return parser
+
+
+def main(argv: List[str] | None = None) -> None:
+    """
+    Run a command of the pipeline.
+
+    Args:
+        - argv (List[str] | None): The arguments of the command line, sys.argv[1:] if None.
+    """
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.env_file is not None and not os.path.isfile(args.env_file):
+        parser.error(f"The .env file {args.env_file} doesn't exist")
+
+    # The configuration is loaded before the command runs, the main function of the STEP module doesn't load it again
+    from HELPERS.config import load_config
+
+    load_config(dotenv_path=args.env_file)
+
+    module_name, _ = COMMANDS[args.command]
+    step = importlib.import_module(module_name)
+
+    if args.import_only:
+        return
+
+    if args.command == "query":
+        step.main(query=args.query)
+    else:
+        step.main()
+
+
+if __name__ == "__main__":
+    main()
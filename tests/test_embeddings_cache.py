@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from HELPERS.embeddings_cache import CachedEmbeddings
+from HELPERS.fake_embeddings import HashingEmbeddings
+
+
+class SlowEmbeddings(HashingEmbeddings):
+    """HashingEmbeddings taking latency_seconds for each call, like a remote model."""
+
+    def __init__(self, latency_seconds: float) -> None:
+        super().__init__(dimension=8)
+        self.latency_seconds = latency_seconds
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency_seconds)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency_seconds)
+        return super().embed_query(text)
+
+
+def test_concurrent_misses_are_embedded_in_parallel(tmp_path) -> None:
+    cache = CachedEmbeddings(
+        embeddings=SlowEmbeddings(latency_seconds=0.2),
+        model_id="slow",
+        cache_file_path=str(tmp_path / "cache.sqlite3"),
+        max_entries=100,
+    )
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        vectors = list(executor.map(cache.embed_query, [f"query {i}" for i in range(8)]))
+    elapsed = time.perf_counter() - start_time
+
+    assert elapsed < 0.2 * 4
+    assert vectors == [cache.embeddings.embed_query(f"query {i}") for i in range(8)]
+    assert cache.stats()["misses"] == 8
+
+
+def test_size_only_counts_new_entries(tmp_path) -> None:
+    cache = CachedEmbeddings(
+        embeddings=HashingEmbeddings(dimension=8),
+        model_id="hashing",
+        cache_file_path=str(tmp_path / "cache.sqlite3"),
+        max_entries=100,
+    )
+
+    cache.embed_documents([f"text {i}" for i in range(9)])
+    # A vector stored again, as when two threads miss the same text at the same time
+    cache._store({cache._key("text 0", "document"): [0.0] * 8})
+
+    rows = cache._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    assert rows == 9
+    assert cache.stats()["entries"] == 9
+
+
+def test_eviction_keeps_max_entries(tmp_path) -> None:
+    cache = CachedEmbeddings(
+        embeddings=HashingEmbeddings(dimension=8),
+        model_id="hashing",
+        cache_file_path=str(tmp_path / "cache.sqlite3"),
+        max_entries=5,
+    )
+
+    cache.embed_documents([f"text {i}" for i in range(3)])
+    cache.embed_documents([f"text {i}" for i in range(3)])
+    cache.embed_documents([f"text {i}" for i in range(3, 8)])
+
+    rows = cache._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    assert rows == 5
+    assert cache.stats()["entries"] == 5
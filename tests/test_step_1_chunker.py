@@ -0,0 +1,62 @@
+import os
+import random
+import sys
+
+import pytest
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from HELPERS.step_1_chunker import TextChunker
+
+
+def _random_text(random_generator: random.Random, words: int) -> str:
+    """Return a text of words of random lengths, some of them ending a sentence."""
+    return " ".join(
+        "x" * random_generator.randint(1, 16) + random_generator.choice(["", "", "", "."])
+        for _ in range(words)
+    )
+
+
+@pytest.mark.parametrize("boundary", ["word", "sentence"])
+@pytest.mark.parametrize("size_unit", ["characters", "tokens"])
+def test_no_chunk_is_a_suffix_of_the_previous_one(size_unit: str, boundary: str) -> None:
+    random_generator = random.Random(0)
+    for _ in range(200):
+        chunk_size = random_generator.randint(5, 60)
+        chunker = TextChunker(
+            chunk_size=chunk_size,
+            chunk_overlap=random_generator.randint(0, chunk_size - 1),
+            size_unit=size_unit,
+            boundary=boundary,
+            dedup=False,
+        )
+        text = _random_text(random_generator, random_generator.randint(1, 80))
+        spans = chunker.split_spans(text)
+
+        assert spans[0][0] == 0 and spans[-1][1] == len(text)
+        for (previous_start, previous_end), (start, end) in zip(spans, spans[1:]):
+            assert start > previous_start and end > previous_end
+
+
+def test_long_word_is_not_preceded_by_suffix_chunks() -> None:
+    chunker = TextChunker(
+        chunk_size=22, chunk_overlap=17, size_unit="characters", boundary="word", dedup=False
+    )
+
+    assert chunker.split_text("alpha beta gamma delta epsilonlongword zeta") == [
+        "alpha beta gamma delta",
+        "delta epsilonlongword",
+        "epsilonlongword zeta",
+    ]
+
+
+def test_sentence_boundary_is_not_followed_by_suffix_chunk() -> None:
+    chunker = TextChunker(
+        chunk_size=22, chunk_overlap=17, size_unit="characters", boundary="sentence", dedup=False
+    )
+
+    assert chunker.split_text("One two. Three four five six seven. Eight.") == [
+        "One two.",
+        "Three four five six",
+        "seven. Eight.",
+    ]
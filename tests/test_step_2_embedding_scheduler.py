@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+
+import pytest
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from HELPERS.local_stub_hub_server import start_stub_hub_server, stub_embedding
+from HELPERS.step_2_embedding_scheduler import EmbeddingScheduler
+
+
+def test_rate_limited_batches_are_retried_in_order() -> None:
+    server = start_stub_hub_server(dimension=8, fail_every=4)
+    try:
+        scheduler = EmbeddingScheduler(
+            endpoint_url=server.url,
+            batch_size=7,
+            max_concurrent_requests=4,
+            max_retries=5,
+            backoff_seconds=0.0,
+        )
+        texts = [f"text number {i}\nof the test" for i in range(100)]
+
+        embeddings = scheduler.embed_documents(texts)
+
+        # The newlines are replaced before the texts are sent
+        assert embeddings == [stub_embedding(text.replace("\n", " "), 8) for text in texts]
+        # 15 batches of 7 texts, every 4th request is rate limited: 4 of the 19 requests are retried
+        stats = scheduler.stats()
+        assert stats["chunks_embedded"] == 100
+        assert stats["requests_sent"] == server.requests_received == 19
+        assert stats["retries"] == 4
+        assert server.texts_embedded == 100
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_batches_are_sent_concurrently() -> None:
+    server = start_stub_hub_server(dimension=8, latency_seconds=0.2)
+    try:
+        scheduler = EmbeddingScheduler(
+            endpoint_url=server.url, batch_size=10, max_concurrent_requests=4
+        )
+
+        start_time = time.perf_counter()
+        embeddings = scheduler.embed_documents([f"text {i}" for i in range(80)])
+        elapsed = time.perf_counter() - start_time
+
+        # 8 batches, 4 at a time
+        assert len(embeddings) == 80
+        assert 0.2 * 2 <= elapsed < 0.2 * 8
+        assert scheduler.stats()["retries"] == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_gives_up_after_max_retries() -> None:
+    server = start_stub_hub_server(dimension=8, fail_every=1)
+    try:
+        scheduler = EmbeddingScheduler(
+            endpoint_url=server.url,
+            batch_size=7,
+            max_concurrent_requests=1,
+            max_retries=2,
+            backoff_seconds=0.0,
+        )
+
+        with pytest.raises(ValueError, match="429"):
+            scheduler.embed_query("text")
+
+        assert scheduler.stats()["requests_sent"] == 3
+        assert scheduler.stats()["retries"] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,37 @@
+import os
+import sys
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from HELPERS.step_2_local_embeddings import local_model_id
+
+
+def _save_model(directory, config: str, weights: bytes) -> str:
+    directory.mkdir(parents=True)
+    (directory / "config.json").write_text(config)
+    (directory / "model.safetensors").write_bytes(weights)
+    (directory / "tokenizer.json").write_text("{}")
+
+    return str(directory)
+
+
+def test_models_in_directories_of_the_same_name_get_different_ids(tmp_path) -> None:
+    first = _save_model(tmp_path / "a" / "model", '{"hidden_size": 768}', b"0" * 100)
+    same = _save_model(tmp_path / "b" / "model", '{"hidden_size": 768}', b"1" * 100)
+    other_config = _save_model(tmp_path / "c" / "model", '{"hidden_size": 384}', b"0" * 100)
+    other_weights = _save_model(tmp_path / "d" / "model", '{"hidden_size": 768}', b"0" * 200)
+
+    assert local_model_id(first).startswith("local/model@")
+    assert local_model_id(first) == local_model_id(same)
+    assert len({local_model_id(path) for path in (first, other_config, other_weights)}) == 3
+    assert local_model_id(first, quantize=True) == local_model_id(first) + "-int8"
+
+
+def test_int8_model_written_next_to_the_model_keeps_its_id(tmp_path) -> None:
+    model = _save_model(tmp_path / "model", '{"hidden_size": 768}', b"0" * 100)
+    model_id = local_model_id(model, quantize=True)
+
+    (tmp_path / "model" / "model.onnx").write_bytes(b"0" * 50)
+    (tmp_path / "model" / "model_int8.onnx").write_bytes(b"0" * 10)
+
+    assert local_model_id(model, quantize=True) == model_id
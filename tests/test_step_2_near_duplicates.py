@@ -0,0 +1,101 @@
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from HELPERS.step_2_near_duplicates import NearDuplicateIndex, find_near_duplicates
+
+
+def _chunks(count: int, seed: int = 0):
+    """Return chunks copied from a few base texts, with a word changed here and there, ingested in 4 runs."""
+    random_generator = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(300)]
+    bases = [
+        [random_generator.choice(vocabulary) for _ in range(60)] for _ in range(count // 4)
+    ]
+    chunks = []
+    for i in range(count):
+        words = list(random_generator.choice(bases))
+        for _ in range(random_generator.choice([0, 1, 2, 20])):
+            words[random_generator.randrange(len(words))] = random_generator.choice(vocabulary)
+        chunks.append(
+            {"id": f"{i:016x}", "text": " ".join(words), "ingested_at": float(i * 4 // count)}
+        )
+
+    return chunks
+
+
+def _ids(chunks) -> np.ndarray:
+    return np.array([chunk["id"].encode("ascii") for chunk in chunks], dtype="S16")
+
+
+def test_incremental_updates_match_a_full_run() -> None:
+    chunks = _chunks(400)
+    index = NearDuplicateIndex(threshold=0.8, num_perm=128)
+    for start in range(0, len(chunks), 100):
+        report = index.update(chunks=chunks[start : start + 100], chunk_ids=None)
+        assert report["chunks_hashed"] == 100
+        assert not report["rebuilt"]
+
+    duplicates, full_report = find_near_duplicates(chunks=chunks, threshold=0.8, num_perm=128)
+    assert duplicates
+    assert index.duplicates() == duplicates
+    assert report["duplicates"] == full_report["duplicates"]
+
+
+@pytest.mark.parametrize(
+    "removed, rebuilt", [(range(0, 400, 7), True), (range(300, 400), False)]
+)
+def test_removing_chunks_matches_a_full_run(removed: range, rebuilt: bool) -> None:
+    chunks = _chunks(400)
+    index = NearDuplicateIndex(threshold=0.8, num_perm=128)
+    index.add(chunks)
+
+    kept_chunks = [chunk for i, chunk in enumerate(chunks) if i not in removed]
+    report = index.update(chunks=[], chunk_ids=_ids(kept_chunks))
+
+    assert report["chunks_hashed"] == 0
+    assert report["rebuilt"] == rebuilt
+    assert index.duplicates() == find_near_duplicates(
+        chunks=kept_chunks, threshold=0.8, num_perm=128
+    )[0]
+
+
+def test_older_new_chunks_are_ordered_first() -> None:
+    chunks = _chunks(400)
+    index = NearDuplicateIndex(threshold=0.8, num_perm=128)
+    index.add(chunks[200:])
+    report = index.add(chunks[:200])
+
+    assert report["rebuilt"]
+    assert index.duplicates() == find_near_duplicates(
+        chunks=chunks, threshold=0.8, num_perm=128
+    )[0]
+
+
+def test_saved_index_is_reloaded_for_another_threshold(tmp_path) -> None:
+    chunks = _chunks(200)
+    index = NearDuplicateIndex(threshold=0.8, num_perm=128)
+    index.add(chunks)
+    index.save(str(tmp_path / "near_duplicates.npz"))
+
+    reloaded = NearDuplicateIndex.load(
+        str(tmp_path / "near_duplicates.npz"), threshold=0.8, num_perm=128
+    )
+    assert reloaded.duplicates() == index.duplicates()
+
+    reloaded = NearDuplicateIndex.load(
+        str(tmp_path / "near_duplicates.npz"), threshold=0.5, num_perm=128
+    )
+    assert reloaded.duplicates() == find_near_duplicates(
+        chunks=chunks, threshold=0.5, num_perm=128
+    )[0]
+
+    reloaded = NearDuplicateIndex.load(
+        str(tmp_path / "near_duplicates.npz"), threshold=0.8, num_perm=64
+    )
+    assert len(reloaded) == 0
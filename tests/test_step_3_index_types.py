@@ -0,0 +1,41 @@
+import os
+import sys
+
+import numpy as np
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from HELPERS.step_3_index_types import build_index, describe_index, sample_training_vectors
+
+
+def test_shard_is_trained_on_its_own_rows() -> None:
+    matrix = np.random.default_rng(0).random((2000, 8), dtype=np.float32)
+    matrix[:, 0] = np.arange(2000)
+    rows = np.r_[100:300, 1500:1700]
+
+    training_vectors = sample_training_vectors(matrix=matrix, sample_size=300, rows=rows)
+
+    assert len(training_vectors) == 300
+    assert np.isin(training_vectors[:, 0], rows).all()
+    assert np.all(np.diff(training_vectors[:, 0]) > 0)
+
+
+def test_number_of_clusters_is_sized_to_the_shard() -> None:
+    matrix = np.random.default_rng(0).random((2000, 8), dtype=np.float32)
+    index_config = {"type": "ivf_flat", "nlist": 1024, "nprobe": 4}
+
+    whole = build_index(
+        dimension=8,
+        index_config=index_config,
+        training_vectors=sample_training_vectors(matrix=matrix, sample_size=1000),
+    )
+    shard = build_index(
+        dimension=8,
+        index_config=index_config,
+        training_vectors=sample_training_vectors(
+            matrix=matrix, sample_size=1000, rows=np.arange(400)
+        ),
+    )
+
+    assert describe_index(whole)["nlist"] == 1000 // 39
+    assert describe_index(shard)["nlist"] == 400 // 39
@@ -0,0 +1,37 @@
+import os
+import sys
+
+from langchain.vectorstores import FAISS
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+import HELPERS.step_4A_create_similarity_search_docs as similarity_search_docs
+from HELPERS.embeddings_cache import CachedEmbeddings
+from HELPERS.fake_embeddings import HashingEmbeddings
+
+
+def test_batch_search_reuses_the_embeddings_of_the_vectorstore(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("QUERY_LOG_FILE_PATH", str(tmp_path / "queries.jsonl"))
+    monkeypatch.setenv("SEARCH_MODE", "vector")
+    embeddings = CachedEmbeddings(
+        embeddings=HashingEmbeddings(dimension=16),
+        model_id="hashing",
+        cache_file_path=str(tmp_path / "cache.sqlite3"),
+        max_entries=100,
+    )
+    texts = [f"document about topic {i}" for i in range(10)]
+    vectorstore = FAISS.from_texts(
+        texts, embeddings, metadatas=[{"source": str(i)} for i in range(10)]
+    )
+
+    def no_new_embeddings(**kwargs):
+        raise AssertionError("The embeddings of the vectorstore must be reused")
+
+    monkeypatch.setattr(similarity_search_docs, "load_cached_embeddings", no_new_embeddings)
+
+    results = similarity_search_docs.create_similarity_search_docs_batch(
+        queries=texts[:3], vectorstore=vectorstore, k=1
+    )
+
+    assert [docs_and_scores[0][0].page_content for docs_and_scores in results] == texts[:3]
+    assert embeddings.stats()["misses"] == 10 + 3
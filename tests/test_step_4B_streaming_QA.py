@@ -0,0 +1,177 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+from langchain.chains.question_answering import load_qa_chain
+from langchain.schema import Document
+
+# Add src directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from HELPERS.instrumentation import METRICS
+from HELPERS.local_stub_hub_server import start_stub_hub_server
+from HELPERS.step_4B_pooled_hub_llm import PooledHuggingFaceHub
+from HELPERS.step_4B_using_similarity_search_docs_for_QA import (
+    _stuffed_prompt,
+    astream_Q_and_A_implementation,
+    stream_Q_and_A_implementation,
+)
+
+DOCS = [
+    Document(page_content="The sky is blue because of Rayleigh scattering.", metadata={"source": "a"}),
+    Document(page_content="Sunsets are red for the same reason.", metadata={"source": "b"}),
+]
+QUERY = "Why is the sky blue?"
+
+TOKEN_LATENCY_SECONDS = 0.05
+
+
+@pytest.fixture
+def server():
+    server = start_stub_hub_server(dimension=8, token_latency_seconds=TOKEN_LATENCY_SECONDS)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _chain(url: str, max_retries: int = 3):
+    llm = PooledHuggingFaceHub(
+        repo_id="stub/model", endpoint_url=url, max_retries=max_retries, backoff_seconds=0.0
+    )
+    return load_qa_chain(llm=llm, chain_type="stuff", verbose=False)
+
+
+def _expected_tokens(chain) -> list:
+    """The tokens of the answer of the stub to the stuffed prompt, the words with the space before them."""
+    prompt = _stuffed_prompt(chain=chain, docs=DOCS, query=QUERY)
+    words = f"Stub answer to a prompt of {len(prompt)} characters.".split(" ")
+
+    return [words[0]] + [" " + word for word in words[1:]]
+
+
+def test_tokens_are_streamed_in_order(server) -> None:
+    chain = _chain(server.url)
+    stream_stats = {}
+
+    tokens = list(
+        stream_Q_and_A_implementation(
+            similarity_search_docs=DOCS,
+            query=QUERY,
+            chain=chain,
+            pack_context_docs=False,
+            stream_stats=stream_stats,
+        )
+    )
+
+    assert tokens == _expected_tokens(chain)
+    assert stream_stats["tokens"] == len(tokens)
+    assert stream_stats["time_to_first_token_seconds"] >= TOKEN_LATENCY_SECONDS
+    assert stream_stats["total_seconds"] >= len(tokens) * TOKEN_LATENCY_SECONDS
+    assert 0 < stream_stats["tokens_per_second"] <= 1 / TOKEN_LATENCY_SECONDS * 1.5
+
+
+def test_rate_limited_stream_is_retried(server) -> None:
+    server.fail_every = 2
+    chain = _chain(server.url)
+    retries = METRICS.counters.get("llm_api_retries", 0)
+
+    # The first request is answered, the second one is rate limited and sent again
+    first = list(
+        stream_Q_and_A_implementation(
+            similarity_search_docs=DOCS, query=QUERY, chain=chain, pack_context_docs=False
+        )
+    )
+    second = list(
+        stream_Q_and_A_implementation(
+            similarity_search_docs=DOCS, query=QUERY, chain=chain, pack_context_docs=False
+        )
+    )
+
+    assert first == second == _expected_tokens(chain)
+    assert server.requests_received == 3
+    assert METRICS.counters["llm_api_retries"] - retries == 1
+
+
+def test_closing_the_stream_early_stops_it(server) -> None:
+    chain = _chain(server.url)
+    stream_stats = {}
+
+    tokens = stream_Q_and_A_implementation(
+        similarity_search_docs=DOCS,
+        query=QUERY,
+        chain=chain,
+        pack_context_docs=False,
+        stream_stats=stream_stats,
+    )
+    first_tokens = [next(tokens), next(tokens)]
+    tokens.close()
+
+    assert first_tokens == _expected_tokens(chain)[:2]
+    assert stream_stats["tokens"] == 2
+    assert stream_stats["total_seconds"] < len(_expected_tokens(chain)) * TOKEN_LATENCY_SECONDS
+
+
+def test_async_tokens_are_streamed_in_order(server) -> None:
+    chain = _chain(server.url)
+    stream_stats = {}
+
+    async def collect():
+        return [
+            token
+            async for token in astream_Q_and_A_implementation(
+                similarity_search_docs=DOCS,
+                query=QUERY,
+                chain=chain,
+                pack_context_docs=False,
+                stream_stats=stream_stats,
+            )
+        ]
+
+    tokens = asyncio.run(collect())
+
+    assert tokens == _expected_tokens(chain)
+    assert stream_stats["tokens"] == len(tokens)
+    assert stream_stats["time_to_first_token_seconds"] >= TOKEN_LATENCY_SECONDS
+
+
+def test_async_stream_raises_when_the_retries_run_out(server) -> None:
+    server.fail_every = 1
+    chain = _chain(server.url, max_retries=1)
+
+    async def collect():
+        return [
+            token
+            async for token in astream_Q_and_A_implementation(
+                similarity_search_docs=DOCS, query=QUERY, chain=chain, pack_context_docs=False
+            )
+        ]
+
+    with pytest.raises(ValueError, match="429"):
+        asyncio.run(collect())
+    assert server.requests_received == 2
+
+
+def test_closing_the_async_stream_early_stops_it(server) -> None:
+    chain = _chain(server.url)
+    stream_stats = {}
+
+    async def first_tokens():
+        tokens = astream_Q_and_A_implementation(
+            similarity_search_docs=DOCS,
+            query=QUERY,
+            chain=chain,
+            pack_context_docs=False,
+            stream_stats=stream_stats,
+        )
+        first = [await tokens.__anext__(), await tokens.__anext__()]
+        await tokens.aclose()
+        return first
+
+    assert asyncio.run(first_tokens()) == _expected_tokens(chain)[:2]
+
+    # The background thread stops reading at the next token and fills the stats
+    deadline = time.perf_counter() + 2.0
+    while "tokens" not in stream_stats and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    assert stream_stats["tokens"] < len(_expected_tokens(chain))